@@ -3,117 +3,143 @@
 # Utiliza modelo LLaMA 3 8B quantizado via llama.cpp
 
 import os
-import sys
-import subprocess
-import tempfile
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+import math
+import click
+from importlib import import_module
+from flask import Flask, Blueprint, render_template, request, jsonify, session, redirect, url_for, Response, current_app, stream_with_context, g, send_file
+from flask.cli import with_appcontext
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import logging
-import uuid
-from flask_migrate import Migrate
-from models import db, User, QueryHistory, Setting
+import time
+from models import db, User, QueryHistory, ArchivedQuery, Setting, Conversation, BatchJob, FAQEntry, bootstrap_db, user_cache
 from config import get_config
+from inference import llama, registry, kv_cache, speculative, GenerationCancelled, GenerationConflict
+from budget import budgeter, PromptTooLong
+from routing import router, ModelBusy
+from backends import BackendUnavailable, pools_metrics
+from prompts import prepare_prompt
+from utils import load_or_create_secret_key, login_required, admin_required, current_user
+from state_store import shared_state, response_cache
+from quotas import limiter, LimitExceeded
+from settings import runtime_settings
+from summarizer import summarizer
+from batch import parse_questions, create_job, cancel_job, export_results
+from rollups import rollups
+from assets import assets
+from resources import resources
+from faq import faq
+from retrieval import retriever
+from profiling import profiler, REQUEST_ID_PATTERN
+from logging_config import configure_logging, logging_metrics
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Logs em JSON gravados por uma thread separada (configurados em create_app, ver logging_config.py)
 logger = logging.getLogger('assistente-ia')
 
-# Inicialização da aplicação Flask
-app = Flask(__name__)
-app.config.from_object(get_config())
-app.secret_key = os.environ.get('SECRET_KEY', str(uuid.uuid4()))
-
-# Inicializar o banco de dados
-db.init_app(app)
-migrate = Migrate(app, db)
-
-# Criar as tabelas do banco de dados se não existirem
-with app.app_context():
-    db.create_all()
-    
-    # Verificar se existe um usuário admin, se não, criar um
-    admin = User.query.filter_by(username='admin').first()
-    if not admin:
-        admin = User(username='admin', role='admin')
-        admin.set_password('admin123')
-        db.session.add(admin)
-        
-        # Adicionar também um usuário comum
-        user = User(username='user', role='user')
-        user.set_password('user123')
-        db.session.add(user)
-        
+# Rotas da aplicação (registradas em create_app)
+main = Blueprint('main', __name__)
+
+# Função para obter o identificador de uma pergunta
+def ask_request_id(data):
+    """Identificador enviado pela interface (para cancelar a geração), se
+    válido; caso contrário, o da requisição (X-Request-ID ou gerado)
+    """
+    request_id = data.get('request_id')
+    if isinstance(request_id, str) and REQUEST_ID_PATTERN.fullmatch(request_id):
+        g.request_id = request_id
+    return g.request_id
+
+# Função para obter a conversa de uma pergunta
+def open_conversation(conversation_id, user_id, question):
+    """Retorna a conversa do usuário, criando uma nova se conversation_id for vazio
+    
+    Returns:
+        Conversation: Conversa, ou None se não existir ou for de outro usuário
+    """
+    if conversation_id:
+        return Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+    conversation = Conversation(user_id=user_id, title=question[:200])
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
+
+# Função para remover uma conversa criada para uma pergunta que falhou
+def discard_empty_conversation(conversation_id):
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is not None and conversation.queries.count() == 0:
+        db.session.delete(conversation)
         db.session.commit()
-        logger.info("Usuários padrão criados: admin e user")
 
-# Configurações do modelo LLaMA
-LLAMA_PATH = os.environ.get('LLAMA_PATH', '/opt/llama.cpp')
-MODEL_PATH = os.environ.get('MODEL_PATH', '/opt/llama.cpp/models/llama-3-8b-instruct.Q4_K_M.gguf')
-CONTEXT_SIZE = os.environ.get('CONTEXT_SIZE', '4096')
-TEMPERATURE = os.environ.get('TEMPERATURE', '0.7')
+# Função para montar a resposta de uma requisição recusada por limite de uso
+def limit_exceeded_response(error):
+    response = jsonify({'error': str(error), 'limit_exceeded': True})
+    response.status_code = 429
+    if error.retry_after:
+        response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+# Função para montar a resposta de uma pergunta com identificador já em uso
+def generation_conflict_response():
+    return jsonify({'error': 'Já existe uma geração em andamento com este identificador'}), 409
+
+# Função para registrar uma resposta do FAQ no histórico
+def record_faq_answer(question, match, conversation, started):
+    """Registra a resposta revisada do FAQ (sem tokens de prompt e sem
+    consumir a cota de uso)
+    
+    Returns:
+        QueryHistory: Registro da pergunta
+    """
+    query_record = QueryHistory(
+        user_id=conversation.user_id,
+        question=question,
+        response=match['answer'],
+        category='faq',
+        prompt_tokens=0,
+        completion_tokens=match['completion_tokens'],
+        latency_ms=int((time.monotonic() - started) * 1000),
+        conversation_id=conversation.id
+    )
+    db.session.add(query_record)
+    conversation.updated_at = datetime.utcnow()
+    db.session.commit()
+    logger.info("Pergunta respondida pelo FAQ (entrada %s, semelhança %s)", match['id'], match['score'],
+                extra={'faq_id': match['id'], 'latency_ms': query_record.latency_ms})
+    return query_record
 
 # Função para executar o modelo LLaMA
-def run_llama_model(prompt):
-    try:
-        # Criar arquivo temporário para o prompt
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False) as temp_file:
-            temp_file.write(prompt)
-            temp_file_path = temp_file.name
-        
-        # Comando para executar o modelo LLaMA
-        cmd = [
-            f"{LLAMA_PATH}/main",
-            "-m", MODEL_PATH,
-            "-c", CONTEXT_SIZE,
-            "-t", TEMPERATURE,
-            "-n", "1024",
-            "--color", "0",
-            "--temp", TEMPERATURE,
-            "--repeat_penalty", "1.1",
-            "--in-prefix", "[INST]",
-            "--in-suffix", "[/INST]",
-            "-f", temp_file_path
-        ]
-        
-        # Executar o comando e capturar a saída
-        logger.info(f"Executando comando: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        # Limpar o arquivo temporário
-        os.unlink(temp_file_path)
-        
-        # Processar a saída
-        output = result.stdout
-        
-        # Extrair apenas a resposta do modelo (após o prompt)
-        response_parts = output.split('[/INST]')
-        if len(response_parts) > 1:
-            response = response_parts[1].strip()
-        else:
-            response = output.strip()
-            
-        return response
+def run_llama_model(prompt, request_id=None, user_id=None, budget=None, category='default',
+                    conversation_id=None):
+    """Gera a resposta de uma pergunta
     
+    Returns:
+        tuple: (resposta ou mensagem de erro, True se a geração foi concluída com sucesso)
+    """
+    try:
+        question_tokens = budget.question_tokens if budget else 0
+        # Requisições com o mesmo prompt de sistema vão preferencialmente ao
+        # mesmo servidor de inferência, que já tem esse prefixo em cache
+        response, _ = router.generate(
+            prompt, category, question_tokens,
+            request_id=request_id, user_id=user_id, budget=budget,
+            cache_key=f"system:{category}", conversation_id=conversation_id
+        )
+        return response, True
+    except (GenerationCancelled, GenerationConflict, ModelBusy, BackendUnavailable):
+        raise
     except Exception as e:
-        logger.error(f"Erro ao executar o modelo: {str(e)}")
-        return f"Erro ao processar sua pergunta: {str(e)}"
+        logger.error("Erro ao executar o modelo: %s", e)
+        return f"Erro ao processar sua pergunta: {str(e)}", False
 
 # Rota principal
-@app.route('/')
+@main.route('/')
 def index():
-    if 'username' not in session:
+    if current_user() is None:
         return render_template('login.html')
     return render_template('index.html')
 
 # Rota de login
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -121,97 +147,627 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
+        if user and user.active and user.check_password(password):
+            # Nova sessão a cada login (evita a fixação de sessão)
+            current_app.session_interface.regenerate(session)
             session['username'] = username
             session['role'] = user.role
             session['user_id'] = user.id
+            session['department'] = user.department
+            
+            # Senhas gravadas com um esquema antigo são refeitas com o configurado
+            if user.needs_rehash():
+                user.set_password(password)
+                logger.info("Hash de senha do usuário %s atualizado", username)
             
             # Atualizar último login
             user.last_login = datetime.utcnow()
             db.session.commit()
+            user_cache.invalidate(user.id)
             
-            logger.info(f"Usuário {username} logado com sucesso")
+            logger.info("Usuário %s logado com sucesso", username)
             return jsonify({'success': True, 'redirect': '/'})
         else:
-            logger.warning(f"Tentativa de login falhou para o usuário {username}")
+            logger.warning("Tentativa de login falhou para o usuário %s", username, extra={'username': username})
             return jsonify({'success': False, 'message': 'Usuário ou senha inválidos'})
     
     return render_template('login.html')
 
 # Rota de logout
-@app.route('/logout')
+@main.route('/logout')
 def logout():
-    session.pop('username', None)
-    session.pop('role', None)
-    session.pop('user_id', None)
+    # Remove a sessão do armazenamento compartilhado e o cookie
+    session.clear()
     return render_template('login.html')
 
 # Rota para processar perguntas
-@app.route('/ask', methods=['POST'])
+@main.route('/ask', methods=['POST'])
+@login_required
 def ask():
-    if 'username' not in session or 'user_id' not in session:
-        return jsonify({'error': 'Não autorizado'}), 401
-    
     data = request.get_json()
     question = data.get('question', '')
     
     if not question:
         return jsonify({'error': 'Pergunta vazia'}), 400
     
-    # Processar a pergunta com o modelo LLaMA
-    response = run_llama_model(question)
+    # Limites de uso do usuário e do departamento
+    try:
+        limiter.check(session['user_id'], session.get('department'))
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    
+    # Identificador usado pela interface para cancelar a geração (e nos logs)
+    request_id = ask_request_id(data)
+    if registry.running(request_id):
+        return generation_conflict_response()
+    
+    conversation = open_conversation(data.get('conversation_id'), session['user_id'], question)
+    if conversation is None:
+        return jsonify({'error': 'Conversa não encontrada'}), 404
+    conversation_id = conversation.id
+    first_question = conversation.queries.count() == 0
+    started = time.monotonic()
+    
+    # Resposta revisada do FAQ, sem passar pelo modelo (apenas para a primeira
+    # pergunta de uma conversa: as seguintes dependem do contexto)
+    match = faq.lookup(question) if first_question else None
+    if match is not None:
+        query_record = record_faq_answer(question, match, conversation, started)
+        return jsonify({
+            'response': match['answer'],
+            'conversation_id': conversation_id,
+            'faq_id': match['id'],
+            'timestamp': query_record.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        })
+    
+    try:
+        prompt, category, budget = prepare_prompt(question, conversation)
+    except PromptTooLong as e:
+        discard_empty_conversation(conversation_id)
+        return jsonify({'error': str(e)}), 400
+    # Devolve a conexão ao pool enquanto espera o modelo: com vários
+    # atendimentos por worker (ver gunicorn.conf.py), as perguntas em
+    # andamento não podem esgotar as conexões das demais rotas
+    db.session.commit()
+    
+    # Processar a pergunta com o modelo LLaMA (ou reaproveitar uma resposta em
+    # cache, apenas para a primeira pergunta de uma conversa)
+    response = response_cache.get(category, question) if first_question else None
+    if response is None:
+        try:
+            response, succeeded = run_llama_model(
+                prompt, request_id=request_id, user_id=session['user_id'],
+                budget=budget, category=category, conversation_id=conversation_id
+            )
+        except GenerationCancelled as e:
+            discard_empty_conversation(conversation_id)
+            if e.reason == 'timeout':
+                return jsonify({'error': 'Tempo limite excedido ao gerar a resposta'}), 504
+            return jsonify({'error': 'Geração cancelada', 'cancelled': True}), 409
+        except GenerationConflict:
+            discard_empty_conversation(conversation_id)
+            return generation_conflict_response()
+        except (ModelBusy, BackendUnavailable):
+            discard_empty_conversation(conversation_id)
+            return jsonify({'error': 'Servidor ocupado, tente novamente em instantes'}), 503
+        # Apenas respostas não vazias de gerações concluídas vão para o cache
+        if first_question and succeeded and response.strip():
+            response_cache.set(category, question, response)
+        generated = True
+    else:
+        generated = False
+    latency_ms = int((time.monotonic() - started) * 1000)
     
     # Registrar a pergunta no histórico
     query_record = QueryHistory(
         user_id=session['user_id'],
         question=question,
-        response=response
+        response=response,
+        category=category,
+        prompt_tokens=budget.prompt_tokens,
+        completion_tokens=budgeter.counter.count(response),
+        latency_ms=latency_ms,
+        conversation_id=conversation_id
     )
     db.session.add(query_record)
+    conversation.updated_at = datetime.utcnow()
     db.session.commit()
     
-    logger.info(f"Pergunta processada: {question[:50]}...")
+    # Respostas do cache não consomem a cota de tokens
+    if generated:
+        limiter.record(session['user_id'], session.get('department'),
+                       query_record.prompt_tokens + query_record.completion_tokens)
+    
+    # Resumir as perguntas antigas em segundo plano, se necessário
+    summarizer.schedule(conversation)
+    
+    logger.info("Pergunta processada: %.50s...", question,
+                extra={'category': category, 'latency_ms': latency_ms, 'conversation_id': conversation_id,
+                       'prompt_tokens': query_record.prompt_tokens,
+                       'completion_tokens': query_record.completion_tokens, 'cached': not generated})
     
     return jsonify({
         'response': response,
+        'conversation_id': conversation_id,
         'timestamp': query_record.timestamp.strftime("%Y-%m-%d %H:%M:%S")
     })
 
+# Rota para processar perguntas com resposta em streaming
+@main.route('/ask/stream', methods=['POST'])
+@login_required
+def ask_stream():
+    data = request.get_json()
+    question = data.get('question', '')
+    
+    if not question:
+        return jsonify({'error': 'Pergunta vazia'}), 400
+    
+    try:
+        limiter.check(session['user_id'], session.get('department'))
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    
+    request_id = ask_request_id(data)
+    if registry.running(request_id):
+        return generation_conflict_response()
+    user_id = session['user_id']
+    department = session.get('department')
+    conversation = open_conversation(data.get('conversation_id'), user_id, question)
+    if conversation is None:
+        return jsonify({'error': 'Conversa não encontrada'}), 404
+    conversation_id = conversation.id
+    headers = {'X-Request-ID': request_id, 'X-Conversation-ID': str(conversation_id)}
+    
+    match = faq.lookup(question) if conversation.queries.count() == 0 else None
+    if match is not None:
+        record_faq_answer(question, match, conversation, time.monotonic())
+        headers['X-FAQ-ID'] = str(match['id'])
+        return Response(match['answer'], mimetype='text/plain', headers=headers)
+    
+    try:
+        prompt, category, budget = prepare_prompt(question, conversation)
+    except PromptTooLong as e:
+        discard_empty_conversation(conversation_id)
+        return jsonify({'error': str(e)}), 400
+    app = current_app._get_current_object()
+    
+    def generate():
+        # Se o cliente desconectar, o servidor fecha este gerador e o
+        # fechamento se propaga até o executor, que encerra o processo
+        chunks = []
+        started = time.monotonic()
+        try:
+            for chunk in router.stream(prompt, category, budget.question_tokens,
+                                       request_id=request_id, user_id=user_id, budget=budget,
+                                       cache_key=f"system:{category}",
+                                       conversation_id=conversation_id):
+                chunks.append(chunk)
+                yield chunk
+        except (GenerationCancelled, GenerationConflict):
+            with app.app_context():
+                discard_empty_conversation(conversation_id)
+            return
+        except (ModelBusy, BackendUnavailable):
+            with app.app_context():
+                discard_empty_conversation(conversation_id)
+            yield 'Servidor ocupado, tente novamente em instantes'
+            return
+        
+        response = ''.join(chunks).strip()
+        completion_tokens = budgeter.counter.count(response)
+        with app.app_context():
+            db.session.add(QueryHistory(
+                user_id=user_id,
+                question=question,
+                response=response,
+                category=category,
+                prompt_tokens=budget.prompt_tokens,
+                completion_tokens=completion_tokens,
+                latency_ms=int((time.monotonic() - started) * 1000),
+                conversation_id=conversation_id
+            ))
+            conversation = db.session.get(Conversation, conversation_id)
+            conversation.updated_at = datetime.utcnow()
+            db.session.commit()
+            limiter.record(user_id, department, budget.prompt_tokens + completion_tokens)
+            summarizer.schedule(conversation)
+    
+    return Response(generate(), mimetype='text/plain', headers=headers)
+
+# Rota para listar as conversas do usuário
+@main.route('/conversations')
+@login_required
+def conversations():
+    records = Conversation.query.filter_by(user_id=session['user_id']) \
+        .order_by(Conversation.updated_at.desc()).limit(50).all()
+    return jsonify({'conversations': [
+        {
+            'id': record.id,
+            'title': record.title,
+            'updated_at': record.updated_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        for record in records
+    ]})
+
+# Rota para consultar ou excluir uma conversa
+@main.route('/conversations/<int:conversation_id>', methods=['GET', 'DELETE'])
+@login_required
+def conversation_detail(conversation_id):
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=session['user_id']).first()
+    if conversation is None:
+        return jsonify({'error': 'Conversa não encontrada'}), 404
+    
+    if request.method == 'DELETE':
+        # As perguntas continuam no histórico, apenas desvinculadas da conversa
+        QueryHistory.query.filter_by(conversation_id=conversation_id).update({'conversation_id': None})
+        db.session.delete(conversation)
+        db.session.commit()
+        kv_cache.discard(conversation_id)
+        return jsonify({'success': True})
+    
+    return jsonify({
+        'id': conversation.id,
+        'title': conversation.title,
+        'turns': [
+            {
+                'question': query.question,
+                'response': query.response,
+                'timestamp': query.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+            }
+            for query in conversation.queries
+        ]
+    })
+
+# Função para obter um trabalho em lote do usuário (ou qualquer um, para administradores)
+def get_batch_job(job_id):
+    job = db.session.get(BatchJob, job_id)
+    if job is None or (job.user_id != session['user_id'] and current_user().role != 'admin'):
+        return None
+    return job
+
+# Rota para criar e listar trabalhos em lote
+@main.route('/batch', methods=['GET', 'POST'])
+@login_required
+def batch_jobs():
+    if request.method == 'GET':
+        jobs = BatchJob.query.filter_by(user_id=session['user_id']) \
+            .order_by(BatchJob.created_at.desc()).limit(50).all()
+        return jsonify({'jobs': [job.to_dict() for job in jobs]})
+    
+    # Limites de uso do usuário e do departamento; os tokens de cada resposta
+    # são somados às cotas pelo worker de lote
+    try:
+        limiter.check(session['user_id'], session.get('department'))
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    
+    # Arquivo enviado (.txt, .csv ou .jsonl) ou JSON com a lista de perguntas
+    max_questions = current_app.config.get('BATCH_MAX_QUESTIONS', 5000)
+    uploaded = request.files.get('file')
+    try:
+        if uploaded:
+            name = request.form.get('name') or uploaded.filename or 'Lote'
+            questions = parse_questions(uploaded.filename, uploaded.read(), max_questions)
+        else:
+            data = request.get_json(silent=True) or {}
+            name = data.get('name') or 'Lote'
+            questions = [str(q).strip() for q in data.get('questions') or [] if str(q).strip()]
+            if not questions:
+                raise ValueError("Nenhuma pergunta enviada")
+            if len(questions) > max_questions:
+                raise ValueError(f"O lote excede o limite de {max_questions} perguntas")
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job = create_job(session['user_id'], name, questions)
+    return jsonify(job.to_dict()), 202
+
+# Rota para consultar o andamento de um trabalho em lote
+@main.route('/batch/<int:job_id>')
+@login_required
+def batch_job_status(job_id):
+    job = get_batch_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabalho não encontrado'}), 404
+    return jsonify(job.to_dict())
+
+# Rota para baixar os resultados de um trabalho em lote (JSONL ou CSV)
+@main.route('/batch/<int:job_id>/results')
+@login_required
+def batch_job_results(job_id):
+    job = get_batch_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabalho não encontrado'}), 404
+    
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in ('jsonl', 'csv'):
+        return jsonify({'error': 'Formato inválido (use jsonl ou csv)'}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(export_results(job.id, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=lote-{job.id}.{fmt}'}
+    )
+
+# Rota para cancelar um trabalho em lote
+@main.route('/batch/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def batch_job_cancel(job_id):
+    job = get_batch_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabalho não encontrado'}), 404
+    return jsonify({'success': cancel_job(job)})
+
+# Rota para cancelar uma geração em andamento
+@main.route('/ask/cancel', methods=['POST'])
+@login_required
+def ask_cancel():
+    # Aceita JSON ou texto simples (navigator.sendBeacon)
+    data = request.get_json(silent=True) or {}
+    request_id = data.get('request_id') or request.get_data(as_text=True).strip()
+    
+    if not request_id:
+        return jsonify({'error': 'Identificador da requisição ausente'}), 400
+    
+    cancelled = registry.cancel(request_id, user_id=session['user_id'])
+    return jsonify({'success': cancelled})
+
 # Rota para visualizar histórico (apenas para administradores)
-@app.route('/history')
+@main.route('/history')
+@admin_required
 def history():
-    if 'username' not in session or session.get('role') != 'admin':
-        return jsonify({'error': 'Não autorizado'}), 401
+    """Histórico paginado, do mais recente para o mais antigo
+    
+    Parâmetros: page, q (busca na pergunta) e archived=1 (busca no índice
+    das perguntas arquivadas, que guarda só o início da resposta)
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config.get('HISTORY_PAGE_SIZE', 50)
+    search = request.args.get('q', '').strip()
+    archived = request.args.get('archived') == '1'
     
-    # Buscar histórico de perguntas do banco de dados
-    history_records = QueryHistory.query.order_by(QueryHistory.timestamp.desc()).all()
-    history_list = []
+    model = ArchivedQuery if archived else QueryHistory
+    response_column = ArchivedQuery.response_preview if archived else QueryHistory.response
+    query = db.session.query(model.id, model.question, response_column.label('response'),
+                             model.timestamp, User.username) \
+        .outerjoin(User, model.user_id == User.id)
+    if search:
+        query = query.filter(model.question.contains(search))
+    # Busca uma linha a mais para saber se existe a próxima página
+    records = query.order_by(model.timestamp.desc(), model.id.desc()) \
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
     
-    for record in history_records:
-        user = User.query.get(record.user_id)
-        history_list.append({
-            'user': user.username if user else 'Usuário desconhecido',
+    history_list = [
+        {
+            'id': record.id,
+            'user': record.username or 'Usuário desconhecido',
             'question': record.question,
-            'response': record.response,
+            'response': record.response or '',
             'timestamp': record.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        })
+        }
+        for record in records[:per_page]
+    ]
     
-    return render_template('history.html', history=history_list)
+    return render_template('history.html', history=history_list, page=page, search=search,
+                           archived=archived, has_next=len(records) > per_page)
+
+# Rota para exportar o histórico para análise (apenas para administradores)
+@main.route('/history/export')
+@admin_required
+def history_export():
+    """Exporta o histórico em CSV, JSONL ou Parquet, em streaming
+    
+    Parâmetros: format, from e to (AAAA-MM-DD), user e department
+    """
+    # Importado na primeira exportação (carrega o pyarrow, se instalado)
+    from export import FORMATS, export_history, parse_filters
+    
+    fmt = request.args.get('format', 'csv')
+    try:
+        filters = parse_filters(request.args)
+        chunks = export_history(fmt, filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    extension, mimetype = FORMATS[fmt]
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=historico-{datetime.utcnow():%Y%m%d}.{extension}'}
+    )
+
+# Rota para a busca nos documentos (SharePoint, File Server e FAQ)
+@main.route('/search')
+@login_required
+def search():
+    """Busca federada (ver retrieval.py). Parâmetros: q e limit"""
+    try:
+        results = retriever.search(request.args.get('q', ''), request.args.get('limit', type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(results)
+
+# Rota para consultar e alterar as opções de perfil (apenas para administradores)
+@main.route('/admin/profiling', methods=['GET', 'POST'])
+@admin_required
+def admin_profiling():
+    """Opções de perfil e perfis gravados
+    
+    O corpo do POST pode trazer sampler (amostragem contínua), paths e count
+    (perfil das próximas requisições desses caminhos) e reset_samples.
+    """
+    if request.method == 'POST':
+        try:
+            settings = profiler.save(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.info("Opções de perfil alteradas por %s: %s", session['username'], settings)
+        return jsonify({'success': True, 'settings': settings})
+    
+    return jsonify({'settings': profiler.settings(), 'profiles': profiler.profiles(), 'metrics': profiler.metrics()})
+
+# Rota para exportar as pilhas amostradas (apenas para administradores)
+@main.route('/admin/profiling/flamegraph')
+@admin_required
+def admin_profiling_flamegraph():
+    """Pilhas de todos os workers no formato folded (flamegraph.pl, speedscope)"""
+    return Response(profiler.folded(), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=amostras-{datetime.utcnow():%Y%m%d-%H%M}.folded'})
+
+# Rota para consultar o perfil de uma requisição (apenas para administradores)
+@main.route('/admin/profiling/<request_id>')
+@admin_required
+def admin_profiling_report(request_id):
+    """Relatório em texto do perfil (ou HTML do pyinstrument); com
+    format=raw, o arquivo .prof para o snakeviz ou o pstats
+    """
+    try:
+        path = profiler.profile_path(request_id)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    raw = request.args.get('format') == 'raw'
+    if raw or path.endswith('.html'):
+        return send_file(path, as_attachment=raw)
+    return Response(profiler.report(path), mimetype='text/plain')
 
 # Rota para administração (apenas para administradores)
-@app.route('/admin')
+@main.route('/admin')
+@admin_required
 def admin():
-    if 'username' not in session or session.get('role') != 'admin':
-        return jsonify({'error': 'Não autorizado'}), 401
+    return render_template('admin.html', **runtime_settings.model_settings())
+
+# Rota para métricas de inferência (apenas para administradores)
+@main.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    return jsonify({
+        'inference': registry.metrics(),
+        'routing': router.metrics(),
+        'backends': pools_metrics(),
+        'kv_cache': kv_cache.metrics(),
+        'speculative': speculative.metrics(),
+        'resources': resources.metrics(),
+        'faq': faq.metrics(),
+        'retrieval': retriever.metrics(),
+        'profiling': profiler.metrics(),
+        'logging': logging_metrics(),
+        'summarizer': summarizer.metrics(),
+        'limits': limiter.metrics(),
+        'user_cache': user_cache.metrics()
+    })
+
+# Rota para o painel de uso (apenas para administradores)
+@main.route('/admin/analytics')
+@admin_required
+def admin_analytics():
+    """Uso por período e por usuário, departamento ou categoria
+    
+    Lê apenas os totais pré-agregados (ver rollups.py). Parâmetros:
+    dimension, period ('day' ou 'hour') e days (intervalo).
+    """
+    period = request.args.get('period', 'day')
+    days = request.args.get('days', type=int)
+    since = datetime.utcnow() - timedelta(days=days) if days else None
+    try:
+        summary = rollups.summary(request.args.get('dimension', 'department'), period, since)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(summary)
+
+# Rota para consultar e alterar as configurações do modelo (apenas para administradores)
+@main.route('/admin/settings', methods=['GET', 'POST'])
+@admin_required
+def admin_settings():
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Configurações inválidas'}), 400
+        try:
+            settings = runtime_settings.save(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.info("Configurações do modelo alteradas por %s", session['username'])
+        return jsonify({'success': True, 'settings': settings})
+    
+    return jsonify({'settings': runtime_settings.model_settings()})
+
+# Rota para consultar e alterar os limites de uso (apenas para administradores)
+@main.route('/admin/limits', methods=['GET', 'POST'])
+@admin_required
+def admin_limits():
+    if request.method == 'POST':
+        try:
+            limits = limiter.save(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.info("Limites de uso alterados por %s", session['username'])
+        return jsonify({'success': True, 'limits': limits})
+    
+    return jsonify({'limits': limiter.limits(), 'usage': limiter.usage()})
+
+# Rota para listar e cadastrar as entradas do FAQ (apenas para administradores)
+@main.route('/admin/faq', methods=['GET', 'POST'])
+@admin_required
+def admin_faq():
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Entrada inválida'}), 400
+        try:
+            entry = faq.save(data, user_id=session['user_id'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.info("Entrada %s do FAQ criada por %s", entry.id, session['username'])
+        return jsonify({'success': True, 'entry': entry.to_dict()})
+    
+    entries = FAQEntry.query.order_by(FAQEntry.updated_at.desc()).all()
+    return jsonify({'entries': [entry.to_dict() for entry in entries], 'metrics': faq.metrics()})
+
+# Rota para alterar ou remover uma entrada do FAQ (apenas para administradores)
+@main.route('/admin/faq/<int:entry_id>', methods=['POST', 'DELETE'])
+@admin_required
+def admin_faq_entry(entry_id):
+    try:
+        if request.method == 'DELETE':
+            faq.delete(entry_id)
+            logger.info("Entrada %s do FAQ removida por %s", entry_id, session['username'])
+            return jsonify({'success': True})
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Entrada inválida'}), 400
+        entry = faq.save(data, entry_id=entry_id)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info("Entrada %s do FAQ alterada por %s", entry_id, session['username'])
+    return jsonify({'success': True, 'entry': entry.to_dict()})
+
+# Rota para adicionar uma resposta do histórico ao FAQ (apenas para administradores)
+@main.route('/history/<int:query_id>/promote', methods=['POST'])
+@admin_required
+def history_promote(query_id):
+    """Cria uma entrada do FAQ com a pergunta e a resposta do histórico
     
-    return render_template('admin.html')
+    O corpo (opcional) pode trazer a resposta revisada, variações da
+    pergunta e a categoria.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Entrada inválida'}), 400
+    try:
+        entry = faq.promote(query_id, session['user_id'], data)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info("Pergunta %s adicionada ao FAQ por %s", query_id, session['username'])
+    return jsonify({'success': True, 'entry': entry.to_dict()})
 
 # Rota para adicionar usuários (apenas para administradores)
-@app.route('/admin/add_user', methods=['POST'])
+@main.route('/admin/add_user', methods=['POST'])
+@admin_required
 def add_user():
-    if 'username' not in session or session.get('role') != 'admin':
-        return jsonify({'error': 'Não autorizado'}), 401
-    
     data = request.get_json()
     new_username = data.get('username')
     new_password = data.get('password')
@@ -241,11 +797,114 @@ def add_user():
     db.session.add(new_user)
     db.session.commit()
     
-    logger.info(f"Novo usuário adicionado: {new_username}")
+    logger.info("Novo usuário adicionado: %s", new_username)
     
     return jsonify({'success': True})
 
+# Comando para criar as tabelas e os usuários padrão
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Cria as tabelas do banco de dados e os usuários padrão"""
+    bootstrap_db()
+    click.echo("Banco de dados inicializado")
+
+# Comandos de manutenção, importados apenas quando executados pelo "flask"
+CLI_COMMANDS = (
+    ('batch-worker', 'batch:batch_worker_command'),
+    ('archive-history', 'archive:archive_history_command'),
+    ('restore-history', 'archive:restore_history_command'),
+    ('export-history', 'export:export_history_command'),
+    ('rollup-usage', 'rollups:rollup_usage_command'),
+    ('calibrate-inference', 'resources:calibrate_inference_command'),
+    ('index-fileserver', 'retrieval:index_fileserver_command'),
+)
+
+class LazyCommand(click.Command):
+    """Comando cujo módulo só é importado quando o comando é executado (ou
+    listado em "flask --help"), e não em cada worker da aplicação web"""
+    
+    def __init__(self, name, import_path):
+        super().__init__(name)
+        self.import_path = import_path
+    
+    def load(self):
+        module, attribute = self.import_path.split(':')
+        return getattr(import_module(module), attribute)
+    
+    def get_short_help_str(self, limit=45):
+        return self.load().get_short_help_str(limit)
+    
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self.load().make_context(info_name, args, parent=parent, **extra)
+
+# Fábrica da aplicação
+def create_app(config_object=None, instance_path=None):
+    """Cria e configura a aplicação Flask
+    
+    A criação não acessa o banco de dados: as tabelas e os usuários padrão
+    são criados uma única vez pelo comando "flask init-db" ou pelo hook
+    on_starting do Gunicorn (ver gunicorn.conf.py), e não em cada worker.
+    
+    Args:
+        config_object (object, optional): Classe de configuração (padrão: get_config())
+        instance_path (str, optional): Diretório dos arquivos locais (banco
+            SQLite, chave secreta, estado compartilhado; padrão: instance/)
+        
+    Returns:
+        Flask: Aplicação configurada
+    """
+    app = Flask(__name__, instance_path=instance_path)
+    app.config.from_object(config_object or get_config())
+    configure_logging(app.config)
+    app.secret_key = app.config.get('SECRET_KEY') or load_or_create_secret_key(app.instance_path)
+    
+    # Sessões e cache de respostas compartilhados entre os workers
+    shared_state.init_app(app)
+    
+    # Identificador e perfis das requisições (registrado primeiro para medir
+    # também as demais funções executadas antes da rota)
+    profiler.init_app(app)
+    response_cache.init_app(app)
+    limiter.init_app(app)
+    
+    # Inicializar o banco de dados
+    db.init_app(app)
+    
+    # Configurações do modelo alteradas em /admin, recarregadas em todos os workers
+    runtime_settings.init_app(app)
+    
+    # Flask-Migrate (Alembic) só é necessário nos comandos "flask db"
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    
+    # Configurar o executor, o orçamento de tokens e o roteamento entre modelos
+    llama.init_app(app)
+    budgeter.init_app(app)
+    router.init_app(app)
+    summarizer.init_app(app)
+    rollups.init_app(app)
+    faq.init_app(app)
+    retriever.init_app(app)
+    
+    # Arquivos estáticos versionados (asset_url) e compressão das respostas
+    assets.init_app(app)
+    
+    # Ano do rodapé das páginas
+    app.context_processor(lambda: {'current_year': datetime.utcnow().year})
+    
+    app.register_blueprint(main)
+    app.cli.add_command(init_db_command)
+    for name, import_path in CLI_COMMANDS:
+        app.cli.add_command(LazyCommand(name, import_path))
+    
+    return app
+
 # Inicialização da aplicação
 if __name__ == '__main__':
     # Em produção, use um servidor WSGI como Gunicorn
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    app = create_app()
+    with app.app_context():
+        bootstrap_db()
+    app.run(host='0.0.0.0', port=5000, debug=False)
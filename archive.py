@@ -0,0 +1,282 @@
+# archive.py
+# Retenção do histórico de perguntas: as linhas de query_history mais antigas
+# que HISTORY_RETENTION_DAYS são gravadas em arquivos compactados por mês
+# (JSONL com gzip ou, se o pacote zstandard estiver instalado, zstd) e
+# removidas do banco. Um índice (tabela history_archive) guarda a pergunta e
+# os metadados para busca e para a restauração.
+#
+# Uso: "flask archive-history" (por exemplo, uma vez por dia pelo cron) e
+# "flask restore-history".
+
+import io
+import os
+import gzip
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_
+
+from models import db, User, QueryHistory, Conversation, ArchivedQuery
+from rollups import rollups
+
+try:
+    # Dependência opcional (compressão zstd)
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Extensão dos arquivos de cada formato de compressão
+EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+# Colunas copiadas para o arquivo da partição
+COLUMNS = ('id', 'user_id', 'question', 'response', 'timestamp', 'category',
+           'prompt_tokens', 'completion_tokens', 'latency_ms', 'conversation_id')
+
+
+# Função para compactar um bloco de linhas JSONL
+def compress(data, fmt):
+    """Compacta um bloco; blocos compactados podem ser concatenados no mesmo arquivo"""
+    if fmt == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+# Função para ler as linhas de um arquivo de partição
+def read_partition(path):
+    """Lê os registros de um arquivo de partição, em sequência
+
+    Yields:
+        dict: Registro arquivado
+    """
+    with open(path, 'rb') as raw:
+        if path.endswith(EXTENSIONS['zstd']):
+            if zstandard is None:
+                raise RuntimeError("O pacote zstandard é necessário para ler arquivos .zst")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = gzip.GzipFile(fileobj=raw)
+        for line in io.TextIOWrapper(stream, encoding='utf-8'):
+            if line.strip():
+                yield json.loads(line)
+
+
+class HistoryArchiver:
+    """Move o histórico antigo para os arquivos compactados e o restaura"""
+
+    def __init__(self, app):
+        self.config = app.config
+        self.directory = self.config.get('ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+        self.format = self.config.get('ARCHIVE_COMPRESSION', 'gzip')
+        if self.format not in EXTENSIONS:
+            raise ValueError(f"Compressão não suportada: {self.format}")
+        if self.format == 'zstd' and zstandard is None:
+            raise ValueError("ARCHIVE_COMPRESSION=zstd requer o pacote zstandard")
+
+    def partition_name(self, timestamp):
+        return f"history-{timestamp:%Y-%m}{EXTENSIONS[self.format]}"
+
+    def candidates(self, cutoff, limit):
+        """Perguntas mais antigas que cutoff, de conversas sem atividade desde então"""
+        return QueryHistory.query.outerjoin(Conversation, QueryHistory.conversation_id == Conversation.id) \
+            .filter(QueryHistory.timestamp < cutoff) \
+            .filter(or_(QueryHistory.conversation_id.is_(None), Conversation.updated_at < cutoff)) \
+            .order_by(QueryHistory.id).limit(limit).all()
+
+    def archive_batch(self, cutoff, batch_size):
+        """Arquiva um lote de perguntas em uma única transação
+
+        O bloco é gravado (e sincronizado no disco) antes de as linhas serem
+        removidas do banco; se o processo parar entre as duas etapas, o bloco
+        é gravado de novo na próxima execução e a restauração usa a última cópia.
+
+        Returns:
+            int: Perguntas arquivadas
+        """
+        rows = self.candidates(cutoff, batch_size)
+        if not rows:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(self.partition_name(row.timestamp), []).append(row)
+        for partition, group in partitions.items():
+            data = ''.join(
+                json.dumps({
+                    column: (getattr(row, column).isoformat() if column == 'timestamp' else getattr(row, column))
+                    for column in COLUMNS
+                }, ensure_ascii=False) + '\n'
+                for row in group
+            ).encode('utf-8')
+            with open(os.path.join(self.directory, partition), 'ab') as partition_file:
+                partition_file.write(compress(data, self.format))
+                partition_file.flush()
+                os.fsync(partition_file.fileno())
+
+        db.session.bulk_insert_mappings(ArchivedQuery, [
+            {
+                'id': row.id,
+                'user_id': row.user_id,
+                'question': row.question,
+                'response_preview': row.response[:200],
+                'timestamp': row.timestamp,
+                'category': row.category,
+                'prompt_tokens': row.prompt_tokens,
+                'completion_tokens': row.completion_tokens,
+                'latency_ms': row.latency_ms,
+                'conversation_id': row.conversation_id,
+                'partition': self.partition_name(row.timestamp)
+            }
+            for row in rows
+        ])
+        QueryHistory.query.filter(QueryHistory.id.in_([row.id for row in rows])) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+        return len(rows)
+
+    def run(self, days=None, batch_size=None, vacuum=True):
+        """Arquiva, em lotes, todas as perguntas fora do prazo de retenção
+
+        Cada lote é uma transação curta, para não bloquear as gravações da
+        aplicação por muito tempo.
+
+        Returns:
+            dict: Perguntas arquivadas, lotes, se houve VACUUM e duração
+        """
+        days = int(days if days is not None else self.config.get('HISTORY_RETENTION_DAYS', 180))
+        batch_size = int(batch_size or self.config.get('ARCHIVE_BATCH_SIZE', 2000))
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        started = time.monotonic()
+        # As perguntas arquivadas deixam de ser lidas pelos totais de uso
+        rollups.refresh()
+        archived = batches = 0
+        while True:
+            count = self.archive_batch(cutoff, batch_size)
+            if not count:
+                break
+            archived += count
+            batches += 1
+        vacuumed = self.maybe_vacuum() if vacuum and archived else False
+        stats = {
+            'archived': archived,
+            'batches': batches,
+            'vacuumed': vacuumed,
+            'seconds': round(time.monotonic() - started, 2)
+        }
+        logger.info("Histórico arquivado: %s", stats)
+        return stats
+
+    def maybe_vacuum(self):
+        """Executa VACUUM no SQLite quando a fração de páginas livres passar de
+        ARCHIVE_VACUUM_FREE_RATIO (o VACUUM reescreve o arquivo inteiro)
+
+        Returns:
+            bool: True se o VACUUM foi executado
+        """
+        if db.engine.dialect.name != 'sqlite':
+            return False
+        with db.engine.connect() as conn:
+            pages = conn.exec_driver_sql('PRAGMA page_count').scalar() or 0
+            free = conn.exec_driver_sql('PRAGMA freelist_count').scalar() or 0
+        ratio = float(self.config.get('ARCHIVE_VACUUM_FREE_RATIO', 0.2))
+        if not pages or free / pages < ratio:
+            return False
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+        logger.info("VACUUM executado: %s de %s páginas livres", free, pages)
+        return True
+
+    def restore(self, ids=None, start=None, end=None, user_id=None):
+        """Devolve perguntas arquivadas para query_history
+
+        Args:
+            ids (list, optional): Identificadores das perguntas
+            start, end (datetime, optional): Período das perguntas
+            user_id (int, optional): Usuário das perguntas
+
+        Returns:
+            int: Perguntas restauradas
+        """
+        query = ArchivedQuery.query
+        if ids:
+            query = query.filter(ArchivedQuery.id.in_(ids))
+        if start:
+            query = query.filter(ArchivedQuery.timestamp >= start)
+        if end:
+            query = query.filter(ArchivedQuery.timestamp < end)
+        if user_id:
+            query = query.filter(ArchivedQuery.user_id == user_id)
+
+        wanted = {}
+        for entry in query.with_entities(ArchivedQuery.id, ArchivedQuery.partition):
+            wanted.setdefault(entry.partition, set()).add(entry.id)
+
+        restored = 0
+        for partition, partition_ids in wanted.items():
+            # A última cópia de cada registro é a válida
+            records = {}
+            for record in read_partition(os.path.join(self.directory, partition)):
+                if record['id'] in partition_ids:
+                    records[record['id']] = record
+            conversation_ids = {r['conversation_id'] for r in records.values() if r['conversation_id']}
+            existing = {
+                conversation_id for (conversation_id,) in db.session.query(Conversation.id)
+                .filter(Conversation.id.in_(conversation_ids))
+            }
+            for record in records.values():
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                if record['conversation_id'] not in existing:
+                    record['conversation_id'] = None
+            db.session.bulk_insert_mappings(QueryHistory, list(records.values()))
+            ArchivedQuery.query.filter(ArchivedQuery.id.in_(list(records))) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+            restored += len(records)
+            missing = len(partition_ids) - len(records)
+            if missing:
+                logger.warning("%s perguntas do índice não foram encontradas em %s", missing, partition)
+        logger.info("%s perguntas restauradas do arquivo", restored)
+        return restored
+
+
+# Comando para arquivar o histórico antigo
+@click.command('archive-history')
+@click.option('--days', type=int, default=None, help='Prazo de retenção (padrão: HISTORY_RETENTION_DAYS)')
+@click.option('--batch-size', type=int, default=None, help='Perguntas por transação')
+@click.option('--no-vacuum', is_flag=True, help='Não executar VACUUM ao final')
+@with_appcontext
+def archive_history_command(days, batch_size, no_vacuum):
+    """Move as perguntas antigas para os arquivos compactados"""
+    stats = HistoryArchiver(current_app._get_current_object()).run(days, batch_size, vacuum=not no_vacuum)
+    click.echo(f"{stats['archived']} perguntas arquivadas em {stats['batches']} lotes "
+               f"({stats['seconds']} s{', com VACUUM' if stats['vacuumed'] else ''})")
+
+
+# Comando para restaurar perguntas arquivadas
+@click.command('restore-history')
+@click.option('--id', 'ids', type=int, multiple=True, help='Pergunta a restaurar (pode repetir)')
+@click.option('--from', 'start', type=click.DateTime(), default=None, help='Início do período')
+@click.option('--to', 'end', type=click.DateTime(), default=None, help='Fim do período (exclusivo)')
+@click.option('--user', 'username', default=None, help='Usuário das perguntas')
+@with_appcontext
+def restore_history_command(ids, start, end, username):
+    """Devolve perguntas arquivadas para o histórico"""
+    if not (ids or start or end or username):
+        raise click.UsageError("Informe --id, --from, --to ou --user")
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.UsageError(f"Usuário não encontrado: {username}")
+        user_id = user.id
+    restored = HistoryArchiver(current_app._get_current_object()).restore(list(ids), start, end, user_id)
+    click.echo(f"{restored} perguntas restauradas")
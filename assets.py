@@ -0,0 +1,151 @@
+# assets.py
+# Arquivos estáticos versionados e compressão das respostas, sem etapa de
+# build: na inicialização, cada arquivo de static/ recebe um nome com o hash
+# do conteúdo (css/style.3f2a9c1b7d4e.css) e versões gzip e brotli em
+# memória. Os templates usam asset_url('css/style.css'); como o nome muda a
+# cada alteração, os navegadores guardam o arquivo por um ano
+# (Cache-Control immutable) e não voltam a pedi-lo ao worker.
+#
+# As respostas JSON e HTML (ex.: /ask, /history) são compactadas com gzip
+# quando o cliente aceita e o corpo passa de COMPRESS_MIN_SIZE bytes.
+
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+
+from flask import current_app, request, url_for, abort, Response
+
+try:
+    # Dependência opcional (compressão brotli dos arquivos estáticos)
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Tipos compactados (arquivos estáticos e respostas da aplicação)
+COMPRESSIBLE_TYPES = {
+    'text/css', 'text/javascript', 'application/javascript', 'application/json',
+    'text/html', 'text/plain', 'image/svg+xml', 'text/csv', 'application/x-ndjson'
+}
+
+# Comprimento do hash no nome dos arquivos
+HASH_LENGTH = 12
+
+
+class Asset:
+    """Arquivo estático com nome versionado e versões compactadas"""
+
+    def __init__(self, path, name, data, mtime):
+        self.path = path
+        self.mtime = mtime
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        root, extension = os.path.splitext(name)
+        self.url_name = f"{root}.{digest}{extension}"
+        self.etag = digest
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.variants = {'identity': data}
+        if self.mimetype in COMPRESSIBLE_TYPES:
+            compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(data, quality=11)
+            # Só guarda as versões que ficam menores que o original
+            self.variants.update({
+                encoding: body for encoding, body in compressed.items() if len(body) < len(data)
+            })
+
+
+class AssetPipeline:
+    """Manifesto dos arquivos estáticos e compressão das respostas"""
+
+    def init_app(self, app):
+        app.extensions['assets'] = self.build(app.static_folder)
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.add_template_global(self.asset_url, 'asset_url')
+        app.after_request(self.compress_response)
+
+    def build(self, folder):
+        """Lê os arquivos da pasta static
+
+        Returns:
+            dict: 'by_name' (caminho original -> Asset) e 'by_url' (nome versionado -> Asset)
+        """
+        by_name, by_url = {}, {}
+        for directory, _, files in os.walk(folder or ''):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, folder).replace(os.sep, '/')
+                with open(path, 'rb') as asset_file:
+                    asset = Asset(path, name, asset_file.read(), os.path.getmtime(path))
+                by_name[name] = asset
+                by_url[asset.url_name] = asset
+        logger.debug("%d arquivos estáticos versionados", len(by_name))
+        return {'by_name': by_name, 'by_url': by_url, 'folder': folder}
+
+    def _manifest(self):
+        app = current_app._get_current_object()
+        manifest = app.extensions['assets']
+        if app.debug and any(
+            not os.path.exists(asset.path) or os.path.getmtime(asset.path) != asset.mtime
+            for asset in manifest['by_name'].values()
+        ):
+            # Em desenvolvimento, os arquivos alterados recebem um novo nome
+            manifest = app.extensions['assets'] = self.build(manifest['folder'])
+        return manifest
+
+    def asset_url(self, filename):
+        """URL versionada de um arquivo de static/ (usada nos templates)"""
+        asset = self._manifest()['by_name'].get(filename)
+        if asset is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=asset.url_name)
+
+    def serve(self, filename):
+        asset = self._manifest()['by_url'].get(filename)
+        if asset is None:
+            abort(404)
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f"{asset.etag}-{encoding}")
+        response.cache_control.public = True
+        response.cache_control.max_age = int(current_app.config.get('ASSETS_MAX_AGE', 31536000))
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+
+    def compress_response(self, response):
+        """Compacta com gzip as respostas textuais, quando o cliente aceita
+
+        Respostas em streaming (/ask/stream, exportações) e arquivos enviados
+        diretamente não são alterados.
+        """
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        level = int(current_app.config.get('COMPRESS_LEVEL', 3))
+        if level <= 0:
+            # Compressão feita pelo proxy (ex.: gzip on no nginx)
+            return response
+        response.vary.add('Accept-Encoding')
+        if not request.accept_encodings['gzip']:
+            return response
+        data = response.get_data()
+        if len(data) < int(current_app.config.get('COMPRESS_MIN_SIZE', 1024)):
+            return response
+        response.set_data(gzip.compress(data, compresslevel=level))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
+# Arquivos estáticos da aplicação
+assets = AssetPipeline()
@@ -0,0 +1,298 @@
+# backends.py
+# Pool de servidores de inferência remotos (llama.cpp server) com
+# balanceamento por menor número de requisições em andamento, verificação
+# de saúde, circuit breaker e afinidade por prompt de sistema
+
+import json
+import time
+import socket
+import hashlib
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Falhas consecutivas até abrir o circuito de um nó
+CIRCUIT_FAILURE_THRESHOLD = 3
+
+# Tempo (em segundos) com o circuito aberto antes de uma nova tentativa
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+# Intervalo entre verificações de saúde
+HEALTH_CHECK_INTERVAL = 10.0
+
+# Quantas requisições a mais o nó preferido pode ter em relação ao menos
+# ocupado antes que a afinidade seja ignorada
+STICKY_SLACK = 2
+
+
+class BackendUnavailable(Exception):
+    """Nenhum servidor de inferência disponível"""
+
+
+class InferenceNode:
+    """Estado de um servidor de inferência"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        parts = urlsplit(self.url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.requests = 0
+
+    def connection(self, timeout):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=timeout)
+
+    @property
+    def circuit(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= CIRCUIT_RESET_TIMEOUT:
+            return 'half-open'
+        return 'open'
+
+    def available(self):
+        """Indica se o nó pode receber uma requisição agora"""
+        circuit = self.circuit
+        if circuit == 'open':
+            return False
+        if circuit == 'half-open':
+            # Apenas uma requisição de teste por vez
+            return not self.probing
+        return self.healthy
+
+
+class RemoteCompletion:
+    """Geração em andamento em um servidor remoto
+
+    Implementa poll/terminate/wait como um subprocess.Popen para que o
+    registro de gerações possa cancelá-la da mesma forma; encerrar a
+    conexão faz o servidor interromper a geração.
+    """
+
+    pid = None
+
+    def __init__(self, connection, probe=False):
+        self.connection = connection
+        self.returncode = None
+        # Requisição de teste de um nó em half-open (ver BackendPool.release)
+        self.probe = probe
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            self.returncode = -15
+        sock = self.connection.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    kill = terminate
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+class BackendPool:
+    """Conjunto de servidores de inferência de um modelo"""
+
+    def __init__(self, endpoints):
+        self.nodes = [InferenceNode(url) for url in endpoints]
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    # Seleção de nós
+
+    def _rendezvous(self, node, key):
+        digest = hashlib.blake2b(f"{node.url}|{key}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def acquire(self, affinity_key=None, exclude=()):
+        """Escolhe um nó e incrementa suas requisições em andamento
+
+        Sem chave de afinidade, escolhe o nó com menos requisições em
+        andamento. Com chave, prefere o nó definido por rendezvous hashing
+        (o mesmo enquanto o conjunto de nós saudáveis não mudar), para
+        reaproveitar o cache de prompt do servidor, desde que ele não esteja
+        muito mais ocupado que o menos ocupado.
+
+        Returns:
+            tuple: (nó, True se esta é a requisição de teste de um nó em half-open)
+
+        Raises:
+            BackendUnavailable: se nenhum nó estiver disponível
+        """
+        self._ensure_health_checks()
+        with self._lock:
+            candidates = [n for n in self.nodes if n not in exclude and n.available()]
+            if not candidates:
+                raise BackendUnavailable("Nenhum servidor de inferência disponível")
+            least = min(candidates, key=lambda n: n.outstanding)
+            node = least
+            if affinity_key is not None:
+                preferred = max(candidates, key=lambda n: self._rendezvous(n, affinity_key))
+                if preferred.outstanding <= least.outstanding + STICKY_SLACK:
+                    node = preferred
+            probe = node.circuit == 'half-open'
+            if probe:
+                node.probing = True
+            node.outstanding += 1
+            node.requests += 1
+            return node, probe
+
+    def release(self, node, success, probe=False):
+        """Conclui uma requisição do nó
+
+        Args:
+            node (InferenceNode): Nó da requisição
+            success (bool): Se o servidor respondeu sem erro
+            probe (bool): Se era a requisição de teste do nó (retornado por
+                acquire); só ela libera um novo teste
+        """
+        with self._lock:
+            node.outstanding -= 1
+            if probe:
+                node.probing = False
+            if success:
+                node.failures = 0
+                node.opened_at = None
+                node.healthy = True
+            else:
+                self._record_failure(node)
+
+    def _record_failure(self, node):
+        node.failures += 1
+        if node.failures >= CIRCUIT_FAILURE_THRESHOLD or node.circuit == 'half-open':
+            if node.circuit != 'open':
+                logger.warning("Circuito aberto para o servidor de inferência %s", node.url)
+            node.opened_at = time.monotonic()
+
+    # Verificação de saúde
+
+    def _ensure_health_checks(self):
+        # Iniciada sob demanda para não criar threads antes do fork dos workers
+        if self._health_thread is None or not self._health_thread.is_alive():
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            self.check_health()
+
+    def check_health(self):
+        """Consulta /health de todos os nós"""
+        for node in self.nodes:
+            healthy = False
+            try:
+                connection = node.connection(timeout=2)
+                connection.request('GET', '/health')
+                response = connection.getresponse()
+                response.read()
+                healthy = response.status == 200
+                connection.close()
+            except (OSError, http.client.HTTPException):
+                pass
+            with self._lock:
+                if healthy and not node.healthy:
+                    logger.info("Servidor de inferência %s voltou a responder", node.url)
+                node.healthy = healthy
+                if not healthy:
+                    self._record_failure(node)
+
+    # Geração
+
+    def open_completion(self, payload, affinity_key=None, timeout=120):
+        """Envia uma requisição de geração em streaming
+
+        Tenta os nós disponíveis até que um aceite a requisição.
+
+        Returns:
+            tuple: (nó, RemoteCompletion, resposta HTTP)
+        """
+        body = json.dumps(payload).encode('utf-8')
+        tried = []
+        while True:
+            try:
+                node, probe = self.acquire(affinity_key, exclude=tried)
+            except BackendUnavailable:
+                if tried:
+                    raise BackendUnavailable(
+                        f"Falha em todos os servidores de inferência: {', '.join(n.url for n in tried)}"
+                    )
+                raise
+            connection = node.connection(timeout=timeout)
+            try:
+                connection.request('POST', '/completion', body, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                if response.status != 200:
+                    raise http.client.HTTPException(f"HTTP {response.status}")
+                return node, RemoteCompletion(connection, probe), response
+            except (OSError, http.client.HTTPException) as e:
+                logger.warning("Servidor de inferência %s falhou: %s", node.url, e)
+                connection.close()
+                self.release(node, success=False, probe=probe)
+                tried.append(node)
+
+    def metrics(self):
+        with self._lock:
+            return [
+                {
+                    'url': node.url,
+                    'healthy': node.healthy,
+                    'circuit': node.circuit,
+                    'outstanding': node.outstanding,
+                    'requests': node.requests,
+                    'failures': node.failures
+                }
+                for node in self.nodes
+            ]
+
+
+# Função para ler os eventos de uma resposta em streaming do llama.cpp server
+def iter_events(response):
+    """Lê as linhas "data: {...}" de uma resposta SSE
+
+    Yields:
+        dict: Evento decodificado
+    """
+    while True:
+        line = response.readline()
+        if not line:
+            return
+        line = line.strip()
+        if not line.startswith(b'data:'):
+            continue
+        yield json.loads(line[5:].strip())
+
+
+# Pools por conjunto de endpoints, criados sob demanda
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(endpoints):
+    """Obtém (ou cria) o pool para uma lista de endpoints"""
+    key = tuple(endpoints)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = BackendPool(key)
+        return _pools[key]
+
+
+def pools_metrics():
+    with _pools_lock:
+        return {','.join(key): pool.metrics() for key, pool in _pools.items()}
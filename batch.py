@@ -0,0 +1,376 @@
+# batch.py
+# Processamento em lote de perguntas (geração de FAQ, classificação de
+# chamados etc.): os trabalhos ficam em uma fila no banco de dados e são
+# processados por um worker separado ("flask batch-worker"), na classe de
+# prioridade de segundo plano (ou de administração, para lotes de administradores)
+
+import io
+import os
+import csv
+import json
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from budget import budgeter, PromptTooLong
+from models import db, User, BatchJob, BatchItem
+from prompts import detect_query_type, prepare_prompt
+from routing import router, ModelBusy
+from inference import registry, GenerationCancelled, GenerationConflict
+from quotas import limiter, LimitExceeded
+from state_store import response_cache
+from settings import runtime_settings
+
+logger = logging.getLogger(__name__)
+
+# Colunas aceitas para a pergunta em arquivos CSV e JSONL
+QUESTION_FIELDS = ('question', 'pergunta')
+
+# Perguntas buscadas por rodada, por geração simultânea
+CLAIM_FACTOR = 4
+
+
+# Função para ler as perguntas de um arquivo enviado
+def parse_questions(filename, data, max_questions=5000):
+    """Lê as perguntas de um arquivo .txt (uma por linha), .csv ou .jsonl
+
+    Em CSV, usa a coluna "question" (ou "pergunta") se houver cabeçalho, ou
+    a primeira coluna. Em JSONL, cada linha é um objeto com o campo
+    "question" (ou "pergunta") ou uma string.
+
+    Args:
+        filename (str): Nome do arquivo (a extensão define o formato)
+        data (bytes): Conteúdo do arquivo
+        max_questions (int): Número máximo de perguntas aceitas
+
+    Returns:
+        list: Perguntas não vazias, na ordem do arquivo
+
+    Raises:
+        ValueError: se o arquivo for inválido ou exceder o limite
+    """
+    text = data.decode('utf-8-sig')
+    extension = os.path.splitext(filename or '')[1].lower()
+
+    if extension == '.csv':
+        rows = list(csv.reader(io.StringIO(text)))
+        header = [column.strip().lower() for column in rows[0]] if rows else []
+        column = next((header.index(f) for f in QUESTION_FIELDS if f in header), None)
+        if column is None:
+            column = 0
+        else:
+            rows = rows[1:]
+        questions = [row[column] for row in rows if len(row) > column]
+    elif extension in ('.jsonl', '.ndjson'):
+        questions = []
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ValueError(f"Linha {number} não é um JSON válido")
+            if isinstance(record, dict):
+                record = next((record[f] for f in QUESTION_FIELDS if f in record), '')
+            questions.append(str(record))
+    else:
+        questions = text.splitlines()
+
+    questions = [question.strip() for question in questions if question and question.strip()]
+    if not questions:
+        raise ValueError("Nenhuma pergunta encontrada no arquivo")
+    if len(questions) > max_questions:
+        raise ValueError(f"O arquivo excede o limite de {max_questions} perguntas")
+    return questions
+
+
+# Função para criar um trabalho em lote
+def create_job(user_id, name, questions):
+    """Cria o trabalho e suas perguntas na fila
+
+    Returns:
+        BatchJob: Trabalho criado
+    """
+    job = BatchJob(user_id=user_id, name=name[:200], total=len(questions))
+    db.session.add(job)
+    db.session.flush()
+    db.session.bulk_insert_mappings(BatchItem, [
+        {
+            'job_id': job.id,
+            'position': position,
+            'question': question,
+            'category': detect_query_type(question),
+            'status': 'pending'
+        }
+        for position, question in enumerate(questions, start=1)
+    ])
+    db.session.commit()
+    logger.info("Trabalho em lote %s criado com %s perguntas", job.id, len(questions),
+                extra={'job_id': job.id, 'questions': len(questions)})
+    return job
+
+
+# Função para cancelar um trabalho em lote
+def cancel_job(job):
+    """Cancela o trabalho: as perguntas pendentes não são mais processadas e
+    as gerações em andamento são interrompidas"""
+    if job.status in ('completed', 'cancelled'):
+        return False
+    job.status = 'cancelled'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    running = BatchItem.query.filter_by(job_id=job.id, status='running').with_entities(BatchItem.id)
+    for (item_id,) in running:
+        registry.cancel(f"batch-{item_id}", reason='client')
+    return True
+
+
+# Função para exportar os resultados de um trabalho
+def export_results(job_id, fmt='jsonl', page_size=500):
+    """Produz os resultados em partes, sem carregar o trabalho inteiro na memória
+
+    Args:
+        job_id (int): Trabalho
+        fmt (str): 'jsonl' ou 'csv'
+        page_size (int): Perguntas lidas do banco por consulta
+
+    Yields:
+        str: Linhas do arquivo de resultados
+    """
+    columns = ('position', 'question', 'status', 'response', 'error', 'category', 'latency_ms')
+    if fmt == 'csv':
+        yield _csv_line(columns)
+    last_position = 0
+    while True:
+        items = BatchItem.query.filter(
+            BatchItem.job_id == job_id, BatchItem.position > last_position
+        ).order_by(BatchItem.position).limit(page_size).all()
+        if not items:
+            return
+        for item in items:
+            values = [getattr(item, column) for column in columns]
+            if fmt == 'csv':
+                yield _csv_line(values)
+            else:
+                yield json.dumps(dict(zip(columns, values)), ensure_ascii=False) + '\n'
+        last_position = items[-1].position
+        db.session.expunge_all()
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(['' if value is None else value for value in values])
+    return buffer.getvalue()
+
+
+class BatchWorker:
+    """Processa as perguntas em lote da fila
+
+    Vários workers (processos) podem rodar ao mesmo tempo: cada um marca as
+    perguntas que processa com um identificador próprio antes de começar.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.concurrency = max(int(self.config.get('BATCH_CONCURRENCY', 1)), 1)
+        self.poll_interval = float(self.config.get('BATCH_POLL_INTERVAL', 2))
+
+    def requeue_stale(self):
+        """Devolve à fila perguntas de workers que pararam no meio do processamento"""
+        # Uma rodada processa até CLAIM_FACTOR perguntas em sequência por thread
+        timeout = int(self.config.get('GENERATION_TIMEOUT', 120))
+        limit = datetime.utcnow() - timedelta(seconds=(CLAIM_FACTOR + 1) * timeout)
+        requeued = BatchItem.query.filter(
+            BatchItem.status == 'running', BatchItem.claimed_at < limit
+        ).update({'status': 'pending', 'claimed_by': None}, synchronize_session=False)
+        db.session.commit()
+        if requeued:
+            logger.warning("%s perguntas em lote devolvidas à fila", requeued)
+
+    def claim(self, limit):
+        """Reserva as próximas perguntas pendentes para este worker
+
+        As perguntas são agrupadas por trabalho e categoria, para que
+        gerações seguidas compartilhem o mesmo prompt de sistema.
+        """
+        candidates = BatchItem.query.join(BatchJob).filter(
+            BatchItem.status == 'pending', BatchJob.status.in_(('queued', 'running'))
+        ).order_by(BatchItem.job_id, BatchItem.category, BatchItem.position) \
+            .with_entities(BatchItem.id).limit(limit).all()
+        if not candidates:
+            return []
+        BatchItem.query.filter(
+            BatchItem.id.in_([item_id for (item_id,) in candidates]), BatchItem.status == 'pending'
+        ).update({
+            'status': 'running', 'claimed_by': self.token, 'claimed_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+
+        items = BatchItem.query.filter_by(claimed_by=self.token, status='running').all()
+        job_ids = {item.job_id for item in items}
+        BatchJob.query.filter(BatchJob.id.in_(job_ids), BatchJob.status == 'queued').update({
+            'status': 'running', 'started_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        return items
+
+    def answer(self, item_id, question, priority='background', owner=None):
+        """Gera a resposta de uma pergunta (executada nas threads do worker)
+
+        Perguntas interrompidas para dar lugar ao tráfego interativo, ou que
+        não conseguiram um modelo a tempo, voltam para a fila. As gerações
+        respeitam a cota diária de tokens do dono do trabalho e são somadas a ela.
+
+        Args:
+            item_id (int): Pergunta do trabalho
+            question (str): Texto da pergunta
+            priority (str): Classe de prioridade no roteador
+            owner (tuple, optional): (usuário, departamento) do dono do trabalho
+
+        Returns:
+            dict: Colunas a atualizar na pergunta
+        """
+        try:
+            prompt, category, budget = prepare_prompt(question)
+        except PromptTooLong as e:
+            return {'status': 'failed', 'error': str(e)}
+        started = time.monotonic()
+        response = response_cache.get(category, question)
+        generated = response is None
+        try:
+            if generated:
+                if owner:
+                    with self.app.app_context():
+                        limiter.check_quota(*owner)
+                response, _ = router.generate(
+                    prompt, category, budget.question_tokens, priority=priority,
+                    request_id=f"batch-{item_id}", budget=budget,
+                    cache_key=f"system:{category}"
+                )
+                if response.strip():
+                    response_cache.set(category, question, response)
+        except LimitExceeded as e:
+            return {'status': 'failed', 'error': str(e)}
+        except (ModelBusy, GenerationConflict):
+            # Item ainda em geração em outro worker: tenta de novo na próxima passada
+            return {'status': 'pending'}
+        except GenerationCancelled as e:
+            if e.reason == 'preempted':
+                return {'status': 'pending'}
+            return {'status': 'failed', 'error': f"Geração cancelada ({e.reason})"}
+        except Exception as e:
+            logger.error("Erro na pergunta em lote %s: %s", item_id, e)
+            return {'status': 'failed', 'error': str(e)}
+        completion_tokens = budgeter.counter.count(response)
+        # Respostas do cache não consomem a cota de tokens (como em /ask)
+        if generated and owner:
+            with self.app.app_context():
+                limiter.record(*owner, budget.prompt_tokens + completion_tokens)
+        return {
+            'status': 'done',
+            'response': response,
+            'error': None,
+            'prompt_tokens': budget.prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'latency_ms': int((time.monotonic() - started) * 1000)
+        }
+
+    def process(self, items):
+        """Responde as perguntas reservadas, com até BATCH_CONCURRENCY gerações simultâneas
+
+        Perguntas repetidas na mesma rodada são respondidas uma única vez.
+        """
+        unique = {}
+        for item in items:
+            key = ' '.join(item.question.lower().split())
+            unique.setdefault(key, []).append(item)
+
+        # Lotes enviados por administradores têm prioridade sobre os demais; os
+        # tokens contam para as cotas do dono do trabalho e do seu departamento
+        owners = {
+            job_id: (role, (user_id, department))
+            for job_id, user_id, role, department in
+            db.session.query(BatchJob.id, User.id, User.role, User.department)
+            .join(User, User.id == BatchJob.user_id)
+            .filter(BatchJob.id.in_({item.job_id for item in items}))
+        }
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {}
+            for key, group in unique.items():
+                role, owner = owners.get(group[0].job_id, (None, None))
+                futures[key] = executor.submit(
+                    self.answer, group[0].id, group[0].question,
+                    'admin' if role == 'admin' else 'background', owner
+                )
+            results = {key: future.result() for key, future in futures.items()}
+
+        counts = {}
+        for key, group in unique.items():
+            for item in group:
+                for column, value in results[key].items():
+                    setattr(item, column, value)
+                item.claimed_by = None
+                done, failed = counts.get(item.job_id, (0, 0))
+                counts[item.job_id] = (done + (item.status == 'done'), failed + (item.status == 'failed'))
+        for job_id, (done, failed) in counts.items():
+            BatchJob.query.filter_by(id=job_id).update({
+                'completed': BatchJob.completed + done,
+                'failed': BatchJob.failed + failed
+            }, synchronize_session=False)
+        db.session.commit()
+
+    def finish_jobs(self):
+        """Marca como concluídos os trabalhos sem perguntas pendentes"""
+        open_items = db.session.query(BatchItem.job_id).filter(
+            BatchItem.status.in_(('pending', 'running'))
+        ).distinct()
+        finished = BatchJob.query.filter(
+            BatchJob.status.in_(('queued', 'running')), ~BatchJob.id.in_(open_items)
+        ).all()
+        for job in finished:
+            job.status = 'completed'
+            job.finished_at = datetime.utcnow()
+            logger.info("Trabalho em lote %s concluído: %s respostas, %s falhas", job.id, job.completed, job.failed)
+        db.session.commit()
+
+    def run(self, once=False):
+        """Processa a fila continuamente
+
+        Args:
+            once (bool): Encerrar quando a fila estiver vazia
+        """
+        logger.info("Worker de lote %s iniciado (%s gerações simultâneas)", self.token, self.concurrency)
+        while True:
+            # Configurações do modelo alteradas pelos administradores
+            runtime_settings.refresh()
+            self.requeue_stale()
+            items = self.claim(self.concurrency * CLAIM_FACTOR)
+            if items:
+                self.process(items)
+            self.finish_jobs()
+            if not items:
+                if once:
+                    return
+                time.sleep(self.poll_interval)
+
+
+# Comando para executar o worker de lote
+@click.command('batch-worker')
+@click.option('--once', is_flag=True, help='Encerrar quando a fila estiver vazia')
+@with_appcontext
+def batch_worker_command(once):
+    """Processa os trabalhos em lote da fila"""
+    nice = int(current_app.config.get('BATCH_NICE', 10))
+    if nice:
+        # Prioridade de CPU menor, herdada pelos processos do llama.cpp
+        os.nice(nice)
+    BatchWorker(current_app._get_current_object()).run(once=once)
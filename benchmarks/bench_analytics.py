@@ -0,0 +1,122 @@
+# benchmarks/bench_analytics.py
+# Tempo das consultas do painel de uso ("perguntas por departamento por dia",
+# com p50/p95 de latência) lendo query_history diretamente e lendo os totais
+# pré-agregados de rollups.py, com um histórico sintético grande
+#
+# Também mede o cálculo inicial dos totais e a atualização incremental
+# (flask rollup-usage) depois de novas perguntas.
+
+import time
+import random
+import argparse
+import tempfile
+from statistics import median
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from benchmarks.bench_history import make_app, populate
+from models import db, User, QueryHistory
+from rollups import rollups
+
+DEPARTMENTS = ('TI', 'Financeiro', 'Jurídico', 'Comercial', 'RH', 'Operações')
+
+
+def live_dashboard(days):
+    """Consulta direta: perguntas e tokens por departamento e dia, e percentis
+    de latência calculados a partir de todas as latências do intervalo"""
+    since = datetime.utcnow() - timedelta(days=days)
+    day = func.date(QueryHistory.timestamp)
+    totals = db.session.query(
+        User.department, day, func.count(QueryHistory.id),
+        func.sum(QueryHistory.prompt_tokens + QueryHistory.completion_tokens)
+    ).join(User, QueryHistory.user_id == User.id).filter(QueryHistory.timestamp >= since) \
+        .group_by(User.department, day).all()
+    latencies = {}
+    for department, latency in db.session.query(User.department, QueryHistory.latency_ms) \
+            .join(User, QueryHistory.user_id == User.id).filter(QueryHistory.timestamp >= since):
+        latencies.setdefault(department, []).append(latency)
+    for values in latencies.values():
+        values.sort()
+        values[len(values) // 2], values[int(len(values) * 0.95)]
+    db.session.remove()
+    return totals
+
+
+def timed(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Painel de uso: consulta direta x totais pré-agregados')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, default=180, help='período coberto pelo histórico')
+    parser.add_argument('--new-rows', type=int, default=1000, help='perguntas novas para a atualização incremental')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(tmpdir)
+        populate(app, args.rows, args.users, args.days, 200, args.seed)
+        with app.app_context():
+            for user in User.query.filter(User.role == 'user'):
+                user.department = rng.choice(DEPARTMENTS)
+            db.session.execute(QueryHistory.__table__.update().values(
+                prompt_tokens=300 + func.abs(func.random() % 700),
+                completion_tokens=50 + func.abs(func.random() % 400),
+                latency_ms=800 + func.abs(func.random() % 15000)
+            ))
+            db.session.commit()
+
+            started = time.perf_counter()
+            rollups.refresh()
+            backfill = time.perf_counter() - started
+            populate_more = [
+                {
+                    'user_id': rng.randint(2, args.users + 1), 'question': 'Pergunta nova', 'response': 'Resposta',
+                    'timestamp': datetime.utcnow(), 'category': 'general', 'prompt_tokens': 400,
+                    'completion_tokens': 200, 'latency_ms': rng.randint(800, 15000)
+                }
+                for _ in range(args.new_rows)
+            ]
+            db.session.bulk_insert_mappings(QueryHistory, populate_more)
+            db.session.commit()
+            started = time.perf_counter()
+            rollups.refresh()
+            incremental = time.perf_counter() - started
+
+            live = {days: timed(lambda: live_dashboard(days), args.repeat) for days in (30, 180)}
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'senha'})
+
+        def dashboard(query):
+            return lambda: client.get(f'/admin/analytics?{query}').status_code == 200 or exit(f"Falha em {query}")
+
+        rolled = {days: timed(dashboard(f'dimension=department&days={days}'), args.repeat * 4) for days in (30, 180)}
+        by_user = timed(dashboard('dimension=user&days=30'), args.repeat * 4)
+        hourly = timed(dashboard('dimension=category&period=hour&days=2'), args.repeat * 4)
+
+        print(f"{args.rows} perguntas em {args.days} dias, {args.users} usuários")
+        print(f"cálculo inicial dos totais: {backfill:.1f} s; atualização com {args.new_rows} perguntas novas: "
+              f"{incremental * 1000:.0f} ms")
+        print()
+        print(f"{'consulta':<42} {'direta (ms)':>12} {'totais (ms)':>12}")
+        for days in (30, 180):
+            print(f"{f'departamento x dia, {days} dias':<42} {live[days] * 1000:>12.0f} {rolled[days] * 1000:>12.1f}")
+        print(f"{'usuário, 30 dias':<42} {'-':>12} {by_user * 1000:>12.1f}")
+        print(f"{'categoria x hora, 48 horas':<42} {'-':>12} {hourly * 1000:>12.1f}")
+        with app.app_context():
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_assets.py
+# Bytes transferidos e tempo de servidor por carregamento de página (/history
+# com o CSS e o JS do layout), na primeira visita e nas seguintes
+#
+# "antes": arquivos servidos por /static sem cache longo (o navegador
+# revalida cada arquivo a cada página, com resposta 304) e respostas sem
+# compressão. "depois": arquivos versionados em /assets (cache imutável: nas
+# visitas seguintes o navegador não os pede) e respostas compactadas.
+
+import re
+import time
+import argparse
+import tempfile
+from statistics import median
+
+from benchmarks.bench_history import make_app, populate
+
+ACCEPT = {'Accept-Encoding': 'gzip, deflate, br'}
+
+
+class Browser:
+    """Cache HTTP mínimo de um navegador sobre o cliente de testes do Flask"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': 'admin', 'password': 'senha'})
+        self.cache = {}
+
+    def get(self, path):
+        """Returns: (bytes transferidos, segundos no servidor)"""
+        cached = self.cache.get(path)
+        if cached is not None and 'immutable' in cached.get('Cache-Control', ''):
+            return 0, 0.0
+        headers = dict(ACCEPT)
+        if cached is not None and cached.get('ETag'):
+            headers['If-None-Match'] = cached['ETag']
+        started = time.perf_counter()
+        response = self.client.get(path, headers=headers)
+        data = response.get_data()
+        seconds = time.perf_counter() - started
+        response.close()
+        if response.status_code == 200 and not path.startswith('/history'):
+            self.cache[path] = dict(response.headers)
+        return len(data), seconds
+
+    def load(self, page, assets):
+        """Returns: (bytes, segundos da página, segundos dos arquivos estáticos)"""
+        page_size, page_seconds = self.get(page)
+        results = [self.get(path) for path in assets]
+        return (page_size + sum(size for size, _ in results), page_seconds,
+                sum(seconds for _, seconds in results))
+
+
+def page_assets(app, versioned):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'senha'})
+    html = client.get('/history').get_data(as_text=True)
+    paths = re.findall(r'(?:href|src)="(/(?:assets|static)/[^"]+)"', html)
+    if not versioned:
+        # Página anterior: arquivos em /static
+        paths = [re.sub(r'^/assets/(.+)\.[0-9a-f]{12}(\.\w+)$', r'/static/\1\2', path) for path in paths]
+    return paths
+
+
+def measure(app, versioned, repeat):
+    assets = page_assets(app, versioned)
+    first, again = [], []
+    for _ in range(repeat):
+        browser = Browser(app)
+        first.append(browser.load('/history', assets))
+        again.append(browser.load('/history', assets))
+    return [[median(values) for values in zip(*runs)] for runs in (first, again)], len(assets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes e tempo de servidor por carregamento de página')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--level', type=int, default=3, help='COMPRESS_LEVEL do cenário "depois"')
+    args = parser.parse_args()
+
+    print(f"{'cenário':<8} {'visita':<10} {'requisições':>11} {'bytes':>9} {'página (ms)':>12} {'estáticos (ms)':>15}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(tmpdir)
+        populate(app, args.rows, 20, 30, 400, 42)
+        for label, versioned in (('antes', False), ('depois', True)):
+            app.config['COMPRESS_LEVEL'] = args.level if versioned else 0
+            visits, count = measure(app, versioned, args.repeat)
+            requests = (count + 1, count + 1 if not versioned else 1)
+            for visit, (size, page, static), total in zip(('primeira', 'seguintes'), visits, requests):
+                print(f"{label:<8} {visit:<10} {total:>11} {size:>9.0f} {page * 1000:>12.2f} {static * 1000:>15.3f}")
+
+if __name__ == '__main__':
+    main()
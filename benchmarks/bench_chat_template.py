@@ -0,0 +1,80 @@
+# benchmarks/bench_chat_template.py
+# Reexecuta perguntas do histórico com o formato de prompt anterior (LLaMA 2,
+# [INST] <<SYS>>) e com o formato de conversa do modelo (lido do arquivo
+# GGUF), comparando tokens gerados por resposta, respostas que só pararam no
+# limite de tokens (n_predict) e latência
+#
+# Com --offline, não executa o modelo: compara apenas o tamanho dos prompts
+# (em tokens) e o tempo de montagem de cada formato.
+
+import time
+import argparse
+from statistics import mean, median
+
+from app import create_app
+from budget import budgeter
+from chat_templates import chat_templates, TEMPLATES
+from inference import LlamaRunner
+from models import QueryHistory
+from prompts import get_system_prompt, prepare_prompt
+
+
+def replay(app, runner, questions, template):
+    """Returns: (tokens por resposta, fração no limite de tokens, latência média)"""
+    app.config['CHAT_TEMPLATE'] = template
+    tokens, truncated, latencies = [], 0, []
+    for question in questions:
+        prompt, _, budget = prepare_prompt(question)
+        started = time.monotonic()
+        response = runner.generate(prompt, budget=budget)
+        latencies.append(time.monotonic() - started)
+        count = budgeter.counter.count(response)
+        tokens.append(count)
+        truncated += count >= budget.n_predict * 0.95
+    return mean(tokens), truncated / len(questions), mean(latencies)
+
+
+def offline(questions, repeat):
+    """Tokens de prompt e microssegundos de montagem por formato"""
+    system_prompt = get_system_prompt('default')
+    for name, template in TEMPLATES.items():
+        durations = []
+        for _ in range(repeat):
+            for question in questions:
+                started = time.perf_counter()
+                template.render(system_prompt, [], question)
+                durations.append(time.perf_counter() - started)
+        tokens = mean(budgeter.counter.count(template.render(system_prompt, [], q)) for q in questions)
+        print(f"{name:<8} {tokens:>14.1f} {median(durations) * 1e6:>16.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tokens gerados com o formato de prompt anterior e o do modelo')
+    parser.add_argument('--limit', type=int, default=20, help='número de perguntas do histórico')
+    parser.add_argument('--offline', action='store_true', help='não executar o modelo')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        records = QueryHistory.query.order_by(QueryHistory.timestamp.desc()).limit(args.limit).all()
+        questions = [record.question for record in records]
+    if not questions:
+        print("Nenhuma pergunta no histórico para reexecutar.")
+        return
+
+    if args.offline:
+        print(f"{'formato':<8} {'tokens/prompt':>14} {'montagem (µs)':>16}")
+        offline(questions, 100)
+        return
+
+    runner = LlamaRunner(app)
+    detected = chat_templates.for_model().name
+    print(f"Reexecutando {len(questions)} perguntas do histórico (formato do modelo: {detected})...")
+    print(f"{'formato':<10} {'tokens/resposta':>16} {'no limite':>10} {'latência média (s)':>20}")
+    for label, template in (('anterior', 'llama2'), ('modelo', 'auto')):
+        tokens, truncated, latency = replay(app, runner, questions, template)
+        print(f"{label:<10} {tokens:>16.1f} {truncated:>10.0%} {latency:>20.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# benchmarks/bench_export.py
+# Vazão e pico de memória da exportação do histórico (export.py) em cada
+# formato, comparados com a leitura de todas as linhas de uma vez
+# (Query.all()), para históricos sintéticos de tamanhos diferentes
+#
+# O pico de memória é medido com tracemalloc (alocações do Python), que
+# deixa a exportação mais lenta: a vazão é medida em uma execução separada.
+
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from benchmarks.bench_history import make_app, populate
+from export import export_history, history_query, pyarrow
+from models import db
+
+
+def load_all(_fmt):
+    """Leitura anterior: todas as linhas na memória"""
+    rows = db.session.execute(history_query()).all()
+    yield str(len(rows))
+
+
+def consume(function, fmt):
+    size = 0
+    for chunk in function(fmt):
+        size += len(chunk)
+    db.session.remove()
+    return size
+
+
+def measure(app, function, fmt):
+    with app.app_context():
+        started = time.perf_counter()
+        size = consume(function, fmt)
+        seconds = time.perf_counter() - started
+        tracemalloc.start()
+        consume(function, fmt)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vazão e memória da exportação do histórico')
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000, 100000])
+    parser.add_argument('--response-size', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    formats = ['csv', 'jsonl'] + (['parquet'] if pyarrow is not None else [])
+    print(f"{'linhas':>8} {'leitura':<12} {'linhas/s':>10} {'pico (MB)':>10} {'saída (MB)':>11}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            app = make_app(tmpdir)
+            populate(app, rows, 50, 365, args.response_size, args.seed)
+            cases = [('all()', load_all, None)] + [(fmt, export_history, fmt) for fmt in formats]
+            for label, function, fmt in cases:
+                seconds, peak, size = measure(app, function, fmt)
+                output = f"{size / 1024 / 1024:>11.1f}" if fmt else f"{'-':>11}"
+                print(f"{rows:>8} {label:<12} {rows / seconds:>10.0f} {peak / 1024 / 1024:>10.1f} {output}")
+            with app.app_context():
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
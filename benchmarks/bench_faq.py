@@ -0,0 +1,105 @@
+# benchmarks/bench_faq.py
+# Tempo de consulta ao FAQ (índice em memória) por número de entradas, para
+# perguntas equivalentes a uma entrada e para perguntas sem entrada, tempo de
+# montagem do índice e latência de /ask respondido pelo FAQ
+#
+# As entradas são sintéticas (perguntas de 6 a 10 palavras de um vocabulário
+# de 2000 palavras); as perguntas equivalentes trocam a ordem e o plural das
+# palavras e acrescentam palavras vazias.
+
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.bench_history import make_app, populate
+from faq import FAQIndex, faq
+from models import FAQEntry
+
+
+def make_entries(count, rng, vocabulary):
+    return [
+        FAQEntry(id=i + 1, question=' '.join(rng.sample(vocabulary, rng.randint(6, 10))) + '?',
+                 answer=f"Resposta revisada {i + 1}")
+        for i in range(count)
+    ]
+
+
+def paraphrase(question, rng):
+    words = question.rstrip('?').split()
+    rng.shuffle(words)
+    return 'Gostaria de saber como ' + ' '.join(word + 's' if rng.random() < 0.3 else word for word in words)
+
+
+def percentiles(durations):
+    durations = sorted(durations)
+    return durations[len(durations) // 2] * 1e6, durations[int(len(durations) * 0.99)] * 1e6
+
+
+def measure_lookups(index, questions, threshold, coverage):
+    durations, hits = [], 0
+    for question in questions:
+        started = time.perf_counter()
+        match = index.match(question, threshold, coverage)
+        durations.append(time.perf_counter() - started)
+        hits += match is not None
+    return percentiles(durations) + (hits / len(questions),)
+
+
+def measure_ask(entries, repeat):
+    """Latência de /ask (p50/p99, em ms) com a pergunta respondida pelo FAQ"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(tmpdir)
+        app.config['RATE_LIMIT_PER_MINUTE'] = 0
+        populate(app, 0, 1, 1, 0, 42)
+        with app.app_context():
+            for entry in entries:
+                faq.save({'question': entry.question, 'answer': entry.answer})
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'senha'})
+        durations = []
+        for i in range(repeat):
+            started = time.perf_counter()
+            response = client.post('/ask', json={'question': entries[i % len(entries)].question})
+            durations.append(time.perf_counter() - started)
+            assert 'faq_id' in response.get_json()
+        p50, p99 = percentiles(durations)
+        return p50 / 1000, p99 / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tempo de consulta ao FAQ em memória')
+    parser.add_argument('--entries', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--coverage', type=float, default=0.75)
+    parser.add_argument('--ask', type=int, default=200, help='perguntas enviadas a /ask (0 = não medir)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    vocabulary = [''.join(rng.choice('abcdefghijlmnoprstuv') for _ in range(rng.randint(5, 10)))
+                  for _ in range(2000)]
+
+    print(f"{'entradas':>8} {'índice (ms)':>12} {'tipo':<12} {'p50 (µs)':>9} {'p99 (µs)':>9} {'encontradas':>12}")
+    for count in args.entries:
+        entries = make_entries(count, rng, vocabulary)
+        started = time.perf_counter()
+        index = FAQIndex(entries)
+        build_ms = (time.perf_counter() - started) * 1000
+        sample = [rng.choice(entries).question for _ in range(args.questions)]
+        kinds = (
+            ('exata', sample),
+            ('equivalente', [paraphrase(question, rng) for question in sample]),
+            ('sem entrada', [' '.join(rng.sample(vocabulary, 8)) + '?' for _ in range(args.questions)])
+        )
+        for kind, questions in kinds:
+            p50, p99, found = measure_lookups(index, questions, args.threshold, args.coverage)
+            print(f"{count:>8} {build_ms:>12.1f} {kind:<12} {p50:>9.1f} {p99:>9.1f} {found:>12.0%}")
+
+    if args.ask:
+        p50, p99 = measure_ask(make_entries(100, rng, vocabulary), args.ask)
+        print(f"\n/ask respondido pelo FAQ: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# benchmarks/bench_history.py
+# Tamanho do banco e latência da página /history com um histórico sintético
+# grande, antes e depois do arquivamento (flask archive-history)
+#
+# "antes" reproduz a página anterior (todas as linhas, com uma consulta de
+# usuário por linha); "depois" é a página paginada atual, após arquivar as
+# perguntas fora do prazo de retenção e executar o VACUUM.
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from statistics import median
+from datetime import datetime, timedelta
+
+from app import create_app
+from archive import HistoryArchiver
+from config import TestingConfig
+from models import db, User, QueryHistory
+
+
+def make_app(tmpdir):
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        STATE_STORE_URL = f"sqlite:///{os.path.join(tmpdir, 'state.db')}"
+        ARCHIVE_DIR = os.path.join(tmpdir, 'archive')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    return create_app(BenchConfig)
+
+
+def populate(app, rows, users, days, response_size, seed):
+    """Histórico sintético espalhado pelos últimos `days` dias"""
+    rng = random.Random(seed)
+    words = ['servidor', 'relatório', 'política', 'acesso', 'sistema', 'contrato', 'férias', 'rede',
+             'senha', 'backup', 'orçamento', 'fornecedor', 'processo', 'cliente', 'prazo']
+    now = datetime.utcnow()
+    with app.app_context():
+        db.create_all()
+        admin = User(username='admin', role='admin')
+        admin.set_password('senha')
+        db.session.add(admin)
+        db.session.add_all(User(username=f"usuario{i}", role='user', password_hash='-') for i in range(users))
+        db.session.commit()
+        for start in range(0, rows, 5000):
+            db.session.bulk_insert_mappings(QueryHistory, [
+                {
+                    'user_id': rng.randint(2, users + 1),
+                    'question': ' '.join(rng.choice(words) for _ in range(12)) + '?',
+                    'response': ' '.join(rng.choice(words) for _ in range(response_size // 8)),
+                    'timestamp': now - timedelta(seconds=rng.uniform(0, days * 86400)),
+                    'category': 'general'
+                }
+                for _ in range(min(5000, rows - start))
+            ])
+            db.session.commit()
+
+
+def old_history_page(app):
+    """Página /history anterior: todas as linhas e uma consulta de usuário por linha"""
+    with app.app_context():
+        records = QueryHistory.query.order_by(QueryHistory.timestamp.desc()).all()
+        result = []
+        for record in records:
+            user = db.session.get(User, record.user_id)
+            result.append((user.username, record.question, record.response, record.timestamp))
+        db.session.remove()
+    return result
+
+
+def timed(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return median(durations)
+
+
+def db_size(tmpdir):
+    return os.path.getsize(os.path.join(tmpdir, 'bench.db')) / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tamanho do banco e latência de /history antes e depois do arquivamento')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, default=730, help='período coberto pelo histórico')
+    parser.add_argument('--retention', type=int, default=180, help='prazo de retenção (dias)')
+    parser.add_argument('--response-size', type=int, default=2000, help='tamanho médio das respostas (bytes)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(tmpdir)
+        populate(app, args.rows, args.users, args.days, args.response_size, args.seed)
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'senha'})
+
+        def page(url):
+            return lambda: client.get(url).status_code == 200 or exit(f"Falha em {url}")
+
+        size_before = db_size(tmpdir)
+        full_before = timed(lambda: old_history_page(app), args.repeat)
+        paged_before = timed(page('/history'), args.repeat * 10)
+
+        with app.app_context():
+            stats = HistoryArchiver(app).run(days=args.retention)
+        archive_size = sum(
+            os.path.getsize(os.path.join(app.config['ARCHIVE_DIR'], name))
+            for name in os.listdir(app.config['ARCHIVE_DIR'])
+        ) / 1024 / 1024
+        size_after = db_size(tmpdir)
+        full_after = timed(lambda: old_history_page(app), args.repeat)
+        paged_after = timed(page('/history'), args.repeat * 10)
+        deep_after = timed(page('/history?page=100'), args.repeat * 10)
+        search_archived = timed(page('/history?archived=1&q=contrato'), args.repeat * 10)
+
+        print(f"{args.rows} perguntas em {args.days} dias; {stats['archived']} arquivadas em "
+              f"{stats['batches']} lotes ({stats['seconds']} s, VACUUM: {'sim' if stats['vacuumed'] else 'não'})")
+        print()
+        print(f"{'medida':<40} {'antes':>10} {'depois':>10}")
+        print(f"{'banco de dados (MB)':<40} {size_before:>10.1f} {size_after:>10.1f}")
+        print(f"{'arquivos compactados (MB)':<40} {'-':>10} {archive_size:>10.1f}")
+        print(f"{'/history anterior, todas as linhas (ms)':<40} {full_before * 1000:>10.0f} {full_after * 1000:>10.0f}")
+        print(f"{'/history paginado, 1ª página (ms)':<40} {paged_before * 1000:>10.1f} {paged_after * 1000:>10.1f}")
+        print(f"{'/history paginado, página 100 (ms)':<40} {'-':>10} {deep_after * 1000:>10.1f}")
+        print(f"{'busca nas arquivadas (ms)':<40} {'-':>10} {search_archived * 1000:>10.1f}")
+        with app.app_context():
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
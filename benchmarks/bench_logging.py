@@ -0,0 +1,113 @@
+# benchmarks/bench_logging.py
+# Custo dos logs por requisição: os registros de uma pergunta (um INFO com a
+# pergunta e a latência e alguns DEBUG, desligados com LOG_LEVEL=INFO)
+# gravados como antes (logging.basicConfig, f-strings, escrita síncrona no
+# terminal e em app.log) e como agora (JSON, fila e thread de gravação,
+# mensagens montadas apenas na gravação), com um destino rápido e um lento
+#
+# O destino lento atrasa cada escrita em --sink-ms, como um terminal
+# redirecionado para um coletor de logs ocupado ou um disco em rede.
+
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import os
+from statistics import median
+
+from flask import Flask, g
+
+from logging_config import configure_logging, logging_metrics
+
+QUESTION = 'Qual é a política de reembolso de despesas de viagem para eventos externos? ' * 3
+
+
+class SlowStream:
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def old_request(logger, cmd):
+    logger.debug(f"Executando comando: {' '.join(cmd)}")
+    logger.debug(f"Prompt com {len(QUESTION)} caracteres")
+    logger.info(f"Pergunta processada: {QUESTION[:50]}...")
+
+
+def new_request(logger, cmd):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Executando comando: %s", ' '.join(cmd))
+    logger.debug("Prompt com %d caracteres", len(QUESTION))
+    logger.info("Pergunta processada: %.50s...", QUESTION,
+                extra={'category': 'rh', 'latency_ms': 812, 'conversation_id': 42})
+
+
+def measure(app, request, requests):
+    logger = logging.getLogger('app')
+    cmd = ['llama-cli', '-m', 'modelo.gguf', '-p', QUESTION, '-n', '512', '--temp', '0.7']
+    durations = []
+    for i in range(requests):
+        with app.test_request_context('/ask', method='POST'):
+            g.request_id = f"{i:032x}"
+            started = time.perf_counter()
+            request(logger, cmd)
+            durations.append(time.perf_counter() - started)
+    durations.sort()
+    return median(durations) * 1e6, durations[int(len(durations) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Custo dos logs por requisição')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--sink-ms', type=float, default=0.2, help='atraso de cada escrita no destino lento')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    stdout = sys.stdout
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir, open(os.devnull, 'w') as devnull:
+        log_file = os.path.join(tmpdir, 'app.log')
+        for sink, delay in (('rápido', 0), ('lento', args.sink_ms / 1000)):
+            # Antes: basicConfig com o terminal e o arquivo, na thread da requisição
+            root = logging.getLogger()
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            outputs = [logging.StreamHandler(SlowStream(devnull, delay)), logging.FileHandler(log_file)]
+            logging.basicConfig(level=logging.INFO, handlers=outputs,
+                                format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            p50, p99 = measure(app, old_request, args.requests)
+            rows.append(('síncrono, f-strings', sink, p50, p99, 0, 0))
+            for handler in outputs:
+                root.removeHandler(handler)
+                handler.close()
+
+            # Agora: JSON, fila e thread de gravação
+            sys.stdout = SlowStream(devnull, delay)
+            try:
+                handler = configure_logging({'LOG_LEVEL': 'INFO', 'LOG_FILE': log_file})
+            finally:
+                sys.stdout = stdout
+            p50, p99 = measure(app, new_request, args.requests)
+            dropped = logging_metrics()['dropped']
+            started = time.perf_counter()
+            handler.stop()
+            rows.append(('fila, JSON', sink, p50, p99, dropped, time.perf_counter() - started))
+            configure_logging({'LOG_LEVEL': 'WARNING', 'LOG_FILE': ''})
+
+    print(f"{'logs':<22} {'destino':<8} {'p50 (µs)':>9} {'p99 (µs)':>9} {'descartados':>12} {'gravação (s)':>13}")
+    for mode, sink, p50, p99, dropped, drain in rows:
+        print(f"{mode:<22} {sink:<8} {p50:>9.1f} {p99:>9.1f} {dropped:>12} {drain:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_login.py
+# Custo do login (POST /login) com diferentes esquemas de hash de senha e da
+# verificação de autenticação por requisição (login_required) com e sem o
+# cache de usuários
+#
+# Cada esquema usa um banco SQLite temporário com usuários próprios; as
+# senhas são verificadas de verdade, então o tempo por login é dominado pelo
+# hash (uma thread de CPU por login).
+
+import os
+import time
+import argparse
+import tempfile
+from statistics import mean, median
+
+from app import create_app
+from config import TestingConfig
+from models import db, User
+from utils import current_user
+
+METHODS = ('pbkdf2:sha256:600000', 'scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:100000')
+
+
+def make_app(tmpdir, method, cache_ttl=30):
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        STATE_STORE_URL = f"sqlite:///{os.path.join(tmpdir, 'state.db')}"
+        PASSWORD_HASH_METHOD = method
+        USER_CACHE_TTL = cache_ttl
+    return create_app(BenchConfig)
+
+
+def bench_logins(method, users, logins):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(tmpdir, method)
+        with app.app_context():
+            db.create_all()
+            for i in range(users):
+                user = User(username=f"usuario{i}", role='user')
+                user.set_password('senha-de-teste')
+                db.session.add(user)
+            db.session.commit()
+        client = app.test_client()
+        durations = []
+        for i in range(logins):
+            started = time.perf_counter()
+            response = client.post('/login', data={'username': f"usuario{i % users}", 'password': 'senha-de-teste'})
+            durations.append(time.perf_counter() - started)
+            assert response.get_json()['success']
+        with app.app_context():
+            db.engine.dispose()
+    return durations
+
+
+def bench_auth_check(cache_ttl, requests):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(tmpdir, 'pbkdf2:sha256:1000', cache_ttl)
+        with app.app_context():
+            db.create_all()
+            user = User(username='usuario', role='user')
+            user.set_password('senha')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        durations = []
+        for _ in range(requests):
+            with app.test_request_context('/'):
+                from flask import session
+                session['username'], session['user_id'] = 'usuario', user_id
+                started = time.perf_counter()
+                assert current_user() is not None
+                durations.append(time.perf_counter() - started)
+                db.session.remove()
+        with app.app_context():
+            db.engine.dispose()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Custo do login e da verificação de autenticação')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'esquema de hash':<24} {'média (ms)':>11} {'mediana (ms)':>13} {'logins/s por núcleo':>20}")
+    for method in METHODS:
+        durations = bench_logins(method, args.users, args.logins)
+        print(f"{method:<24} {mean(durations) * 1000:>11.1f} {median(durations) * 1000:>13.1f} "
+              f"{1 / mean(durations):>20.1f}")
+
+    print()
+    print(f"{'verificação por requisição':<28} {'média (us)':>11}")
+    for label, ttl in (('sem cache (consulta ao banco)', 0), ('cache de usuários', 30)):
+        durations = bench_auth_check(ttl, args.requests)
+        print(f"{label:<28} {mean(durations) * 1e6:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
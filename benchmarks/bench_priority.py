@@ -0,0 +1,119 @@
+# benchmarks/bench_priority.py
+# Latência das perguntas interativas com trabalhos em segundo plano (lotes,
+# resumos) disputando o mesmo modelo: sem segundo plano, com segundo plano
+# sem prioridades e com as classes de prioridade do roteador
+#
+# Usa o roteador real (reservas, fila e preempção) com um servidor de
+# inferência simulado (stub_inference_server); nenhum modelo é executado.
+
+import time
+import random
+import argparse
+import threading
+from statistics import median
+
+from app import create_app
+from budget import TokenBudget
+from inference import GenerationCancelled
+from routing import router, ModelBusy
+from benchmarks.stub_inference_server import start_stub_server
+
+SCENARIOS = ('sem lote', 'sem prioridade', 'com prioridade')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def interactive_client(rng, args, latencies, stop_at):
+    budget = TokenBudget(args.interactive_tokens, 2048)
+    n = 0
+    while time.monotonic() < stop_at:
+        time.sleep(rng.expovariate(1 / args.interval))
+        started = time.monotonic()
+        n += 1
+        try:
+            router.generate('pergunta', 'technical', request_id=f"bench-i-{threading.get_ident()}-{n}", budget=budget)
+            latencies.append(time.monotonic() - started)
+        except ModelBusy:
+            latencies.append(float('inf'))
+
+
+def background_worker(args, priority, counts, stop_at):
+    budget = TokenBudget(args.background_tokens, 2048)
+    n = 0
+    while time.monotonic() < stop_at:
+        n += 1
+        try:
+            router.generate('lote', 'technical', priority=priority,
+                            request_id=f"bench-b-{threading.get_ident()}-{n}", budget=budget)
+            counts['completed'] += 1
+        except GenerationCancelled:
+            # Volta para a fila, como no worker de lote
+            counts['requeued'] += 1
+        except ModelBusy:
+            pass
+
+
+def run_scenario(app, scenario, args):
+    prioritized = scenario == 'com prioridade'
+    app.config['PRIORITY_BACKGROUND_SLOTS'] = args.background_slots if prioritized else 0
+    app.config['PRIORITY_PREEMPT_AFTER'] = args.preempt_after if prioritized else 0
+    stop_at = time.monotonic() + args.duration
+    latencies, counts = [], {'completed': 0, 'requeued': 0}
+    threads = [
+        threading.Thread(target=interactive_client, args=(random.Random(args.seed + i), args, latencies, stop_at))
+        for i in range(args.clients)
+    ]
+    if scenario != 'sem lote':
+        priority = 'background' if prioritized else 'interactive'
+        threads += [
+            threading.Thread(target=background_worker, args=(args, priority, counts, stop_at))
+            for _ in range(args.workers)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latência interativa com trabalhos em segundo plano')
+    parser.add_argument('--duration', type=float, default=30, help='segundos por cenário')
+    parser.add_argument('--clients', type=int, default=2, help='usuários interativos simultâneos')
+    parser.add_argument('--interval', type=float, default=2.0, help='intervalo médio entre perguntas (s)')
+    parser.add_argument('--workers', type=int, default=2, help='threads do worker de lote')
+    parser.add_argument('--concurrency', type=int, default=2, help='execuções simultâneas do modelo')
+    parser.add_argument('--delay', type=float, default=0.02, help='segundos por token')
+    parser.add_argument('--interactive-tokens', type=int, default=40)
+    parser.add_argument('--background-tokens', type=int, default=150)
+    parser.add_argument('--background-slots', type=int, default=1)
+    parser.add_argument('--preempt-after', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay, tokens=max(args.interactive_tokens, args.background_tokens))
+    app = create_app()
+    app.config['MODELS'] = {
+        'large': {
+            'path': '', 'endpoints': [f"http://127.0.0.1:{server.server_port}"],
+            'max_concurrency': args.concurrency
+        }
+    }
+    app.config['SMALL_MODEL'] = None
+    app.config['MODEL_QUEUE_TIMEOUT'] = 120
+
+    print(f"{'cenário':<16} {'p50 (ms)':>9} {'p95 (ms)':>9} {'perguntas':>10} {'lote/min':>9} {'interrompidas':>14}")
+    try:
+        for scenario in SCENARIOS:
+            latencies, counts = run_scenario(app, scenario, args)
+            print(f"{scenario:<16} {median(latencies) * 1000:>9.0f} {percentile(latencies, 0.95) * 1000:>9.0f} "
+                  f"{len(latencies):>10} {counts['completed'] / args.duration * 60:>9.1f} {counts['requeued']:>14}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/bench_profiling.py
+# Custo dos perfis de desempenho por requisição: latência de /history (e de
+# /login) sem perfil, com a amostragem contínua ligada e com o perfil completo
+# da requisição (cProfile), com um histórico sintético
+#
+# A amostragem roda na thread do próprio worker; com um único núcleo, o
+# custo dela aparece inteiro na latência das requisições.
+
+import time
+import argparse
+import tempfile
+from statistics import median
+
+from benchmarks.bench_history import make_app, populate
+
+
+def measure(client, path, repeat, headers=None):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        durations.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    durations.sort()
+    return median(durations) * 1000, durations[int(len(durations) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Custo dos perfis de desempenho por requisição')
+    parser.add_argument('--rows', type=int, default=5000, help='perguntas no histórico')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.01, help='intervalo da amostragem (s)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(tmpdir)
+        app.config.update(PROFILING_SAMPLE_INTERVAL=args.interval, SETTINGS_CHECK_INTERVAL=0)
+        populate(app, args.rows, 20, 30, 400, 42)
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'senha'})
+
+        print(f"{'modo':<22} {'rota':<9} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+        for mode in ('sem perfil', 'amostragem', 'perfil (cProfile)'):
+            client.post('/admin/profiling', json={'sampler': mode == 'amostragem', 'reset_samples': True})
+            headers = {'X-Profile': '1'} if mode == 'perfil (cProfile)' else None
+            for path in ('/history', '/login'):
+                measure(client, path, 10, headers)
+                p50, p95 = measure(client, path, args.repeat, headers)
+                print(f"{mode:<22} {path:<9} {p50:>9.2f} {p95:>9.2f}")
+            if mode == 'amostragem':
+                sampler = client.get('/admin/metrics').get_json()['profiling']['sampler']
+        print(f"\nAmostragem: {sampler['samples']} amostras, {sampler['stacks']} pilhas diferentes")
+
+
+if __name__ == '__main__':
+    main()
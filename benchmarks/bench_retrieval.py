@@ -0,0 +1,121 @@
+# benchmarks/bench_retrieval.py
+# Latência da busca federada (/search) com um SharePoint simulado de latência
+# variável, comparada com a consulta das fontes uma após a outra, e tempo de
+# busca no catálogo do File Server (FTS5) comparado com a busca pelo nome
+# percorrendo a lista de arquivos
+#
+# O catálogo tem arquivos sintéticos em pastas de departamentos, com nomes de
+# um vocabulário de 3000 palavras; a lista percorrida pelo nome está em
+# memória (sem o custo de listar as pastas pela rede). O SharePoint
+# simulado responde em um tempo log-normal (mediana --sharepoint-ms, com
+# cauda longa), como uma chamada à API de busca.
+
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.bench_history import make_app, populate
+from faq import faq
+from retrieval import FileCatalog, retriever
+
+WORDS = ['politica', 'férias', 'reembolso', 'contrato', 'orçamento', 'relatório', 'manual', 'vpn', 'senha',
+         'fornecedor', 'treinamento', 'benefícios', 'viagem', 'ponto', 'escala', 'auditoria', 'backup']
+FOLDERS = ['RH', 'TI', 'Financeiro', 'Jurídico', 'Compras', 'Comercial']
+
+
+def make_files(count, rng, vocabulary):
+    files = []
+    for i in range(count):
+        name = '_'.join(rng.sample(vocabulary, rng.randint(2, 4))) + f"_{i}" + rng.choice(['.pdf', '.docx', '.xlsx'])
+        folder = '/'.join([rng.choice(FOLDERS)] + rng.sample(vocabulary, rng.randint(0, 2)))
+        files.append({'name': name, 'path': f"/{folder}/{name}"})
+    return files
+
+
+class SimulatedSharePoint:
+    name = 'sharepoint'
+
+    def __init__(self, median_ms, rng):
+        self.median = median_ms / 1000
+        self.rng = rng
+
+    def available(self):
+        return True
+
+    def search(self, query, limit):
+        time.sleep(self.median * self.rng.lognormvariate(0, 0.8))
+        return [{'id': f"sp:{query}:{i}", 'title': f"{query} documento {i}", 'url': f"https://sp/{i}",
+                 'snippet': query} for i in range(limit)]
+
+
+def percentiles(durations):
+    durations = sorted(durations)
+    return durations[len(durations) // 2] * 1000, durations[int(len(durations) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latência da busca federada')
+    parser.add_argument('--files', type=int, default=100000, help='arquivos no catálogo')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--sharepoint-ms', type=float, default=400, help='latência mediana do SharePoint simulado')
+    parser.add_argument('--budget-ms', type=int, default=800)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    vocabulary = WORDS + [''.join(rng.choice('abcdefghijlmnoprstuv') for _ in range(rng.randint(5, 10)))
+                          for _ in range(3000 - len(WORDS))]
+    files = make_files(args.files, rng, vocabulary)
+    queries = [' '.join(rng.sample(vocabulary, 2)) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        catalog = FileCatalog(os.path.join(tmpdir, 'catalogo.db'))
+        started = time.perf_counter()
+        catalog.rebuild(files)
+        print(f"Catálogo com {args.files} arquivos montado em {time.perf_counter() - started:.1f} s")
+
+        # Busca pelo nome percorrendo a lista (como search_files, sem a rede)
+        scan, indexed = [], []
+        for query in queries:
+            keyword = query.split()[0]
+            started = time.perf_counter()
+            [item for item in files if keyword in item['name'].lower()]
+            scan.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            catalog.search(query, 30)
+            indexed.append(time.perf_counter() - started)
+        print(f"{'arquivos':<22} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+        print(f"{'lista, pelo nome':<22} {percentiles(scan)[0]:>9.2f} {percentiles(scan)[1]:>9.2f}")
+        print(f"{'catálogo FTS5 (BM25)':<22} {percentiles(indexed)[0]:>9.2f} {percentiles(indexed)[1]:>9.2f}")
+
+        app = make_app(tmpdir)
+        app.config.update(RETRIEVAL_BUDGET_MS=args.budget_ms, RETRIEVAL_CACHE_TTL=0,
+                          RETRIEVAL_TIMEOUTS_MS={'faq': 100, 'fileserver': 300, 'sharepoint': args.budget_ms})
+        populate(app, 0, 1, 1, 0, 42)
+        with app.app_context():
+            for i in range(200):
+                faq.save({'question': ' '.join(rng.sample(vocabulary, 4)) + '?', 'answer': f"Resposta {i}"})
+            retriever.sources['fileserver'].catalog = catalog
+            retriever.sources['sharepoint'] = SimulatedSharePoint(args.sharepoint_ms, rng)
+            sources = retriever.sources
+
+            sequential, federated, partial = [], [], 0
+            for query in queries:
+                started = time.perf_counter()
+                for source in sources.values():
+                    source.search(query, 30)
+                sequential.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                result = retriever.search(query)
+                federated.append(time.perf_counter() - started)
+                partial += result['sources']['sharepoint'] != 'ok'
+
+        print(f"\n{'busca':<22} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+        print(f"{'fontes em sequência':<22} {percentiles(sequential)[0]:>9.1f} {percentiles(sequential)[1]:>9.1f}")
+        print(f"{'federada':<22} {percentiles(federated)[0]:>9.1f} {percentiles(federated)[1]:>9.1f}")
+        print(f"Buscas sem o SharePoint (tempo esgotado): {partial / len(queries):.0%}")
+
+
+if __name__ == '__main__':
+    main()
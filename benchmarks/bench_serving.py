@@ -0,0 +1,180 @@
+# benchmarks/bench_serving.py
+# Conexões sustentadas e latência de GET /login e de um arquivo estático
+# enquanto muitas perguntas lentas (/ask) estão em andamento, com cada modo
+# de atendimento do Gunicorn (GUNICORN_WORKER_CLASS: sync, gthread, gevent)
+#
+# Sobe o Gunicorn de verdade (gunicorn.conf.py) com um banco temporário e um
+# servidor de inferência simulado (stub_inference_server); nenhum modelo é
+# executado. Requer os pacotes gunicorn e, para o modo gevent, gevent.
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from statistics import median
+from urllib.parse import urlencode
+
+from benchmarks.stub_inference_server import start_stub_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('sync', 'gthread', 'gevent')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    """Cliente HTTP mínimo (http.client) que mantém o cookie de sessão"""
+
+    def __init__(self, port, timeout=120):
+        self.port = port
+        self.timeout = timeout
+        self.cookie = None
+
+    def request(self, method, path, body=None, content_type=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return response.status
+        finally:
+            conn.close()
+
+
+def start_gunicorn(mode, tmpdir, endpoint, args):
+    port = free_port()
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=mode,
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, 'bench.db')}",
+        STATE_STORE_URL=f"sqlite:///{os.path.join(tmpdir, 'state.db')}",
+        SECRET_KEY='bench',
+        INFERENCE_ENDPOINTS=endpoint,
+        LARGE_MODEL_CONCURRENCY=str(args.clients),
+        MODEL_QUEUE_TIMEOUT='300',
+        GENERATION_TIMEOUT='300',
+        RATE_LIMIT_PER_MINUTE='0',
+        DAILY_TOKEN_QUOTA='0',
+        SUMMARY_TRIGGER_TOKENS='0'
+    )
+    log = open(os.path.join(tmpdir, f"gunicorn-{mode}.log"), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    for _ in range(200):
+        try:
+            Client(port, timeout=1).request('GET', '/login')
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Gunicorn ({mode}) não iniciou; veja {log.name}")
+
+
+def ask_client(port, stop_at, results):
+    client = Client(port)
+    client.request('POST', '/login', urlencode({'username': 'user', 'password': 'user123'}),
+                   'application/x-www-form-urlencoded')
+    while time.monotonic() < stop_at:
+        started = time.monotonic()
+        try:
+            # Perguntas diferentes, para não usar o cache de respostas
+            body = json.dumps({'question': f"Pergunta {uuid.uuid4()}"})
+            ok = client.request('POST', '/ask', body, 'application/json') == 200
+        except OSError:
+            ok = False
+        results.append((ok, time.monotonic() - started))
+
+
+def probe(port, path, stop_at, latencies, interval):
+    while time.monotonic() < stop_at:
+        started = time.monotonic()
+        try:
+            ok = Client(port, timeout=30).request('GET', path) == 200
+        except OSError:
+            ok = False
+        latencies.append(time.monotonic() - started if ok else 30.0)
+        time.sleep(interval)
+
+
+def run_mode(mode, endpoint, args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        process, port = start_gunicorn(mode, tmpdir, endpoint, args)
+        try:
+            stop_at = time.monotonic() + args.duration
+            asks, login, static = [], [], []
+            threads = [threading.Thread(target=ask_client, args=(port, stop_at, asks)) for _ in range(args.clients)]
+            for thread in threads:
+                thread.start()
+            # Espera as perguntas ocuparem os workers antes de medir
+            time.sleep(2)
+            probes = [
+                threading.Thread(target=probe, args=(port, '/login', stop_at, login, args.probe_interval)),
+                threading.Thread(target=probe, args=(port, '/static/css/style.css', stop_at, static, args.probe_interval))
+            ]
+            for thread in probes:
+                thread.start()
+            for thread in threads + probes:
+                thread.join()
+        finally:
+            process.terminate()
+            process.wait()
+    return asks, login, static
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latência das rotas leves durante perguntas lentas, por modo do Gunicorn')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--clients', type=int, default=32, help='perguntas simultâneas')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=32, help='GUNICORN_THREADS (modo gthread)')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--delay', type=float, default=0.05, help='segundos por token')
+    parser.add_argument('--probe-interval', type=float, default=0.25)
+    args = parser.parse_args()
+
+    server = start_stub_server(delay=args.delay, tokens=args.tokens)
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+    print(f"{args.clients} perguntas simultâneas de ~{args.tokens * args.delay:.0f} s, {args.workers} workers")
+    print(f"{'modo':<8} {'/ask ok':>8} {'/ask erro':>10} {'/ask/min':>9} "
+          f"{'/login p50':>11} {'/login p95':>11} {'estático p95':>13}")
+    try:
+        for mode in args.modes:
+            asks, login, static = run_mode(mode, endpoint, args)
+            ok = [duration for success, duration in asks if success]
+            print(f"{mode:<8} {len(ok):>8} {len(asks) - len(ok):>10} {len(ok) / args.duration * 60:>9.0f} "
+                  f"{median(login) * 1000 if login else float('nan'):>9.0f}ms "
+                  f"{percentile(login, 0.95) * 1000:>9.0f}ms {percentile(static, 0.95) * 1000:>11.0f}ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/bench_sessions.py
+# Mede o custo de abrir e salvar a sessão em cada requisição com cookie
+# assinado (padrão do Flask) e com o backend de estado compartilhado
+
+import os
+import time
+import argparse
+import tempfile
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from state_store import SharedState, StoreSessionInterface, create_store
+
+
+def measure(app, interface, iterations):
+    # Primeira requisição: cria a sessão e obtém o cookie
+    with app.test_request_context('/') as ctx:
+        session = interface.open_session(app, ctx.request)
+        session['username'] = 'usuario'
+        session['role'] = 'user'
+        session['user_id'] = 42
+        response = app.response_class()
+        interface.save_session(app, session, response)
+        cookie = response.headers['Set-Cookie'].split(';', 1)[0]
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with app.test_request_context('/', headers={'Cookie': cookie}) as ctx:
+            session = interface.open_session(app, ctx.request)
+            assert session['user_id'] == 42
+            interface.save_session(app, session, app.response_class())
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Custo de leitura da sessão por requisição')
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--redis', help='URL redis:// para incluir o backend Redis')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backends = {'cookie assinado': SecureCookieSessionInterface()}
+        sqlite_state = SharedState()
+        sqlite_state.backend = create_store(f"sqlite:///{os.path.join(tmpdir, 'state.db')}")
+        backends['sqlite'] = StoreSessionInterface(sqlite_state)
+        if args.redis:
+            redis_state = SharedState()
+            redis_state.backend = create_store(args.redis)
+            backends['redis'] = StoreSessionInterface(redis_state)
+
+        # Custo base do contexto de requisição, sem sessão
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            with app.test_request_context('/'):
+                pass
+        baseline = (time.perf_counter() - started) / args.iterations * 1e6
+
+        print(f"{'backend':<16} {'µs/requisição':>14} {'sem o contexto':>16}")
+        for name, interface in backends.items():
+            cost = measure(app, interface, args.iterations)
+            print(f"{name:<16} {cost:>14.1f} {cost - baseline:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
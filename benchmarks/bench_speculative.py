@@ -0,0 +1,69 @@
+# benchmarks/bench_speculative.py
+# Reexecuta perguntas do histórico (QueryHistory) com o modelo principal
+# sozinho e com decodificação especulativa para cada tamanho de rascunho,
+# comparando tokens por segundo e taxa de aceitação
+#
+# Requer DRAFT_MODEL_PATH (ou --draft-model) e o programa speculative do
+# llama.cpp em LLAMA_PATH; com INFERENCE_ENDPOINTS, os servidores devem ter
+# sido iniciados com o modelo de rascunho (-md).
+
+import time
+import argparse
+
+from app import create_app
+from prompts import prepare_prompt
+from budget import budgeter
+from inference import LlamaRunner, speculative
+from models import QueryHistory
+
+
+def replay(app, runner, prompts, draft_tokens):
+    """Returns: (tokens por segundo, taxa de aceitação, tokens por resposta)"""
+    app.config['SPECULATIVE_DRAFT_TOKENS'] = draft_tokens
+    speculative.reset()
+    tokens, seconds = 0, 0.0
+    for prompt, budget in prompts:
+        started = time.monotonic()
+        response = runner.generate(
+            prompt, budget=budget, model_path=app.config['MODEL_PATH'],
+            endpoints=app.config['MODELS']['large'].get('endpoints')
+        )
+        seconds += time.monotonic() - started
+        tokens += budgeter.counter.count(response)
+    return tokens / seconds, speculative.metrics()['acceptance_rate'], tokens / len(prompts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tokens por segundo com e sem decodificação especulativa')
+    parser.add_argument('--limit', type=int, default=20, help='número de perguntas do histórico')
+    parser.add_argument('--draft', type=int, nargs='+', default=[4, 8, 16], help='tokens de rascunho por passo')
+    parser.add_argument('--draft-model', help='modelo de rascunho (padrão: DRAFT_MODEL_PATH)')
+    args = parser.parse_args()
+
+    app = create_app()
+    # Sem suspensão automática durante a medição
+    app.config['SPECULATIVE_MIN_ACCEPTANCE'] = 0
+    if args.draft_model:
+        app.config['DRAFT_MODEL_PATH'] = args.draft_model
+    if not app.config.get('DRAFT_MODEL_PATH'):
+        print("Defina DRAFT_MODEL_PATH ou --draft-model.")
+        return
+    with app.app_context():
+        records = QueryHistory.query.order_by(QueryHistory.timestamp.desc()).limit(args.limit).all()
+        prompts = [(prompt, budget) for prompt, _, budget in (prepare_prompt(r.question) for r in records)]
+    if not prompts:
+        print("Nenhuma pergunta no histórico para reexecutar.")
+        return
+
+    runner = LlamaRunner(app)
+    print(f"Reexecutando {len(prompts)} perguntas do histórico...")
+    print(f"{'rascunho':<10} {'tokens/s':>9} {'aceitação':>10} {'tokens/resposta':>16}")
+    for draft_tokens in [0] + args.draft:
+        rate, acceptance, tokens = replay(app, runner, prompts, draft_tokens)
+        label = str(draft_tokens) if draft_tokens else 'sem'
+        acceptance = f"{acceptance:.0%}" if acceptance is not None else '-'
+        print(f"{label:<10} {rate:>9.1f} {acceptance:>10} {tokens:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
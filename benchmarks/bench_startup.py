@@ -0,0 +1,55 @@
+# benchmarks/bench_startup.py
+# Mede o tempo de inicialização de um worker: importar o módulo WSGI até
+# responder a primeira requisição, em um processo Python novo a cada rodada
+
+import os
+import sys
+import argparse
+import subprocess
+import tempfile
+from statistics import mean, median
+
+# Executado em um processo separado para medir a partir de um interpretador vazio
+WORKER_SCRIPT = """
+import time
+started = time.perf_counter()
+from wsgi import app
+imported = time.perf_counter()
+response = app.test_client().post('/ask', json={'question': 'teste'})
+assert response.status_code == 401, response.status_code
+ready = time.perf_counter()
+print(f"{(imported - started) * 1000:.1f} {(ready - started) * 1000:.1f}")
+"""
+
+
+def run_once(env):
+    result = subprocess.run(
+        [sys.executable, '-c', WORKER_SCRIPT],
+        capture_output=True, text=True, env=env, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    imported, ready = result.stdout.strip().splitlines()[-1].split()
+    return float(imported), float(ready)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tempo de inicialização de um worker')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ)
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+        env.setdefault('SECRET_KEY', 'benchmark')
+        run_once(env)  # aquecer o cache de bytecode e de disco
+        results = [run_once(env) for _ in range(args.runs)]
+
+    imports = [r[0] for r in results]
+    ready = [r[1] for r in results]
+    print(f"{'etapa':<22} {'média (ms)':>11} {'mediana (ms)':>13}")
+    print(f"{'import wsgi':<22} {mean(imports):>11.1f} {median(imports):>13.1f}")
+    print(f"{'primeira requisição':<22} {mean(ready):>11.1f} {median(ready):>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# benchmarks/bench_summarization.py
+# Tokens de prompt por pergunta em conversas longas (20 perguntas): com o
+# histórico completo, com a janela de MAX_HISTORY_TOKENS e com o resumo
+# contínuo das perguntas antigas
+#
+# As conversas são sintéticas e o resumo é simulado com o tamanho máximo
+# permitido (TOKEN_BUDGETS['summary']), ou seja, o pior caso; nenhum modelo
+# é executado.
+
+import random
+import argparse
+from statistics import mean
+
+from app import create_app
+from budget import budgeter
+from prompts import get_system_prompt
+from summarizer import turns_to_summarize
+from utils import format_conversation_prompt
+
+WORDS = (
+    'acesso sistema relatório férias contrato equipe projeto prazo servidor '
+    'senha política benefício reunião cliente orçamento treinamento suporte '
+    'configuração rede aprovação documento processo gestor solicitação'
+).split()
+
+
+def sentence(rng, tokens):
+    # Aproximadamente um token por palavra curta
+    return ' '.join(rng.choice(WORDS) for _ in range(tokens)) + '.'
+
+
+def synthetic_conversation(rng, turns):
+    return [
+        (sentence(rng, rng.randint(15, 40)), sentence(rng, rng.randint(120, 260)))
+        for _ in range(turns)
+    ]
+
+
+def prompt_tokens_per_turn(conversation, strategy, config):
+    system_prompt = get_system_prompt('default')
+    summary_tokens = config['TOKEN_BUDGETS']['summary']['max_predict']
+    history, summary, results = [], None, []
+    for question, answer in conversation:
+        if strategy == 'completo':
+            turns = history
+        else:
+            turns = budgeter.select_history(history)
+        prompt = format_conversation_prompt(turns, question, system_prompt, summary)
+        results.append(budgeter.counter.count(prompt))
+        history.append((question, answer))
+
+        if strategy == 'resumo':
+            turn_tokens = [budgeter.counter.count(q) + budgeter.counter.count(a) for q, a in history]
+            count = turns_to_summarize(
+                turn_tokens, config['SUMMARY_TRIGGER_TOKENS'], config['SUMMARY_KEEP_TURNS']
+            )
+            if count:
+                summary = budgeter.counter.trim(' '.join(WORDS * 20), summary_tokens)
+                history = history[count:]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tokens de prompt por pergunta em conversas longas')
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--conversations', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    app = create_app()
+    config = app.config
+    rng = random.Random(args.seed)
+    conversations = [synthetic_conversation(rng, args.turns) for _ in range(args.conversations)]
+
+    strategies = ('completo', 'janela', 'resumo')
+    per_turn = {
+        strategy: [
+            mean(values) for values in zip(*(
+                prompt_tokens_per_turn(conversation, strategy, config)
+                for conversation in conversations
+            ))
+        ]
+        for strategy in strategies
+    }
+
+    print(f"Tokens de prompt por pergunta (média de {args.conversations} conversas)")
+    print(f"{'pergunta':>8} " + ' '.join(f"{strategy:>10}" for strategy in strategies))
+    for turn in range(args.turns):
+        print(f"{turn + 1:>8} " + ' '.join(f"{per_turn[s][turn]:>10.0f}" for s in strategies))
+    print(f"{'média':>8} " + ' '.join(f"{mean(per_turn[s]):>10.0f}" for s in strategies))
+    print(f"{'total':>8} " + ' '.join(f"{sum(per_turn[s]):>10.0f}" for s in strategies))
+
+
+if __name__ == '__main__':
+    main()
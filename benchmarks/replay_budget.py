@@ -0,0 +1,65 @@
+# benchmarks/replay_budget.py
+# Reexecuta perguntas do histórico com o orçamento fixo antigo (-n 1024 e o
+# contexto completo) e com o orçamento adaptativo, comparando tokens gerados
+# e latência média
+#
+# As duas execuções usam o mesmo prompt (formato de conversa do modelo) e os
+# mesmos marcadores de fim de turno: só n_predict e o tamanho do contexto mudam.
+# Com --endpoints, a geração é feita nos servidores informados (por exemplo,
+# os de benchmarks/stub_inference_server.py) em vez do binário local.
+
+import time
+import argparse
+from statistics import mean
+
+from app import create_app
+from prompts import prepare_prompt
+from budget import budgeter, TokenBudget
+from inference import LlamaRunner
+from models import QueryHistory
+
+# Orçamento usado antes do orçamento adaptativo
+FIXED_N_PREDICT = 1024
+
+
+def replay(runner, questions, adaptive, endpoints=None):
+    tokens, latencies = [], []
+    for question in questions:
+        prompt, _, budget = prepare_prompt(question)
+        if not adaptive:
+            budget = TokenBudget(FIXED_N_PREDICT, budgeter.max_context, budget.prompt_tokens,
+                                 budget.question_tokens)
+        started = time.monotonic()
+        response = runner.generate(prompt, budget=budget, endpoints=endpoints)
+        latencies.append(time.monotonic() - started)
+        tokens.append(budgeter.counter.count(response))
+    return mean(tokens), mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara o orçamento de tokens fixo e o adaptativo')
+    parser.add_argument('--limit', type=int, default=20, help='número de perguntas do histórico')
+    parser.add_argument('--endpoints', nargs='+', help='URLs de servidores llama.cpp (padrão: binário local)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        records = QueryHistory.query.order_by(QueryHistory.timestamp.desc()).limit(args.limit).all()
+        questions = [record.question for record in records]
+    if not questions:
+        print("Nenhuma pergunta no histórico para reexecutar.")
+        return
+
+    runner = LlamaRunner(app)
+    print(f"Reexecutando {len(questions)} perguntas do histórico...")
+    with app.app_context():
+        before = replay(runner, questions, adaptive=False, endpoints=args.endpoints)
+        after = replay(runner, questions, adaptive=True, endpoints=args.endpoints)
+
+    print(f"{'política':<12} {'tokens médios':>14} {'latência média (s)':>20}")
+    print(f"{'fixa':<12} {before[0]:>14.1f} {before[1]:>20.2f}")
+    print(f"{'adaptativa':<12} {after[0]:>14.1f} {after[1]:>20.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/stub_inference_server.py
+# Servidor de inferência simulado, compatível com os endpoints /health e
+# /completion (streaming) do llama.cpp server, para testar o pool de
+# servidores localmente sem carregar um modelo
+#
+# Exemplo: três servidores nas portas 8081-8083
+#   python -m benchmarks.stub_inference_server --ports 8081 8082 8083
+#   INFERENCE_ENDPOINTS=http://127.0.0.1:8081,http://127.0.0.1:8082,http://127.0.0.1:8083 python run.py
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Responde como um llama.cpp server, gerando tokens fictícios"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != '/health' or self.server.options['unhealthy']:
+            self.send_response(503)
+            self.end_headers()
+            return
+        self._send_json({'status': 'ok'})
+
+    def do_POST(self):
+        if self.path != '/completion':
+            self.send_response(404)
+            self.end_headers()
+            return
+        options = self.server.options
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        with self.server.lock:
+            self.server.requests.append(payload)
+        if options['unhealthy'] or random.random() < options['fail_rate']:
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        n_tokens = min(payload.get('n_predict', options['tokens']), options['tokens'])
+        try:
+            for i in range(n_tokens):
+                time.sleep(options['delay'])
+                self._send_event({'content': f"token{i} ", 'stop': False})
+            final = {'content': '', 'stop': True, 'tokens_predicted': n_tokens}
+            if payload.get('speculative.n_max'):
+                # Servidor com modelo de rascunho: tokens propostos e aceitos
+                final['timings'] = {
+                    'draft_n': n_tokens, 'draft_n_accepted': int(n_tokens * options['acceptance'])
+                }
+            self._send_event(final)
+        except (BrokenPipeError, ConnectionResetError):
+            # Cliente cancelou a geração
+            with self.server.lock:
+                self.server.cancelled += 1
+
+    def _send_event(self, event):
+        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_server(port=0, delay=0.01, tokens=20, fail_rate=0.0):
+    """Inicia um servidor simulado em uma thread
+
+    Returns:
+        ThreadingHTTPServer: Servidor em execução (use server.server_port e server.shutdown())
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.options = {
+        'delay': delay, 'tokens': tokens, 'fail_rate': fail_rate, 'unhealthy': False, 'acceptance': 0.8
+    }
+    server.lock = threading.Lock()
+    server.requests = []
+    server.cancelled = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidores de inferência simulados')
+    parser.add_argument('--ports', type=int, nargs='+', default=[8081, 8082, 8083])
+    parser.add_argument('--delay', type=float, default=0.05, help='segundos por token')
+    parser.add_argument('--tokens', type=int, default=50, help='tokens por resposta')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fração de requisições com erro 500')
+    args = parser.parse_args()
+
+    servers = [start_stub_server(port, args.delay, args.tokens, args.fail_rate) for port in args.ports]
+    print(f"Servidores simulados em: {', '.join(f'http://127.0.0.1:{s.server_port}' for s in servers)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# budget.py
+# Orçamento de tokens por requisição: tamanho da resposta (n_predict) e do
+# contexto escolhidos conforme o tipo de consulta e o tamanho da pergunta
+
+import os
+import re
+import math
+import logging
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Estimativa de caracteres por token usada quando o tokenizador não está disponível
+CHARS_PER_TOKEN = 3.5
+
+# Granularidade do tamanho de contexto enviado ao llama.cpp
+CONTEXT_STEP = 256
+MIN_CONTEXT_SIZE = 512
+
+# Perguntas curtas que normalmente pedem uma resposta direta (sim/não)
+SHORT_ANSWER_PATTERN = re.compile(
+    r'^\s*(posso|pode|podemos|é possível|existe|existem|tenho direito|há|tem|devo|preciso)\b',
+    re.IGNORECASE
+)
+
+# Tokenizadores carregados neste processo, por arquivo de modelo
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+# Função para obter o tokenizador de um modelo
+def load_tokenizer(model_path):
+    """Carrega apenas o vocabulário do modelo (llama-cpp-python, opcional),
+    uma única vez por processo
+
+    Returns:
+        Llama: Tokenizador, ou None se o pacote ou o arquivo não estiver disponível
+    """
+    with _tokenizers_lock:
+        if model_path not in _tokenizers:
+            tokenizer = None
+            if model_path and os.path.exists(model_path):
+                try:
+                    from llama_cpp import Llama
+                    tokenizer = Llama(model_path=model_path, vocab_only=True, verbose=False)
+                except ImportError:
+                    logger.info("llama-cpp-python não instalado, tokens estimados pelo número de caracteres")
+                except (OSError, ValueError, RuntimeError) as e:
+                    logger.warning("Falha ao carregar o tokenizador de %s, usando estimativa: %s", model_path, e)
+            _tokenizers[model_path] = tokenizer
+        return _tokenizers[model_path]
+
+
+# Função para contar os tokens de um texto no vocabulário de um modelo
+@lru_cache(maxsize=4096)
+def count_tokens(model_path, text):
+    tokenizer = load_tokenizer(model_path)
+    if tokenizer is not None:
+        try:
+            return len(tokenizer.tokenize(text.encode('utf-8'), add_bos=False, special=True))
+        except (RuntimeError, ValueError) as e:
+            logger.warning("Falha ao usar o tokenizador, usando estimativa: %s", e)
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class TokenCounter:
+    """Conta tokens com o tokenizador do modelo, no próprio processo
+
+    O vocabulário do arquivo GGUF é carregado uma única vez por modelo
+    (llama-cpp-python); sem o pacote, usa uma estimativa baseada no número
+    de caracteres. As contagens ficam em cache por modelo e texto.
+    """
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+
+    def count(self, text):
+        if not text:
+            return 0
+        return count_tokens(self.model_path, text)
+
+    def trim(self, text, max_tokens):
+        """Corta o texto para caber em max_tokens
+
+        Args:
+            text (str): Texto original
+            max_tokens (int): Número máximo de tokens
+
+        Returns:
+            str: Texto cortado (ou o original se já couber)
+        """
+        tokens = self.count(text)
+        for _ in range(3):
+            if tokens <= max_tokens:
+                return text
+            # Cortar proporcionalmente, com margem, e conferir novamente
+            text = text[:int(len(text) * max_tokens / tokens * 0.95)]
+            tokens = self.count(text)
+        return text[:int(max_tokens * CHARS_PER_TOKEN * 0.8)]
+
+
+class PromptTooLong(ValueError):
+    """Prompt sem espaço para a resposta no contexto do modelo"""
+
+
+class TokenBudget:
+    """Limites de uma requisição ao modelo"""
+
+    def __init__(self, n_predict, context_size, prompt_tokens=0, question_tokens=0):
+        self.n_predict = n_predict
+        self.context_size = context_size
+        self.prompt_tokens = prompt_tokens
+        self.question_tokens = question_tokens
+
+    def __repr__(self):
+        return (f"TokenBudget(n_predict={self.n_predict}, "
+                f"context_size={self.context_size}, prompt_tokens={self.prompt_tokens})")
+
+
+class Budgeter:
+    """Calcula o orçamento de tokens de cada requisição"""
+
+    def __init__(self, app=None):
+        self.config = {}
+        self.counter = TokenCounter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+        self.counter = TokenCounter(app.config.get('MODEL_PATH'))
+
+    @property
+    def max_context(self):
+        return int(self.config.get('CONTEXT_SIZE', 4096))
+
+    @property
+    def min_predict(self):
+        return int(self.config.get('MIN_PREDICT_TOKENS', 128))
+
+    def fits(self, prompt):
+        """Indica se o prompt deixa no contexto espaço para MIN_PREDICT_TOKENS de resposta"""
+        return self.counter.count(prompt) + self.min_predict <= self.max_context
+
+    def trim_question(self, question):
+        """Limita a pergunta ao número máximo de tokens configurado"""
+        max_tokens = int(self.config.get('MAX_QUESTION_TOKENS', 512))
+        trimmed = self.counter.trim(question, max_tokens)
+        if len(trimmed) < len(question):
+            logger.info("Pergunta cortada de %d para %d caracteres", len(question), len(trimmed))
+        return trimmed
+
+    def select_history(self, turns):
+        """Seleciona as perguntas e respostas anteriores que cabem em MAX_HISTORY_TOKENS
+        
+        Args:
+            turns (list): Pares (pergunta, resposta), do mais antigo ao mais recente
+        
+        Returns:
+            list: Os pares mais recentes cuja soma de tokens cabe no limite
+        """
+        remaining = int(self.config.get('MAX_HISTORY_TOKENS', 1536))
+        selected = []
+        for question, answer in reversed(turns):
+            remaining -= self.counter.count(question) + self.counter.count(answer)
+            if remaining < 0:
+                break
+            selected.append((question, answer))
+        selected.reverse()
+        if len(selected) < len(turns):
+            logger.info("Histórico da conversa reduzido de %d para %d perguntas", len(turns), len(selected))
+        return selected
+
+    def plan(self, prompt, category='default', question=''):
+        """Escolhe n_predict e tamanho de contexto para um prompt
+
+        Args:
+            prompt (str): Prompt completo já formatado
+            category (str): Tipo de consulta (ver prompts.detect_query_type)
+            question (str): Pergunta original do usuário
+
+        Returns:
+            TokenBudget: Orçamento da requisição
+
+        Raises:
+            PromptTooLong: se o prompt não deixar no contexto espaço para
+                MIN_PREDICT_TOKENS de resposta (ou o n_predict da categoria, se menor)
+        """
+        budgets = self.config.get('TOKEN_BUDGETS', {})
+        limits = budgets.get(category) or budgets.get('default') or {'n_predict': 512, 'max_predict': 1024}
+
+        question_tokens = self.counter.count(question)
+        n_predict = limits['n_predict']
+        if question_tokens <= 16 and SHORT_ANSWER_PATTERN.match(question):
+            n_predict //= 2
+        else:
+            # Perguntas mais longas tendem a pedir respostas mais detalhadas
+            n_predict += question_tokens
+        n_predict = min(n_predict, limits['max_predict'])
+
+        prompt_tokens = self.counter.count(prompt)
+        needed = prompt_tokens + n_predict
+        context_size = max(MIN_CONTEXT_SIZE, math.ceil(needed / CONTEXT_STEP) * CONTEXT_STEP)
+        if context_size > self.max_context:
+            context_size = self.max_context
+            if context_size - prompt_tokens < min(n_predict, self.min_predict):
+                raise PromptTooLong(
+                    f"A pergunta é longa demais: o prompt ({prompt_tokens} tokens) não deixa espaço "
+                    f"para a resposta no contexto de {context_size} tokens"
+                )
+            n_predict = context_size - prompt_tokens
+
+        return TokenBudget(n_predict, context_size, prompt_tokens, question_tokens)
+
+
+# Instância global configurada pela aplicação
+budgeter = Budgeter()
@@ -0,0 +1,307 @@
+# chat_templates.py
+# Formato de conversa (chat template) de cada modelo: o prompt é montado
+# com os marcadores do formato em que o modelo foi treinado (LLaMA 3,
+# LLaMA 2 ou ChatML), identificado pelos metadados do arquivo GGUF
+# (tokenizer.chat_template), e a geração termina no marcador de fim de turno
+# do formato.
+#
+# Os trechos fixos de cada formato são montados uma única vez; o prompt é
+# apenas a concatenação deles com as mensagens. O token de início (BOS) não é
+# escrito no prompt, porque o llama.cpp já o acrescenta ao tokenizar.
+
+import os
+import mmap
+import struct
+import logging
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Formato usado quando o arquivo do modelo não informa o seu
+DEFAULT_TEMPLATE = 'llama3'
+
+# Tipos de valor dos metadados GGUF e seus tamanhos (8 = string, 9 = array)
+GGUF_SCALARS = {
+    0: '<B', 1: '<b', 2: '<H', 3: '<h', 4: '<I', 5: '<i', 6: '<f', 7: '<?', 10: '<Q', 11: '<q', 12: '<d'
+}
+GGUF_STRING = 8
+GGUF_ARRAY = 9
+
+# Metadados lidos do arquivo do modelo
+METADATA_KEYS = (
+    'general.architecture', 'general.name', 'tokenizer.chat_template',
+    'tokenizer.ggml.eos_token_id', 'tokenizer.ggml.eot_token_id'
+)
+
+
+class ChatTemplate:
+    """Marcadores de um formato de conversa
+
+    Args:
+        name (str): Nome do formato
+        system (str): Mensagem de sistema ({content})
+        user (str): Mensagem do usuário ({content})
+        assistant (str): Início da resposta do modelo (fim do prompt)
+        end_of_turn (str): Marcador escrito após cada resposta anterior
+        stop_sequences (tuple): Textos que encerram a geração
+        eot_token (str, optional): Token especial de fim de turno, quando
+            diferente do fim de texto do tokenizador
+        first_user (str, optional): Primeira mensagem do usuário logo após a
+            de sistema, nos formatos em que as duas formam uma só instrução
+    """
+
+    def __init__(self, name, system, user, assistant, end_of_turn, stop_sequences, eot_token=None,
+                 first_user=None):
+        self.name = name
+        self.system = system
+        self.user = user
+        self.assistant = assistant
+        self.end_of_turn = end_of_turn
+        self.stop_sequences = stop_sequences
+        self.eot_token = eot_token
+        self.first_user = first_user or user
+        self.header = lru_cache(maxsize=64)(self._header)
+
+    def _header(self, system_prompt):
+        return self.system.format(content=system_prompt.strip()) if system_prompt else ''
+
+    def render(self, system_prompt, turns, question):
+        """Monta o prompt
+
+        O prompt de uma pergunta seguido da resposta gerada é o início do
+        prompt da pergunta seguinte, o que permite reaproveitar o estado KV.
+
+        Args:
+            system_prompt (str): Prompt de sistema
+            turns (list): Pares (pergunta, resposta) anteriores
+            question (str): Nova pergunta
+
+        Returns:
+            str: Prompt formatado, terminando no início da resposta
+        """
+        header = self.header(system_prompt)
+        parts = [header]
+        user = self.first_user if header else self.user
+        for previous, answer in turns:
+            parts += [user.format(content=previous), self.assistant, answer.strip(), self.end_of_turn]
+            user = self.user
+        parts += [user.format(content=question), self.assistant]
+        return ''.join(parts)
+
+
+TEMPLATES = {
+    'llama3': ChatTemplate(
+        'llama3',
+        system='<|start_header_id|>system<|end_header_id|>\n\n{content}<|eot_id|>',
+        user='<|start_header_id|>user<|end_header_id|>\n\n{content}<|eot_id|>',
+        assistant='<|start_header_id|>assistant<|end_header_id|>\n\n',
+        end_of_turn='<|eot_id|>',
+        stop_sequences=('<|eot_id|>', '<|start_header_id|>', '<|end_of_text|>'),
+        eot_token='<|eot_id|>'
+    ),
+    # LLaMA 2 e Mistral: o prompt de sistema fica na primeira instrução
+    'llama2': ChatTemplate(
+        'llama2',
+        system='[INST] <<SYS>>\n{content}\n<</SYS>>\n\n',
+        user='[INST] {content} [/INST]',
+        assistant=' ',
+        end_of_turn=' </s><s>',
+        stop_sequences=('</s>', '[INST]'),
+        first_user='{content} [/INST]'
+    ),
+    'chatml': ChatTemplate(
+        'chatml',
+        system='<|im_start|>system\n{content}<|im_end|>\n',
+        user='<|im_start|>user\n{content}<|im_end|>\n',
+        assistant='<|im_start|>assistant\n',
+        end_of_turn='<|im_end|>\n',
+        stop_sequences=('<|im_end|>', '<|im_start|>'),
+        eot_token='<|im_end|>'
+    )
+}
+
+
+class ChatPrompt(str):
+    """Prompt formatado que guarda as mensagens, para ser refeito no formato
+    de outro modelo (ex.: pergunta roteada para o modelo pequeno)"""
+
+    def __new__(cls, template, system_prompt, turns, question):
+        prompt = super().__new__(cls, template.render(system_prompt, turns, question))
+        prompt.template = template
+        prompt.messages = (system_prompt, tuple(turns), question)
+        return prompt
+
+    def for_template(self, template):
+        if template is self.template:
+            return self
+        return ChatPrompt(template, *self.messages)
+
+
+# Função para ler os metadados de um arquivo GGUF
+def read_gguf_metadata(path, keys=METADATA_KEYS, tokens=()):
+    """Lê metadados do cabeçalho de um arquivo GGUF (versões 2 e 3)
+
+    O arquivo é mapeado em memória; apenas o cabeçalho é lido.
+
+    Args:
+        path (str): Arquivo do modelo
+        keys (tuple): Chaves com valor escalar ou texto a retornar
+        tokens (tuple): Textos de tokens cujo id deve ser procurado no vocabulário
+
+    Returns:
+        tuple: (metadados, ids dos tokens encontrados)
+
+    Raises:
+        OSError: se o arquivo não puder ser lido
+        ValueError: se o arquivo não for GGUF
+    """
+    wanted_tokens = {token.encode('utf-8'): token for token in tokens}
+    metadata, token_ids = {}, {}
+    with open(path, 'rb') as model_file, \
+            mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version = struct.unpack_from('<4sI', data, 0)
+        if magic != b'GGUF' or version < 2:
+            raise ValueError(f"Arquivo GGUF não suportado: {path}")
+        _, kv_count = struct.unpack_from('<QQ', data, 8)
+        offset = 24
+
+        def read_string(offset):
+            length, = struct.unpack_from('<Q', data, offset)
+            return data[offset + 8:offset + 8 + length], offset + 8 + length
+
+        def skip_value(value_type, offset):
+            if value_type == GGUF_STRING:
+                length, = struct.unpack_from('<Q', data, offset)
+                return offset + 8 + length
+            return offset + struct.calcsize(GGUF_SCALARS[value_type])
+
+        for _ in range(kv_count):
+            key, offset = read_string(offset)
+            key = key.decode('utf-8', errors='replace')
+            value_type, = struct.unpack_from('<I', data, offset)
+            offset += 4
+            if value_type == GGUF_ARRAY:
+                item_type, count = struct.unpack_from('<IQ', data, offset)
+                offset += 12
+                if item_type in GGUF_SCALARS:
+                    offset += count * struct.calcsize(GGUF_SCALARS[item_type])
+                elif key == 'tokenizer.ggml.tokens' and wanted_tokens:
+                    for index in range(count):
+                        text, offset = read_string(offset)
+                        if text in wanted_tokens:
+                            token_ids[wanted_tokens[text]] = index
+                else:
+                    for _ in range(count):
+                        offset = skip_value(item_type, offset)
+            elif value_type == GGUF_STRING:
+                value, offset = read_string(offset)
+                if key in keys:
+                    metadata[key] = value.decode('utf-8', errors='replace')
+            else:
+                if key in keys:
+                    metadata[key], = struct.unpack_from(GGUF_SCALARS[value_type], data, offset)
+                offset = skip_value(value_type, offset)
+    return metadata, token_ids
+
+
+# Função para identificar o formato de conversa pelos metadados do modelo
+def detect_template(metadata):
+    """Nome do formato (ver TEMPLATES), ou None se não for reconhecido"""
+    chat_template = metadata.get('tokenizer.chat_template') or ''
+    if '<|start_header_id|>' in chat_template:
+        return 'llama3'
+    if '<|im_start|>' in chat_template:
+        return 'chatml'
+    if '[INST]' in chat_template:
+        return 'llama2'
+    name = (metadata.get('general.name') or '').lower().replace(' ', '-')
+    if 'llama-3' in name or 'llama3' in name:
+        return 'llama3'
+    return None
+
+
+class ChatTemplates:
+    """Formato de conversa de cada modelo configurado
+
+    CHAT_TEMPLATE define o formato de todos os modelos ou 'auto' para lê-lo
+    do arquivo de cada modelo (o resultado fica em memória até o arquivo
+    mudar).
+    """
+
+    def __init__(self):
+        self.config = {}
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def init_app(self, app):
+        self.config = app.config
+        setting = self.config.get('CHAT_TEMPLATE', 'auto')
+        if setting != 'auto' and setting not in TEMPLATES:
+            raise ValueError(f"CHAT_TEMPLATE inválido: {setting} (use auto, {', '.join(TEMPLATES)})")
+
+    def _inspect(self, model_path):
+        """Returns: (ChatTemplate, id do token de fim de turno a usar como fim de texto ou None)"""
+        try:
+            stat = os.stat(model_path)
+        except (OSError, TypeError):
+            return TEMPLATES[DEFAULT_TEMPLATE], None
+        key = (model_path, stat.st_mtime, stat.st_size)
+        with self._lock:
+            if key in self._models:
+                return self._models[key]
+        eot_tokens = tuple({template.eot_token for template in TEMPLATES.values() if template.eot_token})
+        try:
+            metadata, token_ids = read_gguf_metadata(model_path, tokens=eot_tokens)
+        except (OSError, ValueError, struct.error, KeyError) as e:
+            logger.warning("Não foi possível ler os metadados de %s: %s", model_path, e)
+            metadata, token_ids = {}, {}
+        name = detect_template(metadata)
+        if name is None:
+            logger.warning("Formato de conversa de %s não reconhecido, usando %s", model_path, DEFAULT_TEMPLATE)
+            name = DEFAULT_TEMPLATE
+        template = TEMPLATES[name]
+        # Arquivos convertidos antes do suporte ao fim de turno têm apenas o
+        # fim de texto como token de parada: sem a substituição, o modelo
+        # continuaria gerando até o limite de tokens
+        eos_override = None
+        eot_id = token_ids.get(template.eot_token)
+        if (eot_id is not None and 'tokenizer.ggml.eot_token_id' not in metadata
+                and metadata.get('tokenizer.ggml.eos_token_id') != eot_id):
+            eos_override = eot_id
+        if eos_override is not None:
+            logger.info("Formato de conversa de %s: %s (fim de texto substituído pelo token %s)",
+                        model_path, name, eos_override)
+        else:
+            logger.info("Formato de conversa de %s: %s", model_path, name)
+        with self._lock:
+            self._models[key] = (template, eos_override)
+        return template, eos_override
+
+    def for_model(self, model_path=None):
+        """Formato de conversa do modelo (padrão: MODEL_PATH)"""
+        setting = self.config.get('CHAT_TEMPLATE', 'auto')
+        if setting != 'auto':
+            return TEMPLATES[setting]
+        return self._inspect(model_path or self.config.get('MODEL_PATH'))[0]
+
+    def command_args(self, model_path=None):
+        """Argumentos do llama.cpp para que a geração termine no fim de turno"""
+        _, eos_override = self._inspect(model_path or self.config.get('MODEL_PATH'))
+        if eos_override is None:
+            return []
+        return ["--override-kv", f"tokenizer.ggml.eos_token_id=int:{eos_override}"]
+
+    def prompt(self, system_prompt, turns, question, model_path=None):
+        """Prompt no formato do modelo (padrão: MODEL_PATH)"""
+        return ChatPrompt(self.for_model(model_path), system_prompt, turns, question)
+
+    def adapt(self, prompt, model_path=None):
+        """Refaz um ChatPrompt no formato de outro modelo (textos comuns não mudam)"""
+        if isinstance(prompt, ChatPrompt):
+            return prompt.for_template(self.for_model(model_path))
+        return prompt
+
+
+# Formatos de conversa, configurados pela aplicação
+chat_templates = ChatTemplates()
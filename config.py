@@ -2,25 +2,245 @@
 # Configurações para a aplicação Assistente IA Corporativo
 
 import os
-import secrets
 from datetime import timedelta
 
+# Função para ler uma lista separada por vírgulas de uma variável de ambiente
+def env_list(name):
+    return [item.strip() for item in os.environ.get(name, '').split(',') if item.strip()]
+
+# Função para ler uma opção verdadeiro/falso de uma variável de ambiente
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'sim', 'on')
+
 # Configurações básicas
 class Config:
     # Segurança
-    SECRET_KEY = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
-    SESSION_TYPE = 'filesystem'
+    # Sem SECRET_KEY, a aplicação usa uma chave gerada uma única vez em instance/secret_key
+    SECRET_KEY = os.environ.get('SECRET_KEY')
     PERMANENT_SESSION_LIFETIME = timedelta(hours=8)
     
-    # Configurações do modelo LLaMA
+    # Autenticação: esquema de hash das senhas (formato do Werkzeug, com todos
+    # os parâmetros; senhas em outro esquema são refeitas no próximo login) e
+    # tempo (em segundos) que cada worker guarda os dados do usuário logado
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:16384:8:1')
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '30'))
+    
+    # Estado compartilhado entre os workers (sessões, cache de respostas e contadores):
+    # vazio para SQLite em instance/state.db, ou redis://host:6379/0
+    STATE_STORE_URL = os.environ.get('STATE_STORE_URL', '')
+    
+    # Tempo (em segundos) que uma resposta fica em cache para perguntas idênticas (0 = desabilitado)
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '3600'))
+    
+    # Limites de uso padrão (0 = sem limite): perguntas por minuto e tokens por
+    # dia de cada usuário e de cada departamento. Desativados por padrão; os
+    # administradores podem ativá-los em /admin/limits
+    RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', '0'))
+    DAILY_TOKEN_QUOTA = int(os.environ.get('DAILY_TOKEN_QUOTA', '0'))
+    DEPARTMENT_RATE_LIMIT_PER_MINUTE = int(os.environ.get('DEPARTMENT_RATE_LIMIT_PER_MINUTE', '0'))
+    DEPARTMENT_DAILY_TOKEN_QUOTA = int(os.environ.get('DEPARTMENT_DAILY_TOKEN_QUOTA', '0'))
+    
+    # Configurações do modelo LLaMA (valores iniciais: LLAMA_PATH, MODEL_PATH,
+    # CONTEXT_SIZE e TEMPERATURE podem ser alterados em /admin sem reiniciar;
+    # cada worker verifica alterações a cada SETTINGS_CHECK_INTERVAL segundos)
+    SETTINGS_CHECK_INTERVAL = float(os.environ.get('SETTINGS_CHECK_INTERVAL', '1'))
     LLAMA_PATH = os.environ.get('LLAMA_PATH', '/opt/llama.cpp')
     MODEL_PATH = os.environ.get('MODEL_PATH', '/opt/llama.cpp/models/llama-3-8b-instruct.Q4_K_M.gguf')
     CONTEXT_SIZE = os.environ.get('CONTEXT_SIZE', '4096')
     TEMPERATURE = os.environ.get('TEMPERATURE', '0.7')
     
-    # Configurações de logging
+    # Formato de conversa dos prompts: 'auto' lê o formato de cada modelo dos
+    # metadados do arquivo GGUF (tokenizer.chat_template); ou llama3, llama2
+    # ou chatml para todos os modelos
+    CHAT_TEMPLATE = os.environ.get('CHAT_TEMPLATE', 'auto')
+    
+    # Recursos do processo do llama.cpp local. Os núcleos físicos são divididos
+    # em INFERENCE_CPU_SLOTS vagas (0 = uma por geração simultânea do modelo
+    # principal, pelo menos uma por nó NUMA) e cada geração fica restrita às
+    # CPUs da sua vaga (INFERENCE_CPU_PINNING). LLAMA_NUM_THREADS e
+    # LLAMA_BATCH_THREADS: 0 = valor medido por "flask calibrate-inference"
+    # neste servidor ou, sem medição, núcleos físicos e CPUs lógicas da vaga.
+    # LLAMA_NUMA: auto, off, distribute, isolate ou numactl (--numa do llama.cpp)
+    LLAMA_NUM_THREADS = int(os.environ.get('LLAMA_NUM_THREADS', '0'))
+    LLAMA_BATCH_THREADS = int(os.environ.get('LLAMA_BATCH_THREADS', '0'))
+    LLAMA_MLOCK = env_bool('LLAMA_MLOCK', False)
+    LLAMA_MMAP = env_bool('LLAMA_MMAP', True)
+    LLAMA_NUMA = os.environ.get('LLAMA_NUMA', 'auto')
+    INFERENCE_CPU_SLOTS = int(os.environ.get('INFERENCE_CPU_SLOTS', '0'))
+    INFERENCE_CPU_PINNING = env_bool('INFERENCE_CPU_PINNING', True)
+    INFERENCE_CALIBRATION_FILE = os.environ.get('INFERENCE_CALIBRATION_FILE', '')
+    
+    # Tempo limite (em segundos) para uma geração antes de ser encerrada
+    GENERATION_TIMEOUT = int(os.environ.get('GENERATION_TIMEOUT', '120'))
+    
+    # Orçamento de tokens da resposta por tipo de consulta (ver prompts.detect_query_type):
+    # n_predict é o valor base, acrescido do tamanho da pergunta até max_predict
+    TOKEN_BUDGETS = {
+        'default': {'n_predict': 384, 'max_predict': 768},
+        'technical': {'n_predict': 512, 'max_predict': 1024},
+        'hr': {'n_predict': 256, 'max_predict': 512},
+        'summary': {'n_predict': 256, 'max_predict': 256}
+    }
+    MAX_QUESTION_TOKENS = int(os.environ.get('MAX_QUESTION_TOKENS', '512'))
+    # Tokens mínimos reservados para a resposta: prompts maiores perdem o
+    # histórico mais antigo (ou são recusados) em vez de gerar uma resposta cortada
+    MIN_PREDICT_TOKENS = int(os.environ.get('MIN_PREDICT_TOKENS', '128'))
+    
+    # Conversas: tokens das perguntas e respostas anteriores incluídos em cada
+    # nova pergunta (as mais antigas são descartadas primeiro)
+    MAX_HISTORY_TOKENS = int(os.environ.get('MAX_HISTORY_TOKENS', '1536'))
+    
+    # Espaço em disco para o estado KV salvo por conversa (--prompt-cache do
+    # llama.cpp); os estados usados há mais tempo são removidos primeiro (0 = desabilitado)
+    KV_CACHE_BUDGET_MB = int(os.environ.get('KV_CACHE_BUDGET_MB', '2048'))
+    
+    # Decodificação especulativa (opcional): um modelo pequeno com o mesmo
+    # vocabulário do MODEL_PATH (ex.: Llama 3.2 1B Instruct) propõe
+    # SPECULATIVE_DRAFT_TOKENS tokens por passo, verificados pelo modelo
+    # principal. Se a taxa de aceitação das últimas SPECULATIVE_WINDOW gerações
+    # ficar abaixo de SPECULATIVE_MIN_ACCEPTANCE, a especulação é suspensa por
+    # SPECULATIVE_RETRY_SECONDS segundos. Com INFERENCE_ENDPOINTS, os servidores
+    # devem ser iniciados com o modelo de rascunho (-md)
+    DRAFT_MODEL_PATH = os.environ.get('DRAFT_MODEL_PATH', '')
+    SPECULATIVE_DRAFT_TOKENS = int(os.environ.get('SPECULATIVE_DRAFT_TOKENS', '8'))
+    SPECULATIVE_MIN_ACCEPTANCE = float(os.environ.get('SPECULATIVE_MIN_ACCEPTANCE', '0.5'))
+    SPECULATIVE_WINDOW = int(os.environ.get('SPECULATIVE_WINDOW', '20'))
+    SPECULATIVE_RETRY_SECONDS = float(os.environ.get('SPECULATIVE_RETRY_SECONDS', '600'))
+    
+    # FAQ (/admin/faq): perguntas equivalentes a uma entrada cadastrada recebem
+    # a resposta revisada sem passar pelo modelo. FAQ_MATCH_THRESHOLD é a
+    # semelhança mínima (0 a 1) e FAQ_MIN_COVERAGE a fração mínima de
+    # palavras-chave em comum entre a pergunta e a entrada
+    FAQ_ENABLED = env_bool('FAQ_ENABLED', True)
+    FAQ_MATCH_THRESHOLD = float(os.environ.get('FAQ_MATCH_THRESHOLD', '0.8'))
+    FAQ_MIN_COVERAGE = float(os.environ.get('FAQ_MIN_COVERAGE', '0.75'))
+    
+    # Busca federada (/search) no FAQ, no catálogo do File Server ("flask
+    # index-fileserver") e no SharePoint. Cada fonte tem seu tempo máximo
+    # (RETRIEVAL_<FONTE>_TIMEOUT_MS) e a busca retorna em até RETRIEVAL_BUDGET_MS
+    # com as fontes que responderam. RETRIEVAL_RERANK_WEIGHT é o peso da
+    # semelhança com a busca na ordem final (0 = só a fusão das listas)
+    RETRIEVAL_SOURCES = env_list('RETRIEVAL_SOURCES') or ['faq', 'fileserver', 'sharepoint']
+    RETRIEVAL_BUDGET_MS = int(os.environ.get('RETRIEVAL_BUDGET_MS', '800'))
+    RETRIEVAL_TIMEOUTS_MS = {
+        'faq': int(os.environ.get('RETRIEVAL_FAQ_TIMEOUT_MS', '100')),
+        'fileserver': int(os.environ.get('RETRIEVAL_FILESERVER_TIMEOUT_MS', '300')),
+        'sharepoint': int(os.environ.get('RETRIEVAL_SHAREPOINT_TIMEOUT_MS', '700'))
+    }
+    RETRIEVAL_MAX_RESULTS = int(os.environ.get('RETRIEVAL_MAX_RESULTS', '10'))
+    RETRIEVAL_CACHE_TTL = int(os.environ.get('RETRIEVAL_CACHE_TTL', '300'))
+    RETRIEVAL_RRF_K = int(os.environ.get('RETRIEVAL_RRF_K', '60'))
+    RETRIEVAL_RERANK_WEIGHT = float(os.environ.get('RETRIEVAL_RERANK_WEIGHT', '0.5'))
+    RETRIEVAL_WORKERS = int(os.environ.get('RETRIEVAL_WORKERS', '8'))
+    RETRIEVAL_CATALOG_PATH = os.environ.get('RETRIEVAL_CATALOG_PATH', '')
+    
+    # Resumo das conversas longas: quando as perguntas ainda não resumidas somam
+    # mais de SUMMARY_TRIGGER_TOKENS, as mais antigas (exceto as últimas
+    # SUMMARY_KEEP_TURNS) são resumidas em segundo plano (0 = desabilitado)
+    SUMMARY_TRIGGER_TOKENS = int(os.environ.get('SUMMARY_TRIGGER_TOKENS', '1024'))
+    SUMMARY_KEEP_TURNS = int(os.environ.get('SUMMARY_KEEP_TURNS', '2'))
+    
+    # Modelos disponíveis para roteamento. Modelos sem caminho nem endpoints ficam
+    # desabilitados. Com endpoints (servidores llama.cpp), a geração é distribuída
+    # entre eles em vez de executar o binário localmente.
+    # memory_mb (opcional) substitui o tamanho do arquivo na contabilidade de memória;
+    # kv_bytes_per_token estima o cache KV de cada execução
+    MODELS = {
+        'large': {
+            'path': MODEL_PATH,
+            'endpoints': env_list('INFERENCE_ENDPOINTS'),
+            'max_concurrency': int(os.environ.get('LARGE_MODEL_CONCURRENCY', '2')),
+            'kv_bytes_per_token': 131072
+        },
+        'small': {
+            'path': os.environ.get('SMALL_MODEL_PATH', ''),
+            'endpoints': env_list('SMALL_MODEL_ENDPOINTS'),
+            'max_concurrency': int(os.environ.get('SMALL_MODEL_CONCURRENCY', '4')),
+            'kv_bytes_per_token': 32768
+        }
+    }
+    DEFAULT_MODEL = 'large'
+    SMALL_MODEL = 'small'
+    
+    # Consultas destas categorias, com até ROUTING_SMALL_MAX_TOKENS tokens, vão para o modelo pequeno
+    ROUTING_SMALL_CATEGORIES = ('default', 'hr', 'summary')
+    ROUTING_SMALL_MAX_TOKENS = int(os.environ.get('ROUTING_SMALL_MAX_TOKENS', '48'))
+    
+    # Memória disponível para os modelos (0 = 80% da RAM do servidor) e tempo
+    # máximo de espera por um modelo ocupado
+    INFERENCE_MEMORY_BUDGET_MB = int(os.environ.get('INFERENCE_MEMORY_BUDGET_MB', '0'))
+    MODEL_QUEUE_TIMEOUT = int(os.environ.get('MODEL_QUEUE_TIMEOUT', '30'))
+    
+    # Prioridades (interativo > administração > segundo plano): execuções simultâneas
+    # de cada modelo permitidas ao segundo plano (resumos, lotes; 0 = sem limite) e
+    # espera (em segundos) de uma pergunta interativa antes de interromper uma
+    # geração de segundo plano (0 = nunca interromper)
+    PRIORITY_BACKGROUND_SLOTS = int(os.environ.get('PRIORITY_BACKGROUND_SLOTS', '1'))
+    PRIORITY_PREEMPT_AFTER = float(os.environ.get('PRIORITY_PREEMPT_AFTER', '2'))
+    
+    # Processamento em lote ("flask batch-worker"): perguntas por trabalho,
+    # gerações simultâneas do worker (aumente com servidores de inferência
+    # remotos), prioridade de CPU (nice) e intervalo de consulta à fila
+    BATCH_MAX_QUESTIONS = int(os.environ.get('BATCH_MAX_QUESTIONS', '5000'))
+    BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '1'))
+    BATCH_NICE = int(os.environ.get('BATCH_NICE', '10'))
+    BATCH_POLL_INTERVAL = float(os.environ.get('BATCH_POLL_INTERVAL', '2'))
+    
+    # Arquivamento do histórico ("flask archive-history"): perguntas mais antigas
+    # que HISTORY_RETENTION_DAYS dias vão para arquivos compactados (gzip ou zstd)
+    # em ARCHIVE_DIR (padrão: instance/archive); VACUUM quando a fração de
+    # páginas livres do SQLite passar de ARCHIVE_VACUUM_FREE_RATIO
+    HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', '180'))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '2000'))
+    ARCHIVE_COMPRESSION = os.environ.get('ARCHIVE_COMPRESSION', 'gzip')
+    ARCHIVE_VACUUM_FREE_RATIO = float(os.environ.get('ARCHIVE_VACUUM_FREE_RATIO', '0.2'))
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '')
+    HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+    
+    # Exportação do histórico (/history/export, "flask export-history"): linhas
+    # lidas do banco por vez (e por grupo de linhas do Parquet)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '1000'))
+    
+    # Totais de uso do painel ("flask rollup-usage"): perguntas por transação e
+    # dias em que os totais por hora são mantidos (os totais por dia não expiram)
+    ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', '5000'))
+    ROLLUP_HOURLY_RETENTION_DAYS = int(os.environ.get('ROLLUP_HOURLY_RETENTION_DAYS', '14'))
+    
+    # Arquivos estáticos (/assets/<nome>.<hash>.<ext>): tempo de cache no
+    # navegador; respostas JSON/HTML maiores que COMPRESS_MIN_SIZE bytes são
+    # compactadas com gzip (nível COMPRESS_LEVEL; 0 desativa, para deixar a
+    # compressão com o proxy)
+    ASSETS_MAX_AGE = int(os.environ.get('ASSETS_MAX_AGE', '31536000'))
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '3'))
+    
+    # Perfis de desempenho (/admin/profiling): arquivos dos perfis (padrão:
+    # instance/profiles), perfis mantidos, ferramenta (cprofile ou
+    # pyinstrument, se instalado) e amostragem contínua das pilhas (também
+    # ligada e desligada em tempo de execução) a cada PROFILING_SAMPLE_INTERVAL segundos
+    PROFILING_DIR = os.environ.get('PROFILING_DIR', '')
+    PROFILING_KEEP = int(os.environ.get('PROFILING_KEEP', '50'))
+    PROFILER = os.environ.get('PROFILER', 'cprofile')
+    PROFILING_SAMPLER = env_bool('PROFILING_SAMPLER', False)
+    PROFILING_SAMPLE_INTERVAL = float(os.environ.get('PROFILING_SAMPLE_INTERVAL', '0.01'))
+    
+    # Configurações de logging: registros em JSON (LOG_FORMAT=json) ou texto,
+    # gravados por uma thread separada no terminal e em LOG_FILE (vazio =
+    # apenas o terminal). O arquivo é reaberto quando o logrotate o move; com
+    # LOG_MAX_BYTES, é rotacionado pela própria aplicação (apenas com um
+    # processo). LOG_QUEUE_SIZE registros aguardam a gravação (acima disso são
+    # descartados) e apenas 1 de cada LOG_DEBUG_SAMPLE registros DEBUG de cada
+    # linha do código é mantido
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
-    LOG_FILE = os.environ.get('LOG_FILE', 'app.log')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_FILE = os.environ.get('LOG_FILE', '')
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', '0'))
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+    LOG_DEBUG_SAMPLE = int(os.environ.get('LOG_DEBUG_SAMPLE', '10'))
     
     # Configurações de upload (para futuras expansões)
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
@@ -34,12 +254,16 @@ class Config:
 class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
 
 # Configurações de teste
 class TestingConfig(Config):
     DEBUG = False
     TESTING = True
     WTF_CSRF_ENABLED = False
+    # Cada teste usa um banco próprio, com os mesmos identificadores de usuário
+    USER_CACHE_TTL = 0
+    LOG_FILE = ''
 
 # Configurações de produção
 class ProductionConfig(Config):
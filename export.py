@@ -0,0 +1,245 @@
+# export.py
+# Exportação do histórico de perguntas para análise (CSV, JSONL ou Parquet),
+# pela rota /history/export e pelo comando "flask export-history".
+#
+# As linhas são lidas com um cursor no servidor (stream_results/yield_per) e
+# convertidas em partes à medida que são enviadas, então a memória usada não
+# depende do tamanho do histórico.
+
+import io
+import csv
+import sys
+import json
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from models import db, User, QueryHistory
+
+try:
+    # Dependência opcional (formato Parquet)
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Formatos aceitos: extensão e tipo MIME
+FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'jsonl': ('jsonl', 'application/x-ndjson'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet')
+}
+
+# Colunas exportadas, na ordem do arquivo
+COLUMNS = ('id', 'timestamp', 'username', 'department', 'category', 'question', 'response',
+           'prompt_tokens', 'completion_tokens', 'latency_ms', 'conversation_id')
+
+
+# Função para validar os filtros da exportação
+def parse_filters(args):
+    """Converte os filtros recebidos (rota ou linha de comando)
+
+    Args:
+        args (dict): 'from' e 'to' (AAAA-MM-DD, 'to' inclusivo), 'user' e 'department'
+
+    Returns:
+        dict: Filtros para export_history
+
+    Raises:
+        ValueError: se alguma data for inválida
+    """
+    filters = {}
+    for name in ('from', 'to'):
+        value = (args.get(name) or '').strip()
+        if not value:
+            continue
+        try:
+            date = datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f"Data inválida em '{name}' (use AAAA-MM-DD)")
+        # O dia final entra inteiro
+        filters['start' if name == 'from' else 'end'] = date if name == 'from' else date + timedelta(days=1)
+    for name in ('user', 'department'):
+        value = (args.get(name) or '').strip()
+        if value:
+            filters[name] = value
+    return filters
+
+
+# Função para montar a consulta da exportação
+def history_query(start=None, end=None, user=None, department=None):
+    """Histórico com o usuário e o departamento, em ordem cronológica"""
+    query = select(
+        QueryHistory.id, QueryHistory.timestamp, User.username, User.department, QueryHistory.category,
+        QueryHistory.question, QueryHistory.response, QueryHistory.prompt_tokens,
+        QueryHistory.completion_tokens, QueryHistory.latency_ms, QueryHistory.conversation_id
+    ).outerjoin(User, QueryHistory.user_id == User.id)
+    if start:
+        query = query.where(QueryHistory.timestamp >= start)
+    if end:
+        query = query.where(QueryHistory.timestamp < end)
+    if user:
+        query = query.where(User.username == user)
+    if department:
+        query = query.where(User.department == department)
+    return query.order_by(QueryHistory.timestamp, QueryHistory.id)
+
+
+# Função para ler o histórico em partes
+def iter_chunks(filters, chunk_size):
+    """Lê o histórico com um cursor no servidor
+
+    Yields:
+        list: Até chunk_size linhas (tuplas na ordem de COLUMNS)
+    """
+    result = db.session.execute(
+        history_query(**filters).execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Arquivo somente de escrita que guarda os bytes até serem enviados"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('timestamp', pyarrow.timestamp('us')),
+        ('username', pyarrow.string()),
+        ('department', pyarrow.string()),
+        ('category', pyarrow.string()),
+        ('question', pyarrow.string()),
+        ('response', pyarrow.string()),
+        ('prompt_tokens', pyarrow.int64()),
+        ('completion_tokens', pyarrow.int64()),
+        ('latency_ms', pyarrow.int64()),
+        ('conversation_id', pyarrow.int64())
+    ])
+
+
+def _export_parquet(filters, chunk_size):
+    """Um grupo de linhas (row group) do Parquet por parte lida do banco"""
+    sink = _ChunkSink()
+    schema = _parquet_schema()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    for rows in iter_chunks(filters, chunk_size):
+        columns = list(zip(*rows))
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema
+        ))
+        db.session.expunge_all()
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+    return buffer.getvalue()
+
+
+# Função para exportar o histórico
+def export_history(fmt='csv', filters=None, chunk_size=None):
+    """Produz o arquivo de exportação em partes
+
+    Args:
+        fmt (str): 'csv', 'jsonl' ou 'parquet'
+        filters (dict, optional): Resultado de parse_filters
+        chunk_size (int, optional): Linhas lidas do banco por vez (padrão: EXPORT_CHUNK_SIZE)
+
+    Yields:
+        str | bytes: Partes do arquivo (bytes no formato Parquet)
+
+    Raises:
+        ValueError: se o formato for inválido ou o pyarrow não estiver instalado
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato inválido (use {', '.join(FORMATS)})")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("A exportação em Parquet requer o pacote pyarrow")
+    filters = filters or {}
+    chunk_size = int(chunk_size or current_app.config.get('EXPORT_CHUNK_SIZE', 1000))
+    logger.info("Exportação do histórico em %s: %s", fmt, filters, extra={'format': fmt, 'filters': filters})
+    return _export_parquet(filters, chunk_size) if fmt == 'parquet' else _export_text(fmt, filters, chunk_size)
+
+
+def _export_text(fmt, filters, chunk_size):
+    if fmt == 'csv':
+        yield _csv_lines([COLUMNS])
+    for rows in iter_chunks(filters, chunk_size):
+        if fmt == 'csv':
+            yield _csv_lines(rows)
+        else:
+            yield ''.join(
+                json.dumps(
+                    dict(zip(COLUMNS, row)), ensure_ascii=False,
+                    default=lambda value: value.isoformat(sep=' ')
+                ) + '\n'
+                for row in rows
+            )
+
+
+# Comando para exportar o histórico
+@click.command('export-history')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv', help='Formato do arquivo')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Arquivo de saída (padrão: saída padrão, exceto Parquet)')
+@click.option('--from', 'start', default=None, help='Data inicial (AAAA-MM-DD)')
+@click.option('--to', 'end', default=None, help='Data final, inclusiva (AAAA-MM-DD)')
+@click.option('--user', default=None, help='Nome do usuário')
+@click.option('--department', default=None, help='Departamento')
+@click.option('--chunk-size', type=int, default=None, help='Linhas lidas do banco por vez')
+@with_appcontext
+def export_history_command(fmt, output, start, end, user, department, chunk_size):
+    """Exporta o histórico de perguntas para análise"""
+    if fmt == 'parquet' and not output:
+        raise click.UsageError("Informe --output para o formato Parquet")
+    try:
+        filters = parse_filters({'from': start, 'to': end, 'user': user, 'department': department})
+        chunks = export_history(fmt, filters, chunk_size)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if output:
+        with open(output, 'wb' if fmt == 'parquet' else 'w', encoding=None if fmt == 'parquet' else 'utf-8',
+                  newline=None if fmt == 'parquet' else '') as output_file:
+            for chunk in chunks:
+                output_file.write(chunk)
+        click.echo(f"Histórico exportado para {output}", err=True)
+    else:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
@@ -0,0 +1,294 @@
+# faq.py
+# Respostas revisadas para as perguntas frequentes (tabela faq_entries),
+# consultadas em /ask antes do modelo
+#
+# Cada worker mantém um índice em memória com as perguntas cadastradas (e
+# suas variações): um índice invertido de palavras-chave normalizadas (sem
+# acentos, sem palavras vazias, reduzidas a um radical) seleciona as
+# candidatas, que precisam ter quase todas as palavras-chave em comum com a
+# pergunta, e a semelhança do cosseno entre vetores de trigramas de
+# caracteres decide se a pergunta é a mesma. Como nas configurações em tempo de execução
+# (settings.py), um número de versão no estado compartilhado avisa os demais
+# workers quando o FAQ é alterado.
+
+import time
+import logging
+import threading
+import unicodedata
+from collections import Counter
+from math import sqrt
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from budget import budgeter
+from models import db, FAQEntry, QueryHistory
+from state_store import shared_state
+
+logger = logging.getLogger(__name__)
+
+# Contador no estado compartilhado incrementado a cada alteração do FAQ
+VERSION_KEY = 'faq-version'
+
+# Letras mantidas de cada palavra (radical aproximado: "solicito" e
+# "solicitar" são a mesma palavra-chave)
+STEM_LENGTH = 6
+
+# Palavras ignoradas na comparação
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'de', 'do', 'da', 'dos', 'das', 'em', 'no', 'na',
+    'nos', 'nas', 'por', 'pelo', 'pela', 'para', 'pra', 'com', 'sem', 'e', 'ou', 'que', 'se', 'eu', 'me',
+    'meu', 'minha', 'meus', 'minhas', 'voce', 'ao', 'aos', 'qual', 'quais', 'como', 'onde', 'quando',
+    'sao', 'ser', 'esta', 'estou', 'isso', 'este', 'esse', 'essa', 'ha', 'tem', 'ter', 'posso',
+    'pode', 'preciso', 'gostaria', 'faco', 'fazer', 'faz', 'saber', 'favor', 'ola', 'oi', 'bom', 'dia', 'boa', 'tarde', 'noite'
+}
+
+
+# Função para separar um texto em palavras normalizadas
+def tokenize(text):
+    """Minúsculas, sem acentos e sem pontuação ("e-mail" vira "email")"""
+    text = unicodedata.normalize('NFKD', (text or '').lower().replace('-', ''))
+    text = ''.join(c if c.isalnum() else ' ' for c in text if not unicodedata.combining(c))
+    return text.split()
+
+
+# Função para extrair as palavras-chave de um texto
+def keywords(text):
+    """Radicais das palavras, sem as palavras vazias e sem o plural"""
+    words = set()
+    for word in tokenize(text):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s'):
+            word = word[:-1]
+        words.add(word[:STEM_LENGTH])
+    return words
+
+
+# Função para calcular o vetor de trigramas de um texto
+def embed(words):
+    """Vetor (esparso, de norma 1) de trigramas de caracteres das palavras-chave
+
+    Returns:
+        dict: trigrama -> peso
+    """
+    counts = Counter()
+    for word in words:
+        padded = f" {word} "
+        counts.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    norm = sqrt(sum(value * value for value in counts.values())) or 1.0
+    return {gram: value / norm for gram, value in counts.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(gram, 0.0) for gram, value in a.items())
+
+
+class FAQIndex:
+    """Índice em memória das perguntas do FAQ"""
+
+    def __init__(self, entries):
+        # Cada pergunta e cada variação é uma forma de encontrar a entrada
+        self.exact = {}
+        self.forms = []
+        self.postings = {}
+        self.answers = {}
+        self.answer_tokens = {}
+        self.questions = {}
+        for entry in entries:
+            self.answers[entry.id] = entry.answer
+            # Contados uma vez, na montagem do índice: a resposta do FAQ vai
+            # para o histórico sem passar pelo modelo nem pelo tokenizador
+            self.answer_tokens[entry.id] = budgeter.counter.count(entry.answer)
+            self.questions[entry.id] = entry.question
+            phrasings = [entry.question] + [line for line in (entry.variations or '').splitlines() if line.strip()]
+            for phrasing in phrasings:
+                self.exact.setdefault(' '.join(tokenize(phrasing)), entry.id)
+                words = keywords(phrasing)
+                if not words:
+                    continue
+                form = len(self.forms)
+                self.forms.append((entry.id, words, embed(words)))
+                for word in words:
+                    self.postings.setdefault(word, []).append(form)
+
+    def __len__(self):
+        return len(self.answers)
+
+    def match(self, question, threshold, min_coverage):
+        """Procura a entrada equivalente à pergunta
+
+        Args:
+            question (str): Pergunta do usuário
+            threshold (float): Semelhança mínima (cosseno dos trigramas)
+            min_coverage (float): Fração mínima das palavras-chave da entrada
+                presentes na pergunta (e vice-versa)
+
+        Returns:
+            tuple: (id da entrada, semelhança), ou None
+        """
+        entry_id = self.exact.get(' '.join(tokenize(question)))
+        if entry_id is not None:
+            return entry_id, 1.0
+        words = keywords(question)
+        # Palavras-chave em comum com cada forma, contadas pelo índice invertido
+        shared = Counter(form for word in words for form in self.postings.get(word, ()))
+        best = None
+        vector = None
+        for form, common in shared.items():
+            entry_id, form_words, form_vector = self.forms[form]
+            if common / len(form_words) < min_coverage or common / len(words) < min_coverage:
+                continue
+            if vector is None:
+                vector = embed(words)
+            score = cosine(vector, form_vector)
+            if score >= threshold and (best is None or score > best[1]):
+                best = (entry_id, score)
+        return best
+
+    def search(self, question, limit):
+        """Entradas mais parecidas com a pergunta, para a busca (sem limiar)
+
+        Returns:
+            list: (id da entrada, semelhança), da mais parecida para a menos
+        """
+        words = keywords(question)
+        if not words:
+            return []
+        vector = embed(words)
+        best = {}
+        for form in set(form for word in words for form in self.postings.get(word, ())):
+            entry_id, _, form_vector = self.forms[form]
+            score = cosine(vector, form_vector)
+            if score > best.get(entry_id, 0.0):
+                best[entry_id] = score
+        return sorted(best.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+class FAQStore:
+    """Perguntas frequentes com respostas revisadas pelos administradores
+
+    O índice de cada aplicação fica em app.extensions['faq']; os métodos usam
+    a aplicação do contexto atual.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0}
+
+    def init_app(self, app):
+        app.extensions['faq'] = {'index': None, 'version': None, 'checked_at': 0.0}
+
+    def index(self, force=False):
+        """Índice em vigor neste worker, recarregado se o FAQ foi alterado"""
+        app = current_app._get_current_object()
+        loaded = app.extensions['faq']
+        interval = float(app.config.get('SETTINGS_CHECK_INTERVAL', 1))
+        now = time.monotonic()
+        with self._lock:
+            if not force and loaded['index'] is not None and now - loaded['checked_at'] < interval:
+                return loaded['index']
+            loaded['checked_at'] = now
+        version = self.state.get(VERSION_KEY) or '0'
+        if force or version != loaded['version'] or loaded['index'] is None:
+            try:
+                entries = FAQEntry.query.filter_by(active=True).all()
+            except SQLAlchemyError as e:
+                # Banco ainda não inicializado: mantém o índice atual
+                db.session.rollback()
+                logger.error("Erro ao carregar o FAQ: %s", e)
+                return loaded['index'] or FAQIndex([])
+            loaded['index'] = FAQIndex(entries)
+            loaded['version'] = version
+        return loaded['index']
+
+    def lookup(self, question):
+        """Resposta revisada para a pergunta
+
+        Returns:
+            dict: id, answer, completion_tokens (tokens da resposta) e score
+                da entrada, ou None
+        """
+        config = current_app.config
+        if not config.get('FAQ_ENABLED', True):
+            return None
+        index = self.index()
+        match = index.match(question, float(config.get('FAQ_MATCH_THRESHOLD', 0.8)),
+                            float(config.get('FAQ_MIN_COVERAGE', 0.75))) if len(index) else None
+        with self._lock:
+            self._counts['hits' if match else 'misses'] += 1
+        if match is None:
+            return None
+        entry_id, score = match
+        return {'id': entry_id, 'answer': index.answers[entry_id],
+                'completion_tokens': index.answer_tokens[entry_id], 'score': round(score, 3)}
+
+    def save(self, data, entry_id=None, user_id=None):
+        """Cria ou altera uma entrada do FAQ, avisando os demais workers
+
+        Raises:
+            ValueError: se a pergunta ou a resposta estiverem vazias
+            LookupError: se a entrada não existir
+        """
+        if entry_id is not None:
+            entry = db.session.get(FAQEntry, entry_id)
+            if entry is None:
+                raise LookupError(f"Entrada do FAQ não encontrada: {entry_id}")
+        else:
+            entry = FAQEntry(created_by=user_id)
+            db.session.add(entry)
+        for field in ('question', 'answer', 'variations', 'category', 'source_query_id'):
+            if field in data:
+                value = data[field]
+                setattr(entry, field, value.strip() if isinstance(value, str) else value)
+        if 'active' in data:
+            entry.active = bool(data['active'])
+        if not entry.question or not entry.answer:
+            db.session.rollback()
+            raise ValueError("Pergunta e resposta são obrigatórias")
+        db.session.commit()
+        self.bump()
+        return entry
+
+    def promote(self, query_id, user_id, data=None):
+        """Cria uma entrada do FAQ a partir de uma pergunta do histórico
+
+        A resposta pode ser revisada antes (data['answer']).
+
+        Raises:
+            LookupError: se a pergunta não existir no histórico
+        """
+        record = db.session.get(QueryHistory, query_id)
+        if record is None:
+            raise LookupError(f"Pergunta não encontrada: {query_id}")
+        values = {'question': record.question, 'answer': record.response,
+                  'category': record.category, 'source_query_id': record.id}
+        values.update({key: value for key, value in (data or {}).items() if value})
+        return self.save(values, user_id=user_id)
+
+    def delete(self, entry_id):
+        entry = db.session.get(FAQEntry, entry_id)
+        if entry is None:
+            raise LookupError(f"Entrada do FAQ não encontrada: {entry_id}")
+        db.session.delete(entry)
+        db.session.commit()
+        self.bump()
+
+    def bump(self):
+        """Marca o FAQ como alterado e recarrega o índice neste worker"""
+        self.state.incr(VERSION_KEY)
+        self.index(force=True)
+
+    def metrics(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = counts['hits'] + counts['misses']
+        counts['hit_rate'] = round(counts['hits'] / total, 3) if total else None
+        return counts
+
+
+# FAQ compartilhado entre os workers
+faq = FAQStore(shared_state)
@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+# Configuração do Gunicorn para o Assistente IA Corporativo
+# Uso: gunicorn -c gunicorn.conf.py wsgi:app
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '180'))
+
+# Modo de atendimento. Uma pergunta passa quase todo o tempo esperando o
+# modelo; com workers "sync" cada pergunta em andamento ocupa um worker
+# inteiro, e poucas gerações lentas deixam o login e os arquivos estáticos
+# sem resposta.
+#   gthread (padrão): GUNICORN_THREADS requisições simultâneas por worker
+#   gevent: atendimento cooperativo, GUNICORN_WORKER_CONNECTIONS conexões por
+#           worker (requer o pacote gevent)
+#   sync: uma requisição por worker (comportamento anterior)
+# O número de gerações simultâneas continua limitado pelo roteador
+# (LARGE_MODEL_CONCURRENCY, MODEL_QUEUE_TIMEOUT).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Com threads > 1 o Gunicorn usa gthread mesmo se outro modo for pedido
+threads = int(os.environ.get('GUNICORN_THREADS', '32')) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '500'))
+
+if worker_class == 'gevent':
+    # A aplicação é importada no processo mestre (on_starting): o monkey
+    # patching precisa vir antes, para que as travas e esperas criadas na
+    # importação sejam cooperativas nos workers
+    from gevent import monkey
+    monkey.patch_all()
+
+
+# Executado uma única vez no processo mestre, antes de criar os workers
+def on_starting(server):
+    from app import create_app
+    from models import db, bootstrap_db
+
+    app = create_app()
+    with app.app_context():
+        bootstrap_db()
+        # Não compartilhar conexões abertas com os workers
+        db.engine.dispose()
@@ -0,0 +1,896 @@
+# inference.py
+# Execução do modelo LLaMA via llama.cpp com tempo limite, cancelamento,
+# métricas de uso de CPU, reaproveitamento do estado KV das conversas e
+# decodificação especulativa com um modelo de rascunho
+
+import os
+import re
+import json
+import time
+import fcntl
+import codecs
+import hashlib
+import signal
+import logging
+import selectors
+import tempfile
+import threading
+import subprocess
+import http.client
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from backends import get_pool, iter_events, BackendUnavailable
+from resources import resources
+from chat_templates import chat_templates
+from profiling import REQUEST_ID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Intervalo (em segundos) entre verificações de cancelamento durante a leitura
+POLL_INTERVAL = 0.25
+
+# Tempo de espera após SIGTERM antes de enviar SIGKILL
+KILL_GRACE_PERIOD = 2.0
+
+# Bytes finais da saída de erro do llama.cpp incluídos no log de uma falha
+STDERR_TAIL_BYTES = 2048
+
+# Marcadores de fim de turno de todos os formatos de conversa (o executor
+# usa os do formato de cada modelo, ver chat_templates.py)
+STOP_SEQUENCES = ('<|eot_id|>', '<|end_of_text|>', '</s>', '[INST]', '<|im_end|>')
+
+
+class GenerationCancelled(Exception):
+    """Geração interrompida antes de terminar"""
+
+    def __init__(self, reason='client'):
+        super().__init__(f"Geração cancelada ({reason})")
+        self.reason = reason
+
+
+class GenerationTimeout(GenerationCancelled):
+    """Geração interrompida por exceder o tempo limite"""
+
+    def __init__(self):
+        super().__init__('timeout')
+
+
+class GenerationConflict(Exception):
+    """Já existe uma geração em andamento com o mesmo identificador"""
+
+
+class GenerationFailed(Exception):
+    """Processo do modelo terminou com erro (modelo não carregado, memória insuficiente etc.)"""
+
+
+# Função para ler o tempo de CPU consumido por um processo
+def process_cpu_seconds(pid):
+    """Lê o tempo de CPU (usuário + sistema) de um processo em /proc
+
+    Args:
+        pid (int): Identificador do processo
+
+    Returns:
+        float: Segundos de CPU consumidos ou 0.0 se não for possível ler
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class _Generation:
+    """Estado de uma geração em andamento neste processo"""
+
+    def __init__(self, request_id, user_id, process, timeout):
+        self.request_id = request_id
+        self.user_id = user_id
+        self.process = process
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.cancel_event = threading.Event()
+        self.reason = None
+
+
+class GenerationRegistry:
+    """Registro das gerações em andamento
+
+    Cada geração é registrada em memória e em um arquivo no diretório de
+    estado compartilhado, de modo que um cancelamento recebido por outro
+    worker do Gunicorn consiga localizar e encerrar o processo do modelo.
+    """
+
+    def __init__(self, state_dir=None):
+        self.state_dir = state_dir
+        self._lock = threading.Lock()
+        self._active = {}
+        self._metrics = {
+            'completed': 0,
+            'failed': 0,
+            'cancelled': {'client': 0, 'disconnect': 0, 'timeout': 0, 'preempted': 0},
+            'cpu_seconds_cancelled': 0.0,
+            'cpu_seconds_reclaimed': 0.0,
+        }
+
+    def init_state_dir(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+
+    def _path(self, request_id, suffix):
+        return os.path.join(self.state_dir, f"{request_id}.{suffix}")
+
+    def _claimed(self, request_id):
+        """Indica se outro worker vivo mantém o arquivo de estado do identificador
+
+        Arquivos de workers que terminaram sem chamar unregister (queda,
+        SIGKILL) são removidos, para que o identificador possa ser reutilizado.
+        """
+        path = self._path(request_id, 'json')
+        try:
+            with open(path) as state_file:
+                worker = json.load(state_file).get('worker')
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            # Arquivo sendo escrito por outro worker neste instante
+            return True
+        if worker is None or worker == os.getpid():
+            return True
+        try:
+            os.kill(worker, 0)
+        except ProcessLookupError:
+            logger.warning("Removendo estado da geração %s de um worker encerrado (pid %s)", request_id, worker)
+            for suffix in ('json', 'cancel'):
+                try:
+                    os.unlink(self._path(request_id, suffix))
+                except FileNotFoundError:
+                    pass
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def running(self, request_id):
+        """Indica se há uma geração em andamento com o identificador, neste ou em outro worker"""
+        with self._lock:
+            if request_id in self._active:
+                return True
+        return bool(self.state_dir) and self._claimed(request_id)
+
+    def register(self, request_id, user_id, process, timeout):
+        """Registra uma geração em andamento
+
+        Raises:
+            ValueError: Se o identificador não for válido (também é o nome
+                do arquivo de estado)
+            GenerationConflict: Se já houver uma geração com o identificador
+                (o cancelamento e o fim de uma afetariam a outra)
+        """
+        if not REQUEST_ID_PATTERN.fullmatch(request_id):
+            raise ValueError(f"Identificador de geração inválido: {request_id!r}")
+        generation = _Generation(request_id, user_id, process, timeout)
+        with self._lock:
+            if request_id in self._active:
+                raise GenerationConflict(f"Geração {request_id} já está em andamento")
+            self._active[request_id] = generation
+        if self.state_dir:
+            state = {'pid': process.pid, 'user_id': user_id, 'worker': os.getpid()}
+            try:
+                # Criação exclusiva: o mesmo identificador em outro worker também é recusado
+                self._create_state(request_id, state)
+            except FileExistsError:
+                try:
+                    if self._claimed(request_id):
+                        raise FileExistsError(request_id)
+                    self._create_state(request_id, state)
+                except FileExistsError:
+                    with self._lock:
+                        self._active.pop(request_id, None)
+                    raise GenerationConflict(f"Geração {request_id} já está em andamento")
+        return generation
+
+    def _create_state(self, request_id, state):
+        with open(self._path(request_id, 'json'), 'x') as state_file:
+            json.dump(state, state_file)
+
+    def unregister(self, generation):
+        with self._lock:
+            self._active.pop(generation.request_id, None)
+        if self.state_dir:
+            for suffix in ('json', 'cancel'):
+                try:
+                    os.unlink(self._path(generation.request_id, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def cancel(self, request_id, user_id=None, reason='client'):
+        """Cancela uma geração, local ou de outro worker
+
+        Args:
+            request_id (str): Identificador da requisição
+            user_id (int, optional): Usuário solicitante; se informado, só
+                cancela gerações do próprio usuário
+            reason (str): Motivo do cancelamento ('client', 'disconnect', 'timeout', 'preempted')
+
+        Returns:
+            bool: True se uma geração foi encontrada e encerrada
+        """
+        with self._lock:
+            generation = self._active.get(request_id)
+        if generation is not None:
+            if user_id is not None and generation.user_id != user_id:
+                return False
+            generation.reason = generation.reason or reason
+            generation.cancel_event.set()
+            terminate_process(generation.process)
+            return True
+
+        # A geração pode estar rodando em outro worker
+        if not self.state_dir or not REQUEST_ID_PATTERN.fullmatch(request_id):
+            return False
+        try:
+            with open(self._path(request_id, 'json')) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return False
+        if user_id is not None and state.get('user_id') != user_id:
+            return False
+        with open(self._path(request_id, 'cancel'), 'w') as marker:
+            marker.write(reason)
+        if not state.get('pid'):
+            # Geração remota: o worker dono encerra a conexão ao ver o marcador
+            return True
+        try:
+            os.kill(state['pid'], signal.SIGTERM)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def cancel_reason(self, generation):
+        """Retorna o motivo do cancelamento de uma geração, se houver"""
+        if generation.reason:
+            return generation.reason
+        if self.state_dir:
+            try:
+                with open(self._path(generation.request_id, 'cancel')) as marker:
+                    return marker.read().strip() or 'client'
+            except FileNotFoundError:
+                pass
+        return None
+
+    def record_completed(self):
+        with self._lock:
+            self._metrics['completed'] += 1
+
+    def record_failed(self):
+        with self._lock:
+            self._metrics['failed'] += 1
+
+    def record_cancelled(self, generation, reason, cpu_seconds):
+        """Contabiliza uma geração cancelada
+
+        O tempo de CPU recuperado é estimado pela taxa de uso observada até o
+        cancelamento, projetada até o tempo limite da geração.
+        """
+        now = time.monotonic()
+        elapsed = max(now - generation.started, 1e-6)
+        remaining = max(generation.deadline - now, 0.0)
+        reclaimed = cpu_seconds / elapsed * remaining
+        with self._lock:
+            cancelled = self._metrics['cancelled']
+            cancelled[reason] = cancelled.get(reason, 0) + 1
+            self._metrics['cpu_seconds_cancelled'] += cpu_seconds
+            self._metrics['cpu_seconds_reclaimed'] += reclaimed
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'active': len(self._active),
+                'completed': self._metrics['completed'],
+                'failed': self._metrics['failed'],
+                'cancelled': dict(self._metrics['cancelled']),
+                'cpu_seconds_cancelled': round(self._metrics['cpu_seconds_cancelled'], 3),
+                'cpu_seconds_reclaimed': round(self._metrics['cpu_seconds_reclaimed'], 3),
+            }
+
+
+# Registro global das gerações deste processo
+registry = GenerationRegistry()
+
+
+# Função para encerrar o processo do modelo
+def terminate_process(process):
+    """Envia SIGTERM ao processo e SIGKILL caso não termine a tempo"""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=KILL_GRACE_PERIOD)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class StopScanner:
+    """Detecta marcadores de fim de turno em uma saída recebida em partes
+
+    Retém o final de cada parte que ainda pode ser o início de um marcador,
+    para que marcadores divididos entre duas leituras sejam reconhecidos.
+    """
+
+    def __init__(self, stop_sequences=STOP_SEQUENCES):
+        self.stop_sequences = stop_sequences
+        self.pending = ''
+        self.stopped = False
+
+    def feed(self, text):
+        """Recebe um trecho da saída e retorna o que pode ser repassado"""
+        text = self.pending + text
+        cut = min((text.find(stop) for stop in self.stop_sequences if stop in text), default=-1)
+        if cut >= 0:
+            self.pending = ''
+            self.stopped = True
+            return text[:cut]
+        keep = 0
+        for stop in self.stop_sequences:
+            for size in range(min(len(stop) - 1, len(text)), 0, -1):
+                if text.endswith(stop[:size]):
+                    keep = max(keep, size)
+                    break
+        self.pending = text[len(text) - keep:] if keep else ''
+        return text[:len(text) - keep]
+
+    def flush(self):
+        pending, self.pending = self.pending, ''
+        return pending
+
+
+class KVCacheStore:
+    """Estado KV salvo por conversa (opção --prompt-cache do llama.cpp)
+
+    Cada conversa tem um arquivo de estado por modelo. Na pergunta seguinte,
+    o llama.cpp carrega o estado e só processa os tokens que não coincidem
+    com o prefixo salvo (a nova pergunta), em vez de todo o histórico. O
+    espaço total é limitado por KV_CACHE_BUDGET_MB, removendo primeiro os
+    estados usados há mais tempo; um lock por arquivo impede que duas
+    gerações da mesma conversa gravem o mesmo estado ao mesmo tempo.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.budget_bytes = 0
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0, 'busy': 0, 'evicted': 0}
+
+    def init_app(self, app):
+        self.budget_bytes = int(app.config.get('KV_CACHE_BUDGET_MB', 0)) * 1024 * 1024
+        if self.budget_bytes:
+            self.directory = os.path.join(app.instance_path, 'kv_cache')
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory and self.budget_bytes)
+
+    def _path(self, conversation_id, model_path):
+        digest = hashlib.blake2b(str(model_path).encode(), digest_size=4).hexdigest()
+        return os.path.join(self.directory, f"{int(conversation_id)}-{digest}.bin")
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    @contextmanager
+    def acquire(self, conversation_id, model_path):
+        """Reserva o arquivo de estado de uma conversa durante a geração
+
+        Yields:
+            str: Caminho do arquivo de estado, ou None se o cache estiver
+                desabilitado ou o estado estiver em uso por outra geração
+        """
+        if not self.enabled or conversation_id is None:
+            yield None
+            return
+        path = self._path(conversation_id, model_path)
+        with open(path + '.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+            except BlockingIOError:
+                locked = False
+            if not locked:
+                # Outra pergunta da mesma conversa em andamento: gerar sem cache
+                self._count('busy')
+                yield None
+                return
+            try:
+                self._count('hits' if os.path.exists(path) else 'misses')
+                yield path
+            finally:
+                if os.path.exists(path):
+                    # Marca o estado como usado recentemente
+                    os.utime(path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bin'):
+                continue
+            try:
+                info = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime, info.st_size, name))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove os estados usados há mais tempo até caber no orçamento"""
+        if not self.enabled:
+            return
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.budget_bytes:
+                break
+            path = os.path.join(self.directory, name)
+            with open(path + '.lock', 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Em uso por uma geração
+                    continue
+                try:
+                    os.unlink(path)
+                    total -= size
+                    self._count('evicted')
+                except FileNotFoundError:
+                    pass
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def discard(self, conversation_id):
+        """Remove os estados de uma conversa excluída"""
+        if not self.enabled:
+            return
+        prefix = f"{int(conversation_id)}-"
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def metrics(self):
+        entries = self._entries() if self.enabled else []
+        with self._lock:
+            counts = dict(self._counts)
+        counts['conversations'] = len(entries)
+        counts['size_mb'] = round(sum(size for _, size, _ in entries) / 1024 / 1024, 1)
+        counts['budget_mb'] = round(self.budget_bytes / 1024 / 1024, 1)
+        return counts
+
+
+# Estados KV das conversas, configurados pela aplicação
+kv_cache = KVCacheStore()
+
+
+# Função para ler o resumo impresso pelo programa speculative do llama.cpp
+def parse_speculative_stats(text):
+    """Extrai os tokens propostos pelo modelo de rascunho e os aceitos
+
+    Args:
+        text (str): Saída de erro do programa speculative
+
+    Returns:
+        tuple: (propostos, aceitos), ou None se o resumo não foi impresso
+    """
+    drafted = re.search(r'n_drafted\s*=\s*(\d+)', text)
+    accepted = re.search(r'n_accept\s*=\s*(\d+)', text)
+    if not drafted or not accepted:
+        return None
+    return int(drafted.group(1)), int(accepted.group(1))
+
+
+class SpeculativeDecoding:
+    """Decodificação especulativa com um modelo de rascunho (DRAFT_MODEL_PATH)
+
+    O modelo de rascunho, pequeno e com o mesmo vocabulário do modelo
+    principal, propõe SPECULATIVE_DRAFT_TOKENS tokens por passo, que o modelo
+    principal verifica de uma só vez. Só vale a pena quando boa parte dos
+    tokens propostos é aceita: se a taxa de aceitação das últimas
+    SPECULATIVE_WINDOW gerações ficar abaixo de SPECULATIVE_MIN_ACCEPTANCE, a
+    especulação é suspensa por SPECULATIVE_RETRY_SECONDS segundos.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def init_app(self, app):
+        self.config = app.config
+
+    def reset(self):
+        """Zera as contagens e reativa a especulação"""
+        with self._lock:
+            self._window = deque()
+            self._disabled_until = 0.0
+            self._counts = {'generations': 0, 'drafted': 0, 'accepted': 0, 'suspended': 0}
+
+    def applies(self, model_path):
+        """Indica se as gerações do modelo usam a especulação
+
+        Apenas o modelo principal (MODEL_PATH) tem modelo de rascunho.
+        """
+        if not self.config.get('DRAFT_MODEL_PATH') or int(self.config.get('SPECULATIVE_DRAFT_TOKENS', 0)) <= 0:
+            return False
+        return model_path is None or model_path == self.config.get('MODEL_PATH')
+
+    def draft_tokens(self, model_path):
+        """Tokens propostos por passo para uma geração (0 = sem especulação)"""
+        if not self.applies(model_path):
+            return 0
+        with self._lock:
+            if time.monotonic() < self._disabled_until:
+                return 0
+        return int(self.config.get('SPECULATIVE_DRAFT_TOKENS'))
+
+    def record(self, drafted, accepted):
+        """Registra o resultado de uma geração e suspende a especulação se a aceitação for baixa"""
+        if drafted <= 0:
+            return
+        window_size = int(self.config.get('SPECULATIVE_WINDOW', 20))
+        min_acceptance = float(self.config.get('SPECULATIVE_MIN_ACCEPTANCE', 0.5))
+        with self._lock:
+            self._counts['generations'] += 1
+            self._counts['drafted'] += drafted
+            self._counts['accepted'] += accepted
+            self._window.append((drafted, accepted))
+            while len(self._window) > window_size:
+                self._window.popleft()
+            if len(self._window) < window_size:
+                return
+            rate = sum(a for _, a in self._window) / sum(d for d, _ in self._window)
+            if rate >= min_acceptance:
+                return
+            self._window.clear()
+            self._counts['suspended'] += 1
+            self._disabled_until = time.monotonic() + float(self.config.get('SPECULATIVE_RETRY_SECONDS', 600))
+        logger.warning("Decodificação especulativa suspensa: taxa de aceitação %.0f%% abaixo de %.0f%%",
+                       rate * 100, min_acceptance * 100)
+
+    def metrics(self):
+        with self._lock:
+            counts = dict(self._counts)
+            window = list(self._window)
+            suspended_for = max(self._disabled_until - time.monotonic(), 0.0)
+        counts['enabled'] = self.applies(None)
+        counts['suspended_for_seconds'] = round(suspended_for)
+        counts['acceptance_rate'] = (
+            round(counts['accepted'] / counts['drafted'], 3) if counts['drafted'] else None
+        )
+        drafted = sum(d for d, _ in window)
+        counts['recent_acceptance_rate'] = round(sum(a for _, a in window) / drafted, 3) if drafted else None
+        return counts
+
+
+# Decodificação especulativa, configurada pela aplicação
+speculative = SpeculativeDecoding()
+
+
+class LlamaRunner:
+    """Executa o binário do llama.cpp para um prompt"""
+
+    def __init__(self, config=None):
+        self.config = {}
+        # None = marcadores do formato de conversa de cada modelo
+        self.stop_sequences = None
+        if config is not None:
+            self.init_app(config)
+
+    def init_app(self, app):
+        self.config = app.config
+        chat_templates.init_app(app)
+        registry.init_state_dir(os.path.join(app.instance_path, 'generations'))
+        kv_cache.init_app(app)
+        speculative.init_app(app)
+        resources.init_app(app)
+
+    def build_command(self, prompt_path, budget=None, model_path=None, prompt_cache=None, draft_tokens=0,
+                      placement=None):
+        llama_path = self.config.get('LLAMA_PATH')
+        temperature = self.config.get('TEMPERATURE')
+        context_size = str(budget.context_size) if budget else self.config.get('CONTEXT_SIZE')
+        n_predict = str(budget.n_predict) if budget else "1024"
+        # Com modelo de rascunho, o programa speculative do llama.cpp
+        binary = 'speculative' if draft_tokens else 'main'
+        cmd = [
+            f"{llama_path}/{binary}",
+            "-m", model_path or self.config.get('MODEL_PATH'),
+            "-c", context_size,
+            *resources.command_args(placement or resources.placement()),
+            *chat_templates.command_args(model_path),
+            "-n", n_predict,
+            "--temp", temperature,
+            "--repeat_penalty", "1.1",
+            "-f", prompt_path
+        ]
+        if not draft_tokens:
+            # Só a resposta na saída padrão (o speculative já escreve o
+            # prompt na saída de erro)
+            cmd.append("--no-display-prompt")
+        if prompt_cache:
+            # Salvar também os tokens gerados: a próxima pergunta da conversa
+            # começa com este prompt seguido desta resposta
+            cmd += ["--prompt-cache", prompt_cache, "--prompt-cache-all"]
+        if draft_tokens:
+            cmd += ["-md", self.config.get('DRAFT_MODEL_PATH'), "--draft", str(draft_tokens)]
+        return cmd
+
+    def stop_sequences_for(self, model_path):
+        if self.stop_sequences is not None:
+            return self.stop_sequences
+        return chat_templates.for_model(model_path).stop_sequences
+
+    def stream(self, prompt, request_id=None, user_id=None, timeout=None, budget=None,
+               model_path=None, endpoints=None, cache_key=None, conversation_id=None):
+        """Executa o modelo e produz a resposta em partes
+
+        A geração termina ao atingir o limite de tokens, ao encontrar um
+        marcador de fim de turno ou ao ser cancelada. Um prompt montado por
+        chat_templates é refeito no formato de conversa de model_path. Se houver endpoints
+        configurados, a geração é feita em um servidor remoto do pool;
+        caso contrário, o binário do llama.cpp é executado localmente.
+
+        Args:
+            prompt (str): Prompt completo
+            request_id (str, optional): Identificador usado para cancelamento
+            user_id (int, optional): Usuário dono da geração
+            timeout (float, optional): Tempo limite em segundos
+            budget (TokenBudget, optional): Limites de tokens e de contexto
+            model_path (str, optional): Arquivo GGUF a usar (padrão: MODEL_PATH)
+            endpoints (list, optional): URLs dos servidores de inferência do modelo
+            cache_key (str, optional): Chave de afinidade entre requisições com o
+                mesmo início de prompt, para reaproveitar o cache do servidor
+            conversation_id (int, optional): Conversa da pergunta; o estado KV do
+                histórico é reaproveitado (arquivo de estado local ou o mesmo
+                servidor remoto, que mantém o prompt anterior em cache)
+
+        Yields:
+            str: Trechos da resposta
+
+        Raises:
+            GenerationCancelled: se a geração for cancelada ou exceder o tempo limite
+            GenerationFailed: se o llama.cpp terminar com erro
+            GenerationConflict: se já houver uma geração com request_id
+            ValueError: se request_id não for um identificador válido
+        """
+        # Validado antes de iniciar o modelo (ver GenerationRegistry.register)
+        if request_id is not None:
+            if not REQUEST_ID_PATTERN.fullmatch(request_id):
+                raise ValueError(f"Identificador de geração inválido: {request_id!r}")
+            if registry.running(request_id):
+                raise GenerationConflict(f"Geração {request_id} já está em andamento")
+        if timeout is None:
+            timeout = float(self.config.get('GENERATION_TIMEOUT', 120))
+        prompt = chat_templates.adapt(prompt, model_path)
+        if endpoints:
+            if conversation_id is not None:
+                cache_key = f"conversation:{conversation_id}"
+            return self._stream_remote(prompt, request_id, user_id, timeout, budget, endpoints, cache_key, model_path)
+        return self._stream_local(prompt, request_id, user_id, timeout, budget, model_path, conversation_id)
+
+    def _stream_local(self, prompt, request_id, user_id, timeout, budget, model_path, conversation_id=None):
+        draft_tokens = speculative.draft_tokens(model_path or self.config.get('MODEL_PATH'))
+        with resources.acquire() as placement:
+            if draft_tokens:
+                # O programa speculative não usa o estado KV salvo (--prompt-cache)
+                yield from self._run_local(prompt, request_id, user_id, timeout, budget, model_path, None,
+                                           draft_tokens, placement)
+                return
+            with kv_cache.acquire(conversation_id, model_path or self.config.get('MODEL_PATH')) as prompt_cache:
+                yield from self._run_local(prompt, request_id, user_id, timeout, budget, model_path, prompt_cache,
+                                           placement=placement)
+
+    def _run_local(self, prompt, request_id, user_id, timeout, budget, model_path, prompt_cache, draft_tokens=0,
+                   placement=None):
+        with tempfile.NamedTemporaryFile(mode='w+', delete=False) as temp_file:
+            temp_file.write(prompt)
+            prompt_path = temp_file.name
+
+        placement = placement or resources.placement()
+        cmd = self.build_command(prompt_path, budget, model_path, prompt_cache, draft_tokens, placement)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Executando comando: %s", ' '.join(cmd))
+        # Saída de erro: mensagem de uma falha e o resumo da especulação
+        # (tokens propostos e aceitos)
+        stderr_file = tempfile.TemporaryFile()
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+        except OSError:
+            stderr_file.close()
+            os.unlink(prompt_path)
+            raise
+        resources.pin(process.pid, placement)
+        try:
+            generation = registry.register(request_id or str(process.pid), user_id, process, timeout)
+        except GenerationConflict:
+            # Outra geração registrou o mesmo identificador depois da verificação em stream
+            terminate_process(process)
+            process.stdout.close()
+            stderr_file.close()
+            os.unlink(prompt_path)
+            raise
+
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        selector = selectors.DefaultSelector()
+        selector.register(process.stdout, selectors.EVENT_READ)
+        scanner = StopScanner(self.stop_sequences_for(model_path))
+        finished = False
+        try:
+            while not scanner.stopped:
+                if generation.cancel_event.is_set():
+                    break
+                if time.monotonic() >= generation.deadline:
+                    generation.reason = 'timeout'
+                    break
+                if not selector.select(POLL_INTERVAL):
+                    continue
+                data = os.read(process.stdout.fileno(), 4096)
+                if not data:
+                    break
+                text = scanner.feed(decoder.decode(data))
+                if text:
+                    yield text
+
+            if scanner.stopped:
+                # Fim de turno encontrado: o restante da saída é descartado
+                terminate_process(process)
+            reason = registry.cancel_reason(generation)
+            if reason is None and (scanner.stopped or process.wait() == 0):
+                finished = True
+                tail = scanner.flush()
+                if tail:
+                    yield tail
+                registry.record_completed()
+                return
+            if reason is None:
+                # Terminou com erro sem ter sido cancelado: a resposta (vazia ou
+                # parcial) é descartada
+                registry.record_failed()
+                message = self._stderr_tail(stderr_file)
+                logger.error("llama.cpp terminou com código %s na geração %s: %s", process.returncode,
+                             generation.request_id, message,
+                             extra={'generation_id': generation.request_id, 'returncode': process.returncode})
+                raise GenerationFailed(f"O modelo terminou com erro (código {process.returncode})")
+            cpu_seconds = process_cpu_seconds(process.pid)
+            terminate_process(process)
+            registry.record_cancelled(generation, reason, cpu_seconds)
+            logger.info("Geração %s cancelada (%s)", generation.request_id, reason,
+                        extra={'generation_id': generation.request_id, 'reason': reason})
+            if reason == 'timeout':
+                raise GenerationTimeout()
+            raise GenerationCancelled(reason)
+        finally:
+            if not finished and process.poll() is None:
+                # O consumidor abandonou o gerador (cliente desconectado)
+                cpu_seconds = process_cpu_seconds(process.pid)
+                terminate_process(process)
+                registry.record_cancelled(generation, 'disconnect', cpu_seconds)
+                logger.info("Geração %s cancelada (disconnect)", generation.request_id,
+                            extra={'generation_id': generation.request_id, 'reason': 'disconnect'})
+            selector.close()
+            process.stdout.close()
+            registry.unregister(generation)
+            os.unlink(prompt_path)
+            if draft_tokens and finished:
+                stderr_file.seek(0)
+                stats = parse_speculative_stats(stderr_file.read().decode('utf-8', errors='replace'))
+                if stats:
+                    speculative.record(*stats)
+            stderr_file.close()
+
+    @staticmethod
+    def _stderr_tail(stderr_file):
+        """Retorna as últimas linhas da saída de erro do llama.cpp"""
+        size = stderr_file.seek(0, os.SEEK_END)
+        stderr_file.seek(max(size - STDERR_TAIL_BYTES, 0))
+        return stderr_file.read().decode('utf-8', errors='replace').strip()
+
+    def _stream_remote(self, prompt, request_id, user_id, timeout, budget, endpoints, cache_key, model_path=None):
+        payload = {
+            'prompt': prompt,
+            'n_predict': budget.n_predict if budget else 1024,
+            'temperature': float(self.config.get('TEMPERATURE')),
+            'repeat_penalty': 1.1,
+            'stop': list(self.stop_sequences_for(model_path)),
+            'cache_prompt': True,
+            'stream': True
+        }
+        if speculative.applies(model_path):
+            # Servidor iniciado com o modelo de rascunho (-md); 0 desativa a especulação
+            payload['speculative.n_max'] = speculative.draft_tokens(model_path)
+        pool = get_pool(endpoints)
+        node, completion, response = pool.open_completion(payload, cache_key, timeout)
+        try:
+            generation = registry.register(request_id or str(uuid.uuid4()), user_id, completion, timeout)
+        except GenerationConflict:
+            completion.terminate()
+            completion.connection.close()
+            pool.release(node, success=True, probe=completion.probe)
+            raise
+
+        scanner = StopScanner(self.stop_sequences_for(model_path))
+        finished = False
+        failed = False
+        next_marker_check = time.monotonic() + POLL_INTERVAL
+        try:
+            try:
+                for event in iter_events(response):
+                    text = scanner.feed(event.get('content', ''))
+                    if text:
+                        yield text
+                    if event.get('stop') and payload.get('speculative.n_max'):
+                        timings = event.get('timings') or {}
+                        speculative.record(timings.get('draft_n', 0), timings.get('draft_n_accepted', 0))
+                    if event.get('stop') or scanner.stopped or generation.cancel_event.is_set():
+                        break
+                    now = time.monotonic()
+                    if now >= generation.deadline:
+                        generation.reason = 'timeout'
+                        break
+                    if now >= next_marker_check:
+                        # Cancelamento recebido por outro worker
+                        if registry.cancel_reason(generation):
+                            break
+                        next_marker_check = now + POLL_INTERVAL
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                if not generation.cancel_event.is_set():
+                    if time.monotonic() < generation.deadline:
+                        failed = True
+                        raise BackendUnavailable(f"Falha no servidor de inferência {node.url}: {str(e)}")
+                    generation.reason = 'timeout'
+
+            reason = registry.cancel_reason(generation)
+            if reason is None:
+                finished = True
+                tail = scanner.flush()
+                if tail:
+                    yield tail
+                registry.record_completed()
+                return
+            terminate_process(completion)
+            registry.record_cancelled(generation, reason, 0.0)
+            logger.info("Geração %s cancelada (%s)", generation.request_id, reason,
+                        extra={'generation_id': generation.request_id, 'reason': reason})
+            if reason == 'timeout':
+                raise GenerationTimeout()
+            raise GenerationCancelled(reason)
+        finally:
+            if not finished and not failed and completion.poll() is None:
+                terminate_process(completion)
+                registry.record_cancelled(generation, 'disconnect', 0.0)
+                logger.info("Geração %s cancelada (disconnect)", generation.request_id,
+                            extra={'generation_id': generation.request_id, 'reason': 'disconnect'})
+            completion.connection.close()
+            pool.release(node, success=not failed, probe=completion.probe)
+            registry.unregister(generation)
+
+    def generate(self, prompt, request_id=None, user_id=None, timeout=None, budget=None,
+                 model_path=None, endpoints=None, cache_key=None, conversation_id=None):
+        """Executa o modelo e retorna a resposta completa"""
+        return ''.join(self.stream(
+            prompt, request_id=request_id, user_id=user_id, timeout=timeout, budget=budget,
+            model_path=model_path, endpoints=endpoints, cache_key=cache_key,
+            conversation_id=conversation_id
+        )).strip()
+
+
+# Executor global configurado pela aplicação
+llama = LlamaRunner()
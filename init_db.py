@@ -4,11 +4,13 @@
 import os
 import sys
 from flask_migrate import Migrate, init, migrate, upgrade
-from app import app, db
-from models import User, QueryHistory, Setting
+from app import create_app
+from models import db, bootstrap_db
 
 def init_db():
     """Inicializa o banco de dados e cria as tabelas necessárias"""
+    app = create_app()
+    Migrate(app, db)
     with app.app_context():
         # Inicializar o sistema de migrações se não existir
         if not os.path.exists(os.path.join('migrations', 'versions')):
@@ -25,21 +27,8 @@ def init_db():
         print("Aplicando migrações...")
         upgrade(directory='migrations')
         
-        # Verificar se existe um usuário admin, se não, criar um
-        admin = User.query.filter_by(username='admin').first()
-        if not admin:
-            print("Criando usuário admin padrão...")
-            admin = User(username='admin', role='admin')
-            admin.set_password('admin123')
-            db.session.add(admin)
-            
-            # Adicionar também um usuário comum
-            user = User(username='user', role='user')
-            user.set_password('user123')
-            db.session.add(user)
-            
-            db.session.commit()
-            print("Usuários padrão criados: admin e user")
+        # Criar os usuários padrão, se ainda não existirem
+        bootstrap_db()
         
         print("Banco de dados inicializado com sucesso!")
 
@@ -31,7 +31,7 @@ def get_integration(integration_name):
     
     # Verificar se a integração está disponível
     if integration_name not in AVAILABLE_INTEGRATIONS:
-        logger.warning(f"Integração '{integration_name}' não está disponível")
+        logger.warning("Integração '%s' não está disponível", integration_name)
         return None
     
     try:
@@ -51,13 +51,13 @@ def get_integration(integration_name):
         
         return instance
     except ImportError as e:
-        logger.error(f"Erro ao importar integração '{integration_name}': {str(e)}")
+        logger.error("Erro ao importar integração '%s': %s", integration_name, e)
         return None
     except AttributeError as e:
-        logger.error(f"Função de fábrica não encontrada para integração '{integration_name}': {str(e)}")
+        logger.error("Função de fábrica não encontrada para integração '%s': %s", integration_name, e)
         return None
     except Exception as e:
-        logger.error(f"Erro ao inicializar integração '{integration_name}': {str(e)}")
+        logger.error("Erro ao inicializar integração '%s': %s", integration_name, e)
         return None
 
 def is_integration_enabled(integration_name):
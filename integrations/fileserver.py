@@ -54,13 +54,13 @@ class FileServerIntegration:
             connected = self.conn.connect(self.host, 139)  # Porta padrão SMB
             
             if connected:
-                logger.info(f"Conexão estabelecida com o File Server {self.host}")
+                logger.info("Conexão estabelecida com o File Server %s", self.host)
                 return True
             else:
-                logger.error(f"Falha ao conectar ao File Server {self.host}")
+                logger.error("Falha ao conectar ao File Server %s", self.host)
                 return False
         except Exception as e:
-            logger.error(f"Erro ao conectar ao File Server: {str(e)}")
+            logger.error("Erro ao conectar ao File Server: %s", e)
             self.conn = None
             return False
     
@@ -117,7 +117,7 @@ class FileServerIntegration:
             
             return results
         except Exception as e:
-            logger.error(f"Erro ao listar arquivos no File Server: {str(e)}")
+            logger.error("Erro ao listar arquivos no File Server: %s", e)
             return []
     
     def read_file(self, file_path):
@@ -154,7 +154,7 @@ class FileServerIntegration:
             
             return content
         except Exception as e:
-            logger.error(f"Erro ao ler arquivo do File Server: {str(e)}")
+            logger.error("Erro ao ler arquivo do File Server: %s", e)
             return ""
     
     def search_files(self, search_path="/", keyword="", max_depth=3):
@@ -209,7 +209,7 @@ class FileServerIntegration:
                     if item.isDirectory:
                         search_directory(item_path, current_depth + 1)
             except Exception as e:
-                logger.error(f"Erro ao pesquisar em {path}: {str(e)}")
+                logger.error("Erro ao pesquisar em %s: %s", path, e)
         
         # Iniciar pesquisa recursiva
         search_directory(search_path)
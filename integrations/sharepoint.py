@@ -41,26 +41,29 @@ class SharePointIntegration:
             logger.info("Conexão com SharePoint estabelecida com sucesso")
             return self.ctx
         except Exception as e:
-            logger.error(f"Erro ao inicializar contexto do SharePoint: {str(e)}")
+            logger.error("Erro ao inicializar contexto do SharePoint: %s", e)
             self.is_configured = False
             return None
     
-    def search_documents(self, query, max_results=10):
+    def search_documents(self, query, max_results=10, raise_errors=False):
         """Pesquisa documentos no SharePoint
         
         Args:
             query (str): Termo de pesquisa
             max_results (int): Número máximo de resultados
+            raise_errors (bool): Repassa as falhas da pesquisa, em vez de
+                retornar uma lista vazia
             
         Returns:
-            list: Lista de documentos encontrados
+            list: Lista de documentos encontrados, na ordem de relevância do SharePoint
         """
         if not self.is_configured:
             logger.warning("Integração com SharePoint não configurada")
             return []
         
         try:
-            search_results = self.ctx.search.query(query_text=query).execute_query()
+            # Limita os resultados no servidor, em vez de receber a primeira página inteira
+            search_results = self.ctx.search.query(query_text=query, row_limit=max_results).execute_query()
             
             results = []
             for result in search_results.value[:max_results]:
@@ -74,7 +77,9 @@ class SharePointIntegration:
             
             return results
         except Exception as e:
-            logger.error(f"Erro ao pesquisar documentos no SharePoint: {str(e)}")
+            if raise_errors:
+                raise
+            logger.error("Erro ao pesquisar documentos no SharePoint: %s", e)
             return []
     
     def get_document_content(self, file_url):
@@ -100,7 +105,7 @@ class SharePointIntegration:
             # Retornar o conteúdo como texto
             return response.content.decode('utf-8')
         except Exception as e:
-            logger.error(f"Erro ao obter conteúdo do documento: {str(e)}")
+            logger.error("Erro ao obter conteúdo do documento: %s", e)
             return ""
     
     def get_recent_documents(self, library_name, max_results=10):
@@ -137,7 +142,7 @@ class SharePointIntegration:
             
             return results
         except Exception as e:
-            logger.error(f"Erro ao obter documentos recentes: {str(e)}")
+            logger.error("Erro ao obter documentos recentes: %s", e)
             return []
 
 # Exemplo de uso
@@ -0,0 +1,230 @@
+# logging_config.py
+# Logs da aplicação: um registro JSON por linha (com o identificador, o
+# usuário e a rota da requisição) gravado por uma thread separada, para que
+# as requisições não esperem pela escrita no terminal ou no disco
+#
+# Os registros vão para uma fila em memória (QueueHandler) e uma thread por
+# processo (QueueListener) os formata e grava no terminal e em LOG_FILE. A
+# mensagem só é montada nessa thread: nos trechos executados a cada
+# requisição, use logger.info("... %s", valor) em vez de f-strings. Com a
+# fila cheia (LOG_QUEUE_SIZE), os registros novos são descartados e contados,
+# em vez de bloquear a requisição. Os registros DEBUG de cada linha do código
+# são amostrados (LOG_DEBUG_SAMPLE: 1 de cada N).
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+
+from flask import g, request, session, has_request_context
+
+# Formato das linhas com LOG_FORMAT=text
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+# Campos da requisição copiados para cada registro
+CONTEXT_FIELDS = ('request_id', 'user', 'method', 'path')
+
+# Atributos padrão dos registros; os demais (extra=) são incluídos no JSON
+RESERVED_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class RequestContextFilter(logging.Filter):
+    """Copia o contexto da requisição (identificador, usuário e rota) para o registro
+
+    Executado na thread da requisição, antes de o registro ir para a fila.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id', '-')
+            record.user = session.get('username')
+            record.method = request.method
+            record.path = request.path
+        else:
+            record.request_id = '-'
+            record.user = record.method = record.path = None
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Mantém 1 de cada `every` registros DEBUG de cada linha do código"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self.discarded = 0
+        self._counts = Counter()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        key = (record.pathname, record.lineno)
+        count = self._counts[key]
+        self._counts[key] = count + 1
+        if count % self.every:
+            self.discarded += 1
+            return False
+        record.sample_rate = self.every
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Um objeto JSON por registro: ts, level, logger, msg, contexto da
+    requisição, campos passados em extra= e exc (traceback)"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_FIELDS and value not in (None, '-'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Aguarda espaço na fila cheia: os registros pendentes são gravados antes do fim
+        self.queue.put(self._sentinel)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Envia os registros para a fila gravada pela thread de cada processo
+
+    A thread é criada no primeiro registro de cada processo: depois do fork,
+    os workers do Gunicorn criam a sua (com uma fila nova).
+    """
+
+    def __init__(self, outputs, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.outputs = outputs
+        self.listener = None
+        self.dropped = 0
+        self._pid = None
+
+    def _start(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.listener = _Listener(self.queue, *self.outputs, respect_handler_level=True)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def prepare(self, record):
+        # A mensagem é montada pela thread de gravação, e não na requisição
+        return record
+
+    def enqueue(self, record):
+        # Executado com a trava do handler (refeita pelo logging após o fork)
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Grava os registros pendentes e encerra a thread"""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+        self._pid = None
+
+    def metrics(self):
+        return {'queued': self.queue.qsize(), 'dropped': self.dropped}
+
+
+# Handler instalado no logger raiz (substituído a cada configuração)
+_handler = None
+_lock = threading.Lock()
+
+
+# Função para criar o arquivo de log
+def file_handler(config):
+    """WatchedFileHandler (reaberto quando o logrotate move o arquivo, seguro
+    com vários workers) ou, com LOG_MAX_BYTES, RotatingFileHandler (apenas
+    para um único processo)
+
+    Returns:
+        logging.Handler: Handler do arquivo, ou None se não puder ser aberto
+    """
+    path = config.get('LOG_FILE')
+    if not path:
+        return None
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        max_bytes = int(config.get('LOG_MAX_BYTES', 0))
+        if max_bytes:
+            return RotatingFileHandler(path, maxBytes=max_bytes, backupCount=int(config.get('LOG_BACKUP_COUNT', 5)),
+                                       encoding='utf-8')
+        return WatchedFileHandler(path, encoding='utf-8')
+    except OSError as e:
+        sys.stderr.write(f"Não foi possível abrir o arquivo de log {path}: {str(e)}\n")
+        return None
+
+
+# Função para configurar os logs do processo
+def configure_logging(config):
+    """Instala a fila de logs no logger raiz, substituindo a configuração anterior
+
+    Args:
+        config (dict): Configuração da aplicação (LOG_LEVEL, LOG_FORMAT,
+            LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE,
+            LOG_DEBUG_SAMPLE)
+
+    Returns:
+        AsyncQueueHandler: Handler instalado
+    """
+    global _handler
+    formatter = JSONFormatter() if config.get('LOG_FORMAT', 'json') == 'json' else logging.Formatter(TEXT_FORMAT)
+    outputs = [logging.StreamHandler(sys.stdout)]
+    output = file_handler(config)
+    if output is not None:
+        outputs.append(output)
+    for output in outputs:
+        output.setFormatter(formatter)
+
+    handler = AsyncQueueHandler(outputs, int(config.get('LOG_QUEUE_SIZE', 10000)))
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(DebugSampler(config.get('LOG_DEBUG_SAMPLE', 1)))
+
+    root = logging.getLogger()
+    with _lock:
+        previous, _handler = _handler, handler
+        if previous is not None:
+            root.removeHandler(previous)
+            previous.stop()
+            for output in previous.outputs:
+                output.close()
+        root.addHandler(handler)
+    root.setLevel(str(config.get('LOG_LEVEL', 'INFO')).upper())
+    return handler
+
+
+# Função para obter as métricas da fila de logs
+def logging_metrics():
+    handler = _handler
+    if handler is None:
+        return {}
+    metrics = handler.metrics()
+    for log_filter in handler.filters:
+        if isinstance(log_filter, DebugSampler):
+            metrics['debug_discarded'] = log_filter.discarded
+    return metrics
+
+
+@atexit.register
+def _flush_logs():
+    if _handler is not None:
+        _handler.stop()
@@ -1,9 +1,54 @@
 # models.py
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict, namedtuple
 from datetime import datetime
+import logging
+import sqlite3
+import threading
+import time
 
 db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+# Espera máxima (ms) por uma gravação de outro processo no SQLite
+SQLITE_BUSY_TIMEOUT_MS = 30000
+
+# Configuração das conexões SQLite
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    """Modo WAL (leituras não bloqueiam gravações) e espera por travas
+    
+    Com vários atendimentos por worker (ver gunicorn.conf.py), muitas
+    gravações simultâneas (logins, histórico) disputam o mesmo arquivo.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+# Esquema de hash de senha padrão do Werkzeug (ver PASSWORD_HASH_METHOD)
+DEFAULT_PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Parâmetros completos dos esquemas do Werkzeug quando informados de forma abreviada
+PASSWORD_HASH_DEFAULTS = {
+    'scrypt': 'scrypt:32768:8:1',
+    'pbkdf2': 'pbkdf2:sha256:600000',
+    'pbkdf2:sha256': 'pbkdf2:sha256:600000'
+}
+
+# Função para obter o esquema de hash de senha configurado
+def password_hash_method():
+    """Retorna o esquema configurado, com todos os parâmetros (ex.: scrypt:32768:8:1)"""
+    method = DEFAULT_PASSWORD_HASH_METHOD
+    if has_app_context():
+        method = current_app.config.get('PASSWORD_HASH_METHOD') or method
+    return PASSWORD_HASH_DEFAULTS.get(method, method)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -22,10 +67,69 @@ class User(db.Model):
     queries = db.relationship('QueryHistory', backref='user', lazy='dynamic')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=password_hash_method())
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
+    
+    def needs_rehash(self):
+        """Indica se a senha foi gravada com um esquema diferente do configurado"""
+        return self.password_hash.split('$', 1)[0] != password_hash_method()
+
+# Dados do usuário verificados a cada requisição autenticada
+CachedUser = namedtuple('CachedUser', 'id username role department active')
+
+class UserCache:
+    """Cache em memória, por worker, dos usuários consultados pelos decoradores
+    de autenticação (ver utils.login_required), com prazo de validade curto
+    para que usuários desativados ou rebaixados percam o acesso rapidamente"""
+    
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0}
+    
+    def get(self, user_id, ttl):
+        """Retorna o usuário (CachedUser) ou None se não existir
+        
+        Deve ser executada dentro de um contexto de aplicação.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[0] < ttl:
+                self._entries.move_to_end(user_id)
+                self._counts['hits'] += 1
+                return entry[1]
+            self._counts['misses'] += 1
+        user = db.session.get(User, user_id)
+        cached = None
+        if user is not None:
+            cached = CachedUser(user.id, user.username, user.role, user.department, bool(user.active))
+        self.put(user_id, cached, now)
+        return cached
+    
+    def put(self, user_id, cached, now=None):
+        with self._lock:
+            self._entries[user_id] = (now or time.monotonic(), cached)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+    
+    def metrics(self):
+        with self._lock:
+            return dict(self._counts, size=len(self._entries))
+
+# Cache de usuários deste worker
+user_cache = UserCache()
 
 class QueryHistory(db.Model):
     __tablename__ = 'query_history'
@@ -34,7 +138,169 @@ class QueryHistory(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     question = db.Column(db.Text, nullable=False)
     response = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    category = db.Column(db.String(20))
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), index=True)
+
+class ArchivedQuery(db.Model):
+    """Índice das perguntas arquivadas (ver archive.py): a resposta completa
+    fica no arquivo compactado da partição"""
+    __tablename__ = 'history_archive'
+    
+    # Mesmo identificador da linha original em query_history
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    question = db.Column(db.Text, nullable=False)
+    response_preview = db.Column(db.String(200))
+    timestamp = db.Column(db.DateTime, index=True)
+    category = db.Column(db.String(20))
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+    conversation_id = db.Column(db.Integer)
+    # Arquivo da partição (mês da pergunta), relativo a ARCHIVE_DIR
+    partition = db.Column(db.String(64), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    title = db.Column(db.String(200), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Resumo das perguntas antigas, até a pergunta summarized_until (id em query_history)
+    summary = db.Column(db.Text)
+    summarized_until = db.Column(db.Integer)
+    
+    queries = db.relationship('QueryHistory', backref='conversation', lazy='dynamic',
+                              order_by='QueryHistory.id')
+    
+    def pending_queries(self):
+        """Perguntas da conversa ainda não incluídas no resumo"""
+        if self.summarized_until:
+            return self.queries.filter(QueryHistory.id > self.summarized_until).all()
+        return self.queries.all()
+    
+    def turns(self):
+        """Pares (pergunta, resposta) não resumidos, do mais antigo ao mais recente"""
+        return [(query.question, query.response) for query in self.pending_queries()]
+
+class BatchJob(db.Model):
+    __tablename__ = 'batch_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    name = db.Column(db.String(200), nullable=False)
+    # queued, running, completed, cancelled
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    items = db.relationship('BatchItem', backref='job', lazy='dynamic',
+                            order_by='BatchItem.position', cascade='all, delete-orphan')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'total': self.total,
+            'completed': self.completed,
+            'failed': self.failed,
+            'progress': round((self.completed + self.failed) / self.total, 3) if self.total else 1.0,
+            'created_at': self.created_at.strftime("%Y-%m-%d %H:%M:%S") if self.created_at else None,
+            'finished_at': self.finished_at.strftime("%Y-%m-%d %H:%M:%S") if self.finished_at else None
+        }
+
+class BatchItem(db.Model):
+    __tablename__ = 'batch_items'
+    __table_args__ = (db.Index('ix_batch_items_status_job', 'status', 'job_id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('batch_jobs.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    question = db.Column(db.Text, nullable=False)
+    category = db.Column(db.String(20))
+    # pending, running, done, failed
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    response = db.Column(db.Text)
+    error = db.Column(db.Text)
+    claimed_by = db.Column(db.String(64))
+    claimed_at = db.Column(db.DateTime)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+
+class UsageRollup(db.Model):
+    """Totais de uso pré-agregados por hora ou dia (ver rollups.py)
+    
+    Cada pergunta é somada em uma linha por dimensão: 'all' (total), 'user'
+    (nome do usuário), 'department' e 'category'.
+    """
+    __tablename__ = 'usage_rollups'
+    __table_args__ = (db.UniqueConstraint('period', 'bucket', 'dimension', 'key', name='uq_usage_rollups'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # hour ou day
+    period = db.Column(db.String(4), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    dimension = db.Column(db.String(16), nullable=False)
+    key = db.Column(db.String(120), nullable=False, default='')
+    queries = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    latency_count = db.Column(db.Integer, nullable=False, default=0)
+    latency_total_ms = db.Column(db.BigInteger, nullable=False, default=0)
+    # Contagens por faixa de latência (rollups.LATENCY_BUCKETS), em JSON
+    latency_histogram = db.Column(db.Text, nullable=False, default='[]')
+
+class RollupState(db.Model):
+    """Última pergunta de query_history já somada aos totais de uso"""
+    __tablename__ = 'rollup_state'
+    
+    name = db.Column(db.String(32), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    last_timestamp = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class FAQEntry(db.Model):
+    """Resposta revisada para uma pergunta frequente (ver faq.py)"""
+    __tablename__ = 'faq_entries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    question = db.Column(db.Text, nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    # Outras formas de fazer a mesma pergunta, uma por linha
+    variations = db.Column(db.Text)
+    category = db.Column(db.String(20))
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    # Pergunta do histórico que deu origem à entrada (sem chave estrangeira:
+    # a pergunta pode ser arquivada)
+    source_query_id = db.Column(db.Integer)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'variations': self.variations or '',
+            'category': self.category,
+            'active': self.active,
+            'source_query_id': self.source_query_id,
+            'updated_at': self.updated_at.strftime("%Y-%m-%d %H:%M:%S") if self.updated_at else None
+        }
 
 class Setting(db.Model):
     __tablename__ = 'settings'
@@ -43,4 +309,28 @@ class Setting(db.Model):
     key = db.Column(db.String(64), unique=True, nullable=False)
     value = db.Column(db.Text, nullable=False)
     description = db.Column(db.Text)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Função para criar as tabelas e os usuários padrão
+def bootstrap_db():
+    """Cria as tabelas que não existirem e os usuários padrão (admin e user)
+    
+    Deve ser executada uma vez por implantação, dentro de um contexto de
+    aplicação, e não a cada importação da aplicação.
+    """
+    db.create_all()
+    
+    # Verificar se existe um usuário admin, se não, criar um
+    admin = User.query.filter_by(username='admin').first()
+    if not admin:
+        admin = User(username='admin', role='admin')
+        admin.set_password('admin123')
+        db.session.add(admin)
+        
+        # Adicionar também um usuário comum
+        user = User(username='user', role='user')
+        user.set_password('user123')
+        db.session.add(user)
+        
+        db.session.commit()
+        logger.info("Usuários padrão criados: admin e user")
@@ -0,0 +1,425 @@
+# profiling.py
+# Diagnóstico de lentidão em produção (/admin/profiling, apenas
+# administradores)
+#
+# - Identificador de cada requisição (cabeçalho X-Request-ID, recebido do
+#   proxy ou gerado aqui), incluído nos logs (logging_config.py) e devolvido
+#   na resposta.
+# - Perfil de uma requisição (cProfile ou, se instalado, pyinstrument): um
+#   administrador pede o perfil das suas requisições com o cabeçalho
+#   "X-Profile: 1" ou arma a captura das próximas N requisições de alguns
+#   caminhos (ex.: /ask) feitas por qualquer usuário. O perfil fica em
+#   PROFILING_DIR com o identificador da requisição.
+# - Amostragem contínua: uma thread lê a pilha das threads que estão
+#   atendendo requisições a cada PROFILING_SAMPLE_INTERVAL segundos e conta
+#   as pilhas, exportadas no formato "folded" (flamegraph.pl, speedscope).
+#
+# As opções ficam no estado compartilhado e valem em todos os workers sem
+# reiniciar o serviço (verificadas a cada SETTINGS_CHECK_INTERVAL segundos).
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request, session
+
+from state_store import shared_state
+from utils import current_user
+
+logger = logging.getLogger(__name__)
+
+# Opções de perfil no estado compartilhado (JSON) e contador das capturas armadas
+SETTINGS_KEY = 'profiling-settings'
+CAPTURED_KEY = 'profiling-captured'
+
+# Identificadores aceitos do cliente (também são nomes de arquivo)
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+# Limites da amostragem: níveis de cada pilha e pilhas diferentes guardadas
+MAX_STACK_DEPTH = 64
+MAX_STACKS = 20000
+
+# Capturas armadas por vez
+MAX_CAPTURES = 100
+
+# Intervalo de gravação das amostras de cada worker em PROFILING_DIR (segundos)
+FLUSH_INTERVAL = 30
+
+
+# Função para validar ou gerar o identificador de uma requisição
+def new_request_id(value=None):
+    if value and REQUEST_ID_PATTERN.fullmatch(value):
+        return value
+    return uuid.uuid4().hex
+
+
+class StackSampler:
+    """Amostragem das pilhas das threads que estão atendendo requisições
+
+    Criada sob demanda na primeira requisição (depois do fork dos workers).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.interval = 0.01
+        self.directory = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._active = {}
+        self._stacks = Counter()
+        self._counts = {'samples': 0, 'overflow': 0}
+        self._dirty = False
+
+    def start(self, interval, directory):
+        self.interval = interval
+        self.directory = directory
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+
+    def track(self, label):
+        self._active[threading.get_ident()] = label
+
+    def untrack(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._counts = {'samples': 0, 'overflow': 0}
+            self._dirty = True
+
+    def _run(self):
+        flushed_at = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            if self.enabled:
+                self.sample()
+            if self._dirty and time.monotonic() - flushed_at >= FLUSH_INTERVAL:
+                flushed_at = time.monotonic()
+                try:
+                    self.flush()
+                except OSError as e:
+                    logger.error("Erro ao gravar as amostras de perfil: %s", e)
+
+    def sample(self):
+        """Conta a pilha atual de cada thread que está atendendo uma requisição"""
+        frames = sys._current_frames()
+        stacks = []
+        for ident, label in list(self._active.items()):
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                stack.append(label)
+                stacks.append(';'.join(reversed(stack)))
+        with self._lock:
+            for stack in stacks:
+                if stack in self._stacks or len(self._stacks) < MAX_STACKS:
+                    self._stacks[stack] += 1
+                else:
+                    self._counts['overflow'] += 1
+            self._counts['samples'] += len(stacks)
+            self._dirty = self._dirty or bool(stacks)
+
+    def folded(self):
+        """Pilhas deste worker no formato folded ("a;b;c contagem")"""
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def flush(self):
+        """Grava as pilhas deste worker para que os demais as incluam na exportação"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"samples-{os.getpid()}.folded")
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as output:
+            output.write(self.folded())
+        os.replace(f"{path}.tmp", path)
+        self._dirty = False
+
+    def metrics(self):
+        with self._lock:
+            counts = dict(self._counts)
+            counts['stacks'] = len(self._stacks)
+        counts['enabled'] = self.enabled
+        counts['active_requests'] = len(self._active)
+        return counts
+
+
+class RequestProfiler:
+    """Perfis por requisição, amostragem contínua e identificador das requisições
+
+    As opções de cada aplicação ficam em app.extensions['profiling']; os
+    métodos usam a aplicação do contexto atual.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.sampler = StackSampler()
+        # O cProfile não admite dois perfis ao mesmo tempo no processo
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._counts = {'profiles': 0, 'skipped': 0}
+
+    def init_app(self, app):
+        if app.config.get('PROFILER', 'cprofile') not in ('cprofile', 'pyinstrument'):
+            raise ValueError(f"PROFILER inválido: {app.config['PROFILER']} (use cprofile ou pyinstrument)")
+        html_profiler = None
+        if app.config.get('PROFILER', 'cprofile') == 'pyinstrument':
+            try:
+                # Dependência opcional (perfis em HTML, com o tempo fora do
+                # Python), importada apenas quando escolhida
+                from pyinstrument import Profiler as html_profiler
+            except ImportError:
+                logger.warning("PROFILER=pyinstrument, mas o pacote pyinstrument não está instalado; usando o cProfile")
+        app.extensions['profiling'] = {'settings': None, 'checked_at': 0.0, 'epoch': None,
+                                       'html_profiler': html_profiler}
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def directory(self):
+        return current_app.config.get('PROFILING_DIR') or os.path.join(current_app.instance_path, 'profiles')
+
+    def defaults(self):
+        return {'sampler': bool(current_app.config.get('PROFILING_SAMPLER', False)),
+                'paths': [], 'count': 0, 'epoch': 0}
+
+    def settings(self, force=False):
+        """Opções em vigor neste worker, relidas do estado compartilhado se mudaram"""
+        loaded = current_app.extensions['profiling']
+        interval = float(current_app.config.get('SETTINGS_CHECK_INTERVAL', 1))
+        now = time.monotonic()
+        with self._lock:
+            if not force and loaded['settings'] is not None and now - loaded['checked_at'] < interval:
+                return loaded['settings']
+            loaded['checked_at'] = now
+        stored = self.state.get(SETTINGS_KEY)
+        settings = self.defaults()
+        if stored:
+            settings.update(json.loads(stored))
+        if loaded['epoch'] is not None and settings['epoch'] != loaded['epoch']:
+            self.sampler.reset()
+        loaded['epoch'] = settings['epoch']
+        loaded['settings'] = settings
+        self.sampler.enabled = settings['sampler']
+        return settings
+
+    def save(self, data):
+        """Altera as opções de perfil em todos os workers
+
+        Args:
+            data (dict): sampler (bool), paths (caminhos cujas próximas
+                requisições terão perfil), count (quantas) e reset_samples
+                (descarta as amostras acumuladas)
+
+        Raises:
+            ValueError: se alguma opção for inválida
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Opções inválidas")
+        unknown = set(data) - {'sampler', 'paths', 'count', 'reset_samples'}
+        if unknown:
+            raise ValueError(f"Opções desconhecidas: {', '.join(sorted(unknown))}")
+        settings = dict(self.settings(force=True))
+        if 'sampler' in data:
+            settings['sampler'] = bool(data['sampler'])
+        if 'paths' in data or 'count' in data:
+            paths = data.get('paths', settings['paths'])
+            if not isinstance(paths, list) or not all(isinstance(path, str) and path.startswith('/') for path in paths):
+                raise ValueError("paths deve ser uma lista de caminhos iniciados por /")
+            try:
+                count = int(data.get('count', settings['count']))
+            except (TypeError, ValueError):
+                raise ValueError("count deve ser um número inteiro")
+            if not 0 <= count <= MAX_CAPTURES:
+                raise ValueError(f"count deve estar entre 0 e {MAX_CAPTURES}")
+            settings['paths'], settings['count'] = paths, count
+            self.state.delete(CAPTURED_KEY)
+        if data.get('reset_samples'):
+            settings['epoch'] += 1
+        self.state.set(SETTINGS_KEY, json.dumps(settings))
+        return self.settings(force=True)
+
+    def _wants_profile(self, settings):
+        if request.headers.get('X-Profile') == '1':
+            user = current_user()
+            return user is not None and user.role == 'admin'
+        if settings['count'] and any(request.path.startswith(path) for path in settings['paths']):
+            return self.state.incr(CAPTURED_KEY) <= settings['count']
+        return False
+
+    def _before_request(self):
+        g.request_id = new_request_id(request.headers.get('X-Request-ID'))
+        if request.endpoint == 'static':
+            return
+        settings = self.settings()
+        if settings['sampler']:
+            self.sampler.start(float(current_app.config.get('PROFILING_SAMPLE_INTERVAL', 0.01)), self.directory())
+            self.sampler.track(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+        if not self._wants_profile(settings):
+            return
+        if not self._busy.acquire(blocking=False):
+            with self._lock:
+                self._counts['skipped'] += 1
+            return
+        html_profiler = current_app.extensions['profiling']['html_profiler']
+        if html_profiler is not None:
+            profile = html_profiler()
+        else:
+            profile = cProfile.Profile()
+        g.profile = (profile, time.perf_counter())
+        if isinstance(profile, cProfile.Profile):
+            profile.enable()
+        else:
+            profile.start()
+
+    def _stop(self):
+        profile, started = g.pop('profile')
+        try:
+            if isinstance(profile, cProfile.Profile):
+                profile.disable()
+            else:
+                profile.stop()
+        finally:
+            self._busy.release()
+        return profile, time.perf_counter() - started
+
+    def _after_request(self, response):
+        response.headers.setdefault('X-Request-ID', g.get('request_id', ''))
+        if 'profile' in g:
+            # Em respostas em streaming (/ask/stream) o perfil vai até o início da resposta
+            profile, duration = self._stop()
+            try:
+                self.write(profile, duration, response.status_code)
+                response.headers['X-Profile-ID'] = new_request_id(g.request_id)
+            except OSError as e:
+                logger.error("Erro ao gravar o perfil da requisição: %s", e)
+        return response
+
+    def _teardown_request(self, error=None):
+        self.sampler.untrack()
+        if 'profile' in g:
+            self._stop()
+
+    def write(self, profile, duration, status):
+        """Grava o perfil da requisição atual e remove os mais antigos"""
+        directory = self.directory()
+        os.makedirs(directory, exist_ok=True)
+        name = new_request_id(g.request_id)
+        if isinstance(profile, cProfile.Profile):
+            profile.dump_stats(os.path.join(directory, f"{name}.prof"))
+            kind = 'cprofile'
+        else:
+            with open(os.path.join(directory, f"{name}.html"), 'w', encoding='utf-8') as output:
+                output.write(profile.output_html())
+            kind = 'pyinstrument'
+        info = {
+            'request_id': name, 'method': request.method, 'path': request.path, 'status': status,
+            'duration_ms': round(duration * 1000, 1), 'user': session.get('username'),
+            'profiler': kind, 'created_at': datetime.utcnow().isoformat()
+        }
+        with open(os.path.join(directory, f"{name}.json"), 'w', encoding='utf-8') as output:
+            json.dump(info, output)
+        with self._lock:
+            self._counts['profiles'] += 1
+        logger.info("Perfil gravado: %s %s (%s ms)", request.method, request.path, info['duration_ms'],
+                    extra={'duration_ms': info['duration_ms'], 'status': status})
+        self._prune(directory)
+
+    def _prune(self, directory):
+        keep = int(current_app.config.get('PROFILING_KEEP', 50))
+        profiles = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+                          key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in profiles[keep:]:
+            stem = entry.path[:-len('.json')]
+            for extension in ('.json', '.prof', '.html'):
+                if os.path.exists(stem + extension):
+                    os.remove(stem + extension)
+
+    def profiles(self):
+        """Perfis gravados, do mais recente para o mais antigo"""
+        directory = self.directory()
+        if not os.path.isdir(directory):
+            return []
+        profiles = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.json'):
+                try:
+                    with open(entry.path, encoding='utf-8') as source:
+                        profiles.append(json.load(source))
+                except (OSError, ValueError):
+                    continue
+        return sorted(profiles, key=lambda info: info['created_at'], reverse=True)
+
+    def profile_path(self, request_id):
+        """Arquivo do perfil (.prof ou .html) de uma requisição
+
+        Raises:
+            LookupError: se não houver perfil da requisição
+        """
+        if REQUEST_ID_PATTERN.fullmatch(request_id or ''):
+            for extension in ('.prof', '.html'):
+                path = os.path.join(self.directory(), request_id + extension)
+                if os.path.exists(path):
+                    return path
+        raise LookupError(f"Perfil não encontrado: {request_id}")
+
+    def report(self, path, limit=40):
+        """Relatório em texto de um perfil do cProfile (funções por tempo acumulado)"""
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).strip_dirs().sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+    def folded(self):
+        """Pilhas amostradas de todos os workers em execução, no formato folded"""
+        directory = self.directory()
+        totals = Counter()
+        own = f"samples-{os.getpid()}.folded"
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if not entry.name.startswith('samples-') or entry.name == own or not entry.name.endswith('.folded'):
+                    continue
+                pid = int(entry.name[len('samples-'):-len('.folded')])
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    # Worker encerrado (reinício do Gunicorn)
+                    os.remove(entry.path)
+                    continue
+                except PermissionError:
+                    pass
+                with open(entry.path, encoding='utf-8') as source:
+                    for line in source:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        if stack:
+                            totals[stack] += int(count)
+        for line in self.sampler.folded().splitlines():
+            stack, _, count = line.rpartition(' ')
+            totals[stack] += int(count)
+        return ''.join(f"{stack} {count}\n" for stack, count in totals.most_common())
+
+    def metrics(self):
+        with self._lock:
+            counts = dict(self._counts)
+        counts['sampler'] = self.sampler.metrics()
+        return counts
+
+
+# Perfis de desempenho, configurados pela aplicação
+profiler = RequestProfiler(shared_state)
@@ -1,6 +1,9 @@
 # prompts.py
 # Definições de prompts de sistema para o modelo LLaMA
 
+from budget import budgeter
+from utils import format_conversation_prompt
+
 # Prompt padrão para o assistente corporativo
 DEFAULT_SYSTEM_PROMPT = """
 Você é um assistente de IA corporativo útil, conciso e profissional. 
@@ -49,12 +52,20 @@ Siga estas diretrizes em suas respostas:
 Seu objetivo é ajudar os funcionários a entender melhor as práticas gerais de RH e políticas corporativas.
 """
 
+# Prompt para resumir as perguntas antigas de uma conversa
+SUMMARY_SYSTEM_PROMPT = """
+Você resume conversas entre um funcionário e o assistente de IA corporativo.
+Escreva um resumo curto, em português, que preserve os fatos, decisões, nomes,
+números e pedidos ainda em aberto necessários para responder às próximas perguntas.
+Não invente informações e não inclua saudações ou comentários sobre o resumo.
+"""
+
 # Função para selecionar o prompt de sistema apropriado
 def get_system_prompt(prompt_type='default'):
     """Retorna o prompt de sistema apropriado com base no tipo solicitado
     
     Args:
-        prompt_type (str): Tipo de prompt ('default', 'technical', 'hr')
+        prompt_type (str): Tipo de prompt ('default', 'technical', 'hr', 'summary')
         
     Returns:
         str: Prompt de sistema
@@ -62,7 +73,8 @@ def get_system_prompt(prompt_type='default'):
     prompts = {
         'default': DEFAULT_SYSTEM_PROMPT,
         'technical': TECHNICAL_SYSTEM_PROMPT,
-        'hr': HR_SYSTEM_PROMPT
+        'hr': HR_SYSTEM_PROMPT,
+        'summary': SUMMARY_SYSTEM_PROMPT
     }
     
     return prompts.get(prompt_type.lower(), DEFAULT_SYSTEM_PROMPT)
@@ -109,4 +121,35 @@ def detect_query_type(question):
             return 'hr'
     
     # Caso contrário, retornar o tipo padrão
-    return 'default'
\ No newline at end of file
+    return 'default'
+
+# Função para montar o prompt e o orçamento de tokens de uma pergunta
+def prepare_prompt(question, conversation=None):
+    """Retorna (prompt, categoria, orçamento) para uma pergunta
+    
+    Em uma conversa, o resumo das perguntas antigas e as perguntas e
+    respostas ainda não resumidas que couberem em MAX_HISTORY_TOKENS são
+    incluídos no prompt. A categoria (e o prompt de sistema) é a da primeira
+    pergunta, para que o início do prompt não mude entre as perguntas e o
+    estado KV salvo possa ser reaproveitado.
+    
+    Se o prompt não deixar espaço para MIN_PREDICT_TOKENS de resposta no
+    contexto, as perguntas mais antigas e depois o resumo são descartados.
+    
+    Raises:
+        PromptTooLong: se nem assim houver espaço para a resposta
+    """
+    turns = conversation.turns() if conversation else []
+    summary = conversation.summary if conversation else None
+    category = detect_query_type(conversation.title if conversation else question)
+    question = budgeter.trim_question(question)
+    history = budgeter.select_history(turns) if turns else []
+    system_prompt = get_system_prompt(category)
+    prompt = format_conversation_prompt(history, question, system_prompt, summary)
+    while (history or summary) and not budgeter.fits(prompt):
+        if history:
+            history = history[1:]
+        else:
+            summary = None
+        prompt = format_conversation_prompt(history, question, system_prompt, summary)
+    return prompt, category, budgeter.plan(prompt, category, question)
@@ -0,0 +1,259 @@
+# quotas.py
+# Limites de uso por usuário e por departamento: perguntas por minuto (balde
+# de fichas) e tokens por dia, contados no estado compartilhado entre os
+# workers. Os valores padrão vêm da configuração e podem ser alterados pelos
+# administradores (tabela settings, chave "usage_limits"), com recarga em
+# todos os workers pelo mesmo mecanismo de settings.py.
+
+import json
+import logging
+import threading
+from datetime import datetime
+
+from models import db, User, Setting
+from state_store import shared_state
+from settings import runtime_settings
+
+logger = logging.getLogger(__name__)
+
+# Chave da tabela settings com os limites definidos pelos administradores
+SETTING_KEY = 'usage_limits'
+
+# Limites aceitos em cada escopo (0 = sem limite)
+LIMIT_FIELDS = ('requests_per_minute', 'daily_tokens')
+
+# Os contadores diários ficam guardados por dois dias (cobre o fuso horário)
+DAILY_TTL = 2 * 24 * 3600
+
+
+class LimitExceeded(Exception):
+    """Requisição recusada por limite de uso"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Função para validar os limites enviados por um administrador
+def validate_limits(data):
+    """Valida e normaliza os limites de uso
+
+    Formato: {"user": {...}, "department": {...}, "departments": {"TI": {...}}},
+    em que cada escopo aceita os campos de LIMIT_FIELDS. "departments" define
+    limites próprios para departamentos específicos.
+
+    Returns:
+        dict: Limites normalizados
+
+    Raises:
+        ValueError: se o formato ou algum valor for inválido
+    """
+    def scope(values, name):
+        if not isinstance(values, dict):
+            raise ValueError(f"Limites de '{name}' devem ser um objeto")
+        unknown = set(values) - set(LIMIT_FIELDS)
+        if unknown:
+            raise ValueError(f"Campos desconhecidos em '{name}': {', '.join(sorted(unknown))}")
+        result = {}
+        for field, value in values.items():
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{name}.{field}' deve ser um número inteiro")
+            if value < 0:
+                raise ValueError(f"'{name}.{field}' não pode ser negativo")
+            result[field] = value
+        return result
+
+    if not isinstance(data, dict):
+        raise ValueError("Os limites devem ser um objeto JSON")
+    unknown = set(data) - {'user', 'department', 'departments'}
+    if unknown:
+        raise ValueError(f"Escopos desconhecidos: {', '.join(sorted(unknown))}")
+    departments = data.get('departments') or {}
+    if not isinstance(departments, dict):
+        raise ValueError("'departments' deve ser um objeto")
+    return {
+        'user': scope(data.get('user') or {}, 'user'),
+        'department': scope(data.get('department') or {}, 'department'),
+        'departments': {
+            str(name): scope(values, name) for name, values in departments.items()
+        }
+    }
+
+
+class UsageLimiter:
+    """Aplica os limites de uso antes de cada pergunta e contabiliza os tokens gerados"""
+
+    def __init__(self, state):
+        self.state = state
+        self.config = {}
+        self._lock = threading.Lock()
+        self._cached = None
+        self._counts = {'rate_limited': 0, 'quota_exceeded': 0}
+
+    def init_app(self, app):
+        self.config = app.config
+        self._cached = None
+        runtime_settings.on_change(self.invalidate)
+
+    def invalidate(self):
+        with self._lock:
+            self._cached = None
+
+    def defaults(self):
+        """Limites da configuração, usados enquanto não houver valores na tabela settings"""
+        return {
+            'user': {
+                'requests_per_minute': int(self.config.get('RATE_LIMIT_PER_MINUTE', 0)),
+                'daily_tokens': int(self.config.get('DAILY_TOKEN_QUOTA', 0))
+            },
+            'department': {
+                'requests_per_minute': int(self.config.get('DEPARTMENT_RATE_LIMIT_PER_MINUTE', 0)),
+                'daily_tokens': int(self.config.get('DEPARTMENT_DAILY_TOKEN_QUOTA', 0))
+            },
+            'departments': {}
+        }
+
+    def limits(self):
+        """Limites em vigor (configuração mais os valores da tabela settings)
+
+        A tabela é lida apenas quando as configurações mudam (ver
+        settings.RuntimeSettings), e não a cada pergunta.
+        """
+        with self._lock:
+            if self._cached is not None:
+                return self._cached
+
+        limits = self.defaults()
+        setting = Setting.query.filter_by(key=SETTING_KEY).first()
+        if setting:
+            try:
+                stored = validate_limits(json.loads(setting.value))
+                for name in ('user', 'department'):
+                    limits[name].update(stored[name])
+                limits['departments'] = stored['departments']
+            except ValueError as e:
+                logger.error("Limites de uso inválidos na tabela settings: %s", e)
+        with self._lock:
+            self._cached = limits
+        return limits
+
+    def save(self, data):
+        """Grava os limites definidos por um administrador
+
+        Raises:
+            ValueError: se os limites forem inválidos
+        """
+        limits = validate_limits(data)
+        setting = Setting.query.filter_by(key=SETTING_KEY).first()
+        if setting is None:
+            setting = Setting(key=SETTING_KEY, description='Limites de uso por usuário e departamento')
+            db.session.add(setting)
+        setting.value = json.dumps(limits, ensure_ascii=False)
+        db.session.commit()
+        # Avisa os demais workers e recarrega os limites neste
+        runtime_settings.bump()
+        logger.info("Limites de uso atualizados")
+        return self.limits()
+
+    def _scopes(self, user_id, department):
+        """Escopos que se aplicam ao usuário: (nome, chave, limites)"""
+        limits = self.limits()
+        scopes = [('usuário', f"user:{user_id}", limits['user'])]
+        if department:
+            department_limits = dict(limits['department'])
+            department_limits.update(limits['departments'].get(department, {}))
+            scopes.append(('departamento', f"department:{department}", department_limits))
+        return scopes
+
+    def _tokens_key(self, scope_key):
+        return f"tokens:{scope_key}:{datetime.utcnow():%Y%m%d}"
+
+    def tokens_today(self, scope_key):
+        return int(self.state.get(self._tokens_key(scope_key)) or 0)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def check_quota(self, user_id, department=None):
+        """Verifica apenas as cotas diárias de tokens, sem consumir fichas
+        (usado pelo worker de lote antes de cada geração)
+
+        Raises:
+            LimitExceeded: se a cota diária de tokens foi atingida
+        """
+        for name, key, limits in self._scopes(user_id, department):
+            quota = limits.get('daily_tokens', 0)
+            if quota and self.tokens_today(key) >= quota:
+                self._count('quota_exceeded')
+                raise LimitExceeded(f"Cota diária de tokens do {name} atingida")
+
+    def check(self, user_id, department=None):
+        """Verifica os limites antes de uma pergunta e consome uma ficha de cada escopo
+
+        As fichas de todos os escopos são retiradas juntas: uma pergunta
+        recusada pelo limite do departamento não gasta a ficha do usuário.
+
+        Raises:
+            LimitExceeded: se a cota diária de tokens foi atingida ou se não
+                houver fichas (perguntas por minuto) disponíveis
+        """
+        self.check_quota(user_id, department)
+        scopes = self._scopes(user_id, department)
+        limited = [(name, key, limits['requests_per_minute'])
+                   for name, key, limits in scopes if limits.get('requests_per_minute')]
+        if not limited:
+            return
+        waits = self.state.take_all([
+            (f"bucket:{key}", per_minute, per_minute / 60.0) for _, key, per_minute in limited
+        ])
+        for (name, _, per_minute), wait in zip(limited, waits):
+            if wait:
+                self._count('rate_limited')
+                raise LimitExceeded(
+                    f"Limite de {per_minute} perguntas por minuto do {name} atingido", retry_after=max(waits)
+                )
+
+    def record(self, user_id, department=None, tokens=0):
+        """Soma os tokens de uma pergunta respondida às cotas diárias"""
+        if tokens <= 0:
+            return
+        for _, key, _ in self._scopes(user_id, department):
+            self.state.incr(self._tokens_key(key), tokens, ttl=DAILY_TTL)
+
+    def usage(self):
+        """Uso do dia por usuário ativo e por departamento, para o painel de administração"""
+        limits = self.limits()
+        users = User.query.filter_by(active=True).order_by(User.username) \
+            .with_entities(User.id, User.username, User.department).all()
+        departments = sorted({user.department for user in users if user.department})
+        return {
+            'users': [
+                {
+                    'username': user.username,
+                    'department': user.department,
+                    'tokens_today': self.tokens_today(f"user:{user.id}"),
+                    'daily_tokens': limits['user'].get('daily_tokens', 0)
+                }
+                for user in users
+            ],
+            'departments': [
+                {
+                    'department': department,
+                    'tokens_today': self.tokens_today(f"department:{department}"),
+                    'daily_tokens': limits['departments'].get(department, {}).get(
+                        'daily_tokens', limits['department'].get('daily_tokens', 0))
+                }
+                for department in departments
+            ]
+        }
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+# Limites de uso compartilhados entre os workers
+limiter = UsageLimiter(shared_state)
@@ -0,0 +1,361 @@
+# resources.py
+# Recursos do processo do llama.cpp local: threads, mlock/mmap e afinidade de
+# CPU por nó NUMA, a partir da topologia detectada no servidor ou dos valores
+# medidos por "flask calibrate-inference"
+#
+# Os núcleos físicos são divididos em "vagas" (INFERENCE_CPU_SLOTS; padrão:
+# uma por geração simultânea do modelo principal e pelo menos uma por nó
+# NUMA). Cada geração ocupa uma vaga livre (lock de arquivo compartilhado
+# entre os workers) e o processo fica restrito às CPUs da vaga, com uma thread
+# por núcleo físico; gerações simultâneas não disputam os mesmos núcleos.
+
+import os
+import re
+import glob
+import json
+import fcntl
+import socket
+import logging
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from utils import format_prompt
+
+logger = logging.getLogger(__name__)
+
+# Pergunta fixa usada na calibração
+CALIBRATION_QUESTION = (
+    "Explique em português, em poucos parágrafos, como funciona a política de "
+    "férias de uma empresa e quais documentos o colaborador precisa apresentar."
+)
+
+
+# Função para ler uma lista de CPUs no formato do Linux ("0-3,8-11")
+def parse_cpu_list(text):
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+# Função para detectar os núcleos físicos e os nós NUMA disponíveis
+def detect_topology(sys_root='/sys/devices/system', available=None):
+    """Agrupa as CPUs disponíveis ao processo por nó NUMA e por núcleo físico
+
+    Args:
+        sys_root (str): Diretório com as informações de CPU e NUMA do kernel
+        available (list, optional): CPUs consideradas (padrão: afinidade do processo)
+
+    Returns:
+        dict: nó NUMA -> lista de núcleos físicos, cada um com a lista das
+            CPUs lógicas (irmãs de hyperthreading) disponíveis
+    """
+    available = sorted(available if available is not None else os.sched_getaffinity(0))
+    node_of = {}
+    for node_path in glob.glob(os.path.join(sys_root, 'node', 'node[0-9]*')):
+        node = int(os.path.basename(node_path)[4:])
+        try:
+            with open(os.path.join(node_path, 'cpulist')) as cpulist:
+                for cpu in parse_cpu_list(cpulist.read()):
+                    node_of[cpu] = node
+        except OSError:
+            continue
+
+    cores = {}
+    for cpu in available:
+        topology = os.path.join(sys_root, 'cpu', f'cpu{cpu}', 'topology')
+        try:
+            with open(os.path.join(topology, 'physical_package_id')) as package_file:
+                package = int(package_file.read())
+            with open(os.path.join(topology, 'core_id')) as core_file:
+                core = int(core_file.read())
+        except (OSError, ValueError):
+            # Sem informação de topologia: cada CPU é um núcleo
+            package, core = 0, cpu
+        cores.setdefault((node_of.get(cpu, 0), package, core), []).append(cpu)
+
+    nodes = {}
+    for (node, _, _), cpus in sorted(cores.items(), key=lambda item: item[1][0]):
+        nodes.setdefault(node, []).append(cpus)
+    return nodes
+
+
+class Placement:
+    """Threads e CPUs de uma execução do llama.cpp"""
+
+    def __init__(self, threads, batch_threads, cpus=None, numa=None):
+        self.threads = threads
+        self.batch_threads = batch_threads
+        self.cpus = cpus
+        self.numa = numa
+
+
+class InferenceResources:
+    """Configuração de threads, memória e afinidade do processo do modelo"""
+
+    def __init__(self):
+        self.config = {}
+        self.slots = []
+        self.node_count = 1
+        self.lock_dir = None
+        self.calibration_file = None
+        self.calibrated = None
+
+    def init_app(self, app):
+        self.config = app.config
+        self.lock_dir = os.path.join(app.instance_path, 'cpu_slots')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.calibration_file = app.config.get('INFERENCE_CALIBRATION_FILE') or \
+            os.path.join(app.instance_path, 'inference_calibration.json')
+        nodes = detect_topology()
+        self.node_count = len(nodes)
+        self.slots = self.plan_slots(nodes)
+        self.calibrated = self.load_calibration()
+        if app.config.get('LLAMA_MLOCK'):
+            self.check_memlock()
+
+    def plan_slots(self, nodes):
+        """Divide os núcleos físicos de cada nó NUMA em vagas
+
+        Returns:
+            list: Vagas, cada uma uma lista de núcleos físicos (listas de CPUs)
+        """
+        total_cores = sum(len(cores) for cores in nodes.values())
+        count = int(self.config.get('INFERENCE_CPU_SLOTS', 0))
+        if count <= 0:
+            large = self.config.get('MODELS', {}).get(self.config.get('DEFAULT_MODEL', 'large'), {})
+            count = max(len(nodes), int(large.get('max_concurrency', 1)))
+        count = max(1, min(count, total_cores))
+        # Vagas por nó proporcionais ao número de núcleos, sem atravessar nós
+        slots = []
+        for node, cores in nodes.items():
+            share = max(1, round(count * len(cores) / total_cores))
+            share = min(share, len(cores))
+            size, extra = divmod(len(cores), share)
+            start = 0
+            for index in range(share):
+                end = start + size + (1 if index < extra else 0)
+                slots.append(cores[start:end])
+                start = end
+        return slots
+
+    def check_memlock(self):
+        soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+        model_path = self.config.get('MODEL_PATH')
+        size = os.path.getsize(model_path) if model_path and os.path.exists(model_path) else 0
+        if soft != resource.RLIM_INFINITY and soft < size:
+            logger.warning(
+                "LLAMA_MLOCK ativo, mas o limite de memória bloqueada (%s MB) "
+                "é menor que o modelo (%s MB); aumente LimitMEMLOCK no serviço",
+                soft // 1024 // 1024, size // 1024 // 1024
+            )
+
+    def load_calibration(self):
+        """Valores medidos por "flask calibrate-inference" para este servidor e vaga"""
+        try:
+            with open(self.calibration_file) as calibration_file:
+                hosts = json.load(calibration_file)
+        except (OSError, ValueError):
+            return None
+        result = hosts.get(socket.gethostname())
+        if not result or not self.slots or result.get('slot_cores') != len(self.slots[0]):
+            # Topologia ou número de vagas diferente do medido
+            return None
+        return result
+
+    def placement(self, slot=None):
+        """Threads e CPUs de uma execução na vaga indicada (None = sem afinidade)"""
+        calibrated = self.calibrated or {}
+        cores = self.slots[slot] if slot is not None else None
+        if cores is None:
+            physical = max(1, sum(len(s) for s in self.slots) // max(len(self.slots), 1))
+            logical = max(1, sum(len(c) for s in self.slots for c in s) // max(len(self.slots), 1))
+            cpus = None
+        else:
+            physical = len(cores)
+            cpus = sorted(cpu for core in cores for cpu in core)
+            logical = len(cpus)
+        threads = int(self.config.get('LLAMA_NUM_THREADS', 0)) or calibrated.get('threads') or physical
+        batch_threads = int(self.config.get('LLAMA_BATCH_THREADS', 0)) or calibrated.get('batch_threads') or logical
+        numa = self.config.get('LLAMA_NUMA', 'auto')
+        if numa == 'auto':
+            # Com a afinidade definida, o llama.cpp segue o mapa de CPUs do processo
+            numa = 'numactl' if cpus is not None and self.node_count > 1 else None
+        elif numa == 'off':
+            numa = None
+        return Placement(threads, batch_threads, cpus, numa)
+
+    def command_args(self, placement):
+        """Opções do llama.cpp para a execução"""
+        args = ["-t", str(placement.threads), "-tb", str(placement.batch_threads)]
+        if self.config.get('LLAMA_MLOCK'):
+            args.append("--mlock")
+        if not self.config.get('LLAMA_MMAP', True):
+            args.append("--no-mmap")
+        if placement.numa:
+            args += ["--numa", placement.numa]
+        return args
+
+    @contextmanager
+    def acquire(self):
+        """Reserva uma vaga de CPUs livre durante a geração
+
+        Yields:
+            Placement: Threads e CPUs da vaga; sem vaga livre (ou com
+                INFERENCE_CPU_PINNING desativado), sem afinidade
+        """
+        if not self.config.get('INFERENCE_CPU_PINNING', True) or not self.lock_dir:
+            yield self.placement()
+            return
+        for slot in range(len(self.slots)):
+            with open(os.path.join(self.lock_dir, f"{slot}.lock"), 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    yield self.placement(slot)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return
+        yield self.placement()
+
+    def pin(self, pid, placement):
+        """Restringe o processo do modelo às CPUs da vaga"""
+        if placement.cpus:
+            try:
+                os.sched_setaffinity(pid, placement.cpus)
+            except OSError as e:
+                logger.warning("Não foi possível definir a afinidade do processo %s: %s", pid, e)
+
+    def calibrate(self, runner, thread_counts=None, n_predict=64):
+        """Mede tokens por segundo com cada número de threads na primeira vaga
+
+        Returns:
+            dict: Melhores valores e medições, salvos para este servidor
+        """
+        cores = self.slots[0]
+        cpus = sorted(cpu for core in cores for cpu in core)
+        numa = self.placement(0).numa
+        if not thread_counts:
+            candidates = {1, 2, 4, 8, 16, 32, 64, len(cores), len(cpus), max(len(cores) // 2, 1)}
+            thread_counts = sorted(n for n in candidates if n <= len(cpus))
+
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as prompt_file:
+            prompt_file.write(format_prompt(CALIBRATION_QUESTION))
+        results = []
+        try:
+            for threads in thread_counts:
+                placement = Placement(threads, threads, cpus, numa)
+                cmd = runner.build_command(prompt_file.name, model_path=self.config.get('MODEL_PATH'),
+                                           placement=placement)
+                # Sempre n_predict tokens, mesmo que o modelo termine o turno antes
+                cmd[cmd.index("-n") + 1] = str(n_predict)
+                cmd.append("--ignore-eos")
+                process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                self.pin(process.pid, placement)
+                _, stderr = process.communicate()
+                speeds = parse_timings(stderr.decode('utf-8', errors='replace'))
+                if speeds is None:
+                    logger.warning("Sem medição de tempo com %s threads (código %s)", threads, process.returncode)
+                    continue
+                results.append({'threads': threads, 'tokens_per_second': speeds[1],
+                                'prompt_tokens_per_second': speeds[0]})
+                logger.info("%s threads: %.1f tokens/s, prompt %.1f tokens/s", threads, speeds[1], speeds[0])
+        finally:
+            os.unlink(prompt_file.name)
+        if not results:
+            return None
+
+        best = max(results, key=lambda item: item['tokens_per_second'])
+        best_prompt = max(results, key=lambda item: item['prompt_tokens_per_second'])
+        calibration = {
+            'threads': best['threads'],
+            'batch_threads': best_prompt['threads'],
+            'tokens_per_second': best['tokens_per_second'],
+            'prompt_tokens_per_second': best_prompt['prompt_tokens_per_second'],
+            'slot_cores': len(self.slots[0]),
+            'slots': len(self.slots),
+            'model': self.config.get('MODEL_PATH'),
+            'measured_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'results': results
+        }
+        self.save_calibration(calibration)
+        return calibration
+
+    def save_calibration(self, calibration):
+        try:
+            with open(self.calibration_file) as calibration_file:
+                hosts = json.load(calibration_file)
+        except (OSError, ValueError):
+            hosts = {}
+        hosts[socket.gethostname()] = calibration
+        temp_path = f"{self.calibration_file}.tmp"
+        with open(temp_path, 'w') as calibration_file:
+            json.dump(hosts, calibration_file, indent=2)
+        os.replace(temp_path, self.calibration_file)
+        self.calibrated = calibration
+
+    def metrics(self):
+        calibrated = self.calibrated
+        placement = self.placement(0) if self.slots else self.placement()
+        return {
+            'slots': [sorted(cpu for core in cores for cpu in core) for cores in self.slots],
+            'threads': placement.threads,
+            'batch_threads': placement.batch_threads,
+            'numa': placement.numa,
+            'calibrated_at': calibrated.get('measured_at') if calibrated else None
+        }
+
+
+# Função para ler as velocidades impressas pelo llama.cpp ao final da execução
+def parse_timings(text):
+    """Returns: (tokens/s do prompt, tokens/s da geração), ou None"""
+    prompt = re.search(r'prompt eval time\s*=.*?([\d.]+) tokens per second', text)
+    generation = re.search(r'(?<!prompt )eval time\s*=.*?([\d.]+) tokens per second', text)
+    if not prompt or not generation:
+        return None
+    return float(prompt.group(1)), float(generation.group(1))
+
+
+# Recursos do processo do modelo, configurados pela aplicação
+resources = InferenceResources()
+
+
+# Comando para medir o melhor número de threads neste servidor
+@click.command('calibrate-inference')
+@click.option('--threads', 'thread_counts', type=int, multiple=True, help='Número de threads a testar (pode repetir)')
+@click.option('--tokens', type=int, default=64, help='Tokens gerados por medição')
+@with_appcontext
+def calibrate_inference_command(thread_counts, tokens):
+    """Mede a velocidade do modelo com cada número de threads e salva a melhor"""
+    from inference import llama
+
+    if not resources.slots:
+        raise click.ClickException("Nenhuma CPU disponível para o modelo")
+    click.echo(f"{len(resources.slots)} vagas de {len(resources.slots[0])} núcleos físicos; "
+               f"modelo {current_app.config.get('MODEL_PATH')}")
+    try:
+        calibration = resources.calibrate(llama, list(thread_counts), tokens)
+    except OSError as e:
+        raise click.ClickException(f"Não foi possível executar o llama.cpp: {str(e)}")
+    if calibration is None:
+        raise click.ClickException("Nenhuma medição concluída; verifique LLAMA_PATH e MODEL_PATH")
+    click.echo(f"{'threads':>8} {'tokens/s':>9} {'prompt tokens/s':>16}")
+    for item in calibration['results']:
+        click.echo(f"{item['threads']:>8} {item['tokens_per_second']:>9.1f} {item['prompt_tokens_per_second']:>16.1f}")
+    click.echo(f"Salvo em {resources.calibration_file}: LLAMA_NUM_THREADS={calibration['threads']}, "
+               f"LLAMA_BATCH_THREADS={calibration['batch_threads']}")
@@ -0,0 +1,404 @@
+# retrieval.py
+# Busca federada (/search): consulta ao mesmo tempo o SharePoint, o catálogo
+# do File Server e o FAQ, combina as listas com a fusão por posição recíproca
+# (reciprocal rank fusion) e reordena os primeiros resultados pela
+# semelhança com a busca
+#
+# Cada fonte tem um tempo máximo para responder e a busca toda retorna dentro
+# de RETRIEVAL_BUDGET_MS, apenas com as fontes que responderam a tempo (a
+# resposta informa a situação de cada uma). Os resultados completos ficam no
+# estado compartilhado por RETRIEVAL_CACHE_TTL segundos.
+#
+# O File Server não tem busca por conteúdo e percorrer os diretórios a cada
+# busca levaria segundos; por isso os nomes e caminhos dos arquivos são
+# copiados periodicamente ("flask index-fileserver") para um catálogo SQLite
+# com índice de texto completo (FTS5), consultado com ordenação BM25.
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from faq import faq, tokenize, keywords, embed, cosine
+from integrations import get_integration, is_integration_enabled
+from state_store import shared_state
+
+logger = logging.getLogger(__name__)
+
+# Prefixo das buscas guardadas no estado compartilhado
+CACHE_PREFIX = 'search:'
+
+# Peso do nome do arquivo em relação ao caminho na ordenação do catálogo
+NAME_WEIGHT = 4.0
+
+# Tamanho máximo do trecho de cada resultado
+SNIPPET_LENGTH = 240
+
+
+# Função para combinar as listas das fontes
+def fuse(rankings, k=60):
+    """Fusão por posição recíproca: cada resultado soma 1 / (k + posição) em
+    cada lista em que aparece (o mesmo id em duas fontes soma as duas)
+
+    Args:
+        rankings (dict): fonte -> lista de resultados (dicts com 'id'), do
+            mais relevante para o menos
+        k (int): Constante que atenua a diferença entre as primeiras posições
+
+    Returns:
+        list: (pontuação, resultado), da maior pontuação para a menor
+    """
+    scores = Counter()
+    results = {}
+    for ranking in rankings.values():
+        for position, result in enumerate(ranking, start=1):
+            scores[result['id']] += 1.0 / (k + position)
+            results.setdefault(result['id'], result)
+    return [(score, results[result_id]) for result_id, score in scores.most_common()]
+
+
+# Função para reordenar os resultados combinados
+def rerank(query, fused, weight):
+    """Reordena pela semelhança entre a busca e o título/trecho de cada resultado
+
+    A semelhança é a média entre a fração das palavras-chave da busca
+    presentes no resultado e o cosseno dos vetores de trigramas (os mesmos
+    do FAQ); a pontuação final combina a fusão (normalizada) e a semelhança.
+
+    Args:
+        query (str): Texto da busca
+        fused (list): (pontuação, resultado) retornados por fuse
+        weight (float): Peso da semelhança (0 = só a fusão, 1 = só a semelhança)
+
+    Returns:
+        list: Resultados com 'score', do mais relevante para o menos
+    """
+    if not fused:
+        return []
+    query_words = keywords(query)
+    query_vector = embed(query_words)
+    top = fused[0][0]
+    ranked = []
+    for score, result in fused:
+        words = keywords(f"{result.get('title') or ''} {result.get('snippet') or ''}")
+        coverage = len(query_words & words) / len(query_words) if query_words else 0.0
+        similarity = (coverage + cosine(query_vector, embed(words))) / 2
+        final = (1 - weight) * score / top + weight * similarity
+        ranked.append(dict(result, score=round(final, 4)))
+    ranked.sort(key=lambda result: result['score'], reverse=True)
+    return ranked
+
+
+class FileCatalog:
+    """Catálogo dos arquivos do File Server (SQLite com FTS5)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def rebuild(self, files):
+        """Substitui o catálogo pelos arquivos informados
+
+        O novo catálogo é montado em um arquivo temporário e colocado no lugar
+        do atual de uma vez, sem interromper as buscas em andamento.
+
+        Args:
+            files (iterable): dicts com name, path, size e created
+
+        Returns:
+            int: Número de arquivos no catálogo
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        conn = sqlite3.connect(temporary)
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE files USING fts5("
+                "name, folder, path UNINDEXED, size UNINDEXED, created UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            count = 0
+            with conn:
+                for item in files:
+                    folder = os.path.dirname(item['path'])
+                    conn.execute(
+                        "INSERT INTO files (name, folder, path, size, created) VALUES (?, ?, ?, ?, ?)",
+                        (item['name'], folder, item['path'], item.get('size'), item.get('created'))
+                    )
+                    count += 1
+            conn.execute("INSERT INTO files (files) VALUES ('optimize')")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(temporary, self.path)
+        return count
+
+    def search(self, query, limit):
+        """Arquivos cujo nome ou pasta contém as palavras da busca (BM25)"""
+        words = keywords(query)
+        if not words:
+            return []
+        # Radicais como prefixo: "ferias" encontra "Ferias_2024.pdf"
+        expression = ' OR '.join(f'"{word}"*' for word in sorted(words))
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT name, folder, path FROM files WHERE files MATCH ? "
+                "ORDER BY bm25(files, ?, 1.0) LIMIT ?",
+                (expression, NAME_WEIGHT, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {'id': f"fileserver:{path}", 'title': name, 'url': path, 'snippet': folder}
+            for name, folder, path in rows
+        ]
+
+
+class SharePointSource:
+    """Documentos do SharePoint, na ordem de relevância do próprio SharePoint"""
+
+    name = 'sharepoint'
+
+    def available(self):
+        if not is_integration_enabled('sharepoint'):
+            return False
+        integration = get_integration('sharepoint')
+        return integration is not None and integration.is_configured
+
+    def search(self, query, limit):
+        # Uma falha do SharePoint aparece como 'error' (e a busca não vai para o cache)
+        documents = get_integration('sharepoint').search_documents(query, max_results=limit, raise_errors=True)
+        return [
+            {'id': document['url'], 'title': document['title'], 'url': document['url'],
+             'snippet': (document.get('summary') or '')[:SNIPPET_LENGTH]}
+            for document in documents
+        ]
+
+
+class FileServerSource:
+    """Arquivos do File Server, pelo catálogo local"""
+
+    name = 'fileserver'
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def available(self):
+        return self.catalog.exists()
+
+    def search(self, query, limit):
+        return self.catalog.search(query, limit)
+
+
+class FAQSource:
+    """Entradas do FAQ mais parecidas com a busca"""
+
+    name = 'faq'
+
+    def available(self):
+        return current_app.config.get('FAQ_ENABLED', True)
+
+    def search(self, query, limit):
+        index = faq.index()
+        return [
+            {'id': f"faq:{entry_id}", 'title': index.questions[entry_id], 'url': None,
+             'snippet': index.answers[entry_id][:SNIPPET_LENGTH]}
+            for entry_id, _ in index.search(query, limit)
+        ]
+
+
+class FederatedSearch:
+    """Busca nas fontes configuradas em RETRIEVAL_SOURCES dentro de um tempo fixo
+
+    As fontes são consultadas em threads: uma fonte lenta não atrasa a
+    resposta além do seu tempo máximo, mas a consulta continua até terminar.
+    Para que uma fonte travada não ocupe todas as threads, cada fonte tem no
+    máximo metade delas ocupadas; acima disso é ignorada na busca.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.config = {}
+        self.sources = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._counts = {}
+        self._cache = {'hits': 0, 'misses': 0}
+
+    def init_app(self, app):
+        self.config = app.config
+        catalog = FileCatalog(app.config.get('RETRIEVAL_CATALOG_PATH')
+                              or os.path.join(app.instance_path, 'fileserver_catalog.db'))
+        available = {source.name: source for source in (FAQSource(), FileServerSource(catalog), SharePointSource())}
+        names = app.config.get('RETRIEVAL_SOURCES', list(available))
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise ValueError(f"Fontes de busca inválidas: {', '.join(unknown)} (use {', '.join(available)})")
+        self.sources = {name: available[name] for name in names}
+
+    @property
+    def catalog(self):
+        source = self.sources.get('fileserver')
+        return source.catalog if source else None
+
+    def _count(self, name, field, amount=1):
+        with self._lock:
+            counts = self._counts.setdefault(name, {
+                'calls': 0, 'timeouts': 0, 'errors': 0, 'skipped': 0, 'seconds': 0.0
+            })
+            counts[field] += amount
+
+    def _call(self, app, source, query, limit):
+        started = time.monotonic()
+        try:
+            with app.app_context():
+                return source.search(query, limit)
+        finally:
+            self._count(source.name, 'seconds', time.monotonic() - started)
+            with self._lock:
+                self._pending[source.name] -= 1
+
+    def _cache_key(self, query, names, limit):
+        normalized = ' '.join(tokenize(query))
+        digest = hashlib.sha256(f"{normalized}|{','.join(names)}|{limit}".encode('utf-8')).hexdigest()
+        return CACHE_PREFIX + digest
+
+    def search(self, query, limit=None):
+        """Busca nas fontes configuradas
+
+        Deve ser executada dentro de um contexto de aplicação.
+
+        Args:
+            query (str): Texto da busca
+            limit (int, optional): Número de resultados (padrão: RETRIEVAL_MAX_RESULTS)
+
+        Returns:
+            dict: results (com source, title, url, snippet e score), sources
+                (situação de cada fonte: ok, timeout, error, busy ou
+                unavailable), cached e elapsed_ms
+
+        Raises:
+            ValueError: se a busca estiver vazia
+        """
+        if not tokenize(query):
+            raise ValueError("Informe o texto da busca")
+        config = self.config
+        limit = max(1, min(limit or int(config.get('RETRIEVAL_MAX_RESULTS', 10)), 50))
+        started = time.monotonic()
+        key = self._cache_key(query, list(self.sources), limit)
+        ttl = int(config.get('RETRIEVAL_CACHE_TTL', 0))
+        cached = self.state.get(key) if ttl else None
+        with self._lock:
+            self._cache['hits' if cached else 'misses'] += 1
+        if cached:
+            return dict(json.loads(cached), cached=True, elapsed_ms=round((time.monotonic() - started) * 1000, 1))
+
+        deadline = started + int(config.get('RETRIEVAL_BUDGET_MS', 800)) / 1000
+        timeouts = config.get('RETRIEVAL_TIMEOUTS_MS', {})
+        workers = int(config.get('RETRIEVAL_WORKERS', 8))
+        # Cada fonte retorna mais resultados que o pedido, para a fusão e a reordenação
+        depth = limit * 3
+        app = current_app._get_current_object()
+        status, futures = {}, {}
+        with self._lock:
+            # Criado sob demanda para não criar threads antes do fork dos workers
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='retrieval')
+        for name, source in self.sources.items():
+            if not source.available():
+                status[name] = 'unavailable'
+                continue
+            with self._lock:
+                busy = self._pending[name] >= max(1, workers // 2)
+                if not busy:
+                    self._pending[name] += 1
+            if busy:
+                status[name] = 'busy'
+                self._count(name, 'skipped')
+                continue
+            self._count(name, 'calls')
+            futures[name] = self._executor.submit(self._call, app, source, query, depth)
+
+        rankings = {}
+        for name, future in futures.items():
+            source_deadline = min(started + int(timeouts.get(name, 1000)) / 1000, deadline)
+            try:
+                results = future.result(timeout=max(source_deadline - time.monotonic(), 0))
+            except FutureTimeout:
+                status[name] = 'timeout'
+                self._count(name, 'timeouts')
+                logger.warning("Busca em %s excedeu o tempo máximo", name, extra={'source': name})
+                continue
+            except Exception as e:
+                status[name] = 'error'
+                self._count(name, 'errors')
+                logger.error("Erro na busca em %s: %s", name, e, extra={'source': name})
+                continue
+            status[name] = 'ok'
+            rankings[name] = [dict(result, source=name) for result in results]
+
+        fused = fuse(rankings, int(config.get('RETRIEVAL_RRF_K', 60)))
+        results = rerank(query, fused[:depth], float(config.get('RETRIEVAL_RERANK_WEIGHT', 0.5)))[:limit]
+        payload = {'query': query, 'results': results, 'sources': status}
+        # Resultados parciais não são guardados: a próxima busca tenta de novo as fontes que falharam
+        if ttl and all(value in ('ok', 'unavailable') for value in status.values()):
+            self.state.set(key, json.dumps(payload, ensure_ascii=False), ttl)
+        return dict(payload, cached=False, elapsed_ms=round((time.monotonic() - started) * 1000, 1))
+
+    def metrics(self):
+        with self._lock:
+            sources = {name: dict(counts) for name, counts in self._counts.items()}
+            pending = dict(self._pending)
+            cache = dict(self._cache)
+        for name, counts in sources.items():
+            seconds = counts.pop('seconds')
+            finished = counts['calls'] - pending.get(name, 0)
+            counts['avg_ms'] = round(seconds / finished * 1000, 1) if finished else None
+            counts['pending'] = pending.get(name, 0)
+        total = cache['hits'] + cache['misses']
+        cache['hit_rate'] = round(cache['hits'] / total, 3) if total else None
+        return {'sources': sources, 'cache': cache}
+
+
+# Busca federada, configurada pela aplicação
+retriever = FederatedSearch(shared_state)
+
+
+# Comando para atualizar o catálogo do File Server
+@click.command('index-fileserver')
+@click.option('--path', 'root', default='/', help='Pasta inicial no compartilhamento')
+@click.option('--max-depth', type=int, default=5, help='Níveis de subpastas percorridos')
+@with_appcontext
+def index_fileserver_command(root, max_depth):
+    """Copia os nomes dos arquivos do File Server para o catálogo da busca"""
+    catalog = retriever.catalog
+    if catalog is None:
+        raise click.UsageError("A fonte 'fileserver' não está em RETRIEVAL_SOURCES")
+    integration = get_integration('fileserver')
+    if integration is None or not integration.is_configured:
+        raise click.ClickException("Integração com o File Server indisponível (veja FILESERVER_* no .env)")
+    started = time.monotonic()
+    try:
+        files = [item for item in integration.search_files(root, '', max_depth) if not item['is_directory']]
+    finally:
+        integration.disconnect()
+    if not files:
+        # Falha de conexão também retorna uma lista vazia: mantém o catálogo atual
+        raise click.ClickException("Nenhum arquivo encontrado; o catálogo não foi alterado")
+    count = catalog.rebuild(files)
+    click.echo(f"{count} arquivos no catálogo ({time.monotonic() - started:.1f} s)")
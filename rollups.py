@@ -0,0 +1,301 @@
+# rollups.py
+# Totais de uso pré-agregados (tabela usage_rollups) para o painel de
+# administração: perguntas, tokens e latência por hora e por dia, no total e
+# por usuário, departamento e categoria (detect_query_type).
+#
+# Os totais são atualizados de forma incremental: cada execução soma apenas
+# as perguntas de query_history posteriores à última já processada
+# (rollup_state). O painel lê somente os totais, então o tempo de resposta
+# não depende do tamanho do histórico.
+#
+# Uso: "flask rollup-usage" pelo cron (ou "--interval N" como serviço); o
+# arquivamento do histórico executa a atualização antes de arquivar.
+
+import json
+import time
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from models import db, User, QueryHistory, UsageRollup, RollupState
+
+logger = logging.getLogger(__name__)
+
+# Nome do registro de progresso em rollup_state
+STATE_NAME = 'usage'
+
+# Limites superiores (ms) das faixas do histograma de latência; a última
+# faixa, acima de 120 s, não tem limite
+LATENCY_BUCKETS = (250, 500, 1000, 2000, 3000, 5000, 7500, 10000, 15000, 20000, 30000, 60000, 120000)
+
+# Dimensões do painel ('all' = total)
+DIMENSIONS = ('all', 'user', 'department', 'category')
+
+# Dimensões mantidas em cada granularidade: por usuário, apenas por dia (por
+# hora, seriam quase uma linha por pergunta)
+PERIOD_DIMENSIONS = {
+    'hour': ('all', 'department', 'category'),
+    'day': DIMENSIONS
+}
+
+# Granularidades: nome -> função que trunca o horário
+PERIODS = {
+    'hour': lambda timestamp: timestamp.replace(minute=0, second=0, microsecond=0),
+    'day': lambda timestamp: timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+}
+
+
+# Função para estimar um percentil a partir do histograma de latência
+def histogram_percentile(histogram, fraction):
+    """Percentil aproximado (interpolação linear dentro da faixa)
+
+    Args:
+        histogram (list): Contagens por faixa de LATENCY_BUCKETS (mais a última)
+        fraction (float): Percentil entre 0 e 1
+
+    Returns:
+        int: Latência em ms, ou None sem medições
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    target = fraction * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= target:
+            lower = LATENCY_BUCKETS[index - 1] if index else 0
+            upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else lower * 2
+            return int(lower + (upper - lower) * (target - seen) / count)
+        seen += count
+    return LATENCY_BUCKETS[-1] * 2
+
+
+def _merge(histogram, other):
+    if len(histogram) < len(other):
+        histogram.extend([0] * (len(other) - len(histogram)))
+    for index, count in enumerate(other):
+        histogram[index] += count
+
+
+class UsageRollups:
+    """Mantém os totais de uso e responde às consultas do painel"""
+
+    def __init__(self):
+        self.config = {}
+
+    def init_app(self, app):
+        self.config = app.config
+
+    def _state(self):
+        state = db.session.get(RollupState, STATE_NAME)
+        if state is None:
+            try:
+                db.session.add(RollupState(name=STATE_NAME, last_id=0))
+                db.session.commit()
+            except IntegrityError:
+                # Outro processo criou o registro ao mesmo tempo
+                db.session.rollback()
+            state = db.session.get(RollupState, STATE_NAME)
+        return state
+
+    def refresh_batch(self, batch_size):
+        """Soma aos totais o próximo lote de perguntas ainda não processadas
+
+        O progresso é atualizado com uma comparação (last_id = valor lido) na
+        mesma transação dos totais: se dois processos atualizarem ao mesmo
+        tempo, apenas um grava o lote.
+
+        Returns:
+            int: Perguntas somadas
+        """
+        state = self._state()
+        last_id = state.last_id
+        rows = db.session.query(
+            QueryHistory.id, QueryHistory.timestamp, QueryHistory.category, QueryHistory.prompt_tokens,
+            QueryHistory.completion_tokens, QueryHistory.latency_ms, User.username, User.department
+        ).outerjoin(User, QueryHistory.user_id == User.id) \
+            .filter(QueryHistory.id > last_id).order_by(QueryHistory.id).limit(batch_size).all()
+        if not rows:
+            db.session.rollback()
+            return 0
+
+        # Totais por hora só dentro do prazo de ROLLUP_HOURLY_RETENTION_DAYS
+        hourly_limit = datetime.utcnow() - timedelta(days=int(self.config.get('ROLLUP_HOURLY_RETENTION_DAYS', 14)))
+        totals = {}
+        for row in rows:
+            keys = {
+                'all': '',
+                'user': row.username or '',
+                'department': row.department or '',
+                'category': row.category or ''
+            }
+            latency_index = bisect.bisect_left(LATENCY_BUCKETS, row.latency_ms) if row.latency_ms is not None else None
+            for period, truncate in PERIODS.items():
+                if period == 'hour' and row.timestamp < hourly_limit:
+                    continue
+                bucket = truncate(row.timestamp)
+                for dimension in PERIOD_DIMENSIONS[period]:
+                    entry = totals.setdefault((period, bucket, dimension, keys[dimension]), {
+                        'queries': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                        'latency_count': 0, 'latency_total_ms': 0,
+                        'latency_histogram': [0] * (len(LATENCY_BUCKETS) + 1)
+                    })
+                    entry['queries'] += 1
+                    entry['prompt_tokens'] += row.prompt_tokens or 0
+                    entry['completion_tokens'] += row.completion_tokens or 0
+                    if latency_index is not None:
+                        entry['latency_count'] += 1
+                        entry['latency_total_ms'] += row.latency_ms
+                        entry['latency_histogram'][latency_index] += 1
+
+        try:
+            claimed = RollupState.query.filter_by(name=STATE_NAME, last_id=last_id).update(
+                {'last_id': rows[-1].id, 'last_timestamp': rows[-1].timestamp, 'updated_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+            if not claimed:
+                db.session.rollback()
+                return 0
+            self._upsert(totals)
+            db.session.commit()
+        except OperationalError as e:
+            # Banco ocupado por outra atualização: o lote fica para a próxima
+            db.session.rollback()
+            logger.warning("Atualização dos totais de uso adiada: %s", e)
+            return 0
+        return len(rows)
+
+    def _upsert(self, totals):
+        buckets = [bucket for (_, bucket, _, _) in totals]
+        existing = {
+            (rollup.period, rollup.bucket, rollup.dimension, rollup.key): rollup
+            for rollup in UsageRollup.query.filter(
+                UsageRollup.bucket >= min(buckets), UsageRollup.bucket <= max(buckets)
+            )
+        }
+        created = []
+        for key, entry in totals.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                period, bucket, dimension, name = key
+                created.append(dict(
+                    entry, period=period, bucket=bucket, dimension=dimension, key=name,
+                    latency_histogram=json.dumps(entry['latency_histogram'])
+                ))
+                continue
+            rollup.queries += entry['queries']
+            rollup.prompt_tokens += entry['prompt_tokens']
+            rollup.completion_tokens += entry['completion_tokens']
+            rollup.latency_count += entry['latency_count']
+            rollup.latency_total_ms += entry['latency_total_ms']
+            histogram = json.loads(rollup.latency_histogram)
+            _merge(histogram, entry['latency_histogram'])
+            rollup.latency_histogram = json.dumps(histogram)
+        db.session.bulk_insert_mappings(UsageRollup, created)
+
+    def refresh(self, batch_size=None):
+        """Processa todas as perguntas pendentes, em lotes
+
+        Returns:
+            int: Perguntas somadas
+        """
+        batch_size = int(batch_size or self.config.get('ROLLUP_BATCH_SIZE', 5000))
+        processed = 0
+        while True:
+            count = self.refresh_batch(batch_size)
+            db.session.expunge_all()
+            if not count:
+                break
+            processed += count
+        if processed:
+            self.prune()
+            logger.info("Totais de uso atualizados com %s perguntas", processed, extra={'processed': processed})
+        return processed
+
+    def prune(self):
+        """Remove os totais por hora mais antigos que ROLLUP_HOURLY_RETENTION_DAYS"""
+        days = int(self.config.get('ROLLUP_HOURLY_RETENTION_DAYS', 14))
+        limit = datetime.utcnow() - timedelta(days=days)
+        UsageRollup.query.filter(UsageRollup.period == 'hour', UsageRollup.bucket < limit) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+    def summary(self, dimension='department', period='day', since=None):
+        """Dados do painel: série do total por período e totais por chave da dimensão
+
+        Args:
+            dimension (str): 'user' (apenas por dia), 'department' ou 'category'
+            period (str): 'hour' ou 'day'
+            since (datetime, optional): Início do intervalo (padrão: 30 dias ou 48 horas)
+
+        Returns:
+            dict: series, breakdown e updated_until
+        """
+        if period not in PERIODS or dimension not in PERIOD_DIMENSIONS[period][1:]:
+            raise ValueError("Dimensão ou período inválido")
+        if since is None:
+            since = datetime.utcnow() - (timedelta(hours=48) if period == 'hour' else timedelta(days=30))
+        since = PERIODS[period](since)
+
+        rows = db.session.query(
+            UsageRollup.bucket, UsageRollup.dimension, UsageRollup.key, UsageRollup.queries,
+            UsageRollup.prompt_tokens, UsageRollup.completion_tokens, UsageRollup.latency_count,
+            UsageRollup.latency_total_ms, UsageRollup.latency_histogram
+        ).filter(
+            UsageRollup.period == period, UsageRollup.bucket >= since,
+            UsageRollup.dimension.in_(('all', dimension))
+        ).order_by(UsageRollup.bucket).all()
+
+        series, breakdown = [], {}
+        for row in rows:
+            if row.dimension == 'all':
+                group = {'key': row.bucket.strftime('%Y-%m-%d %H:%M')}
+                series.append(group)
+            else:
+                group = breakdown.setdefault(row.key, {'key': row.key})
+            for field in ('queries', 'prompt_tokens', 'completion_tokens', 'latency_count', 'latency_total_ms'):
+                group[field] = group.get(field, 0) + getattr(row, field)
+            _merge(group.setdefault('histogram', []), json.loads(row.latency_histogram))
+        state = db.session.get(RollupState, STATE_NAME)
+        return {
+            'series': [self._describe(group) for group in series],
+            'breakdown': sorted(
+                (self._describe(group) for group in breakdown.values()),
+                key=lambda item: item['queries'], reverse=True
+            ),
+            'updated_until': state.last_timestamp.strftime('%Y-%m-%d %H:%M:%S')
+            if state and state.last_timestamp else None
+        }
+
+    def _describe(self, group):
+        histogram = group.pop('histogram')
+        latency_count = group.pop('latency_count')
+        latency_total_ms = group.pop('latency_total_ms')
+        group['latency_avg_ms'] = int(latency_total_ms / latency_count) if latency_count else None
+        group['latency_p50_ms'] = histogram_percentile(histogram, 0.5)
+        group['latency_p95_ms'] = histogram_percentile(histogram, 0.95)
+        return group
+
+
+# Totais de uso da aplicação
+rollups = UsageRollups()
+
+
+# Comando para atualizar os totais de uso
+@click.command('rollup-usage')
+@click.option('--batch-size', type=int, default=None, help='Perguntas por transação')
+@click.option('--interval', type=float, default=0, help='Repetir a cada N segundos (0 = executar uma vez)')
+@with_appcontext
+def rollup_usage_command(batch_size, interval):
+    """Soma as perguntas novas aos totais de uso do painel"""
+    while True:
+        processed = rollups.refresh(batch_size)
+        if not interval:
+            click.echo(f"{processed} perguntas somadas aos totais de uso")
+            return
+        db.session.remove()
+        time.sleep(interval)
@@ -0,0 +1,367 @@
+# routing.py
+# Roteamento entre modelos: um modelo pequeno e rápido para consultas simples
+# e o modelo de 8B para as complexas, com limite de concorrência por modelo,
+# controle de memória para não sobrecarregar a RAM do servidor e classes de
+# prioridade (interativo, administração, segundo plano)
+
+import os
+import re
+import json
+import time
+import fcntl
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from inference import llama, registry
+
+logger = logging.getLogger(__name__)
+
+# Intervalo entre tentativas de reservar um modelo ocupado
+ACQUIRE_POLL_INTERVAL = 0.1
+
+# Classes de prioridade (menor valor = maior prioridade): perguntas do /ask,
+# ferramentas de administração e trabalhos em segundo plano (resumos, lotes)
+PRIORITY_CLASSES = {'interactive': 0, 'admin': 1, 'background': 2}
+
+# Tempos de espera guardados por classe para o cálculo do p95
+WAIT_SAMPLES = 1000
+
+# Frases que indicam que o modelo pequeno não soube responder
+LOW_CONFIDENCE_PATTERN = re.compile(
+    r"não (sei|tenho (essa|informaç\w+)|posso ajudar|consigo responder)|"
+    r"como (um )?modelo de (linguagem|ia)|desculpe, (mas )?não",
+    re.IGNORECASE
+)
+
+
+class ModelBusy(Exception):
+    """Nenhum modelo pôde ser reservado dentro do tempo de espera"""
+
+
+# Função para obter a memória total do servidor
+def total_memory_bytes():
+    """Lê a memória total em /proc/meminfo (0 se não disponível)"""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+# Função para avaliar se uma resposta do modelo pequeno é confiável
+def is_low_confidence(response):
+    """Heurística barata para detectar respostas ruins do modelo pequeno
+
+    Args:
+        response (str): Resposta gerada
+
+    Returns:
+        bool: True se a resposta deve ser refeita pelo modelo grande
+    """
+    text = (response or '').strip()
+    if len(text) < 20 or text.startswith('Erro ao processar'):
+        return True
+    if LOW_CONFIDENCE_PATTERN.search(text):
+        return True
+    # Respostas muito repetitivas indicam que o modelo entrou em laço
+    words = text.lower().split()
+    return len(words) >= 30 and len(set(words)) / len(words) < 0.3
+
+
+class ReservationLedger:
+    """Reservas de modelos compartilhadas entre os workers do Gunicorn
+
+    As reservas ficam em um arquivo JSON protegido por flock; reservas de
+    processos que já terminaram são descartadas a cada leitura. Cada entrada
+    está ativa (executando) ou aguardando; as que aguardam são atendidas por
+    classe de prioridade e, dentro da mesma classe, por ordem de chegada.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self.path, 'a+') as ledger_file:
+            fcntl.flock(ledger_file, fcntl.LOCK_EX)
+            try:
+                ledger_file.seek(0)
+                content = ledger_file.read()
+                try:
+                    reservations = json.loads(content) if content else []
+                except ValueError:
+                    reservations = []
+                reservations = [r for r in reservations if _pid_alive(r['pid'])]
+                yield reservations
+                ledger_file.seek(0)
+                ledger_file.truncate()
+                json.dump(reservations, ledger_file)
+            finally:
+                fcntl.flock(ledger_file, fcntl.LOCK_UN)
+
+    def try_reserve(self, token, model, max_concurrency, memory_bytes, weights_bytes, budget_bytes,
+                    priority=0, background_slots=0, request_id=None):
+        """Tenta reservar uma execução do modelo
+
+        Na primeira tentativa, a requisição entra na fila de espera do modelo.
+        Ela só é atendida quando nenhuma requisição de prioridade maior (ou
+        de mesma prioridade, mais antiga) estiver aguardando. Os pesos são
+        contados uma única vez por modelo, pois o arquivo GGUF é mapeado em
+        memória e compartilhado entre os processos.
+
+        Args:
+            token (str): Identificador da reserva (o mesmo em todas as tentativas)
+            priority (int): Classe de prioridade (ver PRIORITY_CLASSES)
+            background_slots (int): Execuções simultâneas permitidas à classe de
+                segundo plano (0 = sem limite além de max_concurrency)
+            request_id (str, optional): Geração associada, para preempção
+
+        Returns:
+            bool: True se a reserva foi feita
+        """
+        with self._locked() as entries:
+            mine = next((e for e in entries if e['id'] == token), None)
+            if mine is None:
+                mine = {
+                    'id': token, 'pid': os.getpid(), 'model': model, 'state': 'waiting',
+                    'priority': priority, 'since': time.time(), 'request_id': request_id
+                }
+                entries.append(mine)
+            ahead = [
+                e for e in entries
+                if e['state'] == 'waiting' and e['model'] == model and e['id'] != token
+                and (e['priority'], e['since']) < (priority, mine['since'])
+            ]
+            if ahead:
+                return False
+            active = [e for e in entries if e['state'] == 'active']
+            running = [e for e in active if e['model'] == model]
+            if len(running) >= max_concurrency:
+                return False
+            background = PRIORITY_CLASSES['background']
+            if (priority >= background and background_slots
+                    and sum(1 for e in running if e['priority'] >= background) >= background_slots):
+                return False
+            needed = memory_bytes + (0 if running else weights_bytes)
+            # Com o servidor ocioso, a execução é sempre permitida
+            if active and budget_bytes and reserved_bytes(active) + needed > budget_bytes:
+                return False
+            mine.update(state='active', memory=memory_bytes, weights=weights_bytes)
+            return True
+
+    def release(self, token):
+        with self._locked() as entries:
+            entries[:] = [e for e in entries if e['id'] != token]
+
+    def snapshot(self):
+        with self._locked() as entries:
+            return list(entries)
+
+
+def reserved_bytes(reservations):
+    """Memória reservada: cache KV de cada execução mais os pesos de cada modelo em uso"""
+    active = [r for r in reservations if r.get('state', 'active') == 'active']
+    weights = {r['model']: r['weights'] for r in active}
+    return sum(r['memory'] for r in active) + sum(weights.values())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ModelRouter:
+    """Seleciona o modelo de cada requisição e controla sua execução"""
+
+    def __init__(self, app=None):
+        self.config = {}
+        self.ledger = ReservationLedger()
+        self._lock = threading.Lock()
+        self._counts = {'routed': {}, 'fallbacks': 0, 'busy': 0, 'preempted': 0}
+        self._waits = {name: deque(maxlen=WAIT_SAMPLES) for name in PRIORITY_CLASSES}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+        state_dir = os.path.join(app.instance_path, 'routing')
+        os.makedirs(state_dir, exist_ok=True)
+        self.ledger.path = os.path.join(state_dir, 'reservations.json')
+
+    @property
+    def models(self):
+        """Modelos habilitados (com caminho ou servidores de inferência configurados)"""
+        return {
+            name: spec for name, spec in self.config.get('MODELS', {}).items()
+            if spec.get('path') or spec.get('endpoints')
+        }
+
+    @property
+    def default_model(self):
+        return self.config.get('DEFAULT_MODEL', 'large')
+
+    @property
+    def memory_budget(self):
+        budget_mb = int(self.config.get('INFERENCE_MEMORY_BUDGET_MB', 0))
+        if budget_mb:
+            return budget_mb * 1024 * 1024
+        return int(total_memory_bytes() * 0.8)
+
+    def select(self, category, question_tokens):
+        """Escolhe o modelo para uma consulta
+
+        Args:
+            category (str): Tipo de consulta (ver prompts.detect_query_type)
+            question_tokens (int): Tamanho da pergunta em tokens
+
+        Returns:
+            str: Nome do modelo
+        """
+        models = self.models
+        small = self.config.get('SMALL_MODEL', 'small')
+        if (small in models
+                and category in self.config.get('ROUTING_SMALL_CATEGORIES', ())
+                and question_tokens <= int(self.config.get('ROUTING_SMALL_MAX_TOKENS', 48))):
+            return small
+        return self.default_model
+
+    def _weights_bytes(self, spec):
+        if spec.get('memory_mb'):
+            return int(spec['memory_mb']) * 1024 * 1024
+        try:
+            return os.path.getsize(spec['path'])
+        except OSError:
+            return 0
+
+    def _preempt(self, name, priority, preempted):
+        """Cancela a geração de segundo plano mais recente do modelo
+
+        Usada quando uma requisição interativa aguarda há mais de
+        PRIORITY_PREEMPT_AFTER segundos; o trabalho interrompido volta para a
+        fila de quem o enviou (ver batch.py).
+        """
+        background = PRIORITY_CLASSES['background']
+        candidates = [
+            e for e in self.ledger.snapshot()
+            if e['state'] == 'active' and e['model'] == name and e['priority'] >= background
+            and e['priority'] > priority and e.get('request_id') and e['id'] not in preempted
+        ]
+        if not candidates:
+            return
+        victim = max(candidates, key=lambda e: e['since'])
+        preempted.add(victim['id'])
+        if registry.cancel(victim['request_id'], reason='preempted'):
+            logger.info("Geração %s interrompida para atender uma requisição interativa", victim['request_id'])
+            with self._lock:
+                self._counts['preempted'] += 1
+
+    @contextmanager
+    def reserve(self, name, budget=None, priority='interactive', request_id=None):
+        """Reserva uma execução do modelo, aguardando se estiver ocupado
+
+        Args:
+            name (str): Nome do modelo
+            budget (TokenBudget, optional): Orçamento da requisição (define o cache KV)
+            priority (str): Classe de prioridade (ver PRIORITY_CLASSES)
+            request_id (str, optional): Geração associada, para preempção
+
+        Raises:
+            ModelBusy: se não houver capacidade dentro de MODEL_QUEUE_TIMEOUT
+        """
+        spec = self.models[name]
+        level = PRIORITY_CLASSES[priority]
+        context_size = budget.context_size if budget else int(self.config.get('CONTEXT_SIZE', 4096))
+        kv_bytes = context_size * int(spec.get('kv_bytes_per_token', 131072))
+        weights_bytes = self._weights_bytes(spec)
+        if spec.get('endpoints'):
+            # Modelos servidos remotamente não consomem memória deste servidor
+            kv_bytes = weights_bytes = 0
+        started = time.monotonic()
+        deadline = started + float(self.config.get('MODEL_QUEUE_TIMEOUT', 30))
+        preempt_after = float(self.config.get('PRIORITY_PREEMPT_AFTER', 0))
+        token = f"{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}"
+        preempted = set()
+        try:
+            while not self.ledger.try_reserve(
+                    token, name, int(spec.get('max_concurrency', 1)), kv_bytes, weights_bytes,
+                    self.memory_budget, level, int(self.config.get('PRIORITY_BACKGROUND_SLOTS', 0)),
+                    request_id):
+                now = time.monotonic()
+                if now >= deadline:
+                    with self._lock:
+                        self._counts['busy'] += 1
+                    raise ModelBusy(f"Modelo '{name}' ocupado")
+                if level == 0 and preempt_after and now - started >= preempt_after:
+                    self._preempt(name, level, preempted)
+                time.sleep(ACQUIRE_POLL_INTERVAL)
+            with self._lock:
+                routed = self._counts['routed']
+                routed[name] = routed.get(name, 0) + 1
+                self._waits[priority].append(time.monotonic() - started)
+            yield spec
+        finally:
+            self.ledger.release(token)
+
+    def stream(self, prompt, category='default', question_tokens=0, priority='interactive', **kwargs):
+        """Executa a geração em streaming no modelo selecionado (sem fallback)"""
+        name = self.select(category, question_tokens)
+        with self.reserve(name, kwargs.get('budget'), priority, kwargs.get('request_id')) as spec:
+            yield from llama.stream(prompt, model_path=spec['path'], endpoints=spec.get('endpoints'), **kwargs)
+
+    def generate(self, prompt, category='default', question_tokens=0, priority='interactive', **kwargs):
+        """Executa a geração no modelo selecionado
+
+        Respostas de baixa confiança do modelo pequeno são refeitas no
+        modelo padrão.
+
+        Returns:
+            tuple: (resposta, nome do modelo que a produziu)
+        """
+        name = self.select(category, question_tokens)
+        with self.reserve(name, kwargs.get('budget'), priority, kwargs.get('request_id')) as spec:
+            response = llama.generate(prompt, model_path=spec['path'], endpoints=spec.get('endpoints'), **kwargs)
+        if name == self.default_model or not is_low_confidence(response):
+            return response, name
+
+        logger.info("Resposta de baixa confiança do modelo '%s', refazendo no modelo padrão", name)
+        with self._lock:
+            self._counts['fallbacks'] += 1
+        with self.reserve(self.default_model, kwargs.get('budget'), priority, kwargs.get('request_id')) as spec:
+            response = llama.generate(prompt, model_path=spec['path'], endpoints=spec.get('endpoints'), **kwargs)
+            return response, self.default_model
+
+    def metrics(self):
+        reservations = self.ledger.snapshot() if self.ledger.path else []
+        with self._lock:
+            counts = json.loads(json.dumps(self._counts))
+            waits = {name: sorted(samples) for name, samples in self._waits.items()}
+        counts['models'] = {
+            name: {
+                'active': sum(1 for r in reservations if r['model'] == name and r['state'] == 'active'),
+                'waiting': sum(1 for r in reservations if r['model'] == name and r['state'] == 'waiting'),
+                'max_concurrency': int(spec.get('max_concurrency', 1))
+            }
+            for name, spec in self.models.items()
+        }
+        counts['queue_wait_p95_ms'] = {
+            name: round(samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000, 1)
+            for name, samples in waits.items() if samples
+        }
+        counts['memory_reserved_mb'] = round(reserved_bytes(reservations) / 1024 / 1024, 1)
+        counts['memory_budget_mb'] = round(self.memory_budget / 1024 / 1024, 1)
+        return counts
+
+
+# Roteador global configurado pela aplicação
+router = ModelRouter()
@@ -4,14 +4,13 @@
 
 import os
 import logging
-from app import app
+from app import create_app
 from config import DevelopmentConfig
+from models import bootstrap_db
+from logging_config import configure_logging
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configurar logging (em texto, até a aplicação ser criada)
+configure_logging({'LOG_FORMAT': 'text', 'LOG_FILE': ''})
 logger = logging.getLogger(__name__)
 
 if __name__ == '__main__':
@@ -43,5 +42,7 @@ if __name__ == '__main__':
     
     # Iniciar a aplicação
     logger.info('Iniciando o Assistente IA Corporativo em modo de desenvolvimento')
-    app.config.from_object(DevelopmentConfig)
+    app = create_app(DevelopmentConfig)
+    with app.app_context():
+        bootstrap_db()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
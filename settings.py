@@ -0,0 +1,182 @@
+# settings.py
+# Configurações do modelo alteráveis em tempo de execução: os valores ficam na
+# tabela settings e são aplicados em todos os workers sem reiniciar o serviço.
+#
+# Cada worker guarda os valores em memória e, no máximo a cada
+# SETTINGS_CHECK_INTERVAL segundos, compara um número de versão no estado
+# compartilhado; o banco de dados só é consultado quando a versão muda.
+
+import time
+import logging
+import threading
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Setting
+from state_store import shared_state
+from utils import validate_model_config
+
+logger = logging.getLogger(__name__)
+
+# Configurações do modelo: chave na tabela settings (sem o prefixo) -> chave de configuração
+MODEL_SETTINGS = {
+    'llama_path': 'LLAMA_PATH',
+    'model_path': 'MODEL_PATH',
+    'context_size': 'CONTEXT_SIZE',
+    'temperature': 'TEMPERATURE'
+}
+
+# Prefixo das chaves do modelo na tabela settings
+KEY_PREFIX = 'model.'
+
+# Contador no estado compartilhado incrementado a cada alteração
+VERSION_KEY = 'settings-version'
+
+DESCRIPTIONS = {
+    'llama_path': 'Diretório do llama.cpp',
+    'model_path': 'Arquivo GGUF do modelo principal',
+    'context_size': 'Tamanho máximo do contexto',
+    'temperature': 'Temperatura de amostragem'
+}
+
+
+class RuntimeSettings:
+    """Configurações da tabela settings aplicadas à configuração da aplicação
+
+    O estado de cada aplicação (versão carregada, valores do ambiente) fica
+    em app.extensions; os métodos usam a aplicação do contexto atual.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions['runtime_settings'] = {
+            'version': None,
+            'checked_at': 0.0,
+            # Valores da configuração (ambiente), usados para chaves ausentes na tabela
+            'defaults': {key: app.config.get(name) for key, name in MODEL_SETTINGS.items()}
+        }
+        app.before_request(self._before_request)
+
+    def on_change(self, callback):
+        """Registra uma função chamada sempre que as configurações forem recarregadas"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def _before_request(self):
+        self.refresh()
+
+    def model_settings(self):
+        """Configurações do modelo em vigor neste worker"""
+        return {key: current_app.config.get(name) for key, name in MODEL_SETTINGS.items()}
+
+    def refresh(self, force=False):
+        """Recarrega as configurações se outro worker as alterou
+
+        Deve ser executada dentro de um contexto de aplicação.
+
+        Returns:
+            bool: True se as configurações foram recarregadas
+        """
+        app = current_app._get_current_object()
+        loaded = app.extensions['runtime_settings']
+        interval = float(app.config.get('SETTINGS_CHECK_INTERVAL', 1))
+        now = time.monotonic()
+        with self._lock:
+            if not force and loaded['version'] is not None and now - loaded['checked_at'] < interval:
+                return False
+            loaded['checked_at'] = now
+        version = self.state.get(VERSION_KEY) or '0'
+        if version == loaded['version'] and not force:
+            return False
+        try:
+            self.load(app)
+        except SQLAlchemyError as e:
+            # Banco ainda não inicializado: mantém os valores atuais e tenta de novo depois
+            db.session.rollback()
+            logger.error("Erro ao carregar as configurações: %s", e)
+            return False
+        loaded['version'] = version
+        return True
+
+    def load(self, app):
+        """Lê as configurações do modelo da tabela settings e as aplica"""
+        rows = Setting.query.filter(Setting.key.like(f"{KEY_PREFIX}%")).all()
+        values = dict(app.extensions['runtime_settings']['defaults'])
+        for row in rows:
+            key = row.key[len(KEY_PREFIX):]
+            if key in MODEL_SETTINGS:
+                values[key] = row.value
+        self.apply(app, values)
+        for callback in self._listeners:
+            callback()
+
+    def apply(self, app, values):
+        """Aplica as configurações do modelo à configuração da aplicação
+
+        O executor, o orçamento de tokens e o roteador leem app.config a cada
+        geração, então a próxima geração já usa os novos valores.
+        """
+        config = app.config
+        previous_model = config.get('MODEL_PATH')
+        previous_llama = config.get('LLAMA_PATH')
+        for key, name in MODEL_SETTINGS.items():
+            config[name] = values[key]
+
+        if config['MODEL_PATH'] != previous_model:
+            # O modelo padrão do roteamento acompanha MODEL_PATH (cópia, para
+            # não alterar o dicionário compartilhado da classe de configuração)
+            models = {name: dict(spec) for name, spec in config.get('MODELS', {}).items()}
+            default = models.get(config.get('DEFAULT_MODEL', 'large'))
+            if default is not None and default.get('path') == previous_model:
+                default['path'] = config['MODEL_PATH']
+            config['MODELS'] = models
+            logger.info("Modelo alterado para %s", config['MODEL_PATH'])
+        if config['MODEL_PATH'] != previous_model or config['LLAMA_PATH'] != previous_llama:
+            # O contador de tokens usa o tokenizador do modelo
+            from budget import budgeter
+            budgeter.init_app(app)
+
+    def save(self, values):
+        """Valida e grava configurações do modelo, avisando os demais workers
+
+        Args:
+            values (dict): Chaves de MODEL_SETTINGS a alterar
+
+        Raises:
+            ValueError: se alguma chave ou valor for inválido
+        """
+        unknown = set(values) - set(MODEL_SETTINGS)
+        if unknown:
+            raise ValueError(f"Configurações desconhecidas: {', '.join(sorted(unknown))}")
+        merged = self.model_settings()
+        merged.update({key: str(value).strip() for key, value in values.items()})
+        # O diretório do llama.cpp só é verificado quando alterado
+        checked = {key: value for key, value in merged.items() if key != 'llama_path' or key in values}
+        valid, error = validate_model_config(checked)
+        if not valid:
+            raise ValueError(error)
+
+        for key in values:
+            row = Setting.query.filter_by(key=f"{KEY_PREFIX}{key}").first()
+            if row is None:
+                row = Setting(key=f"{KEY_PREFIX}{key}", description=DESCRIPTIONS[key])
+                db.session.add(row)
+            row.value = merged[key]
+        db.session.commit()
+        self.bump()
+        logger.info("Configurações do modelo alteradas: %s", ', '.join(sorted(values)))
+        return self.model_settings()
+
+    def bump(self):
+        """Marca as configurações como alteradas e as recarrega neste worker"""
+        self.state.incr(VERSION_KEY)
+        self.refresh(force=True)
+
+
+# Configurações em tempo de execução compartilhadas entre os workers
+runtime_settings = RuntimeSettings(shared_state)
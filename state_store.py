@@ -0,0 +1,372 @@
+# state_store.py
+# Armazenamento de estado compartilhado entre os workers do Gunicorn:
+# sessões, cache de respostas, contadores e baldes de fichas (limites de uso)
+#
+# Backends disponíveis:
+#   sqlite:///caminho/state.db  (padrão, arquivo em instance/)
+#   redis://host:6379/0        (opcional, requer o pacote redis)
+
+import os
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import secrets
+import threading
+
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+# Probabilidade de remover entradas expiradas a cada escrita no SQLite
+PURGE_PROBABILITY = 0.01
+
+
+class SQLiteStore:
+    """Chave-valor com expiração em um arquivo SQLite (modo WAL)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS kv ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+        )
+
+    def _conn(self):
+        # Uma conexão por thread e por processo (as conexões não sobrevivem ao fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, value, expires_at))
+        if random.random() < PURGE_PROBABILITY:
+            conn.execute('DELETE FROM kv WHERE expires_at < ?', (time.time(),))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        """Incrementa um contador de forma atômica entre processos
+
+        O prazo de expiração é definido na criação do contador e não é
+        renovado pelos incrementos seguintes.
+
+        Returns:
+            int: Valor após o incremento
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                value = amount
+                conn.execute('INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+                             (key, str(value), now + ttl if ttl else None))
+            else:
+                value = int(row[0]) + amount
+                conn.execute('UPDATE kv SET value = ? WHERE key = ?', (str(value), key))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def take(self, key, capacity, rate, cost=1):
+        """Retira fichas de um balde (token bucket) de forma atômica entre processos
+
+        O balde começa cheio, com capacity fichas, e é reabastecido com rate
+        fichas por segundo. O valor guardado é "fichas instante".
+
+        Returns:
+            float: 0 se as fichas foram retiradas, ou segundos até haver fichas suficientes
+        """
+        return self.take_all([(key, capacity, rate)], cost)[0]
+
+    def take_all(self, buckets, cost=1):
+        """Retira fichas de vários baldes em uma única transação: de todos ou de nenhum
+
+        Args:
+            buckets (list): Baldes (chave, capacidade, fichas por segundo)
+            cost (int): Fichas retiradas de cada balde
+
+        Returns:
+            list: Segundos de espera de cada balde (todos 0 se as fichas foram retiradas)
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, capacity, rate in buckets:
+                row = conn.execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+                tokens = capacity
+                if row is not None and (row[1] is None or row[1] >= now):
+                    stored, updated = (float(v) for v in row[0].split())
+                    tokens = min(capacity, stored + (now - updated) * rate)
+                levels.append(tokens)
+            waits = [0.0 if tokens >= cost else (cost - tokens) / rate
+                     for (_, _, rate), tokens in zip(buckets, levels)]
+            if not any(waits):
+                for (key, capacity, rate), tokens in zip(buckets, levels):
+                    tokens -= cost
+                    # Depois de reabastecido, o balde equivale a um balde novo
+                    conn.execute('INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+                                 (key, f"{tokens} {now}", now + (capacity - tokens) / rate + 1))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return waits
+
+
+# Baldes de fichas no Redis: mesma lógica de SQLiteStore.take_all, em um
+# script Lua atômico (ARGV: custo, instante e capacidade e taxa de cada balde)
+TAKE_SCRIPT = """
+local cost, now = tonumber(ARGV[1]), tonumber(ARGV[2])
+local levels, waits, available = {}, {}, true
+for i, key in ipairs(KEYS) do
+    local capacity, rate = tonumber(ARGV[2 * i + 1]), tonumber(ARGV[2 * i + 2])
+    local tokens = capacity
+    local value = redis.call('GET', key)
+    if value then
+        local stored, updated = string.match(value, '(%S+) (%S+)')
+        tokens = math.min(capacity, tonumber(stored) + (now - tonumber(updated)) * rate)
+    end
+    levels[i] = tokens
+    if tokens >= cost then
+        waits[i] = '0'
+    else
+        waits[i] = tostring((cost - tokens) / rate)
+        available = false
+    end
+end
+if available then
+    for i, key in ipairs(KEYS) do
+        local capacity, rate = tonumber(ARGV[2 * i + 1]), tonumber(ARGV[2 * i + 2])
+        local tokens = levels[i] - cost
+        redis.call('SET', key, tostring(tokens) .. ' ' .. tostring(now),
+                   'EX', math.ceil((capacity - tokens) / rate) + 1)
+    end
+end
+return waits
+"""
+
+
+class RedisStore:
+    """Chave-valor em um servidor Redis (ou compatível)"""
+
+    def __init__(self, url):
+        # Dependência opcional, importada apenas quando configurada
+        import redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._take = None
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        value = self.client.incrby(key, amount)
+        if ttl and value == amount:
+            self.client.expire(key, int(ttl))
+        return value
+
+    def take(self, key, capacity, rate, cost=1):
+        return self.take_all([(key, capacity, rate)], cost)[0]
+
+    def take_all(self, buckets, cost=1):
+        if self._take is None:
+            self._take = self.client.register_script(TAKE_SCRIPT)
+        args = [cost, time.time()]
+        for _, capacity, rate in buckets:
+            args += [capacity, rate]
+        waits = self._take(keys=[key for key, _, _ in buckets], args=args)
+        return [float(wait) for wait in waits]
+
+
+# Função para criar o backend a partir de uma URL
+def create_store(url):
+    """Cria o backend de estado indicado pela URL
+
+    Args:
+        url (str): 'sqlite:///caminho' ou 'redis://...'
+
+    Returns:
+        SQLiteStore | RedisStore: Backend configurado
+    """
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    raise ValueError(f"Backend de estado não suportado: {url}")
+
+
+class SharedState:
+    """Acesso ao backend de estado configurado pela aplicação"""
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        url = app.config.get('STATE_STORE_URL')
+        if not url:
+            os.makedirs(app.instance_path, exist_ok=True)
+            url = f"sqlite:///{os.path.join(app.instance_path, 'state.db')}"
+        self.backend = create_store(url)
+        app.session_interface = StoreSessionInterface(self)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        return self.backend.incr(key, amount, ttl)
+
+    def take(self, key, capacity, rate, cost=1):
+        return self.backend.take(key, capacity, rate, cost)
+
+    def take_all(self, buckets, cost=1):
+        return self.backend.take_all(buckets, cost)
+
+
+# Estado compartilhado configurado pela aplicação
+shared_state = SharedState()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Sessão cujos dados ficam no backend de estado; o cookie guarda apenas o identificador"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class StoreSessionInterface(SessionInterface):
+    """Sessões no servidor, compartilhadas entre todos os workers"""
+
+    serializer = TaggedJSONSerializer()
+    key_prefix = 'session:'
+
+    def __init__(self, state):
+        self.state = state
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='flask-session-id')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.state.get(self.key_prefix + sid)
+                if data is not None:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        """Descarta a sessão atual e passa a usar um identificador novo
+
+        Usado no login: um identificador obtido antes da autenticação (por
+        exemplo, imposto por um atacante) deixa de valer (fixação de sessão).
+        """
+        self.state.delete(self.key_prefix + session.sid)
+        session.clear()
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.state.delete(self.key_prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        self.state.set(self.key_prefix + session.sid, self.serializer.dumps(dict(session)), ttl)
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode('utf-8'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+
+class ResponseCache:
+    """Cache de respostas do modelo para perguntas repetidas"""
+
+    key_prefix = 'response:'
+
+    def __init__(self, state):
+        self.state = state
+        self.ttl = 0
+
+    def init_app(self, app):
+        self.ttl = int(app.config.get('RESPONSE_CACHE_TTL', 0))
+
+    def _key(self, category, question):
+        normalized = ' '.join(question.lower().split())
+        digest = hashlib.sha256(f"{category}|{normalized}".encode('utf-8')).hexdigest()
+        return self.key_prefix + digest
+
+    def get(self, category, question):
+        if not self.ttl:
+            return None
+        return self.state.get(self._key(category, question))
+
+    def set(self, category, question, response):
+        if self.ttl:
+            self.state.set(self._key(category, question), response, self.ttl)
+
+
+# Cache de respostas compartilhado
+response_cache = ResponseCache(shared_state)
@@ -0,0 +1,158 @@
+# summarizer.py
+# Resumo contínuo das conversas longas: as perguntas mais antigas são
+# condensadas em um resumo salvo no banco de dados, para que o prompt de
+# cada nova pergunta não cresça indefinidamente
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from budget import budgeter
+from models import db, Conversation
+from prompts import get_system_prompt
+from routing import router
+from state_store import shared_state
+from utils import format_prompt
+
+logger = logging.getLogger(__name__)
+
+
+# Função para decidir quantas perguntas antigas devem ser resumidas
+def turns_to_summarize(turn_tokens, trigger_tokens, keep_turns):
+    """Calcula quantas perguntas, a partir da mais antiga, devem ir para o resumo
+
+    Args:
+        turn_tokens (list): Tokens de cada pergunta e resposta ainda não resumida
+        trigger_tokens (int): Total a partir do qual o resumo é feito (0 = nunca)
+        keep_turns (int): Perguntas mais recentes mantidas na íntegra
+
+    Returns:
+        int: Número de perguntas a resumir (0 se ainda não for necessário)
+    """
+    if not trigger_tokens or sum(turn_tokens) <= trigger_tokens:
+        return 0
+    return max(len(turn_tokens) - keep_turns, 0)
+
+
+# Função para montar o prompt de resumo
+def format_summary_prompt(summary, turns):
+    """Monta o prompt que pede ao modelo um novo resumo
+
+    Args:
+        summary (str): Resumo atual (ou None)
+        turns (list): Pares (pergunta, resposta) a incluir no resumo
+
+    Returns:
+        str: Prompt formatado
+    """
+    parts = []
+    if summary:
+        parts.append(f"Resumo anterior:\n{summary.strip()}")
+    for question, answer in turns:
+        parts.append(f"Funcionário: {question.strip()}\nAssistente: {answer.strip()}")
+    parts.append("Escreva o resumo atualizado da conversa.")
+    return format_prompt('\n\n'.join(parts), get_system_prompt('summary'), max_length=None)
+
+
+class ConversationSummarizer:
+    """Resume conversas em segundo plano, uma de cada vez por worker"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.config = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._counts = {'scheduled': 0, 'completed': 0, 'failed': 0, 'skipped': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.config = app.config
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def pending(self, conversation):
+        """Perguntas da conversa que devem ser resumidas agora"""
+        queries = conversation.pending_queries()
+        turn_tokens = [
+            budgeter.counter.count(query.question) + budgeter.counter.count(query.response)
+            for query in queries
+        ]
+        count = turns_to_summarize(
+            turn_tokens,
+            int(self.config.get('SUMMARY_TRIGGER_TOKENS', 0)),
+            int(self.config.get('SUMMARY_KEEP_TURNS', 2))
+        )
+        return queries[:count]
+
+    def schedule(self, conversation):
+        """Agenda o resumo da conversa se as perguntas pendentes excederem o limite"""
+        if not self.pending(conversation):
+            return False
+        with self._lock:
+            # Criado sob demanda para não criar threads antes do fork dos workers
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summarizer')
+            self._counts['scheduled'] += 1
+        self._executor.submit(self._run, conversation.id)
+        return True
+
+    def _run(self, conversation_id):
+        try:
+            with self.app.app_context():
+                self.summarize(conversation_id)
+        except Exception as e:
+            self._count('failed')
+            logger.error("Erro ao resumir a conversa %s: %s", conversation_id, e)
+
+    def summarize(self, conversation_id):
+        """Atualiza o resumo da conversa com as perguntas antigas pendentes
+
+        Deve ser executada dentro de um contexto de aplicação. Um contador no
+        estado compartilhado impede que dois workers resumam a mesma conversa
+        ao mesmo tempo.
+
+        Returns:
+            bool: True se o resumo foi atualizado
+        """
+        lock_key = f"summary-lock:{conversation_id}"
+        timeout = int(self.config.get('GENERATION_TIMEOUT', 120))
+        if shared_state.incr(lock_key, ttl=timeout * 2) != 1:
+            self._count('skipped')
+            return False
+        try:
+            conversation = db.session.get(Conversation, conversation_id)
+            queries = self.pending(conversation) if conversation else []
+            if not queries:
+                self._count('skipped')
+                return False
+
+            turns = [(query.question, query.response) for query in queries]
+            prompt = format_summary_prompt(conversation.summary, turns)
+            budget = budgeter.plan(prompt, 'summary')
+            summary, _ = router.generate(
+                prompt, 'summary', 0, priority='background',
+                request_id=f"summary-{conversation_id}", budget=budget
+            )
+            if not summary or summary.startswith('Erro ao processar'):
+                raise RuntimeError(summary or 'resumo vazio')
+
+            conversation.summary = summary
+            conversation.summarized_until = queries[-1].id
+            db.session.commit()
+            self._count('completed')
+            logger.info("Conversa %s: %s perguntas incluídas no resumo", conversation_id, len(queries))
+            return True
+        finally:
+            shared_state.delete(lock_key)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+# Resumidor global configurado pela aplicação
+summarizer = ConversationSummarizer()
@@ -3,28 +3,129 @@
 
 import unittest
 import os
+import sys
+import stat
+import runpy
+import subprocess
+import time
 import tempfile
+import threading
 import json
-from app import app
-from utils import sanitize_input, format_prompt, process_model_response
+import io
+import csv
+import gzip
+import re
+import struct
+import logging
+from unittest import mock
+from flask import session, g
+from datetime import datetime, timedelta
+from app import create_app, ask_request_id
+from config import TestingConfig
+from models import db, User, Conversation, QueryHistory, ArchivedQuery, FAQEntry, user_cache
+from archive import HistoryArchiver
+from export import export_history, pyarrow
+from rollups import rollups, histogram_percentile, LATENCY_BUCKETS
+from summarizer import summarizer, turns_to_summarize
+from prompts import prepare_prompt
+from batch import parse_questions, BatchWorker
+from quotas import validate_limits, limiter
+from utils import sanitize_input, format_prompt, format_conversation_prompt, process_model_response
+from inference import LlamaRunner, GenerationRegistry, GenerationCancelled, GenerationTimeout, GenerationFailed, GenerationConflict, StopScanner, KVCacheStore, SpeculativeDecoding, registry, kv_cache
+from budget import Budgeter, TokenCounter, TokenBudget, PromptTooLong, count_tokens
+from routing import ModelRouter, ReservationLedger, ModelBusy, is_low_confidence
+from backends import BackendPool, BackendUnavailable, get_pool
+from resources import InferenceResources, detect_topology, parse_timings
+from faq import FAQIndex, faq
+from retrieval import FileCatalog, SharePointSource, fuse, retriever
+from profiling import profiler
+from logging_config import RequestContextFilter, DebugSampler, AsyncQueueHandler, configure_logging, logging_metrics
+from chat_templates import ChatTemplates, TEMPLATES
+from routing import router
+from benchmarks.stub_inference_server import start_stub_server
+from state_store import SQLiteStore, SharedState, ResponseCache, shared_state
+from utils import load_or_create_secret_key
 
-class AssistenteIATestCase(unittest.TestCase):
+# Aplicação compartilhada pelos testes que não usam o banco; os arquivos
+# locais ficam em um diretório temporário, e não no instance/ do projeto
+APP_INSTANCE = tempfile.TemporaryDirectory()
+app = create_app(TestingConfig, instance_path=APP_INSTANCE.name)
+
+class AppTestCase(unittest.TestCase):
+    """Base dos testes que usam a aplicação com banco e estado compartilhado próprios
+    
+    Cada teste tem um diretório temporário (self.tmpdir) com o banco SQLite e
+    o estado compartilhado; as subclasses criam a aplicação com make_app,
+    informando apenas as configurações específicas, e os dados do teste.
+    """
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self._apps = []
+    
+    def tearDown(self):
+        user_cache.invalidate()
+        for test_app in self._apps:
+            with test_app.app_context():
+                db.engine.dispose()
+        self.tmpdir.cleanup()
+    
+    def make_app(self, **overrides):
+        """Cria uma aplicação (um worker) com o banco e o estado do teste
+        
+        Aplicações criadas no mesmo teste compartilham o banco e o estado,
+        como os workers do Gunicorn; as tabelas são criadas na primeira.
+        """
+        settings = {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(self.tmpdir.name, 'app.db')}",
+            'STATE_STORE_URL': f"sqlite:///{os.path.join(self.tmpdir.name, 'state.db')}",
+            **overrides
+        }
+        # Os componentes globais (registro de gerações, vagas de CPU) passam a
+        # usar o instance/ da aplicação, que precisa existir até o fim dos testes
+        test_app = create_app(type('AppConfig', (TestingConfig,), settings), instance_path=APP_INSTANCE.name)
+        if not self._apps:
+            with test_app.app_context():
+                db.create_all()
+        self._apps.append(test_app)
+        return test_app
+    
+    def add_user(self, username, role='user', department=None, password='senha'):
+        """Cria um usuário (sem senha se password for None) e retorna o identificador"""
+        with self._apps[0].app_context():
+            user = User(username=username, role=role, department=department)
+            if password is None:
+                user.password_hash = '-'
+            else:
+                user.set_password(password)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    
+    def login_as(self, username, test_app=None):
+        """Retorna um cliente com a sessão do usuário, sem passar por /login"""
+        test_app = test_app or self.app
+        with test_app.app_context():
+            user = User.query.filter_by(username=username).one()
+            values = {'username': user.username, 'role': user.role, 'user_id': user.id,
+                      'department': user.department}
+        client = test_app.test_client()
+        with client.session_transaction() as sess:
+            sess.update(values)
+        return client
+
+class AssistenteIATestCase(AppTestCase):
     """Testes unitários para o Assistente IA Corporativo"""
     
     def setUp(self):
         """Configuração para cada teste"""
-        # Configurar a aplicação para testes
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        app.config['SECRET_KEY'] = 'test-key'
-        
-        # Criar cliente de teste
-        self.client = app.test_client()
+        # Aplicação de testes com banco próprio, criado como pelo comando init-db
+        super().setUp()
+        self.app = self.make_app(SECRET_KEY='test-key')
+        self.user_id = self.add_user('testuser')
         
-        # Configurar sessão de teste
-        with self.client.session_transaction() as sess:
-            sess['username'] = 'testuser'
-            sess['role'] = 'user'
+        # Criar cliente de teste com a sessão do usuário
+        self.client = self.login_as('testuser')
     
     def test_index_route(self):
         """Testar rota principal"""
@@ -52,6 +153,28 @@ class AssistenteIATestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertFalse(data['success'])
     
+    def test_session_rotated_on_login(self):
+        """Testar que o login troca o identificador da sessão e o logout a remove"""
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['theme'] = 'escuro'
+        fixed = client.get_cookie('session').value
+        
+        response = client.post('/login', data={'username': 'testuser', 'password': 'senha'})
+        self.assertTrue(response.get_json()['success'])
+        logged_in = client.get_cookie('session').value
+        self.assertNotEqual(logged_in, fixed)
+        with self.app.test_request_context('/', headers={'Cookie': f'session={fixed}'}) as ctx:
+            self.assertTrue(self.app.session_interface.open_session(self.app, ctx.request).new)
+        with client.session_transaction() as sess:
+            self.assertEqual(sess['user_id'], self.user_id)
+            self.assertNotIn('theme', sess)
+        
+        client.get('/logout')
+        self.assertIsNone(client.get_cookie('session'))
+        with self.app.test_request_context('/', headers={'Cookie': f'session={logged_in}'}) as ctx:
+            self.assertTrue(self.app.session_interface.open_session(self.app, ctx.request).new)
+    
     def test_ask_route(self):
         """Testar rota de perguntas"""
         # Testar sem autenticação
@@ -67,18 +190,34 @@ class AssistenteIATestCase(unittest.TestCase):
         with self.client.session_transaction() as sess:
             sess['username'] = 'testuser'
             sess['role'] = 'user'
+            sess['user_id'] = self.user_id
         
-        # Simular resposta do modelo (em um teste real, mockamos a função run_llama_model)
-        app.config['TESTING_MODEL_RESPONSE'] = "Esta é uma resposta de teste."
-        
-        response = self.client.post('/ask', json={
-            'question': 'Teste'
-        })
+        # Simular resposta do modelo
+        with mock.patch('app.run_llama_model', return_value=("Esta é uma resposta de teste.", True)):
+            response = self.client.post('/ask', json={
+                'question': 'Teste'
+            })
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertIn('response', data)
         self.assertIn('timestamp', data)
     
+    def test_failed_answer_not_cached(self):
+        """Testar que respostas vazias ou de gerações com erro não vão para o cache"""
+        for result in (("Erro ao processar sua pergunta: falha", False), ("  ", True)):
+            with mock.patch('app.run_llama_model', return_value=result) as run:
+                self.client.post('/ask', json={'question': 'Pergunta sem cache'})
+                self.client.post('/ask', json={'question': 'Pergunta sem cache'})
+            self.assertEqual(run.call_count, 2)
+    
+    def test_duplicate_request_id_rejected(self):
+        """Testar que /ask recusa um identificador com geração em andamento"""
+        with mock.patch('app.registry.running', return_value=True), \
+                mock.patch('app.run_llama_model') as run:
+            response = self.client.post('/ask', json={'question': 'Olá', 'request_id': 'em-uso'})
+        self.assertEqual(response.status_code, 409)
+        run.assert_not_called()
+    
     def test_sanitize_input(self):
         """Testar função de sanitização de entrada"""
         # Testar remoção de caracteres perigosos
@@ -100,9 +239,10 @@ class AssistenteIATestCase(unittest.TestCase):
         # Verificar se o prompt contém a pergunta
         self.assertIn(question, prompt)
         
-        # Verificar se o prompt está no formato correto
-        self.assertIn("[INST]", prompt)
-        self.assertIn("[/INST]", prompt)
+        # Verificar se o prompt está no formato do LLaMA 3 (formato padrão)
+        self.assertIn("<|start_header_id|>user<|end_header_id|>", prompt)
+        self.assertTrue(prompt.endswith("<|start_header_id|>assistant<|end_header_id|>\n\n"))
+        self.assertNotIn("[INST]", prompt)
         
         # Testar com prompt de sistema personalizado
         system_prompt = "Você é um assistente técnico."
@@ -124,5 +264,1614 @@ class AssistenteIATestCase(unittest.TestCase):
         # Testar resposta vazia
         self.assertIn("Desculpe", process_model_response(""))
 
+# Script que simula o binário main do llama.cpp: ecoa o prompt (exceto com
+# --no-display-prompt) e responde
+FAKE_LLAMA_SCRIPT = """#!{python}
+import sys, time
+args = sys.argv[1:]
+prompt = open(args[args.index('-f') + 1]).read()
+if '--no-display-prompt' not in args:
+    print(prompt, flush=True)
+if '--prompt-cache' in args:
+    with open(args[args.index('--prompt-cache') + 1], 'w') as cache_file:
+        cache_file.write(prompt)
+if 'falhar' in prompt:
+    print('error: unable to load model', file=sys.stderr)
+    sys.exit(1)
+print('Início', flush=True)
+if 'parar' in prompt:
+    print('Fim do turno<|eot_id|>continua', flush=True)
+    time.sleep(30)
+if 'devagar' in prompt:
+    time.sleep(30)
+print('Resposta simulada', flush=True)
+"""
+
+# Script que simula o binário speculative do llama.cpp: o prompt e o resumo
+# (tokens propostos e aceitos) vão para a saída de erro
+FAKE_SPECULATIVE_SCRIPT = """#!{python}
+import sys
+args = sys.argv[1:]
+prompt = open(args[args.index('-f') + 1]).read()
+draft = int(args[args.index('--draft') + 1])
+print(prompt, file=sys.stderr)
+print('Resposta especulativa', flush=True)
+accepted = draft if 'ruim' not in prompt else 1
+print(f"n_draft   = {{draft}}\\nn_drafted = {{draft * 10}}\\nn_accept  = {{accepted * 10}}", file=sys.stderr)
+"""
+
+# Função para gravar um arquivo GGUF só com metadados (sem tensores)
+def write_gguf(path, metadata):
+    def string(text):
+        data = text.encode('utf-8')
+        return struct.pack('<Q', len(data)) + data
+    
+    body = b''
+    for key, value in metadata.items():
+        body += string(key)
+        if isinstance(value, list):
+            body += struct.pack('<IIQ', 9, 8, len(value)) + b''.join(string(item) for item in value)
+        elif isinstance(value, str):
+            body += struct.pack('<I', 8) + string(value)
+        else:
+            body += struct.pack('<II', 4, value)
+    with open(path, 'wb') as gguf_file:
+        gguf_file.write(b'GGUF' + struct.pack('<IQQ', 3, 0, len(metadata)) + body)
+
+class ChatTemplateTestCase(unittest.TestCase):
+    """Testes dos formatos de conversa lidos do arquivo do modelo"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.llama3 = os.path.join(self.tmpdir.name, 'llama3.gguf')
+        self.chatml = os.path.join(self.tmpdir.name, 'chatml.gguf')
+        # Arquivo antigo do LLaMA 3: fim de texto (1) como único token de parada
+        write_gguf(self.llama3, {
+            'general.architecture': 'llama',
+            'tokenizer.ggml.tokens': ['<|begin_of_text|>', '<|end_of_text|>', '<|eot_id|>', 'ol', 'á'],
+            'tokenizer.ggml.eos_token_id': 1,
+            'tokenizer.chat_template': "{{ '<|start_header_id|>' + message['role'] + '<|end_header_id|>' }}"
+        })
+        write_gguf(self.chatml, {
+            'general.architecture': 'qwen2',
+            'tokenizer.ggml.tokens': ['<|im_start|>', '<|im_end|>', 'a'],
+            'tokenizer.ggml.eos_token_id': 1,
+            'tokenizer.chat_template': "{{ '<|im_start|>' + message['role'] }}"
+        })
+        self.templates = ChatTemplates()
+        self.templates.config = {'CHAT_TEMPLATE': 'auto', 'MODEL_PATH': self.llama3}
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_detect_from_gguf(self):
+        """Testar a identificação do formato e a parada no fim de turno"""
+        self.assertIs(self.templates.for_model(), TEMPLATES['llama3'])
+        self.assertIs(self.templates.for_model(self.chatml), TEMPLATES['chatml'])
+        self.assertEqual(self.templates.command_args(),
+                         ['--override-kv', 'tokenizer.ggml.eos_token_id=int:2'])
+        # O fim de turno já é o token de parada
+        self.assertEqual(self.templates.command_args(self.chatml), [])
+        # Arquivo ausente ou que não é GGUF: formato padrão
+        self.assertIs(self.templates.for_model(os.path.join(self.tmpdir.name, 'nao-existe.gguf')),
+                      TEMPLATES['llama3'])
+        self.templates.config['CHAT_TEMPLATE'] = 'llama2'
+        self.assertIs(self.templates.for_model(self.chatml), TEMPLATES['llama2'])
+    
+    def test_prompt_per_model(self):
+        """Testar o prompt refeito no formato do modelo escolhido pelo roteador"""
+        first = self.templates.prompt('Sistema', [], 'Primeira')
+        prompt = self.templates.prompt('Sistema', [('Primeira', 'Resposta')], 'Segunda')
+        # O prompt anterior seguido da resposta é o início do novo (estado KV)
+        self.assertTrue(prompt.startswith(first + 'Resposta<|eot_id|>'))
+        self.assertEqual(prompt.count('<|start_header_id|>system'), 1)
+        
+        adapted = self.templates.adapt(prompt, self.chatml)
+        self.assertTrue(adapted.startswith('<|im_start|>system\nSistema<|im_end|>'))
+        self.assertTrue(adapted.endswith('<|im_start|>user\nSegunda<|im_end|>\n<|im_start|>assistant\n'))
+        self.assertEqual(self.templates.adapt('texto livre', self.chatml), 'texto livre')
+        
+        llama2 = TEMPLATES['llama2'].render('Sistema', [('Primeira', 'Resposta')], 'Segunda')
+        self.assertEqual(llama2, '[INST] <<SYS>>\nSistema\n<</SYS>>\n\nPrimeira [/INST] Resposta </s><s>'
+                                 '[INST] Segunda [/INST] ')
+        
+        runner = LlamaRunner()
+        runner.config = {'LLAMA_PATH': '/opt/llama.cpp', 'MODEL_PATH': self.llama3,
+                         'CONTEXT_SIZE': '4096', 'TEMPERATURE': '0.7'}
+        with mock.patch('inference.chat_templates', self.templates):
+            cmd = runner.build_command('prompt.txt')
+            self.assertEqual(runner.stop_sequences_for(self.chatml), TEMPLATES['chatml'].stop_sequences)
+        self.assertIn('--no-display-prompt', cmd)
+        self.assertNotIn('--in-prefix', cmd)
+        self.assertEqual(cmd[cmd.index('--override-kv') + 1], 'tokenizer.ggml.eos_token_id=int:2')
+
+class InferenceTestCase(unittest.TestCase):
+    """Testes do executor do modelo com tempo limite e cancelamento"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for name, script in (('main', FAKE_LLAMA_SCRIPT), ('speculative', FAKE_SPECULATIVE_SCRIPT)):
+            script_path = os.path.join(self.tmpdir.name, name)
+            with open(script_path, 'w') as f:
+                f.write(script.format(python=sys.executable))
+            os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IEXEC)
+        
+        self.runner = LlamaRunner()
+        self.runner.config = {
+            'LLAMA_PATH': self.tmpdir.name,
+            'MODEL_PATH': 'modelo.gguf',
+            'CONTEXT_SIZE': '4096',
+            'TEMPERATURE': '0.7',
+            'GENERATION_TIMEOUT': 10
+        }
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_generate_strips_prompt(self):
+        """Testar que a resposta não inclui o prompt ecoado"""
+        self.assertEqual(self.runner.generate('Olá'), 'Início\nResposta simulada')
+    
+    def test_timeout(self):
+        """Testar encerramento da geração por tempo limite"""
+        before = registry.metrics()['cancelled']['timeout']
+        start = time.monotonic()
+        with self.assertRaises(GenerationTimeout):
+            self.runner.generate('devagar', timeout=0.5)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(registry.metrics()['cancelled']['timeout'], before + 1)
+    
+    def test_cancel(self):
+        """Testar cancelamento explícito de uma geração em andamento"""
+        timer = threading.Timer(0.5, registry.cancel, args=('req-1',), kwargs={'user_id': 7})
+        timer.start()
+        with self.assertRaises(GenerationCancelled) as ctx:
+            self.runner.generate('devagar', request_id='req-1', user_id=7)
+        timer.join()
+        self.assertEqual(ctx.exception.reason, 'client')
+        self.assertEqual(registry.metrics()['active'], 0)
+    
+    def test_cancel_other_user(self):
+        """Testar que um usuário não cancela a geração de outro"""
+        stream = self.runner.stream('devagar Olá', request_id='req-2', user_id=7)
+        next(stream)
+        generation = registry._active['req-2']
+        self.assertFalse(registry.cancel('req-2', user_id=8))
+        self.assertIsNone(generation.reason)
+        self.assertIsNone(generation.process.poll())
+        
+        self.assertTrue(registry.cancel('req-2', user_id=7))
+        with self.assertRaises(GenerationCancelled) as ctx:
+            list(stream)
+        self.assertEqual(ctx.exception.reason, 'client')
+    
+    def test_duplicate_request_id(self):
+        """Testar que um identificador em uso não substitui a geração em andamento"""
+        stream = self.runner.stream('devagar Olá', request_id='req-dup', user_id=7)
+        next(stream)
+        generation = registry._active['req-dup']
+        with self.assertRaises(GenerationConflict):
+            self.runner.generate('Olá', request_id='req-dup', user_id=7)
+        with self.assertRaises(GenerationConflict):
+            registry.register('req-dup', 7, generation.process, 5)
+        self.assertIs(registry._active['req-dup'], generation)
+        
+        self.assertTrue(registry.cancel('req-dup', user_id=7))
+        with self.assertRaises(GenerationCancelled):
+            list(stream)
+        self.assertEqual(registry.metrics()['active'], 0)
+    
+    def test_stale_request_id_reused(self):
+        """Testar que o estado deixado por um worker encerrado não bloqueia o identificador"""
+        with tempfile.TemporaryDirectory() as state_dir:
+            registry_copy = GenerationRegistry(state_dir)
+            dead = subprocess.Popen(['true'])
+            dead.wait()
+            with open(os.path.join(state_dir, 'req-velho.json'), 'w') as state_file:
+                json.dump({'pid': None, 'user_id': 7, 'worker': dead.pid}, state_file)
+            self.assertFalse(registry_copy.running('req-velho'))
+            
+            with open(os.path.join(state_dir, 'req-vivo.json'), 'w') as state_file:
+                json.dump({'pid': None, 'user_id': 7, 'worker': os.getppid()}, state_file)
+            self.assertTrue(registry_copy.running('req-vivo'))
+            with self.assertRaises(GenerationConflict):
+                registry_copy.register('req-vivo', 7, mock.Mock(pid=None), 5)
+            self.assertEqual(registry_copy.metrics()['active'], 0)
+    
+    def test_invalid_request_id(self):
+        """Testar que identificadores fora do padrão não viram nomes de arquivo"""
+        with tempfile.TemporaryDirectory() as state_dir:
+            registry_copy = GenerationRegistry(os.path.join(state_dir, 'generations'))
+            os.makedirs(registry_copy.state_dir)
+            with self.assertRaises(ValueError):
+                registry_copy.register('../vitima', 7, mock.Mock(pid=1), 10)
+            self.assertEqual(os.listdir(state_dir), ['generations'])
+            self.assertFalse(registry_copy.cancel('../vitima', user_id=7))
+        with self.assertRaises(ValueError):
+            next(self.runner.stream('Olá', request_id='../vitima'))
+        self.assertEqual(registry.metrics()['active'], 0)
+        
+        # Na rota, um identificador inválido do corpo dá lugar ao da requisição
+        with app.test_request_context('/ask', method='POST'):
+            g.request_id = 'servidor'
+            self.assertEqual(ask_request_id({'request_id': '../vitima'}), 'servidor')
+            self.assertEqual(ask_request_id({'request_id': ['lista']}), 'servidor')
+            self.assertEqual(ask_request_id({'request_id': 'cliente-1'}), 'cliente-1')
+            self.assertEqual(g.request_id, 'cliente-1')
+    
+    def test_process_error(self):
+        """Testar que o llama.cpp terminando com erro não produz uma resposta vazia"""
+        before = registry.metrics()
+        with self.assertLogs('inference', level='ERROR') as logs:
+            with self.assertRaises(GenerationFailed):
+                self.runner.generate('falhar')
+        self.assertIn('unable to load model', logs.output[0])
+        after = registry.metrics()
+        self.assertEqual(after['completed'], before['completed'])
+        self.assertEqual(after['failed'], before['failed'] + 1)
+        self.assertEqual(after['active'], 0)
+    
+    def test_stream_closed_by_client(self):
+        """Testar que fechar o stream encerra o processo do modelo"""
+        before = registry.metrics()['cancelled']['disconnect']
+        stream = self.runner.stream('devagar Olá')
+        next(stream)
+        stream.close()
+        self.assertEqual(registry.metrics()['cancelled']['disconnect'], before + 1)
+
+    def test_stop_on_end_of_turn(self):
+        """Testar que a geração termina no marcador de fim de turno"""
+        start = time.monotonic()
+        self.assertEqual(self.runner.generate('parar'), 'Início\nFim do turno')
+        self.assertLess(time.monotonic() - start, 5)
+    
+    def test_conversation_prompt(self):
+        """Testar que o histórico da conversa ecoado pelo llama.cpp não aparece na resposta"""
+        first = format_prompt('Primeira pergunta')
+        prompt = format_conversation_prompt([('Primeira pergunta', 'Primeira resposta')], 'Segunda pergunta')
+        self.assertTrue(prompt.startswith(first + 'Primeira resposta'))
+        self.assertEqual(self.runner.generate(prompt), 'Início\nResposta simulada')
+    
+    def test_prompt_cache_per_conversation(self):
+        """Testar que o estado KV da conversa é salvo e reaproveitado na pergunta seguinte"""
+        with mock.patch.multiple(kv_cache, directory=self.tmpdir.name, budget_bytes=1024 * 1024):
+            before = kv_cache.metrics()
+            self.runner.generate('Olá', conversation_id=5)
+            self.runner.generate('Olá de novo', conversation_id=5)
+            after = kv_cache.metrics()
+        self.assertEqual(after['misses'], before['misses'] + 1)
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['conversations'], 1)
+    
+    def test_speculative_decoding(self):
+        """Testar a geração com modelo de rascunho e a suspensão por baixa aceitação"""
+        self.runner.config.update({
+            'DRAFT_MODEL_PATH': 'rascunho.gguf', 'SPECULATIVE_DRAFT_TOKENS': 4,
+            'SPECULATIVE_WINDOW': 2, 'SPECULATIVE_MIN_ACCEPTANCE': 0.5, 'SPECULATIVE_RETRY_SECONDS': 600
+        })
+        decoding = SpeculativeDecoding(self.runner.config)
+        with mock.patch('inference.speculative', decoding):
+            self.assertEqual(self.runner.generate('Olá'), 'Resposta especulativa')
+            self.assertEqual(decoding.metrics()['acceptance_rate'], 1.0)
+            # Modelo pequeno: sem especulação
+            self.assertEqual(self.runner.generate('Olá', model_path='pequeno.gguf'), 'Início\nResposta simulada')
+            
+            self.runner.generate('ruim')
+            self.runner.generate('ruim')
+            metrics = decoding.metrics()
+            self.assertEqual(metrics['suspended'], 1)
+            self.assertGreater(metrics['suspended_for_seconds'], 0)
+            self.assertEqual(decoding.draft_tokens('modelo.gguf'), 0)
+            self.assertEqual(self.runner.generate('Olá'), 'Início\nResposta simulada')
+            
+            with mock.patch('inference.time.monotonic', return_value=time.monotonic() + 601):
+                self.assertEqual(decoding.draft_tokens('modelo.gguf'), 4)
+    
+    def test_stop_scanner_split_marker(self):
+        """Testar marcador de fim de turno dividido entre duas leituras"""
+        scanner = StopScanner()
+        self.assertEqual(scanner.feed('Resposta <|eot'), 'Resposta ')
+        self.assertEqual(scanner.feed('_id|> lixo'), '')
+        self.assertTrue(scanner.stopped)
+
+class BudgetTestCase(unittest.TestCase):
+    """Testes do orçamento de tokens por tipo de consulta"""
+    
+    def setUp(self):
+        self.budgeter = Budgeter()
+        self.budgeter.config = {
+            'CONTEXT_SIZE': '4096',
+            'MAX_QUESTION_TOKENS': 50,
+            'TOKEN_BUDGETS': app.config['TOKEN_BUDGETS']
+        }
+    
+    def test_short_question_gets_smaller_budget(self):
+        """Testar que perguntas curtas de sim/não recebem menos tokens"""
+        short = self.budgeter.plan('prompt', 'hr', 'Posso tirar férias em julho?')
+        detailed = self.budgeter.plan('prompt', 'technical', 'Como configuro a VPN no notebook novo?')
+        self.assertLess(short.n_predict, detailed.n_predict)
+        self.assertLessEqual(detailed.n_predict, app.config['TOKEN_BUDGETS']['technical']['max_predict'])
+    
+    def test_context_fits_prompt_and_answer(self):
+        """Testar que o contexto comporta o prompt e a resposta"""
+        budget = self.budgeter.plan('x' * 3500, 'default', 'pergunta')
+        self.assertGreaterEqual(budget.context_size, budget.prompt_tokens + budget.n_predict)
+        self.assertEqual(budget.context_size % 256, 0)
+        self.assertLessEqual(budget.context_size, 4096)
+    
+    def test_prompt_leaves_room_for_answer(self):
+        """Testar que o prompt que enche o contexto perde o histórico antigo ou é recusado"""
+        budget = self.budgeter.plan('x' * 13300, 'default', 'pergunta')
+        self.assertGreaterEqual(budget.n_predict, 128)
+        self.assertLessEqual(budget.prompt_tokens + budget.n_predict, 4096)
+        with self.assertRaises(PromptTooLong):
+            self.budgeter.plan('x' * 14000, 'default', 'pergunta')
+        
+        self.budgeter.config.update({'CONTEXT_SIZE': '1024', 'MAX_HISTORY_TOKENS': 10000})
+        turns = [(f'pergunta {i}', f'resposta {i} ' + 'y' * 1000) for i in range(4)]
+        conversation = mock.Mock(title='pergunta', summary='Resumo ' + 'z' * 1000, turns=lambda: turns)
+        with mock.patch('prompts.budgeter', self.budgeter):
+            prompt, _, budget = prepare_prompt('Nova pergunta', conversation)
+        self.assertGreaterEqual(budget.n_predict, 128)
+        self.assertIn('resposta 3', prompt)
+        self.assertNotIn('resposta 0', prompt)
+        self.assertIn('Resumo', prompt)
+    
+    def test_trim_question(self):
+        """Testar corte da pergunta pelo número de tokens"""
+        question = 'palavra ' * 200
+        trimmed = self.budgeter.trim_question(question)
+        self.assertLessEqual(TokenCounter().count(trimmed), 50)
+    
+    def test_tokenizer_loaded_once_per_model(self):
+        """Testar que a contagem usa um tokenizador por modelo, carregado uma vez, sem iniciar processos"""
+        tokenizers = {'grande.gguf': mock.Mock(), 'pequeno.gguf': mock.Mock()}
+        tokenizers['grande.gguf'].tokenize.side_effect = lambda data, **kwargs: data.split()
+        tokenizers['pequeno.gguf'].tokenize.side_effect = lambda data, **kwargs: list(data)
+        count_tokens.cache_clear()
+        with mock.patch('budget.load_tokenizer', side_effect=tokenizers.get) as load, \
+                mock.patch('subprocess.run') as run, mock.patch('subprocess.Popen') as popen:
+            large, small = TokenCounter('grande.gguf'), TokenCounter('pequeno.gguf')
+            self.assertEqual(large.count('uma pergunta'), 2)
+            self.assertEqual(large.count('uma pergunta'), 2)
+            self.assertEqual(small.count('uma pergunta'), 12)
+        count_tokens.cache_clear()
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(tokenizers['grande.gguf'].tokenize.call_count, 1)
+        self.assertFalse(run.called or popen.called)
+        # Sem o pacote ou o arquivo do modelo, a contagem é estimada
+        self.assertEqual(TokenCounter('inexistente.gguf').count('x' * 35), 10)
+    
+    def test_select_history_keeps_recent_turns(self):
+        """Testar que o histórico da conversa descarta primeiro as perguntas mais antigas"""
+        self.budgeter.config['MAX_HISTORY_TOKENS'] = 40
+        turns = [(f'pergunta {i}', 'resposta ' * 10) for i in range(5)]
+        history = self.budgeter.select_history(turns)
+        self.assertEqual(history, turns[-1:])
+
+class KVCacheTestCase(unittest.TestCase):
+    """Testes do cache de estado KV das conversas"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = KVCacheStore()
+        self.store.directory = self.tmpdir.name
+        self.store.budget_bytes = 250
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def _write_state(self, conversation_id, age):
+        with self.store.acquire(conversation_id, 'modelo.gguf') as path:
+            with open(path, 'w') as state_file:
+                state_file.write('x' * 100)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+    
+    def test_evicts_least_recently_used(self):
+        """Testar remoção dos estados usados há mais tempo ao exceder o orçamento"""
+        oldest = self._write_state(1, age=30)
+        recent = self._write_state(2, age=10)
+        newest = self._write_state(3, age=0)
+        self.store.evict()
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(os.path.exists(newest))
+    
+    def test_state_in_use_is_not_shared(self):
+        """Testar que duas gerações da mesma conversa não usam o mesmo estado ao mesmo tempo"""
+        with self.store.acquire(1, 'modelo.gguf') as first:
+            with self.store.acquire(1, 'modelo.gguf') as second:
+                self.assertIsNotNone(first)
+                self.assertIsNone(second)
+    
+    def test_discard(self):
+        """Testar remoção dos estados de uma conversa excluída"""
+        path = self._write_state(7, age=0)
+        self.store.discard(7)
+        self.assertFalse(os.path.exists(path))
+
+class RoutingTestCase(unittest.TestCase):
+    """Testes do roteamento entre modelos"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.router = ModelRouter()
+        self.router.ledger = ReservationLedger(os.path.join(self.tmpdir.name, 'reservations.json'))
+        self.router.config = {
+            'MODELS': {
+                'large': {'path': 'grande.gguf', 'max_concurrency': 1, 'memory_mb': 100},
+                'small': {'path': 'pequeno.gguf', 'max_concurrency': 2, 'memory_mb': 10}
+            },
+            'DEFAULT_MODEL': 'large',
+            'SMALL_MODEL': 'small',
+            'ROUTING_SMALL_CATEGORIES': ('default', 'hr'),
+            'ROUTING_SMALL_MAX_TOKENS': 48,
+            'INFERENCE_MEMORY_BUDGET_MB': 4096,
+            'MODEL_QUEUE_TIMEOUT': 0.2,
+            'CONTEXT_SIZE': '4096'
+        }
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_select(self):
+        """Testar escolha do modelo por categoria e tamanho da pergunta"""
+        self.assertEqual(self.router.select('hr', 10), 'small')
+        self.assertEqual(self.router.select('technical', 10), 'large')
+        self.assertEqual(self.router.select('default', 200), 'large')
+        
+        # Sem modelo pequeno configurado, tudo vai para o modelo padrão
+        self.router.config['MODELS']['small']['path'] = ''
+        self.assertEqual(self.router.select('hr', 10), 'large')
+    
+    def test_concurrency_limit(self):
+        """Testar limite de execuções simultâneas por modelo"""
+        with self.router.reserve('large'):
+            with self.assertRaises(ModelBusy):
+                with self.router.reserve('large'):
+                    pass
+            # Outro modelo continua disponível
+            with self.router.reserve('small'):
+                pass
+        self.assertEqual(self.router.metrics()['models']['large']['active'], 0)
+    
+    def test_memory_budget(self):
+        """Testar que a memória reservada não ultrapassa o orçamento"""
+        self.router.config['INFERENCE_MEMORY_BUDGET_MB'] = 700
+        budget = TokenBudget(256, 4096)
+        with self.router.reserve('large', budget):
+            self.assertGreater(self.router.metrics()['memory_reserved_mb'], 100)
+            with self.assertRaises(ModelBusy):
+                with self.router.reserve('small', budget):
+                    pass
+    
+    def test_priority_order(self):
+        """Testar que requisições interativas passam à frente das de segundo plano"""
+        ledger = self.router.ledger
+        self.assertTrue(ledger.try_reserve('ativa', 'large', 1, 0, 0, 0, priority=0))
+        self.assertFalse(ledger.try_reserve('lote', 'large', 1, 0, 0, 0, priority=2))
+        self.assertFalse(ledger.try_reserve('pergunta', 'large', 1, 0, 0, 0, priority=0))
+        ledger.release('ativa')
+        # A requisição de segundo plano chegou antes, mas a interativa é atendida primeiro
+        self.assertFalse(ledger.try_reserve('lote', 'large', 1, 0, 0, 0, priority=2))
+        self.assertTrue(ledger.try_reserve('pergunta', 'large', 1, 0, 0, 0, priority=0))
+        
+        # Limite de execuções simultâneas de segundo plano por modelo
+        self.assertTrue(ledger.try_reserve('lote-1', 'small', 2, 0, 0, 0, priority=2, background_slots=1))
+        self.assertFalse(ledger.try_reserve('lote-2', 'small', 2, 0, 0, 0, priority=2, background_slots=1))
+        ledger.release('lote-2')
+        self.assertTrue(ledger.try_reserve('pergunta-2', 'small', 2, 0, 0, 0, priority=0, background_slots=1))
+    
+    def test_preemption(self):
+        """Testar interrupção de uma geração de segundo plano por uma pergunta interativa"""
+        self.router.config.update(MODEL_QUEUE_TIMEOUT=2, PRIORITY_PREEMPT_AFTER=0.1)
+        cancelled = threading.Event()
+        started = threading.Event()
+        
+        def background():
+            with self.router.reserve('large', priority='background', request_id='batch-1'):
+                started.set()
+                cancelled.wait(2)
+        
+        def cancel(request_id, reason):
+            self.assertEqual((request_id, reason), ('batch-1', 'preempted'))
+            cancelled.set()
+            return True
+        
+        worker = threading.Thread(target=background)
+        worker.start()
+        started.wait(1)
+        with mock.patch('routing.registry.cancel', side_effect=cancel):
+            with self.router.reserve('large'):
+                pass
+        worker.join()
+        metrics = self.router.metrics()
+        self.assertEqual(metrics['preempted'], 1)
+        self.assertIn('interactive', metrics['queue_wait_p95_ms'])
+    
+    def test_fallback_on_low_confidence(self):
+        """Testar que respostas ruins do modelo pequeno são refeitas no grande"""
+        answers = {'pequeno.gguf': 'Não sei.', 'grande.gguf': 'Resposta completa e detalhada do modelo grande.'}
+        with mock.patch('routing.llama.generate', side_effect=lambda prompt, model_path, **kw: answers[model_path]):
+            response, model = self.router.generate('prompt', 'hr', 5)
+        self.assertEqual(model, 'large')
+        self.assertEqual(response, answers['grande.gguf'])
+        self.assertEqual(self.router.metrics()['fallbacks'], 1)
+    
+    def test_is_low_confidence(self):
+        """Testar heurística de baixa confiança"""
+        self.assertTrue(is_low_confidence(''))
+        self.assertTrue(is_low_confidence('Desculpe, não tenho informações sobre isso.'))
+        self.assertTrue(is_low_confidence('sim ' * 40))
+        self.assertFalse(is_low_confidence('Sim, as férias podem ser divididas em até três períodos.'))
+
+# Script que simula o binário main do llama.cpp na calibração: a velocidade
+# depende do número de threads (-t) e é impressa na saída de erro
+FAKE_TIMINGS_SCRIPT = """#!{python}
+import sys
+args = sys.argv[1:]
+threads = int(args[args.index('-t') + 1])
+speed = {{1: 4.0, 2: 7.5, 4: 6.0}}.get(threads, 1.0)
+print(f"llama_print_timings: prompt eval time =   500.00 ms /    40 tokens (   12.50 ms per token, {{threads * 20.0:8.2f}} tokens per second)", file=sys.stderr)
+print(f"llama_print_timings:        eval time =  8000.00 ms /    63 runs   (  126.98 ms per token, {{speed:8.2f}} tokens per second)", file=sys.stderr)
+"""
+
+class ResourcesTestCase(unittest.TestCase):
+    """Testes da topologia de CPU, das vagas e da calibração do modelo"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Dois nós NUMA, 4 núcleos físicos por nó e 2 CPUs lógicas por núcleo
+        root = self.tmpdir.name
+        for node, cpulist in ((0, '0-3,8-11'), (1, '4-7,12-15')):
+            os.makedirs(os.path.join(root, 'node', f'node{node}'))
+            with open(os.path.join(root, 'node', f'node{node}', 'cpulist'), 'w') as f:
+                f.write(cpulist + '\n')
+        for cpu in range(16):
+            topology = os.path.join(root, 'cpu', f'cpu{cpu}', 'topology')
+            os.makedirs(topology)
+            for name, value in (('physical_package_id', (cpu % 8) // 4), ('core_id', cpu % 4)):
+                with open(os.path.join(topology, name), 'w') as f:
+                    f.write(f"{value}\n")
+        self.resources = InferenceResources()
+        self.resources.config = {
+            'LLAMA_PATH': root, 'MODEL_PATH': 'modelo.gguf', 'CONTEXT_SIZE': '4096', 'TEMPERATURE': '0.7',
+            'MODELS': {'large': {'max_concurrency': 4}}, 'LLAMA_NUMA': 'auto', 'LLAMA_MLOCK': True
+        }
+        self.resources.node_count = 2
+        self.resources.calibration_file = os.path.join(root, 'calibration.json')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_topology_and_slots(self):
+        """Testar a divisão dos núcleos físicos em vagas por nó NUMA"""
+        nodes = detect_topology(self.tmpdir.name, available=range(16))
+        self.assertEqual(sorted(nodes), [0, 1])
+        self.assertEqual(nodes[0], [[0, 8], [1, 9], [2, 10], [3, 11]])
+        
+        self.resources.slots = self.resources.plan_slots(nodes)
+        self.assertEqual(len(self.resources.slots), 4)
+        placement = self.resources.placement(2)
+        self.assertEqual(placement.cpus, [4, 5, 12, 13])
+        self.assertEqual((placement.threads, placement.batch_threads), (2, 4))
+        self.assertEqual(self.resources.command_args(placement),
+                         ['-t', '2', '-tb', '4', '--mlock', '--numa', 'numactl'])
+        
+        # Valores explícitos têm prioridade
+        self.resources.config.update({'LLAMA_NUM_THREADS': 3, 'LLAMA_MMAP': False, 'LLAMA_NUMA': 'off'})
+        self.assertEqual(self.resources.command_args(self.resources.placement(0)),
+                         ['-t', '3', '-tb', '4', '--mlock', '--no-mmap'])
+    
+    def test_runner_thread_count(self):
+        """Testar que o número de threads não é mais a temperatura"""
+        runner = LlamaRunner()
+        runner.config = self.resources.config
+        self.resources.slots = [[[0, 8], [1, 9]]]
+        with mock.patch('inference.resources', self.resources):
+            cmd = runner.build_command('prompt.txt', placement=self.resources.placement(0))
+        self.assertEqual(cmd[cmd.index('-t') + 1], '2')
+        self.assertEqual(cmd[cmd.index('--temp') + 1], '0.7')
+        self.assertNotIn('--color', cmd)
+    
+    def test_calibration(self):
+        """Testar que a calibração escolhe e salva o número de threads mais rápido"""
+        script_path = os.path.join(self.tmpdir.name, 'main')
+        with open(script_path, 'w') as f:
+            f.write(FAKE_TIMINGS_SCRIPT.format(python=sys.executable))
+        os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IEXEC)
+        self.resources.slots = self.resources.plan_slots(detect_topology(self.tmpdir.name, available=range(16)))
+        runner = LlamaRunner()
+        runner.config = self.resources.config
+        with mock.patch('inference.resources', self.resources), \
+                mock.patch.object(self.resources, 'pin'):
+            calibration = self.resources.calibrate(runner)
+        self.assertEqual([item['threads'] for item in calibration['results']], [1, 2, 4])
+        self.assertEqual(calibration['threads'], 2)
+        self.assertEqual(calibration['batch_threads'], 4)
+        self.assertEqual(calibration['prompt_tokens_per_second'], 80.0)
+        
+        # Nova inicialização no mesmo servidor usa os valores medidos
+        self.resources.calibrated = None
+        self.assertEqual(self.resources.load_calibration()['threads'], 2)
+        self.assertIsNone(parse_timings('sem medições'))
+
+class BackendPoolTestCase(unittest.TestCase):
+    """Testes do pool de servidores de inferência com servidores simulados"""
+    
+    def setUp(self):
+        self.servers = [start_stub_server(delay=0.01, tokens=5) for _ in range(3)]
+        self.endpoints = [f"http://127.0.0.1:{server.server_port}" for server in self.servers]
+        self.runner = LlamaRunner()
+        self.runner.config = {'TEMPERATURE': '0.7', 'GENERATION_TIMEOUT': 10}
+    
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+    
+    def test_least_outstanding(self):
+        """Testar distribuição de requisições simultâneas entre os servidores"""
+        for server in self.servers:
+            server.options['delay'] = 0.05
+        threads = [
+            threading.Thread(target=self.runner.generate, args=('Olá',), kwargs={'endpoints': self.endpoints})
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([len(server.requests) for server in self.servers], [2, 2, 2])
+    
+    def test_sticky_routing(self):
+        """Testar que o mesmo prompt de sistema vai sempre ao mesmo servidor"""
+        for _ in range(4):
+            response = self.runner.generate('Olá', endpoints=self.endpoints, cache_key='system:hr')
+            self.assertEqual(response, 'token0 token1 token2 token3 token4')
+        self.assertEqual(sorted(len(server.requests) for server in self.servers), [0, 0, 4])
+        self.assertTrue(all(r['cache_prompt'] for server in self.servers for r in server.requests))
+    
+    def test_speculative_remote(self):
+        """Testar o limite de tokens de rascunho enviado ao servidor e a taxa de aceitação recebida"""
+        self.runner.config.update({'MODEL_PATH': 'modelo.gguf', 'DRAFT_MODEL_PATH': 'rascunho.gguf',
+                                   'SPECULATIVE_DRAFT_TOKENS': 6})
+        decoding = SpeculativeDecoding(self.runner.config)
+        with mock.patch('inference.speculative', decoding):
+            self.runner.generate('Olá', endpoints=self.endpoints[:1], model_path='modelo.gguf')
+            self.runner.generate('Olá', endpoints=self.endpoints[:1], model_path='pequeno.gguf')
+        requests = self.servers[0].requests
+        self.assertEqual(requests[0]['speculative.n_max'], 6)
+        self.assertNotIn('speculative.n_max', requests[1])
+        self.assertEqual(decoding.metrics()['acceptance_rate'], 0.8)
+    
+    def test_circuit_breaker(self):
+        """Testar que um servidor com falhas é retirado do balanceamento"""
+        self.servers[0].options['fail_rate'] = 1.0
+        pool = BackendPool(self.endpoints)
+        for _ in range(6):
+            node, completion, response = pool.open_completion({'prompt': 'Olá', 'stream': True})
+            response.read()
+            completion.connection.close()
+            pool.release(node, success=True)
+        failing = pool.metrics()[0]
+        self.assertEqual(failing['circuit'], 'open')
+        self.assertEqual(len(self.servers[0].requests), 3)
+    
+    def test_single_probe_when_half_open(self):
+        """Testar que uma requisição comum que termina não libera um segundo teste do nó em half-open"""
+        pool = BackendPool(self.endpoints[:1])
+        node, _ = pool.acquire()
+        node.opened_at = time.monotonic() - 60
+        self.assertEqual(node.circuit, 'half-open')
+        probe_node, probe = pool.acquire()
+        self.assertTrue(probe)
+        pool.release(node, success=False)
+        node.opened_at = time.monotonic() - 60
+        with self.assertRaises(BackendUnavailable):
+            pool.acquire()
+        pool.release(probe_node, success=True, probe=True)
+        self.assertEqual(pool.acquire(), (node, False))
+    
+    def test_cancel_remote(self):
+        """Testar cancelamento de uma geração remota"""
+        self.servers[0].options.update(delay=0.1, tokens=100)
+        endpoints = self.endpoints[:1]
+        timer = threading.Timer(0.3, registry.cancel, args=('req-remoto',))
+        timer.start()
+        with self.assertRaises(GenerationCancelled):
+            self.runner.generate('Olá', request_id='req-remoto', endpoints=endpoints)
+        timer.join()
+        self.assertEqual(get_pool(endpoints).metrics()[0]['outstanding'], 0)
+
+class StateStoreTestCase(unittest.TestCase):
+    """Testes do estado compartilhado entre workers"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SQLiteStore(os.path.join(self.tmpdir.name, 'state.db'))
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_get_set_expire(self):
+        """Testar leitura, escrita e expiração de valores"""
+        self.store.set('a', 'valor')
+        self.assertEqual(self.store.get('a'), 'valor')
+        self.store.set('b', 'temporário', ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.store.get('b'))
+        self.store.delete('a')
+        self.assertIsNone(self.store.get('a'))
+    
+    def test_incr_shared_between_connections(self):
+        """Testar contador atômico visto por outra conexão (outro worker)"""
+        other = SQLiteStore(self.store.path)
+        self.assertEqual(self.store.incr('contador'), 1)
+        self.assertEqual(other.incr('contador', 5), 6)
+        self.assertEqual(self.store.get('contador'), '6')
+    
+    def test_token_bucket(self):
+        """Testar balde de fichas compartilhado entre conexões (outros workers)"""
+        other = SQLiteStore(self.store.path)
+        self.assertEqual(self.store.take('balde', 2, 10.0), 0)
+        self.assertEqual(other.take('balde', 2, 10.0), 0)
+        wait = self.store.take('balde', 2, 10.0)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+        time.sleep(0.15)
+        self.assertEqual(other.take('balde', 2, 10.0), 0)
+    
+    def test_response_cache(self):
+        """Testar cache de respostas com normalização da pergunta"""
+        state = SharedState()
+        state.backend = self.store
+        cache = ResponseCache(state)
+        cache.ttl = 60
+        cache.set('hr', 'Quantos dias de  férias?', 'Trinta dias.')
+        self.assertEqual(cache.get('hr', 'quantos dias de férias?'), 'Trinta dias.')
+        self.assertIsNone(cache.get('technical', 'quantos dias de férias?'))
+    
+    def test_secret_key_stable(self):
+        """Testar que todos os workers obtêm a mesma chave secreta"""
+        first = load_or_create_secret_key(self.tmpdir.name)
+        self.assertEqual(load_or_create_secret_key(self.tmpdir.name), first)
+        self.assertEqual(len(first), 64)
+    
+    def test_session_shared_between_apps(self):
+        """Testar que uma sessão criada em um worker é lida por outro"""
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['username'] = 'compartilhado'
+            cookie = client.get_cookie('session').value
+        
+        # O cookie contém apenas o identificador assinado, não os dados
+        self.assertNotIn('compartilhado', cookie)
+        with app.test_request_context('/', headers={'Cookie': f'session={cookie}'}) as ctx:
+            sess = app.session_interface.open_session(app, ctx.request)
+            self.assertEqual(sess['username'], 'compartilhado')
+
+class StartupTestCase(unittest.TestCase):
+    """Testes da inicialização da aplicação"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        
+        class StartupConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(self.tmpdir.name, 'startup.db')}"
+        
+        self.app = create_app(StartupConfig, instance_path=APP_INSTANCE.name)
+    
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        self.tmpdir.cleanup()
+    
+    def test_create_app_does_not_touch_database(self):
+        """Testar que criar a aplicação não cria tabelas nem usuários"""
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, 'startup.db')))
+    
+    def test_init_db_command(self):
+        """Testar que o comando init-db cria as tabelas e os usuários padrão uma única vez"""
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['init-db'])
+        self.assertEqual(result.exit_code, 0)
+        runner.invoke(args=['init-db'])
+        with self.app.app_context():
+            self.assertEqual(User.query.filter_by(username='admin').count(), 1)
+            self.assertTrue(User.query.filter_by(username='user').first().check_password('user123'))
+    
+    def test_cli_modules_imported_on_demand(self):
+        """Testar que os módulos dos comandos de manutenção não são importados pela aplicação web"""
+        script = ("import sys, app, config; app.create_app(config.TestingConfig, instance_path=sys.argv[1]); "
+                  "print(sorted(m for m in ('archive', 'export', 'pyarrow', 'flask_migrate') if m in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', script, self.tmpdir.name], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.stdout.strip().splitlines()[-1], '[]')
+        result = self.app.test_cli_runner().invoke(args=['export-history', '--help'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('--format', result.output)
+    
+    def test_gunicorn_worker_modes(self):
+        """Testar que o modo de atendimento do Gunicorn é respeitado"""
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+        with mock.patch.dict(os.environ, {'GUNICORN_THREADS': '8'}):
+            os.environ.pop('GUNICORN_WORKER_CLASS', None)
+            settings = runpy.run_path(path)
+        self.assertEqual((settings['worker_class'], settings['threads']), ('gthread', 8))
+        # Com mais de uma thread o Gunicorn trocaria sync por gthread
+        with mock.patch.dict(os.environ, {'GUNICORN_WORKER_CLASS': 'sync'}):
+            settings = runpy.run_path(path)
+        self.assertEqual((settings['worker_class'], settings['threads']), ('sync', 1))
+
+class SummarizerTestCase(AppTestCase):
+    """Testes do resumo das conversas longas"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(SUMMARY_TRIGGER_TOKENS=100, SUMMARY_KEEP_TURNS=2)
+        user_id = self.add_user('conversa')
+        with self.app.app_context():
+            conversation = Conversation(user_id=user_id, title='Pergunta 0')
+            db.session.add(conversation)
+            db.session.flush()
+            for i in range(5):
+                db.session.add(QueryHistory(
+                    user_id=user_id, conversation_id=conversation.id,
+                    question=f'Pergunta {i}', response='resposta detalhada ' * 10
+                ))
+            db.session.commit()
+            self.conversation_id = conversation.id
+    
+    def test_turns_to_summarize(self):
+        """Testar que o resumo só é feito acima do limite e mantém as perguntas recentes"""
+        self.assertEqual(turns_to_summarize([50, 40], 100, 2), 0)
+        self.assertEqual(turns_to_summarize([50, 40, 30, 20], 100, 2), 2)
+        self.assertEqual(turns_to_summarize([500], 0, 2), 0)
+    
+    def test_summarize_bounds_prompt(self):
+        """Testar que as perguntas antigas saem do prompt e entram no resumo"""
+        with self.app.app_context(), \
+                mock.patch('summarizer.router.generate', return_value=('Resumo das perguntas 0 a 2', 'large')):
+            conversation = db.session.get(Conversation, self.conversation_id)
+            before, _, _ = prepare_prompt('Nova pergunta', conversation)
+            self.assertTrue(summarizer.summarize(self.conversation_id))
+            
+            conversation = db.session.get(Conversation, self.conversation_id)
+            self.assertEqual(len(conversation.turns()), 2)
+            after, _, _ = prepare_prompt('Nova pergunta', conversation)
+        self.assertIn('Resumo das perguntas 0 a 2', after)
+        self.assertNotIn('Pergunta 0', after)
+        self.assertLess(len(after), len(before))
+
+class BatchTestCase(AppTestCase):
+    """Testes do processamento em lote"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(RESPONSE_CACHE_TTL=0, BATCH_CONCURRENCY=2)
+        self.user_id = self.add_user('lote')
+        self.client = self.login_as('lote')
+    
+    def test_parse_questions(self):
+        """Testar leitura de perguntas em TXT, CSV e JSONL"""
+        self.assertEqual(parse_questions('a.txt', b'Um\n\nDois\n'), ['Um', 'Dois'])
+        self.assertEqual(parse_questions('a.csv', b'id,pergunta\n1,Um\n2,"Dois, tres"\n'), ['Um', 'Dois, tres'])
+        self.assertEqual(parse_questions('a.jsonl', b'{"question": "Um"}\n"Dois"\n'), ['Um', 'Dois'])
+        with self.assertRaises(ValueError):
+            parse_questions('a.txt', b'Um\nDois\nTres', max_questions=2)
+    
+    def test_job_lifecycle(self):
+        """Testar envio, processamento e exportação de um trabalho em lote"""
+        from io import BytesIO
+        response = self.client.post('/batch', data={
+            'file': (BytesIO('Como configuro a VPN?\nQuantos dias de férias?\ncomo configuro a vpn?\n'.encode()), 'perguntas.txt')
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['id']
+        self.assertEqual(response.get_json()['status'], 'queued')
+        
+        with self.app.app_context(), \
+                mock.patch('batch.router.generate', return_value=('Resposta em lote', 'large')) as generate:
+            BatchWorker(self.app).run(once=True)
+        # Perguntas repetidas são respondidas uma única vez
+        self.assertEqual(generate.call_count, 2)
+        
+        status = self.client.get(f'/batch/{job_id}').get_json()
+        self.assertEqual(status['status'], 'completed')
+        self.assertEqual(status['completed'], 3)
+        self.assertEqual(status['progress'], 1.0)
+        
+        lines = self.client.get(f'/batch/{job_id}/results').get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['position'] for line in lines], [1, 2, 3])
+        self.assertEqual(json.loads(lines[1])['response'], 'Resposta em lote')
+        csv_lines = self.client.get(f'/batch/{job_id}/results?format=csv').get_data(as_text=True).splitlines()
+        self.assertEqual(len(csv_lines), 4)
+        self.assertTrue(csv_lines[0].startswith('position,question'))
+    
+    def test_preempted_item_requeued(self):
+        """Testar que perguntas interrompidas pelo tráfego interativo voltam para a fila"""
+        response = self.client.post('/batch', json={'questions': ['Como configuro a VPN?']})
+        job_id = response.get_json()['id']
+        answers = [GenerationCancelled('preempted'), ('Resposta em lote', 'large')]
+        with self.app.app_context(), \
+                mock.patch('batch.router.generate', side_effect=answers) as generate:
+            BatchWorker(self.app).run(once=True)
+        self.assertEqual(generate.call_count, 2)
+        self.assertEqual(generate.call_args.kwargs['priority'], 'background')
+        status = self.client.get(f'/batch/{job_id}').get_json()
+        self.assertEqual((status['status'], status['completed'], status['failed']), ('completed', 1, 0))
+
+    def test_daily_token_quota(self):
+        """Testar que o lote soma os tokens à cota diária do usuário e para ao atingi-la"""
+        with self.app.app_context():
+            limiter.save({'user': {'daily_tokens': 1}})
+        response = self.client.post('/batch', json={'questions': ['Como configuro a VPN?', 'Quantos dias de férias?']})
+        job_id = response.get_json()['id']
+        worker = BatchWorker(self.app)
+        worker.concurrency = 1
+        with self.app.app_context(), \
+                mock.patch('batch.router.generate', return_value=('Resposta em lote', 'large')) as generate:
+            worker.run(once=True)
+            self.assertGreater(limiter.tokens_today(f"user:{self.user_id}"), 0)
+        self.assertEqual(generate.call_count, 1)
+        status = self.client.get(f'/batch/{job_id}').get_json()
+        self.assertEqual((status['completed'], status['failed']), (1, 1))
+        self.assertEqual(self.client.post('/batch', json={'questions': ['Outra pergunta']}).status_code, 429)
+
+class LimitsTestCase(AppTestCase):
+    """Testes dos limites de uso por usuário e por departamento"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(RESPONSE_CACHE_TTL=0, RATE_LIMIT_PER_MINUTE=2, DAILY_TOKEN_QUOTA=0)
+        self.user_id = self.add_user('limitado', 'admin', 'TI')
+        self.client = self.login_as('limitado')
+    
+    def ask(self):
+        with mock.patch('app.router.generate', return_value=('Resposta do modelo', 'large')):
+            return self.client.post('/ask', json={'question': 'Como configuro a VPN?'})
+    
+    def test_rate_limit(self):
+        """Testar recusa de perguntas acima do limite por minuto"""
+        self.assertEqual(self.ask().status_code, 200)
+        self.assertEqual(self.ask().status_code, 200)
+        response = self.ask()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(response.get_json()['limit_exceeded'])
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+    
+    def test_department_rate_limit_keeps_user_tokens(self):
+        """Testar que a recusa pelo limite do departamento não gasta a ficha do usuário"""
+        response = self.client.post('/admin/limits', json={
+            'user': {'requests_per_minute': 2},
+            'departments': {'TI': {'requests_per_minute': 1}}
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ask().status_code, 200)
+        for _ in range(3):
+            response = self.ask()
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('departamento', response.get_json()['error'])
+        with self.app.app_context():
+            self.assertEqual(shared_state.take(f"bucket:user:{self.user_id}", 2, 2 / 60.0), 0)
+    
+    def test_department_token_quota(self):
+        """Testar cota diária de tokens do departamento definida pelo administrador"""
+        response = self.client.post('/admin/limits', json={
+            'user': {'requests_per_minute': 0},
+            'departments': {'TI': {'daily_tokens': 1}}
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ask().status_code, 200)
+        response = self.ask()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('departamento', response.get_json()['error'])
+        
+        usage = self.client.get('/admin/limits').get_json()['usage']
+        self.assertGreater(usage['users'][0]['tokens_today'], 0)
+        self.assertEqual(usage['departments'][0]['daily_tokens'], 1)
+    
+    def test_validate_limits(self):
+        """Testar validação dos limites enviados pelo administrador"""
+        self.assertEqual(validate_limits({'user': {'daily_tokens': '10'}})['user'], {'daily_tokens': 10})
+        for invalid in ({'user': {'daily_tokens': -1}}, {'user': {'outro': 1}}, {'grupo': {}}, []):
+            with self.assertRaises(ValueError):
+                validate_limits(invalid)
+
+class RuntimeSettingsTestCase(AppTestCase):
+    """Testes das configurações do modelo alteradas em tempo de execução"""
+    
+    def setUp(self):
+        super().setUp()
+        self.model_path = os.path.join(self.tmpdir.name, 'novo.gguf')
+        open(self.model_path, 'wb').close()
+        
+        # Dois workers com o mesmo banco e o mesmo estado compartilhado
+        self.apps = [self.make_app(SETTINGS_CHECK_INTERVAL=0), self.make_app(SETTINGS_CHECK_INTERVAL=0)]
+        self.add_user('admin', 'admin')
+        self.clients = [self.login_as('admin', test_app) for test_app in self.apps]
+    
+    def test_hot_reload_across_workers(self):
+        """Testar que uma alteração feita em um worker vale no outro sem reiniciar"""
+        original_models = TestingConfig.MODELS['large']['path']
+        self.assertEqual(self.clients[1].get('/admin/settings').status_code, 200)
+        
+        response = self.clients[0].post('/admin/settings', json={
+            'model_path': self.model_path, 'temperature': '0.2'
+        })
+        self.assertEqual(response.status_code, 200)
+        
+        settings = self.clients[1].get('/admin/settings').get_json()['settings']
+        self.assertEqual(settings['model_path'], self.model_path)
+        self.assertEqual(settings['temperature'], '0.2')
+        config = self.apps[1].config
+        self.assertEqual(config['MODELS']['large']['path'], self.model_path)
+        # A classe de configuração não é alterada
+        self.assertEqual(TestingConfig.MODELS['large']['path'], original_models)
+    
+    def test_invalid_settings(self):
+        """Testar validação das configurações do modelo"""
+        self.assertEqual(self.clients[0].post('/admin/settings', json={'model_path': self.model_path}).status_code, 200)
+        for invalid in ({'model_path': '/nao/existe.gguf'}, {'temperature': '3'},
+                        {'context_size': '100'}, {'llama_path': '/nao/existe'}, {'outra': '1'}):
+            response = self.clients[0].post('/admin/settings', json=invalid)
+            self.assertEqual(response.status_code, 400, invalid)
+
+class AuthTestCase(AppTestCase):
+    """Testes do login, do hash de senhas e do cache de usuários"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+        self.user_id = self.add_user('funcionario')
+        self.client = self.app.test_client()
+    
+    def login(self):
+        return self.client.post('/login', data={'username': 'funcionario', 'password': 'senha'}).get_json()
+    
+    def test_rehash_on_login(self):
+        """Testar que a senha é refeita com o esquema configurado no login"""
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertTrue(self.login()['success'])
+        with self.app.app_context():
+            user = db.session.get(User, self.user_id)
+            self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+            self.assertFalse(user.needs_rehash())
+            self.assertTrue(user.check_password('senha'))
+    
+    def test_inactive_user_rejected(self):
+        """Testar que usuários desativados perdem o acesso quando o cache expira"""
+        self.app.config['USER_CACHE_TTL'] = 60
+        self.assertTrue(self.login()['success'])
+        self.assertEqual(self.client.get('/conversations').status_code, 200)
+        # Usuário comum não acessa as rotas de administração
+        self.assertEqual(self.client.get('/admin/metrics').status_code, 403)
+        
+        with self.app.app_context():
+            db.session.get(User, self.user_id).active = False
+            db.session.commit()
+        # Ainda no cache
+        self.assertEqual(self.client.get('/conversations').status_code, 200)
+        user_cache.invalidate(self.user_id)
+        self.assertEqual(self.client.get('/conversations').status_code, 401)
+        self.assertFalse(self.login()['success'])
+
+class ArchiveTestCase(AppTestCase):
+    """Testes do arquivamento do histórico e da página de histórico"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(ARCHIVE_DIR=os.path.join(self.tmpdir.name, 'archive'),
+                                 PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', HISTORY_PAGE_SIZE=2)
+        admin_id = self.add_user('admin', 'admin')
+        now = datetime.utcnow()
+        with self.app.app_context():
+            # Conversa antiga, mas com atividade recente: não é arquivada
+            active = Conversation(user_id=admin_id, title='Ativa', updated_at=now)
+            db.session.add(active)
+            db.session.flush()
+            for days, conversation_id in ((400, None), (300, None), (200, active.id), (10, None)):
+                db.session.add(QueryHistory(
+                    user_id=admin_id, question=f"Pergunta de {days} dias", response='Resposta ' * 50,
+                    timestamp=now - timedelta(days=days), conversation_id=conversation_id
+                ))
+            db.session.commit()
+        self.client = self.app.test_client()
+    
+    def test_archive_and_restore(self):
+        """Testar que o histórico antigo é arquivado e restaurado sem perdas"""
+        with self.app.app_context():
+            original = {q.id: (q.question, q.response, q.timestamp) for q in QueryHistory.query}
+            stats = HistoryArchiver(self.app).run(days=180, batch_size=1)
+            self.assertEqual(stats['archived'], 2)
+            self.assertEqual(stats['batches'], 2)
+            self.assertEqual(QueryHistory.query.count(), 2)
+            self.assertEqual(ArchivedQuery.query.count(), 2)
+            self.assertEqual(len(os.listdir(self.app.config['ARCHIVE_DIR'])), 2)
+            # Execução incremental: nada mais a arquivar
+            self.assertEqual(HistoryArchiver(self.app).run(days=180)['archived'], 0)
+            
+            self.assertEqual(HistoryArchiver(self.app).restore(start=datetime(2000, 1, 1)), 2)
+            self.assertEqual(ArchivedQuery.query.count(), 0)
+            restored = {q.id: (q.question, q.response, q.timestamp) for q in QueryHistory.query}
+            self.assertEqual(restored, original)
+    
+    def test_history_pagination(self):
+        """Testar a paginação e a busca no histórico, inclusive no arquivado"""
+        self.client.post('/login', data={'username': 'admin', 'password': 'senha'})
+        page = self.client.get('/history').get_data(as_text=True)
+        self.assertIn('Pergunta de 10 dias', page)
+        self.assertNotIn('Pergunta de 300 dias', page)
+        page = self.client.get('/history?page=2').get_data(as_text=True)
+        self.assertIn('Pergunta de 300 dias', page)
+        
+        with self.app.app_context():
+            HistoryArchiver(self.app).run(days=180)
+        page = self.client.get('/history?archived=1&q=400').get_data(as_text=True)
+        self.assertIn('Pergunta de 400 dias', page)
+        self.assertNotIn('Pergunta de 300 dias', page)
+
+class ExportTestCase(AppTestCase):
+    """Testes da exportação do histórico"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', EXPORT_CHUNK_SIZE=2)
+        admin_id = self.add_user('admin', 'admin', 'TI')
+        analyst_id = self.add_user('analista', 'user', 'Financeiro', password=None)
+        with self.app.app_context():
+            for day in range(1, 6):
+                db.session.add(QueryHistory(
+                    user_id=analyst_id if day % 2 else admin_id, question=f"Pergunta, dia {day}",
+                    response='Resposta "com aspas"', timestamp=datetime(2024, 3, day, 10), category='general'
+                ))
+            db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'admin', 'password': 'senha'})
+    
+    def test_csv_and_jsonl(self):
+        """Testar a exportação em CSV e JSONL com filtros"""
+        response = self.client.get('/history/export?format=csv&department=Financeiro&to=2024-03-03')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual([row['question'] for row in rows], ['Pergunta, dia 1', 'Pergunta, dia 3'])
+        self.assertEqual(rows[0]['username'], 'analista')
+        self.assertEqual(rows[0]['response'], 'Resposta "com aspas"')
+        
+        response = self.client.get('/history/export?format=jsonl&from=2024-03-04')
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([r['timestamp'] for r in records], ['2024-03-04 10:00:00', '2024-03-05 10:00:00'])
+        
+        self.assertEqual(self.client.get('/history/export?format=xls').status_code, 400)
+        self.assertEqual(self.client.get('/history/export?from=03/2024').status_code, 400)
+    
+    def test_chunks(self):
+        """Testar que o histórico é produzido em partes de EXPORT_CHUNK_SIZE linhas"""
+        with self.app.app_context():
+            chunks = list(export_history('jsonl'))
+        self.assertEqual([chunk.count('\n') for chunk in chunks], [2, 2, 1])
+    
+    @unittest.skipIf(pyarrow is None, 'pyarrow não instalado')
+    def test_parquet(self):
+        """Testar a exportação em Parquet pelo comando flask export-history"""
+        output = os.path.join(self.tmpdir.name, 'historico.parquet')
+        result = self.app.test_cli_runner().invoke(args=['export-history', '--format', 'parquet', '-o', output])
+        self.assertEqual(result.exit_code, 0, result.output)
+        table = pyarrow.parquet.read_table(output)
+        self.assertEqual(table.num_rows, 5)
+        # Um grupo de linhas por parte lida do banco
+        self.assertEqual(pyarrow.parquet.ParquetFile(output).num_row_groups, 3)
+        self.assertEqual(table.column('username').to_pylist()[:2], ['analista', 'admin'])
+
+class RollupTestCase(AppTestCase):
+    """Testes dos totais de uso e do painel"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(ARCHIVE_DIR=os.path.join(self.tmpdir.name, 'archive'),
+                                 PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', ROLLUP_BATCH_SIZE=3)
+        self.user_ids = {'admin': self.add_user('admin', 'admin', 'TI'),
+                         'analista': self.add_user('analista', 'user', 'Financeiro', password=None)}
+        self.client = self.app.test_client()
+    
+    def add_queries(self, username, count, timestamp, latency_ms=800):
+        with self.app.app_context():
+            for _ in range(count):
+                db.session.add(QueryHistory(
+                    user_id=self.user_ids[username], question='Pergunta', response='Resposta',
+                    timestamp=timestamp, category='technical', prompt_tokens=100,
+                    completion_tokens=50, latency_ms=latency_ms
+                ))
+            db.session.commit()
+    
+    def summary(self, dimension):
+        self.client.post('/login', data={'username': 'admin', 'password': 'senha'})
+        response = self.client.get(f'/admin/analytics?dimension={dimension}&days=400')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+    
+    def test_incremental_rollup(self):
+        """Testar que cada pergunta é somada uma única vez, inclusive após o arquivamento"""
+        now = datetime.utcnow()
+        self.add_queries('analista', 4, now - timedelta(days=1))
+        self.add_queries('admin', 1, now - timedelta(days=300), latency_ms=20000)
+        with self.app.app_context():
+            self.assertEqual(rollups.refresh(), 5)
+            self.assertEqual(rollups.refresh(), 0)
+        self.add_queries('analista', 2, now)
+        with self.app.app_context():
+            # O arquivamento soma as perguntas novas antes de arquivar
+            self.assertEqual(HistoryArchiver(self.app).run(days=180)['archived'], 1)
+            self.assertEqual(rollups.refresh(), 0)
+        
+        summary = self.summary('department')
+        departments = {item['key']: item for item in summary['breakdown']}
+        self.assertEqual(departments['Financeiro']['queries'], 6)
+        self.assertEqual(departments['Financeiro']['prompt_tokens'], 600)
+        self.assertEqual(departments['TI']['queries'], 1)
+        self.assertEqual(sum(item['queries'] for item in summary['series']), 7)
+        self.assertIsNotNone(summary['updated_until'])
+        self.assertEqual(self.client.get('/admin/analytics?dimension=cargo').status_code, 400)
+    
+    def test_histogram_percentile(self):
+        """Testar a estimativa de percentis pelo histograma de latência"""
+        histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        histogram[2] = 90   # 500 a 1000 ms
+        histogram[7] = 10   # 7500 a 10000 ms
+        self.assertTrue(500 <= histogram_percentile(histogram, 0.5) <= 1000)
+        self.assertTrue(7500 <= histogram_percentile(histogram, 0.95) <= 10000)
+        self.assertIsNone(histogram_percentile([0] * len(histogram), 0.5))
+
+class AssetsTestCase(AppTestCase):
+    """Testes dos arquivos estáticos versionados e da compressão das respostas"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', COMPRESS_MIN_SIZE=100)
+        self.add_user('admin', 'admin', 'TI')
+        self.client = self.app.test_client()
+    
+    def test_fingerprinted_assets(self):
+        """Testar o nome versionado, o cache imutável e as versões compactadas"""
+        page = self.client.get('/login').get_data(as_text=True)
+        url = re.search(r'href="(/assets/css/style\.[0-9a-f]{12}\.css)"', page).group(1)
+        with open(os.path.join(self.app.static_folder, 'css', 'style.css'), 'rb') as css_file:
+            original = css_file.read()
+        
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, original)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), original)
+        self.assertEqual(self.client.get(url, headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']
+        }).status_code, 304)
+        self.assertEqual(self.client.get('/assets/css/style.000000000000.css').status_code, 404)
+    
+    def test_response_compression(self):
+        """Testar a compressão das respostas JSON e HTML"""
+        self.client.post('/login', data={'username': 'admin', 'password': 'senha'})
+        plain = self.client.get('/history')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        
+        compressed = self.client.get('/history', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        
+        # Respostas menores que COMPRESS_MIN_SIZE não são compactadas
+        small = self.client.get('/admin/analytics', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', small.headers)
+        self.assertEqual(small.get_json()['breakdown'], [])
+
+class FAQTestCase(AppTestCase):
+    """Testes das respostas revisadas do FAQ"""
+    
+    def setUp(self):
+        super().setUp()
+        # Dois workers com o mesmo banco e o mesmo estado compartilhado
+        self.apps = [self.make_app(SETTINGS_CHECK_INTERVAL=0), self.make_app(SETTINGS_CHECK_INTERVAL=0)]
+        self.admin_id = self.add_user('admin', 'admin')
+        with self.apps[0].app_context():
+            query = QueryHistory(user_id=self.admin_id, question='Como faço para redefinir minha senha do e-mail?',
+                                 response='Acesse o portal de senhas e clique em "Esqueci a senha".',
+                                 category='technical')
+            db.session.add(query)
+            db.session.commit()
+            self.query_id = query.id
+        self.clients = [self.login_as('admin', test_app) for test_app in self.apps]
+    
+    def test_match(self):
+        """Testar as perguntas equivalentes e as diferentes"""
+        index = FAQIndex([
+            FAQEntry(id=1, question='Como faço para redefinir minha senha do e-mail?', answer='senha',
+                     variations='Esqueci a senha do email'),
+            FAQEntry(id=2, question='Qual o horário de funcionamento do RH?', answer='rh'),
+            FAQEntry(id=3, question='Como solicitar férias?', answer='férias')
+        ])
+        self.assertEqual(index.match('como faco para redefinir minha senha do email', 0.8, 0.75), (1, 1.0))
+        self.assertEqual(index.match('Preciso redefinir a senha do meu e-mail', 0.8, 0.75)[0], 1)
+        self.assertEqual(index.match('esqueci minha senha de email', 0.8, 0.75)[0], 1)
+        self.assertEqual(index.match('RH funciona em que horário?', 0.8, 0.75)[0], 2)
+        self.assertEqual(index.match('Como solicito minhas férias?', 0.8, 0.75)[0], 3)
+        self.assertEqual(index.search('senha do email bloqueada', 3)[0][0], 1)
+        for question in ('Quais são as regras de férias para estagiários?', 'redefinir senha do sistema SAP',
+                         'horário de funcionamento da cantina', 'Qual a capital da França?'):
+            self.assertIsNone(index.match(question, 0.8, 0.75), question)
+    
+    def test_promote_and_answer(self):
+        """Testar a promoção de uma resposta do histórico e a resposta sem o modelo"""
+        response = self.clients[0].post(f'/history/{self.query_id}/promote', json={})
+        self.assertEqual(response.status_code, 200)
+        entry_id = response.get_json()['entry']['id']
+        self.assertEqual(self.clients[0].post('/history/999/promote', json={}).status_code, 404)
+        
+        # O outro worker passa a responder pelo FAQ, sem chamar o modelo (nem
+        # contar os tokens da resposta, contados na montagem do índice)
+        with self.apps[1].app_context():
+            faq.index(force=True)
+        with mock.patch.object(router, 'generate', side_effect=AssertionError('modelo chamado')), \
+                mock.patch('budget.count_tokens', side_effect=AssertionError('tokens contados')):
+            response = self.clients[1].post('/ask', json={'question': 'Preciso redefinir a senha do meu e-mail'})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['faq_id'], entry_id)
+        self.assertIn('portal de senhas', data['response'])
+        with self.apps[1].app_context():
+            record = QueryHistory.query.filter_by(conversation_id=data['conversation_id']).one()
+            self.assertEqual(record.category, 'faq')
+            self.assertEqual(record.prompt_tokens, 0)
+            self.assertEqual(record.completion_tokens, TokenCounter().count(record.response))
+        
+        # Entradas desativadas deixam de ser usadas
+        self.assertEqual(self.clients[0].post(f'/admin/faq/{entry_id}', json={'active': False}).status_code, 200)
+        with mock.patch.object(router, 'generate', return_value=('Resposta do modelo', 'large')) as generate:
+            response = self.clients[1].post('/ask', json={'question': 'Preciso redefinir a senha do meu e-mail'})
+        self.assertEqual(response.get_json()['response'], 'Resposta do modelo')
+        generate.assert_called_once()
+        
+        self.assertEqual(self.clients[0].post('/admin/faq', json={'question': 'Sem resposta'}).status_code, 400)
+        self.assertEqual(self.clients[0].delete(f'/admin/faq/{entry_id}').status_code, 200)
+        self.assertEqual(self.clients[1].get('/admin/faq').get_json()['entries'], [])
+
+class RetrievalTestCase(AppTestCase):
+    """Testes da busca federada"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(RETRIEVAL_BUDGET_MS=300, RETRIEVAL_TIMEOUTS_MS={'intranet': 200, 'arquivos': 200})
+        self.add_user('teste')
+        self.client = self.login_as('teste')
+        self.release = threading.Event()
+    
+    def tearDown(self):
+        self.release.set()
+        super().tearDown()
+    
+    def source(self, name, titles, wait=False):
+        release = self.release
+        
+        class Source:
+            calls = 0
+            
+            def available(self):
+                return True
+            
+            def search(self, query, limit):
+                Source.calls += 1
+                if wait:
+                    release.wait(5)
+                return [{'id': title, 'title': title, 'url': None, 'snippet': ''} for title in titles[:limit]]
+        
+        Source.name = name
+        return Source()
+    
+    def test_fuse_and_catalog(self):
+        """Testar a fusão das listas e o catálogo do File Server"""
+        fused = fuse({'a': [{'id': 'x'}, {'id': 'y'}, {'id': 'z'}], 'b': [{'id': 'y'}, {'id': 'w'}]}, k=60)
+        self.assertEqual([result['id'] for _, result in fused], ['y', 'x', 'w', 'z'])
+        
+        catalog = FileCatalog(os.path.join(self.tmpdir.name, 'catalogo.db'))
+        self.assertFalse(catalog.exists())
+        count = catalog.rebuild([
+            {'name': 'Politica_Ferias_2024.pdf', 'path': '/RH/Beneficios/Politica_Ferias_2024.pdf'},
+            {'name': 'Escala.xlsx', 'path': '/RH/Férias/Escala.xlsx'},
+            {'name': 'Manual_VPN.docx', 'path': '/TI/Manual_VPN.docx'}
+        ])
+        self.assertEqual(count, 3)
+        results = catalog.search('Qual a política de férias?', 10)
+        # O nome do arquivo pesa mais que a pasta; acentos são ignorados
+        self.assertEqual([result['title'] for result in results], ['Politica_Ferias_2024.pdf', 'Escala.xlsx'])
+        self.assertEqual(catalog.search('configurar vpn', 10)[0]['url'], '/TI/Manual_VPN.docx')
+        self.assertEqual(catalog.search('orçamento', 10), [])
+    
+    def test_budget_and_cache(self):
+        """Testar o tempo máximo da busca com uma fonte lenta e o cache"""
+        fast = self.source('intranet', ['Férias', 'Reembolso de despesas'])
+        slow = self.source('arquivos', ['Politica de ferias'], wait=True)
+        retriever.sources = {'intranet': fast, 'arquivos': slow}
+        
+        started = time.monotonic()
+        response = self.client.get('/search?q=ferias')
+        self.assertLess(time.monotonic() - started, 1)
+        data = response.get_json()
+        self.assertEqual(data['sources'], {'intranet': 'ok', 'arquivos': 'timeout'})
+        self.assertEqual([result['title'] for result in data['results']], ['Férias', 'Reembolso de despesas'])
+        self.assertEqual(data['results'][0]['source'], 'intranet')
+        self.release.set()
+        
+        # Resultados parciais não ficam em cache; os completos ficam
+        self.assertFalse(self.client.get('/search?q=ferias').get_json()['cached'])
+        data = self.client.get('/search?q=Férias').get_json()
+        self.assertTrue(data['cached'])
+        self.assertEqual(data['sources'], {'intranet': 'ok', 'arquivos': 'ok'})
+        self.assertEqual(fast.calls, 2)
+        self.assertEqual(self.client.get('/search?q=%3F').status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(retriever.metrics()['sources']['arquivos']['timeouts'], 1)
+    
+    def test_sharepoint_failure(self):
+        """Testar que uma falha do SharePoint aparece na busca e não vai para o cache"""
+        class FailingSharePoint:
+            is_configured = True
+            
+            def search_documents(self, query, max_results=10, raise_errors=False):
+                if not raise_errors:
+                    return []
+                raise ConnectionError('SharePoint fora do ar')
+        
+        retriever.sources = {'intranet': self.source('intranet', ['Férias']), 'sharepoint': SharePointSource()}
+        with mock.patch('retrieval.is_integration_enabled', return_value=True), \
+                mock.patch('retrieval.get_integration', return_value=FailingSharePoint()):
+            for _ in range(2):
+                data = self.client.get('/search?q=ferias').get_json()
+                self.assertEqual(data['sources'], {'intranet': 'ok', 'sharepoint': 'error'})
+                self.assertFalse(data['cached'])
+            self.assertEqual([result['title'] for result in data['results']], ['Férias'])
+        with self.app.app_context():
+            self.assertEqual(retriever.metrics()['sources']['sharepoint']['errors'], 2)
+
+class ProfilingTestCase(AppTestCase):
+    """Testes dos perfis de desempenho e do identificador das requisições"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app = self.make_app(PROFILING_DIR=os.path.join(self.tmpdir.name, 'profiles'), SETTINGS_CHECK_INTERVAL=0)
+        self.add_user('admin', 'admin')
+        self.add_user('usuario')
+        self.admin = self.login_as('admin')
+        self.user = self.login_as('usuario')
+    
+    def test_request_profiles(self):
+        """Testar o perfil pedido pelo administrador e as capturas armadas"""
+        response = self.admin.get('/history', headers={'X-Request-ID': 'lento-1', 'X-Profile': '1'})
+        self.assertEqual(response.headers['X-Request-ID'], 'lento-1')
+        self.assertEqual(response.headers['X-Profile-ID'], 'lento-1')
+        report = self.admin.get('/admin/profiling/lento-1')
+        self.assertIn('function calls', report.get_data(as_text=True))
+        self.assertIn('history', report.get_data(as_text=True))
+        self.assertEqual(self.admin.get('/admin/profiling/inexistente').status_code, 404)
+        
+        # Usuários comuns não pedem perfis; identificadores inválidos são substituídos
+        response = self.user.get('/history', headers={'X-Request-ID': '../x', 'X-Profile': '1'})
+        self.assertNotIn('X-Profile-ID', response.headers)
+        self.assertRegex(response.headers['X-Request-ID'], r'^[0-9a-f]{32}$')
+        
+        # Captura armada da próxima requisição de /history de qualquer usuário
+        self.assertEqual(self.admin.post('/admin/profiling', json={'count': 500}).status_code, 400)
+        self.assertEqual(self.admin.post('/admin/profiling', json={'paths': ['/history'], 'count': 1}).status_code, 200)
+        self.assertIn('X-Profile-ID', self.user.get('/history').headers)
+        self.assertNotIn('X-Profile-ID', self.user.get('/history').headers)
+        profiles = self.admin.get('/admin/profiling').get_json()['profiles']
+        self.assertEqual([profile['user'] for profile in profiles], ['usuario', 'admin'])
+        self.assertEqual(self.user.get('/admin/profiling').status_code, 403)
+    
+    def test_sampler_and_log_ids(self):
+        """Testar a amostragem das pilhas e o identificador nos logs"""
+        self.assertEqual(self.admin.post('/admin/profiling', json={'sampler': True, 'reset_samples': True}).status_code, 200)
+        self.assertTrue(profiler.sampler.enabled)
+        profiler.sampler.track('GET /teste')
+        profiler.sampler.sample()
+        profiler.sampler.untrack()
+        folded = self.admin.get('/admin/profiling/flamegraph').get_data(as_text=True)
+        self.assertIn('GET /teste;', folded)
+        self.assertIn('test_sampler_and_log_ids (tests.py:', folded)
+        self.admin.post('/admin/profiling', json={'sampler': False, 'reset_samples': True})
+        self.assertFalse(profiler.sampler.enabled)
+        self.assertEqual(self.admin.get('/admin/profiling/flamegraph').get_data(as_text=True), '')
+        
+        record = logging.LogRecord('teste', logging.INFO, __file__, 1, 'mensagem', None, None)
+        with self.app.test_request_context('/'):
+            self.app.preprocess_request()
+            RequestContextFilter().filter(record)
+            self.assertRegex(record.request_id, r'^[0-9a-f]{32}$')
+        RequestContextFilter().filter(record)
+        self.assertEqual(record.request_id, '-')
+
+class LoggingTestCase(AppTestCase):
+    """Testes dos logs em JSON gravados por uma thread separada"""
+    
+    def setUp(self):
+        super().setUp()
+        self.log_file = os.path.join(self.tmpdir.name, 'logs', 'app.log')
+        self.app = self.make_app(LOG_FILE=self.log_file, LOG_FORMAT='json')
+    
+    def tearDown(self):
+        # Fechar o arquivo de log antes de remover o diretório
+        configure_logging({'LOG_LEVEL': TestingConfig.LOG_LEVEL, 'LOG_FILE': ''})
+        super().tearDown()
+    
+    def read_log(self):
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, AsyncQueueHandler):
+                handler.stop()
+        with open(self.log_file, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+    
+    def test_json_records_with_request_context(self):
+        """Testar o registro em JSON com o contexto da requisição e os campos extras"""
+        logger = logging.getLogger('teste')
+        with self.app.test_request_context('/ask', method='POST', headers={'X-Request-ID': 'req-1'}):
+            self.app.preprocess_request()
+            session['username'] = 'maria'
+            logger.info("Pergunta processada: %.5s...", 'pergunta longa', extra={'latency_ms': 12})
+        try:
+            raise ValueError('falha')
+        except ValueError:
+            logger.exception("Erro fora da requisição")
+        
+        entries = [entry for entry in self.read_log() if entry['logger'] == 'teste']
+        self.assertEqual(entries[0]['msg'], 'Pergunta processada: pergu...')
+        self.assertEqual(entries[0]['request_id'], 'req-1')
+        self.assertEqual(entries[0]['user'], 'maria')
+        self.assertEqual((entries[0]['method'], entries[0]['path']), ('POST', '/ask'))
+        self.assertEqual(entries[0]['latency_ms'], 12)
+        self.assertEqual(entries[1]['level'], 'ERROR')
+        self.assertNotIn('request_id', entries[1])
+        self.assertIn('ValueError: falha', entries[1]['exc'])
+    
+    def test_full_queue_drops_records(self):
+        """Testar o descarte dos registros com a fila cheia, sem bloquear"""
+        release = threading.Event()
+        written = []
+        
+        class SlowHandler(logging.Handler):
+            def emit(self, record):
+                release.wait(5)
+                written.append(record.getMessage())
+        
+        handler = AsyncQueueHandler([SlowHandler()], 2)
+        started = time.monotonic()
+        for i in range(10):
+            handler.handle(logging.LogRecord('teste', logging.INFO, __file__, 1, 'registro %d', (i,), None))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertGreaterEqual(handler.dropped, 7)
+        release.set()
+        handler.stop()
+        self.assertEqual(len(written) + handler.dropped, 10)
+        self.assertEqual(written[0], 'registro 0')
+    
+    def test_debug_sampling(self):
+        """Testar a amostragem dos registros DEBUG de cada linha"""
+        sampler = DebugSampler(5)
+        kept = [sampler.filter(logging.LogRecord('teste', logging.DEBUG, __file__, 10, 'x', None, None))
+                for _ in range(10)]
+        self.assertEqual(kept.count(True), 2)
+        self.assertEqual(sampler.discarded, 8)
+        other_line = logging.LogRecord('teste', logging.DEBUG, __file__, 20, 'x', None, None)
+        self.assertTrue(sampler.filter(other_line))
+        self.assertEqual(other_line.sample_rate, 5)
+        self.assertTrue(all(sampler.filter(logging.LogRecord('teste', logging.INFO, __file__, 10, 'x', None, None))
+                            for _ in range(3)))
+        self.assertIn('dropped', logging_metrics())
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
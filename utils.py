@@ -4,23 +4,93 @@
 import os
 import re
 import json
+import time
 import logging
+import secrets
 from datetime import datetime
 from functools import wraps
-from flask import session, redirect, url_for, request, jsonify
+from flask import session, redirect, url_for, request, jsonify, current_app
+from chat_templates import chat_templates
 
 logger = logging.getLogger(__name__)
 
+# Prompt de sistema usado quando nenhum é informado
+DEFAULT_SYSTEM_PROMPT = (
+    "Você é um assistente de IA corporativo útil e conciso. "
+    "Responda às perguntas de forma profissional e objetiva, "
+    "fornecendo informações precisas e relevantes para o ambiente corporativo."
+)
+
+# Função para obter uma chave secreta estável entre os workers
+def load_or_create_secret_key(instance_path):
+    """Lê a chave secreta de instance/secret_key, criando-a na primeira execução
+    
+    Sem SECRET_KEY definida, cada worker do Gunicorn geraria uma chave
+    diferente e as sessões assinadas por um worker seriam rejeitadas pelos
+    outros. O arquivo é criado de forma exclusiva, então todos os workers
+    acabam lendo a mesma chave.
+    
+    Args:
+        instance_path (str): Diretório de instância da aplicação
+        
+    Returns:
+        str: Chave secreta
+    """
+    os.makedirs(instance_path, exist_ok=True)
+    key_path = os.path.join(instance_path, 'secret_key')
+    try:
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(key_path) as key_file:
+            key = key_file.read().strip()
+        if key:
+            return key
+        # Outro worker está escrevendo a chave neste instante
+        time.sleep(0.1)
+        with open(key_path) as key_file:
+            return key_file.read().strip()
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as key_file:
+        key_file.write(key)
+    return key
+
+# Função para obter o usuário da sessão atual
+def current_user():
+    """Retorna o usuário logado (models.CachedUser) ou None
+    
+    Os dados vêm do cache de usuários do worker (USER_CACHE_TTL), e não do
+    banco de dados a cada requisição. Usuários desativados ou excluídos
+    perdem o acesso quando a entrada do cache expira.
+    """
+    # Importado aqui para não carregar os modelos ao importar utils
+    from models import user_cache
+    
+    user_id = session.get('user_id')
+    if 'username' not in session or user_id is None:
+        return None
+    user = user_cache.get(user_id, float(current_app.config.get('USER_CACHE_TTL', 60)))
+    if user is None or not user.active:
+        return None
+    return user
+
+# Função para decidir se a resposta de acesso negado deve ser JSON
+def wants_json():
+    # Navegação do navegador (GET que prefere HTML) é redirecionada; chamadas
+    # de API e AJAX recebem JSON
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.method != 'GET':
+        return True
+    return request.accept_mimetypes.best != 'text/html'
+
 # Decorador para verificar autenticação
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'username' not in session:
-            # Se for uma requisição AJAX, retornar erro 401
-            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if current_user() is None:
+            # Se for uma requisição de API ou AJAX, retornar erro 401
+            if wants_json():
                 return jsonify({'error': 'Não autorizado'}), 401
             # Caso contrário, redirecionar para a página de login
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -28,21 +98,26 @@ def login_required(f):
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'username' not in session or session.get('role') != 'admin':
-            # Se for uma requisição AJAX, retornar erro 403
-            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        user = current_user()
+        if user is None or user.role != 'admin':
+            # Se for uma requisição de API ou AJAX, retornar erro (401 sem login, 403 sem permissão)
+            if wants_json():
+                if user is None:
+                    return jsonify({'error': 'Não autorizado'}), 401
                 return jsonify({'error': 'Acesso negado'}), 403
             # Caso contrário, redirecionar para a página principal
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         return f(*args, **kwargs)
     return decorated_function
 
 # Função para sanitizar entrada do usuário
-def sanitize_input(text):
+def sanitize_input(text, max_length=1000):
     """Sanitiza a entrada do usuário para evitar injeção de comandos
     
     Args:
         text (str): Texto a ser sanitizado
+        max_length (int, optional): Tamanho máximo em caracteres; None para
+            não limitar (quando o limite é aplicado em tokens, ver budget.py)
         
     Returns:
         str: Texto sanitizado
@@ -54,38 +129,58 @@ def sanitize_input(text):
     sanitized = re.sub(r'[;&|`$><]', '', text)
     
     # Limitar o tamanho da entrada
-    max_length = 1000
-    if len(sanitized) > max_length:
+    if max_length is not None and len(sanitized) > max_length:
         sanitized = sanitized[:max_length]
     
     return sanitized
 
 # Função para formatar o prompt para o modelo LLaMA
-def format_prompt(question, system_prompt=None):
-    """Formata o prompt para o modelo LLaMA
+def format_prompt(question, system_prompt=None, max_length=1000):
+    """Formata o prompt no formato de conversa do modelo (ver chat_templates.py)
     
     Args:
         question (str): Pergunta do usuário
         system_prompt (str, optional): Prompt de sistema para contextualizar o modelo
+        max_length (int, optional): Tamanho máximo da pergunta em caracteres
         
     Returns:
-        str: Prompt formatado
+        ChatPrompt: Prompt formatado
     """
     # Sanitizar a entrada
-    question = sanitize_input(question)
+    question = sanitize_input(question, max_length=max_length)
     
     # Prompt de sistema padrão se não for fornecido
-    if not system_prompt:
+    return chat_templates.prompt(system_prompt or DEFAULT_SYSTEM_PROMPT, [], question)
+
+# Função para formatar o prompt de uma conversa com perguntas anteriores
+def format_conversation_prompt(turns, question, system_prompt=None, summary=None):
+    """Formata o prompt de uma pergunta de acompanhamento
+    
+    O início do prompt é idêntico ao prompt da pergunta anterior seguido da
+    resposta gerada, o que permite ao llama.cpp reaproveitar o estado KV já
+    calculado para esse prefixo.
+    
+    Args:
+        turns (list): Pares (pergunta, resposta) anteriores, do mais antigo ao mais recente
+        question (str): Nova pergunta do usuário
+        system_prompt (str, optional): Prompt de sistema para contextualizar o modelo
+        summary (str, optional): Resumo das perguntas anteriores a turns
+        
+    Returns:
+        ChatPrompt: Prompt formatado
+    """
+    if summary:
         system_prompt = (
-            "Você é um assistente de IA corporativo útil e conciso. "
-            "Responda às perguntas de forma profissional e objetiva, "
-            "fornecendo informações precisas e relevantes para o ambiente corporativo."
+            f"{(system_prompt or '').strip()}\n\n"
+            f"Resumo da conversa até aqui:\n{summary.strip()}"
         )
     
-    # Formatar o prompt no formato esperado pelo LLaMA
-    formatted_prompt = f"<s>[INST] <<SYS>>\n{system_prompt}\n<</SYS>>\n\n{question} [/INST]\n"
+    if not turns:
+        return format_prompt(question, system_prompt, max_length=None)
     
-    return formatted_prompt
+    turns = [(sanitize_input(previous, max_length=None), answer) for previous, answer in turns]
+    return chat_templates.prompt(system_prompt or DEFAULT_SYSTEM_PROMPT, turns,
+                                 sanitize_input(question, max_length=None))
 
 # Função para registrar consultas no histórico
 def log_query(username, question, response):
@@ -123,6 +218,12 @@ def validate_model_config(config):
     Returns:
         tuple: (bool, str) - (válido, mensagem de erro)
     """
+    # Verificar o diretório do llama.cpp, se informado
+    if 'llama_path' in config:
+        llama_path = config.get('llama_path')
+        if not llama_path or not os.path.isdir(llama_path):
+            return False, f"Diretório do llama.cpp inválido: {llama_path}"
+    
     # Verificar se o caminho do modelo existe
     model_path = config.get('model_path')
     if not model_path or not os.path.exists(model_path):
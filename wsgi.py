@@ -1,7 +1,9 @@
 # wsgi.py
 # Ponto de entrada para servidores WSGI como Gunicorn
 
-from app import app
+from app import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
-    app.run()
\ No newline at end of file
+    app.run()